@@ -24,7 +24,7 @@ async def cache_stats(_=Depends(_auth)):
         zero = {"hit_rate": 0, "size": 0, "max_size": 0, "hits": 0, "misses": 0}
         return {"ok": True, "caches": {"llm": zero, "search": zero, "general": zero}, "note": "test-mode"}
     try:
-        from middleware import llm_cache, search_cache, general_cache
+        from core.middleware import llm_cache, search_cache, general_cache
         return {
             "ok": True,
             "caches": {
@@ -38,11 +38,24 @@ async def cache_stats(_=Depends(_auth)):
         zero = {"hit_rate": 0, "size": 0, "max_size": 0, "hits": 0, "misses": 0}
         return {"ok": True, "caches": {"llm": zero, "search": zero, "general": zero}, "note": "cache middleware not available"}
 
+@router.get("/cache/semantic")
+async def semantic_cache_stats(_=Depends(_auth)):
+    """🧠 Semantic LLM cache: hit rate, size, sampled false hits"""
+    from core.semantic_cache import get_semantic_cache_stats
+    return {"ok": True, "semantic": get_semantic_cache_stats()}
+
+@router.post("/cache/semantic/clear")
+async def semantic_cache_clear(_=Depends(_auth)):
+    """🗑️ Clear semantic LLM cache"""
+    from core.semantic_cache import get_semantic_cache
+    get_semantic_cache().clear()
+    return {"ok": True, "cleared": "semantic"}
+
 @router.post("/cache/clear")
 async def clear_cache(cache_type: str = "all", _=Depends(_auth)):
     """🗑️ Clear cache"""
     try:
-        from middleware import llm_cache, search_cache, general_cache
+        from core.middleware import llm_cache, search_cache, general_cache
         
         if cache_type == "all":
             llm_cache.invalidate()
@@ -68,7 +81,7 @@ async def clear_cache(cache_type: str = "all", _=Depends(_auth)):
 async def rate_limit_usage(user_id: str, endpoint_type: str = "default", _=Depends(_auth)):
     """📈 Get rate limit usage for user"""
     try:
-        from middleware import rate_limiter
+        from core.middleware import rate_limiter
         usage = rate_limiter.get_usage(user_id, endpoint_type)
         return {"ok": True, "user_id": user_id, "usage": usage}
     except ImportError:
@@ -78,10 +91,11 @@ async def rate_limit_usage(user_id: str, endpoint_type: str = "default", _=Depen
 async def rate_limit_config(_=Depends(_auth)):
     """⚙️ Get rate limit configuration"""
     try:
-        from middleware import rate_limiter
+        from core.middleware import rate_limiter
         return {
             "ok": True,
-            "limits": rate_limiter.limits
+            "limits": rate_limiter.limits,
+            "backend": rate_limiter.backend
         }
     except ImportError:
         raise HTTPException(500, "Rate limiter not available")
@@ -81,10 +81,10 @@ __all__ = [
     "http_get", "http_get_json", "http_post_json",
     "normalize_text", "tokenize", "make_id",
     "tfidf_vec", "tfidf_cosine", "cosine_similarity",
-    "embed_many", "tag_pii", "extract_profile_info",
+    "embed_many", "aembed_many", "tag_pii", "extract_profile_info",
     
     # LLM
-    "call_llm", "call_llm_once", "call_llm_stream",
+    "call_llm", "acall_llm", "call_llm_once", "call_llm_stream",
     
     # Memory
     "memory_manager", "time_manager",
@@ -12,15 +12,17 @@ Data: 15 października 2025
 import asyncio
 import time
 from datetime import datetime
-from typing import Dict, List, Any, Optional, Tuple
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
 from .config import *
-from .llm import get_llm_client
+from .llm import get_llm_client, call_llm_stream
 from .memory import get_memory_manager
 from .hierarchical_memory import get_hierarchical_memory_system
 from .helpers import log_info, log_error, log_warning
+from .parallel import run_stage_dag
+from .latency_budget import Deadline, get_load_monitor, track_inflight, within_deadline
 
 # Import wszystkich systemów kognitywnych (opcjonalne - fallback jeśli brak)
 try:
@@ -59,6 +61,30 @@ class CognitiveMode(Enum):
     MULTI_AGENT = "multi_agent"        # Z orkiestracją agentów
     FULL_COGNITIVE = "full_cognitive"  # Wszystkie systemy aktywne
 
+# Szacunkowa liczba sekwencyjnych rund LLM na tryb: generacja + najdłuższy etap po
+# odpowiedzi (agenci i refleksja biegną współbieżnie, predykcja w tle)
+REFLECTION_LLM_ROUNDS = 5      # ewaluacja, meta-komentarz, poprawa, insights, korekty
+MULTI_AGENT_LLM_ROUNDS = 11    # multi_agent_orchestrator.SESSION_LLM_ROUNDS
+POST_STAGE_MIN_LLM_ROUNDS = 2  # minimum, przy którym etap po odpowiedzi w ogóle startuje
+
+MODE_LLM_ROUNDS = {
+    CognitiveMode.BASIC: 1,
+    CognitiveMode.PREDICTIVE: 1,
+    CognitiveMode.ENHANCED: 1 + REFLECTION_LLM_ROUNDS,
+    CognitiveMode.ADVANCED: 1 + REFLECTION_LLM_ROUNDS,
+    CognitiveMode.MULTI_AGENT: 1 + MULTI_AGENT_LLM_ROUNDS,
+    CognitiveMode.FULL_COGNITIVE: 1 + MULTI_AGENT_LLM_ROUNDS,
+}
+
+# Tańszy tryb przy braku budżetu lub przeciążeniu
+MODE_DOWNGRADE = {
+    CognitiveMode.FULL_COGNITIVE: CognitiveMode.ADVANCED,
+    CognitiveMode.MULTI_AGENT: CognitiveMode.ENHANCED,
+    CognitiveMode.ADVANCED: CognitiveMode.ENHANCED,
+    CognitiveMode.PREDICTIVE: CognitiveMode.BASIC,
+    CognitiveMode.ENHANCED: CognitiveMode.BASIC,
+}
+
 class ProcessingStage(Enum):
     """Etapy przetwarzania kognitywnego"""
     INPUT_ANALYSIS = "input_analysis"
@@ -112,9 +138,12 @@ class AdvancedCognitiveEngine:
         # Konfiguracja
         self.default_mode = CognitiveMode.ENHANCED
         self.enable_caching = True
-        self.parallel_processing = True
+        self.parallel_processing = True  # Niezależne etapy współbieżnie (run_stage_dag)
         self.adaptive_depth = True
         
+        # Predykcja przyszłości i statystyki kończą się poza ścieżką odpowiedzi
+        self._background_tasks: set = set()
+        
         # Metryki
         self.processing_stats = {
             "total_requests": 0,
@@ -128,6 +157,7 @@ class AdvancedCognitiveEngine:
         
         log_info("[COGNITIVE_ENGINE] Zaawansowany silnik kognitywny zainicjalizowany")
     
+    @track_inflight
     async def process_message(
         self,
         user_message: str,
@@ -136,7 +166,8 @@ class AdvancedCognitiveEngine:
         cognitive_mode: CognitiveMode = None,
         enable_prediction: bool = True,
         reflection_depth: ReflectionDepth = None,
-        custom_agents: List[str] = None
+        custom_agents: List[str] = None,
+        deadline: Optional[Deadline] = None
     ) -> CognitiveResult:
         """
         Główna funkcja przetwarzania wiadomości przez wszystkie systemy kognitywne
@@ -149,6 +180,7 @@ class AdvancedCognitiveEngine:
             enable_prediction: Czy włączyć predykcję przyszłości
             reflection_depth: Głębokość refleksji
             custom_agents: Niestandardowi agenci
+            deadline: Budżet czasu żądania (tryb i etapy dopasowują się do niego)
             
         Returns:
             CognitiveResult: Kompleksowy wynik przetwarzania
@@ -158,125 +190,53 @@ class AdvancedCognitiveEngine:
         processing_metrics = {}
         
         try:
-            # Ustaw domyślny tryb
+            # Ustaw domyślny tryb i dopasuj go do budżetu / obciążenia
             if cognitive_mode is None:
                 cognitive_mode = self.default_mode
+            cognitive_mode = self.fit_mode_to_budget(cognitive_mode, deadline, processing_metrics)
             
             log_info(f"[COGNITIVE_ENGINE] Przetwarzanie w trybie: {cognitive_mode.value}")
             
-            # ETAP 1: Analiza input i konwersja na język wewnętrzny
-            stage_start = time.time()
-            inner_thought = await self._process_inner_language(user_message, conversation_context)
-            processing_metrics["inner_language_time"] = time.time() - stage_start
-            
-            # ETAP 2: Wyszukiwanie w pamięci z kompresją wiedzy
-            stage_start = time.time()
-            memory_context, compressed_knowledge = await self._enhanced_memory_search(
-                user_message, user_id, inner_thought
+            # ETAP 7: Predykcja przyszłych zapytań nie zależy od odpowiedzi - rusza od razu w tle
+            prediction_task = self._start_future_predictions(
+                user_id, user_message, conversation_context, cognitive_mode, enable_prediction, processing_metrics
             )
-            processing_metrics["memory_search_time"] = time.time() - stage_start
-            
-            # ETAP 3: Sprawdź predykcje z cache (jeśli włączone)
-            prediction_hit = None
-            if enable_prediction and cognitive_mode in [CognitiveMode.PREDICTIVE, CognitiveMode.FULL_COGNITIVE]:
-                prediction_hit = await self.future_predictor.check_prediction_hit(user_id, user_message)
-                if prediction_hit:
-                    log_info("[COGNITIVE_ENGINE] 🎯 PREDICTION HIT - używam przygotowanej odpowiedzi")
-            
-            # ETAP 4: Generacja odpowiedzi (podstawowa lub z cache)
-            stage_start = time.time()
-            if prediction_hit and prediction_hit.preparation_confidence > 0.7:
-                # Użyj przygotowanej odpowiedzi
-                primary_response = prediction_hit.prepared_content
-                processing_metrics["response_generation_time"] = 0.01  # Cache hit
-            else:
-                # Generuj nową odpowiedź
-                primary_response = await self._generate_enhanced_response(
-                    user_message, memory_context, compressed_knowledge, inner_thought, cognitive_mode
-                )
-                processing_metrics["response_generation_time"] = time.time() - stage_start
-            
-            # ETAP 5: Wieloagentowa analiza (jeśli włączona)
-            agent_perspectives = []
-            if cognitive_mode in [CognitiveMode.MULTI_AGENT, CognitiveMode.FULL_COGNITIVE]:
-                stage_start = time.time()
-                agent_perspectives = await self._orchestrate_multi_agent_analysis(
-                    user_message, primary_response, conversation_context, custom_agents
-                )
-                processing_metrics["multi_agent_time"] = time.time() - stage_start
             
-            # ETAP 6: Self-reflection i poprawa (jeśli włączona)
-            reflection_insights = []
-            final_response = primary_response
-            
-            if cognitive_mode in [CognitiveMode.ENHANCED, CognitiveMode.ADVANCED, CognitiveMode.FULL_COGNITIVE]:
-                stage_start = time.time()
-                
-                # Adaptacyjna głębokość refleksji
-                if reflection_depth is None:
-                    reflection_depth = await self._determine_reflection_depth(
-                        user_message, primary_response, cognitive_mode
-                    )
-                
-                reflection_result = await self.self_reflection.reflect_on_response(
-                    original_query=user_message,
-                    initial_response=primary_response,
-                    context=conversation_context or [],
-                    depth=reflection_depth,
-                    agent_feedback=agent_perspectives
+            # ETAP 1-3 współbieżnie (język wewnętrzny, pamięć, cache predykcji), potem ETAP 4
+            async def generate(inner_language, memory_search, prediction_check):
+                memory_context, compressed_knowledge = memory_search
+                if prediction_check and prediction_check.preparation_confidence > 0.7:
+                    # Użyj przygotowanej odpowiedzi
+                    return prediction_check.prepared_content
+                return await self._generate_enhanced_response(
+                    user_message, memory_context, compressed_knowledge, inner_language, cognitive_mode, deadline
                 )
-                
-                reflection_insights = reflection_result.get("insights", [])
-                improved_response = reflection_result.get("improved_response")
-                
-                if improved_response and len(improved_response) > len(primary_response) * 0.8:
-                    final_response = improved_response
-                    self.processing_stats["reflection_improvements"] += 1
-                
-                processing_metrics["reflection_time"] = time.time() - stage_start
-            
-            # ETAP 7: Predykcja przyszłych zapytań (jeśli włączona)
-            future_predictions = []
-            if enable_prediction and cognitive_mode in [CognitiveMode.PREDICTIVE, CognitiveMode.FULL_COGNITIVE]:
-                stage_start = time.time()
-                future_predictions = await self._generate_future_predictions(
-                    user_id, user_message, conversation_context
-                )
-                processing_metrics["future_prediction_time"] = time.time() - stage_start
             
-            # ETAP 8: Oblicz metryki końcowe
-            confidence_score = await self._calculate_overall_confidence(
-                final_response, reflection_insights, agent_perspectives, compressed_knowledge
+            stages = self._pre_answer_stages(
+                user_message, user_id, conversation_context, cognitive_mode, enable_prediction, deadline
             )
-            
-            originality_score = await self._calculate_originality_score(
-                inner_thought, compressed_knowledge, agent_perspectives
+            stages[ProcessingStage.RESPONSE_GENERATION.value] = (
+                (ProcessingStage.INNER_LANGUAGE.value, ProcessingStage.MEMORY_SEARCH.value, "prediction_check"),
+                generate
             )
+            results = await run_stage_dag(stages, processing_metrics, concurrent=self.parallel_processing)
+            inner_thought = results[ProcessingStage.INNER_LANGUAGE.value]
+            _, compressed_knowledge = results[ProcessingStage.MEMORY_SEARCH.value]
+            primary_response = results[ProcessingStage.RESPONSE_GENERATION.value]
             
-            total_time = time.time() - start_time
-            processing_metrics["total_time"] = total_time
-            
-            # ETAP 9: Aktualizuj statystyki
-            await self._update_processing_stats(total_time, confidence_score, len(future_predictions))
+            # ETAP 5-6: Agenci i refleksja (współbieżnie, obie zależą tylko od odpowiedzi)
+            final_response, agent_perspectives, reflection_insights = await self._run_post_stages(
+                user_message, user_id, primary_response, conversation_context, cognitive_mode,
+                reflection_depth, custom_agents, processing_metrics, deadline=deadline
+            )
             
-            # Stwórz wynik
-            result = CognitiveResult(
-                primary_response=final_response,
-                reflection_insights=reflection_insights,
-                agent_perspectives=agent_perspectives,
-                future_predictions=future_predictions,
-                compressed_knowledge=compressed_knowledge,
-                inner_thought={
-                    "token_chain": inner_thought.token_chain if inner_thought else [],
-                    "compression_level": inner_thought.compression_level if inner_thought else 0.0,
-                    "confidence": inner_thought.confidence if inner_thought else 0.5,
-                    "originality": inner_thought.originality if inner_thought else 0.5
-                },
-                processing_metrics=processing_metrics,
-                confidence_score=confidence_score,
-                originality_score=originality_score,
-                total_processing_time=total_time
+            # ETAP 8-9: Metryki końcowe i wynik (statystyki w tle)
+            result = await self._build_result(
+                start_time, final_response, reflection_insights, agent_perspectives,
+                prediction_task, compressed_knowledge, inner_thought, processing_metrics, deadline
             )
+            total_time = result.total_processing_time
+            confidence_score = result.confidence_score
             
             log_info(f"[COGNITIVE_ENGINE] Przetwarzanie zakończone: {total_time:.2f}s, confidence: {confidence_score:.2f}")
             return result
@@ -285,6 +245,386 @@ class AdvancedCognitiveEngine:
             log_error(f"[COGNITIVE_ENGINE] Błąd przetwarzania kognitywnego: {e}")
             return await self._create_fallback_result(user_message)
     
+    @track_inflight
+    async def process_message_stream(
+        self,
+        user_message: str,
+        user_id: str,
+        conversation_context: List[Dict[str, Any]] = None,
+        cognitive_mode: CognitiveMode = None,
+        enable_prediction: bool = True,
+        reflection_depth: ReflectionDepth = None,
+        custom_agents: List[str] = None,
+        deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Strumieniowy wariant process_message
+        
+        Zdarzenia (dict):
+            {"type": "progress", "stage": ...}  - przed każdym etapem
+            {"type": "chunk", "content": ...}   - tokeny finalnej generacji (call_llm_stream)
+            {"type": "result", "result": CognitiveResult} - zawsze ostatnie
+        
+        Odpowiedź wychodzi do klienta zanim ruszą agenci i refleksja, więc
+        refleksja nie podmienia tekstu - jej insights trafiają do metadanych.
+        Wyjątki propagują do wywołującego (CognitiveEngine decyduje o fallbacku).
+        """
+        
+        start_time = time.time()
+        processing_metrics = {}
+        
+        if cognitive_mode is None:
+            cognitive_mode = self.default_mode
+        cognitive_mode = self.fit_mode_to_budget(cognitive_mode, deadline, processing_metrics)
+        
+        log_info(f"[COGNITIVE_ENGINE] Streaming w trybie: {cognitive_mode.value}")
+        
+        prediction_task = self._start_future_predictions(
+            user_id, user_message, conversation_context, cognitive_mode, enable_prediction, processing_metrics
+        )
+        
+        # ETAP 1-3 współbieżnie: język wewnętrzny, pamięć + kompresja, cache predykcji
+        yield {"type": "progress", "stage": ProcessingStage.INNER_LANGUAGE.value}
+        yield {"type": "progress", "stage": ProcessingStage.MEMORY_SEARCH.value}
+        results = await run_stage_dag(
+            self._pre_answer_stages(
+                user_message, user_id, conversation_context, cognitive_mode, enable_prediction, deadline
+            ),
+            processing_metrics,
+            concurrent=self.parallel_processing
+        )
+        inner_thought = results[ProcessingStage.INNER_LANGUAGE.value]
+        memory_context, compressed_knowledge = results[ProcessingStage.MEMORY_SEARCH.value]
+        prediction_hit = results["prediction_check"]
+        
+        # ETAP 4: Generacja - prawdziwe tokeny z LLM
+        yield {"type": "progress", "stage": ProcessingStage.RESPONSE_GENERATION.value}
+        stage_start = time.time()
+        if prediction_hit and prediction_hit.preparation_confidence > 0.7:
+            primary_response = prediction_hit.prepared_content
+            yield {"type": "chunk", "content": primary_response}
+            processing_metrics["response_generation_time"] = 0.01  # Cache hit
+        else:
+            messages = self._build_response_messages(
+                user_message, memory_context, compressed_knowledge, inner_thought, cognitive_mode
+            )
+            parts: List[str] = []
+            first_token_at = None
+            async for token in call_llm_stream(messages):
+                if token.startswith("[STREAM-ERROR]"):
+                    log_warning(f"[COGNITIVE_ENGINE] Streaming przerwany: {token}")
+                    if not parts:
+                        # Nic jeszcze nie wyszło - spróbuj zwykłej generacji
+                        fallback = await self._generate_enhanced_response(
+                            user_message, memory_context, compressed_knowledge, inner_thought, cognitive_mode, deadline
+                        )
+                        parts.append(fallback)
+                        yield {"type": "chunk", "content": fallback}
+                    break
+                if first_token_at is None:
+                    first_token_at = time.time()
+                parts.append(token)
+                yield {"type": "chunk", "content": token}
+            
+            finished_at = time.time()
+            primary_response = "".join(parts)
+            processing_metrics["response_generation_time"] = finished_at - stage_start
+            if first_token_at is not None:
+                decode_time = finished_at - first_token_at
+                processing_metrics["llm_time_to_first_token"] = first_token_at - stage_start
+                processing_metrics["llm_tokens_per_second"] = (
+                    (len(parts) - 1) / decode_time if decode_time > 0 else 0.0
+                )
+        
+        # ETAP 5-6: agenci / refleksja - już po wysłaniu odpowiedzi
+        yield {"type": "progress", "stage": ProcessingStage.OUTPUT_SYNTHESIS.value}
+        final_response, agent_perspectives, reflection_insights = await self._run_post_stages(
+            user_message, user_id, primary_response, conversation_context, cognitive_mode,
+            reflection_depth, custom_agents, processing_metrics,
+            allow_rewrite=False, deadline=deadline
+        )
+        
+        result = await self._build_result(
+            start_time, final_response, reflection_insights, agent_perspectives,
+            prediction_task, compressed_knowledge, inner_thought, processing_metrics, deadline
+        )
+        log_info(f"[COGNITIVE_ENGINE] Streaming zakończony: {result.total_processing_time:.2f}s")
+        yield {"type": "result", "result": result}
+    
+    def fit_mode_to_budget(
+        self,
+        cognitive_mode: CognitiveMode,
+        deadline: Optional[Deadline] = None,
+        processing_metrics: Optional[Dict[str, float]] = None
+    ) -> CognitiveMode:
+        """
+        Zejdź do tańszego trybu, gdy budżet czasu nie wystarczy lub system jest przeciążony
+        
+        Przeciążenie (LoadMonitor.pressure): >= 1.0 - najwyżej koszt ENHANCED,
+        >= 2.0 - tylko BASIC. Budżet: tryb musi zmieścić MODE_LLM_ROUNDS rund
+        LLM przy bieżącej (EWMA) latencji upstream.
+        """
+        
+        monitor = get_load_monitor()
+        pressure = monitor.pressure()
+        if pressure >= 2.0:
+            max_rounds = MODE_LLM_ROUNDS[CognitiveMode.BASIC]
+        elif pressure >= 1.0:
+            max_rounds = MODE_LLM_ROUNDS[CognitiveMode.ENHANCED]
+        else:
+            max_rounds = float("inf")
+        
+        requested = cognitive_mode
+        while cognitive_mode in MODE_DOWNGRADE and (
+            MODE_LLM_ROUNDS[cognitive_mode] > max_rounds
+            or (deadline is not None and not deadline.fits(MODE_LLM_ROUNDS[cognitive_mode], monitor))
+        ):
+            cognitive_mode = MODE_DOWNGRADE[cognitive_mode]
+        
+        if cognitive_mode != requested:
+            budget = f"{deadline.remaining():.1f}s" if deadline else "brak"
+            log_info(f"[COGNITIVE_ENGINE] Tryb {requested.value} -> {cognitive_mode.value} "
+                     f"(presja={pressure:.2f}, budżet={budget})")
+        if processing_metrics is not None:
+            processing_metrics["load_pressure"] = pressure
+            processing_metrics["mode_downgraded"] = float(cognitive_mode != requested)
+        return cognitive_mode
+    
+    def _pre_answer_stages(
+        self,
+        user_message: str,
+        user_id: str,
+        conversation_context: List[Dict[str, Any]],
+        cognitive_mode: CognitiveMode,
+        enable_prediction: bool,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Tuple[Tuple[str, ...], Any]]:
+        """Etapy 1-3 dla run_stage_dag - wzajemnie niezależne"""
+        
+        async def inner_language():
+            return await self._process_inner_language(user_message, conversation_context)
+        
+        async def memory_search():
+            # _enhanced_memory_search nie korzysta z inner_thought - nie czeka na ETAP 1
+            return await self._enhanced_memory_search(user_message, user_id, None, deadline)
+        
+        async def prediction_check():
+            return await self._check_prediction_hit(user_id, user_message, cognitive_mode, enable_prediction)
+        
+        return {
+            ProcessingStage.INNER_LANGUAGE.value: ((), inner_language),
+            ProcessingStage.MEMORY_SEARCH.value: ((), memory_search),
+            "prediction_check": ((), prediction_check),
+        }
+    
+    def _spawn_background(self, coro) -> asyncio.Task:
+        """Zadanie poza ścieżką odpowiedzi (referencja trzymana do zakończenia)"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+    
+    def _start_future_predictions(
+        self,
+        user_id: str,
+        user_message: str,
+        conversation_context: List[Dict[str, Any]],
+        cognitive_mode: CognitiveMode,
+        enable_prediction: bool,
+        processing_metrics: Dict[str, float]
+    ) -> Optional[asyncio.Task]:
+        """ETAP 7 w tle: wynik trafia do CognitiveResult tylko jeśli zdąży przed odpowiedzią"""
+        
+        if not self.future_predictor or not enable_prediction or cognitive_mode not in [CognitiveMode.PREDICTIVE, CognitiveMode.FULL_COGNITIVE]:
+            return None
+        
+        async def predict():
+            stage_start = time.perf_counter()
+            predictions = await self._generate_future_predictions(user_id, user_message, conversation_context)
+            processing_metrics["future_prediction_time"] = time.perf_counter() - stage_start
+            return predictions
+        
+        return self._spawn_background(predict())
+    
+    async def _check_prediction_hit(
+        self,
+        user_id: str,
+        user_message: str,
+        cognitive_mode: CognitiveMode,
+        enable_prediction: bool
+    ):
+        """Sprawdź czy odpowiedź została przygotowana przez Future Predictor"""
+        
+        if not self.future_predictor or not enable_prediction or cognitive_mode not in [CognitiveMode.PREDICTIVE, CognitiveMode.FULL_COGNITIVE]:
+            return None
+        
+        prediction_hit = await self.future_predictor.check_prediction_hit(user_id, user_message)
+        if prediction_hit:
+            log_info("[COGNITIVE_ENGINE] 🎯 PREDICTION HIT - używam przygotowanej odpowiedzi")
+        return prediction_hit
+    
+    async def _run_post_stages(
+        self,
+        user_message: str,
+        user_id: str,
+        primary_response: str,
+        conversation_context: List[Dict[str, Any]],
+        cognitive_mode: CognitiveMode,
+        reflection_depth,
+        custom_agents: List[str],
+        processing_metrics: Dict[str, float],
+        allow_rewrite: bool = True,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[str, List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Etapy po wygenerowaniu odpowiedzi: agenci i refleksja (współbieżnie)
+        
+        Refleksja to pierwszy przebieg nad odpowiedzią - nie czeka na agentów.
+        allow_rewrite=False (streaming): odpowiedź została już wysłana klientowi,
+        więc refleksja dostarcza tylko insights, bez podmiany tekstu.
+        Z deadline: etap startuje tylko gdy mieści minimum rund LLM, a po
+        wyczerpaniu budżetu jest przerywany (odpowiedź zostaje bez zmian).
+        """
+        
+        stages = {}
+        skipped = 0
+        has_budget = deadline is None or deadline.fits(POST_STAGE_MIN_LLM_ROUNDS)
+        
+        # ETAP 5: Wieloagentowa analiza (jeśli włączona)
+        if self.multi_agent and cognitive_mode in [CognitiveMode.MULTI_AGENT, CognitiveMode.FULL_COGNITIVE]:
+            async def multi_agent():
+                return await within_deadline(self._orchestrate_multi_agent_analysis(
+                    user_message, primary_response, conversation_context, custom_agents, deadline
+                ), deadline, [])
+            if has_budget:
+                stages[ProcessingStage.MULTI_AGENT.value] = ((), multi_agent)
+            else:
+                skipped += 1
+        
+        # ETAP 6: Self-reflection i poprawa (jeśli włączona)
+        if self.self_reflection and cognitive_mode in [CognitiveMode.ENHANCED, CognitiveMode.ADVANCED, CognitiveMode.FULL_COGNITIVE]:
+            async def reflection():
+                return await within_deadline(self._reflect_on_response(
+                    user_message, user_id, primary_response, cognitive_mode, reflection_depth, deadline
+                ), deadline, ([], None))
+            if has_budget:
+                stages["reflection"] = ((), reflection)
+            else:
+                skipped += 1
+        
+        if deadline is not None:
+            processing_metrics["deadline_skipped_stages"] = float(skipped)
+        
+        results = await run_stage_dag(stages, processing_metrics, concurrent=self.parallel_processing)
+        
+        agent_perspectives = results.get(ProcessingStage.MULTI_AGENT.value, [])
+        reflection_insights, improved_response = results.get("reflection", ([], None))
+        
+        final_response = primary_response
+        if allow_rewrite and improved_response and len(improved_response) > len(primary_response) * 0.8:
+            final_response = improved_response
+            self.processing_stats["reflection_improvements"] += 1
+        
+        return final_response, agent_perspectives, reflection_insights
+    
+    async def _reflect_on_response(
+        self,
+        user_message: str,
+        user_id: str,
+        primary_response: str,
+        cognitive_mode: CognitiveMode,
+        reflection_depth,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Refleksja nad odpowiedzią -> (insights, poprawiona odpowiedź)"""
+        
+        try:
+            # Adaptacyjna głębokość refleksji
+            if reflection_depth is None:
+                reflection_depth = await self._determine_reflection_depth(
+                    user_message, primary_response, cognitive_mode
+                )
+            
+            cycle = await self.self_reflection.reflect_on_response(
+                query=user_message,
+                initial_response=primary_response,
+                depth=reflection_depth,
+                user_id=user_id,
+                deadline=deadline
+            )
+            
+            insights = [
+                {"insight": insight, "confidence": cycle.reflection_score}
+                for insight in cycle.insights_gained
+            ]
+            return insights, cycle.improved_response
+            
+        except Exception as e:
+            log_error(f"[COGNITIVE_ENGINE] Błąd refleksji: {e}")
+            return [], None
+    
+    async def _build_result(
+        self,
+        start_time: float,
+        final_response: str,
+        reflection_insights: List[Dict[str, Any]],
+        agent_perspectives: List[Dict[str, Any]],
+        prediction_task: Optional[asyncio.Task],
+        compressed_knowledge: Dict[str, Any],
+        inner_thought,
+        processing_metrics: Dict[str, float],
+        deadline: Optional[Deadline] = None
+    ) -> CognitiveResult:
+        """
+        Oblicz metryki końcowe i zbuduj CognitiveResult
+        
+        Predykcje trafiają do wyniku, jeśli skończyły się przed odpowiedzią;
+        w przeciwnym razie kończą się w tle (i tak zasilają cache predykcji).
+        Statystyki aktualizowane są w tle po zakończeniu predykcji.
+        """
+        
+        future_predictions = []
+        if prediction_task is not None and prediction_task.done() and not prediction_task.cancelled() \
+                and prediction_task.exception() is None:
+            future_predictions = prediction_task.result()
+        processing_metrics["future_prediction_deferred"] = float(
+            prediction_task is not None and not prediction_task.done()
+        )
+        
+        confidence_score = await self._calculate_overall_confidence(
+            final_response, reflection_insights, agent_perspectives, compressed_knowledge
+        )
+        
+        originality_score = await self._calculate_originality_score(
+            inner_thought, compressed_knowledge, agent_perspectives
+        )
+        
+        total_time = time.time() - start_time
+        processing_metrics["total_time"] = total_time
+        if deadline is not None:
+            processing_metrics["deadline_budget"] = deadline.budget_s
+            processing_metrics["deadline_remaining"] = deadline.remaining()
+
+        self._spawn_background(self._finish_post_answer(prediction_task, total_time, confidence_score))
+        
+        return CognitiveResult(
+            primary_response=final_response,
+            reflection_insights=reflection_insights,
+            agent_perspectives=agent_perspectives,
+            future_predictions=future_predictions,
+            compressed_knowledge=compressed_knowledge,
+            inner_thought={
+                "token_chain": getattr(inner_thought, "token_chain", []),
+                "compression_level": getattr(inner_thought, "compression_level", 0.0),
+                "confidence": getattr(inner_thought, "confidence", 0.5),
+                "originality": getattr(inner_thought, "originality", 0.5)
+            },
+            processing_metrics=processing_metrics,
+            confidence_score=confidence_score,
+            originality_score=originality_score,
+            total_processing_time=total_time
+        )
+    
     async def _process_inner_language(
         self, 
         user_message: str, 
@@ -315,19 +655,22 @@ class AdvancedCognitiveEngine:
         self, 
         user_message: str, 
         user_id: str,
-        inner_thought
+        inner_thought,
+        deadline: Optional[Deadline] = None
     ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
-        """Rozszerzone wyszukiwanie w pamięci z kompresją wiedzy"""
+        """Rozszerzone wyszukiwanie w pamięci z kompresją wiedzy (kompresja tylko gdy starcza budżetu)"""
         
-        # Standardowe wyszukiwanie w pamięci
-        memory_results = await self.hierarchical_memory.search_hybrid(
+        # Standardowe wyszukiwanie w pamięci (UnifiedMemorySystem.search_hybrid jest synchroniczne)
+        memory_results = await asyncio.to_thread(
+            self.memory.search_hybrid,
             query=user_message,
             user_id=user_id,
-            max_results=10
+            limit=10
         )
         
         # Kompresja i synteza wiedzy
-        if len(memory_results) > 3 and self.knowledge_compressor:
+        # Kompresja + synteza to 2 rundy LLM przed generacją, która też musi się zmieścić
+        if len(memory_results) > 3 and self.knowledge_compressor and (deadline is None or deadline.fits(3)):
             # Przygotuj konwersacje do kompresji
             conversations = []
             for result in memory_results:
@@ -361,15 +704,15 @@ class AdvancedCognitiveEngine:
         
         return memory_results, compressed_knowledge
     
-    async def _generate_enhanced_response(
+    def _build_response_messages(
         self,
         user_message: str,
         memory_context: List[Dict[str, Any]],
         compressed_knowledge: Dict[str, Any],
         inner_thought,
         cognitive_mode: CognitiveMode
-    ) -> str:
-        """Generuj ulepszoną odpowiedź z pełnym kontekstem"""
+    ) -> List[Dict[str, str]]:
+        """Zbuduj wiadomości dla finalnej generacji (wspólne dla trybu zwykłego i streamingu)"""
         
         # Przygotuj kontekst dla LLM
         context_elements = []
@@ -383,8 +726,8 @@ class AdvancedCognitiveEngine:
             if patterns:
                 context_elements.append(f"Wzorce myślowe: {patterns[0].get('description', '')}")
         
-        # Dodaj inner language insights
-        if inner_thought:
+        # Dodaj inner language insights (fallback _process_inner_language zwraca dict)
+        if inner_thought and hasattr(inner_thought, "compression_level"):
             context_elements.append(f"Kompresja myśli: {inner_thought.compression_level:.2f}")
             if inner_thought.confidence > 0.7:
                 context_elements.append("Wysoka pewność interpretacji")
@@ -414,14 +757,34 @@ class AdvancedCognitiveEngine:
         Odpowiedź:
         """
         
+        return [{
+            "role": "system",
+            "content": f"Jesteś zaawansowanym asystentem AI z możliwościami kognitywnego przetwarzania w trybie {cognitive_mode.value}. Wykorzystujesz kontekst z pamięci, kompresji wiedzy i analizy wewnętrznego języka."
+        }, {
+            "role": "user",
+            "content": enhanced_prompt
+        }]
+    
+    async def _generate_enhanced_response(
+        self,
+        user_message: str,
+        memory_context: List[Dict[str, Any]],
+        compressed_knowledge: Dict[str, Any],
+        inner_thought,
+        cognitive_mode: CognitiveMode,
+        deadline: Optional[Deadline] = None
+    ) -> str:
+        """Generuj ulepszoną odpowiedź z pełnym kontekstem"""
+        
+        opts = {}
+        if deadline is not None:
+            # Odpowiedź jest obowiązkowa - nawet po przekroczeniu budżetu dostaje minimum czasu
+            opts["timeout_s"] = max(5.0, deadline.timeout(LLM_TIMEOUT))
+        
         try:
-            response = await self.llm_client.chat_completion([{
-                "role": "system",
-                "content": f"Jesteś zaawansowanym asystentem AI z możliwościami kognitywnego przetwarzania w trybie {cognitive_mode.value}. Wykorzystujesz kontekst z pamięci, kompresji wiedzy i analizy wewnętrznego języka."
-            }, {
-                "role": "user",
-                "content": enhanced_prompt
-            }])
+            response = await self.llm_client.chat_completion(self._build_response_messages(
+                user_message, memory_context, compressed_knowledge, inner_thought, cognitive_mode
+            ), **opts)
             
             return response
             
@@ -434,24 +797,37 @@ class AdvancedCognitiveEngine:
         user_message: str,
         primary_response: str,
         conversation_context: List[Dict[str, Any]],
-        custom_agents: List[str] = None
+        custom_agents: List[str] = None,
+        deadline: Optional[Deadline] = None
     ) -> List[Dict[str, Any]]:
-        """Orkiestruj analizę wieloagentową"""
+        """Orkiestruj analizę wieloagentową -> perspektywy (agent, pewność)"""
         
         try:
-            result = await self.multi_agent.orchestrate_multi_agent_response(
-                user_query=user_message,
-                initial_response=primary_response,
-                conversation_context=conversation_context or [],
-                custom_agents=custom_agents
-            )
+            from .multi_agent_orchestrator import AgentRole
+            active_agents = [AgentRole(name) for name in custom_agents] if custom_agents else None
             
-            return result.get("agent_responses", [])
+            consensus = await self.multi_agent.orchestrate_multi_agent_response(
+                query=user_message,
+                context={"initial_response": primary_response, "conversation": conversation_context or []},
+                active_agents=active_agents,
+                deadline=deadline
+            )
+            if consensus.integration_method == "error_fallback":
+                return []
             
+            return [
+                {
+                    "agent": role.value,
+                    "confidence": confidence,
+                    "consensus_strength": consensus.consensus_strength
+                }
+                for role, confidence in consensus.confidence_distribution.items()
+            ]
+        
         except Exception as e:
             log_error(f"[COGNITIVE_ENGINE] Błąd analizy wieloagentowej: {e}")
             return []
-    
+
     async def _determine_reflection_depth(
         self,
         user_message: str,
@@ -592,7 +968,7 @@ class AdvancedCognitiveEngine:
         
         # Oryginalność z inner language
         if inner_thought:
-            originality += inner_thought.originality * 0.4
+            originality += getattr(inner_thought, "originality", 0.5) * 0.4
         
         # Oryginalność z syntezy wiedzy
         if compressed_knowledge.get("synthetic_memories"):
@@ -604,6 +980,22 @@ class AdvancedCognitiveEngine:
         
         return min(originality, 1.0)
     
+    async def _finish_post_answer(
+        self,
+        prediction_task: Optional[asyncio.Task],
+        processing_time: float,
+        confidence_score: float
+    ):
+        """Dokończ predykcję (jeśli trwa) i zaktualizuj statystyki - poza ścieżką odpowiedzi"""
+        
+        predictions = []
+        if prediction_task is not None:
+            try:
+                predictions = await prediction_task
+            except Exception as e:
+                log_warning(f"[COGNITIVE_ENGINE] Predykcja w tle nie powiodła się: {e}")
+        await self._update_processing_stats(processing_time, confidence_score, len(predictions))
+    
     async def _update_processing_stats(
         self,
         processing_time: float,
@@ -694,7 +1086,8 @@ async def process_with_full_cognition(
     user_message: str,
     user_id: str,
     conversation_context: List[Dict[str, Any]] = None,
-    mode: str = "enhanced"
+    mode: str = "enhanced",
+    deadline: Optional[Deadline] = None
 ) -> Dict[str, Any]:
     """
     Główna funkcja przetwarzania z pełną kognicją
@@ -704,6 +1097,7 @@ async def process_with_full_cognition(
         user_id: ID użytkownika  
         conversation_context: Kontekst konwersacji
         mode: Tryb kognitywny ("basic", "enhanced", "advanced", "full_cognitive")
+        deadline: Budżet czasu (domyślnie COGNITIVE_DEADLINES["cognitive"])
         
     Returns:
         Dict: Wynik przetwarzania kognitywnego
@@ -720,7 +1114,8 @@ async def process_with_full_cognition(
         user_message=user_message,
         user_id=user_id,
         conversation_context=conversation_context,
-        cognitive_mode=cognitive_mode
+        cognitive_mode=cognitive_mode,
+        deadline=deadline or Deadline.for_endpoint("cognitive")
     )
     
     # Konwertuj na dict dla API
@@ -710,7 +710,7 @@ class MemoryClustering:
             return None
             
         # Użyj LLM do wygenerowania podsumowania
-        from .llm import _llm_request
+        from .llm import _allm_request
         
         prompt = f"""Wygeneruj zwięzłe podsumowanie poniższych powiązanych faktów:
 
@@ -720,7 +720,7 @@ Podsumowanie (maksymalnie 3 zdania):"""
         
         try:
             summary = await task_pool.submit(
-                _llm_request, 
+                _allm_request, 
                 messages=[
                     {"role": "system", "content": "Jesteś pomocnym asystentem specjalizującym się w tworzeniu zwięzłych podsumowań."},
                     {"role": "user", "content": prompt}
@@ -19,6 +19,7 @@ from fastapi.staticfiles import StaticFiles
 
 from core.metrics import (
     PROMETHEUS_AVAILABLE,
+    endpoint_label,
     record_error,
     record_request,
 )
@@ -214,23 +215,23 @@ if PROMETHEUS_AVAILABLE:
     @app.middleware("http")
     async def prometheus_middleware(request: Request, call_next):
         start_time = time.time()
-        endpoint = request.url.path
         method = request.method
         status_code = 500
         
         try:
             response = await call_next(request)
             status_code = response.status_code
-
+            
             return response
         except Exception as exc:
             status_code = getattr(exc, "status_code", 500)
             error_label = exc.__class__.__name__
-            record_error(error_label, endpoint)
+            record_error(error_label, endpoint_label(request.scope))
             raise
         finally:
+            # Szablon trasy (ustawiony przez router w call_next), nie surowa ścieżka
             duration = time.time() - start_time
-            record_request(method, endpoint, status_code, duration)
+            record_request(method, endpoint_label(request.scope), status_code, duration)
 
 # ═══════════════════════════════════════════════════════════════════
 # INCLUDE ROUTERS - Wszystkie endpointy
@@ -643,12 +644,41 @@ async def startup_event():
         print("[OK] Pamięć LTM załadowana")
     except Exception as e:
         print(f"[WARN] Błąd inicjalizacji pamięci: {e}")
+    
+    # Pula procesów ekstrakcji (forkserver) - workery startują teraz, nie przy pierwszym żądaniu
+    try:
+        from core.research import start_extract_pool
+        start_extract_pool()
+    except Exception as e:
+        print(f"[WARN] Błąd startu puli ekstrakcji: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup przy wyłączeniu"""
     print("\n[INFO] Shutting down Mordzix AI...")
 
+    # Zapis zaległych (write-behind) zapisów pamięci i zamknięcie połączeń DB
+    try:
+        from core.memory import memory_shutdown
+        memory_shutdown()
+    except Exception as e:
+        print(f"[WARN] Błąd zamykania pamięci: {e}")
+
+    # Zamknięcie współdzielonej puli połączeń LLM (httpx)
+    try:
+        from core.llm import close_llm_clients
+        await close_llm_clients()
+    except Exception as e:
+        print(f"[WARN] Błąd zamykania klienta LLM: {e}")
+    
+    # Zamknięcie puli HTTP modułu research (search/scraping)
+    try:
+        from core.research import close_web_clients, shutdown_extract_pool
+        await close_web_clients()
+        shutdown_extract_pool()
+    except Exception as e:
+        print(f"[WARN] Błąd zamykania klienta web: {e}")
+
 # ═══════════════════════════════════════════════════════════════════
 # MAIN - Uruchomienie serwera
 # ═══════════════════════════════════════════════════════════════════
@@ -7,11 +7,13 @@ from fastapi import APIRouter, Request, HTTPException, Depends
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-import os, json, asyncio
+import os, json, asyncio, time
 from dataclasses import dataclass, asdict
 
 # --- MAIN IMPORT: THE NEW COGNITIVE ENGINE ---
 from core.cognitive_engine import cognitive_engine
+from core.helpers import log_info, log_warning
+from core.metrics import observe_llm_stream
 
 # Imports for memory saving (UnifiedMemorySystem)
 try:
@@ -93,17 +95,41 @@ async def chat_assistant_stream(body: ChatRequest, req: Request, _=Depends(_auth
     user_id = body.user_id or req.client.host or "default"
 
     async def generate():
-        result = await cognitive_engine.process_message(user_id, [m.dict() for m in body.messages], req)
-        answer = result.get("answer", "Error processing stream.")
+        started = time.perf_counter()
+        first_token_at = None
+        streamed: List[str] = []
+        result: Dict[str, Any] = {}
 
         yield f"data: {json.dumps({'type': 'start'})}\n\n"
-        # Simulate streaming for now
-        for i in range(0, len(answer), 48):
-            chunk = answer[i:i+48]
-            yield f"data: {json.dumps({'type': 'chunk', 'content': chunk})}\n\n"
-            await asyncio.sleep(0.01)
-        
-        yield f"data: {json.dumps({'type': 'complete', 'answer': answer, 'metadata': result.get('metadata', {})})}\n\n"
+
+        # Real tokens from the final LLM generation + progress events for the pre-stages
+        async for event in cognitive_engine.process_message_stream(user_id, [m.dict() for m in body.messages], req):
+            if event.get("type") == "result":
+                result = event.get("result") or {}
+                continue
+            if event.get("type") == "chunk":
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                streamed.append(event.get("content", ""))
+            yield f"data: {json.dumps(event)}\n\n"
+
+        sent = "".join(streamed)
+        answer = result.get("answer") or sent or "Error processing stream."
+        metadata = result.get("metadata", {})
+
+        # Fast path / fallback / tool info: send whatever was not streamed yet
+        if answer != sent and answer.startswith(sent):
+            yield f"data: {json.dumps({'type': 'chunk', 'content': answer[len(sent):]})}\n\n"
+
+        if first_token_at is not None:
+            ttft = first_token_at - started
+            decode_time = time.perf_counter() - first_token_at
+            tokens_per_second = (len(streamed) - 1) / decode_time if decode_time > 0 else 0.0
+            observe_llm_stream(ttft, tokens_per_second)
+            metadata["time_to_first_token"] = ttft
+            metadata["tokens_per_second"] = tokens_per_second
+
+        yield f"data: {json.dumps({'type': 'complete', 'answer': answer, 'metadata': metadata}, default=str)}\n\n"
 
         # 🔥 Save to UNIFIED MEMORY after stream completion
         plain_last_user = next((m.content for m in reversed(body.messages) if m.role == "user"), "")
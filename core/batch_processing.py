@@ -9,6 +9,7 @@ optymalizując wykorzystanie API i minimalizując opóźnienia.
 import asyncio
 import time
 import json
+import hashlib
 from typing import List, Dict, Any, Optional, Union, Callable, Tuple
 from dataclasses import dataclass, field
 import traceback
@@ -18,7 +19,7 @@ from core.config import (
     LLM_MODEL, LLM_API_KEY, LLM_BASE_URL, 
     LLM_RETRIES, LLM_TIMEOUT, LLM_BACKOFF_S
 )
-from core.llm import call_llm, call_llm_raw
+from core.llm import call_llm, call_llm_raw, acall_llm
 
 # ═══════════════════════════════════════════════════════════════════
 # KONFIGURACJA WSADOWEGO PRZETWARZANIA
@@ -30,6 +31,10 @@ MAX_BATCH_WAIT_MS = 100       # Maksymalny czas oczekiwania na więcej zapytań
 MIN_BATCH_SIZE = 2            # Minimalna liczba zapytań potrzebna do uruchomienia wsadowego przetwarzania
 MAX_CONCURRENT_BATCHES = 3    # Maksymalna liczba równoległych przetwarzań wsadowych
 BATCH_TIMEOUT = 30            # Globalny timeout dla wsadowego przetwarzania (sekundy)
+MAX_CONCURRENT_LLM_CALLS = 8  # Limit równoległych wywołań LLM ze wszystkich partii
+CHARS_PER_TOKEN = 4           # Przybliżenie tokenów (jak llm.truncate_messages)
+PREFIX_WARMUP_MIN_TOKENS = 1024  # Wspólny prefiks od tej długości: pierwsze żądanie grupy idzie przodem
+                                 # (typowe minimum prefix cache dostawców; krótszy nie jest cache'owany)
 
 # Metryki i monitoring
 METRICS_WINDOW_SIZE = 100     # Liczba zapytań do przechowywania w metrykach
@@ -55,7 +60,11 @@ class BatchMetrics:
     avg_batch_size: float = 0.0      # Średni rozmiar partii
     avg_wait_time: float = 0.0       # Średni czas oczekiwania (ms)
     avg_processing_time: float = 0.0  # Średni czas przetwarzania (ms)
-    token_savings: int = 0           # Oszacowane oszczędności tokenów
+    token_savings: int = 0           # Tokeny promptu niewysłane (żądania scalone z identycznym w locie)
+    prompt_tokens: int = 0           # Tokeny promptu wysłane do API
+    merged_requests: int = 0         # Żądania scalone z identycznym żądaniem w locie
+    prefix_groups: int = 0           # Grupy >1 żądań rozgrzewające prefix cache (pierwsze żądanie przodem)
+    prefix_cache_estimate: int = 0   # Szacunek tokenów prefiksu, które dostawca może wziąć z cache
     error_count: int = 0             # Liczba błędów
     
     # Historia ostatnich operacji dla wykresów
@@ -64,6 +73,36 @@ class BatchMetrics:
     recent_processing_times: deque = field(default_factory=lambda: deque(maxlen=METRICS_WINDOW_SIZE))
 
 
+def _estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Przybliżona liczba tokenów promptu"""
+    return sum(len(str(m.get("content", ""))) for m in messages) // CHARS_PER_TOKEN
+
+
+def _shared_prefix(messages_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Najdłuższy wspólny początek list wiadomości (pełne wiadomości)"""
+    prefix = []
+    for column in zip(*messages_lists):
+        if any(m != column[0] for m in column[1:]):
+            break
+        prefix.append(column[0])
+    return prefix
+
+
+def _request_key(messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+    """Klucz identycznych żądań (do scalania w locie)"""
+    data = json.dumps({"messages": messages, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _group_key(request: "BatchRequest") -> Tuple[str, str, str]:
+    """Grupa partii: model + parametry + prompt systemowy"""
+    params = dict(request.params)
+    model = params.pop("model", LLM_MODEL)
+    system = [m.get("content", "") for m in request.messages if m.get("role") == "system"][:1]
+    system_hash = hashlib.sha1(json.dumps(system).encode()).hexdigest()
+    return model, json.dumps(params, sort_keys=True, default=str), system_hash
+
+
 # ═══════════════════════════════════════════════════════════════════
 # GŁÓWNA LOGIKA WSADOWEGO PRZETWARZANIA
 # ═══════════════════════════════════════════════════════════════════
@@ -89,8 +128,12 @@ class LLMBatchProcessor:
         # Metryki i statystyki
         self.metrics = BatchMetrics()
         
-        # Funkcja wywołania LLM
-        self._llm_call_func = call_llm
+        # Funkcja wywołania LLM (async - nie blokuje pętli zdarzeń)
+        self._llm_call_func = acall_llm
+        self._llm_semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+        
+        # Identyczne żądania w locie: klucz -> future pierwszego z nich
+        self._inflight: Dict[str, asyncio.Future] = {}
         
         # Status i zarządzanie
         self.last_error = None
@@ -165,23 +208,33 @@ class LLMBatchProcessor:
         if not request_id:
             request_id = f"req_{int(time.time() * 1000)}_{hash(str(messages))}"
         
-        # Utwórz żądanie
-        request = BatchRequest(
-            id=request_id,
-            messages=messages,
-            params=params,
-            priority=priority,
-            metadata={
-                "submit_time": time.time()
-            }
-        )
-        
-        # Dodaj do kolejki
-        await self.pending_requests.put(request)
+        # Identyczne żądanie już w locie - podepnij się pod jego wynik
+        key = _request_key(messages, params)
+        future = self._inflight.get(key)
+        if future is not None and not future.done():
+            self.metrics.merged_requests += 1
+            self.metrics.token_savings += _estimate_tokens(messages)
+        else:
+            # Utwórz żądanie
+            request = BatchRequest(
+                id=request_id,
+                messages=messages,
+                params=params,
+                priority=priority,
+                metadata={
+                    "submit_time": time.time()
+                }
+            )
+            future = request.future
+            self._inflight[key] = future
+            future.add_done_callback(lambda f, key=key: self._forget_inflight(key, f))
+            
+            # Dodaj do kolejki
+            await self.pending_requests.put(request)
         
-        # Poczekaj na odpowiedź
+        # Poczekaj na odpowiedź (shield: timeout jednego czekającego nie anuluje wspólnego wyniku)
         try:
-            result = await asyncio.wait_for(request.future, timeout=BATCH_TIMEOUT)
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=BATCH_TIMEOUT)
             return result
         except asyncio.TimeoutError:
             error_msg = f"Timeout waiting for batch request {request_id}"
@@ -189,6 +242,11 @@ class LLMBatchProcessor:
             self.metrics.error_count += 1
             raise TimeoutError(error_msg)
     
+    def _forget_inflight(self, key: str, future: asyncio.Future):
+        """Usuń zakończone żądanie z mapy żądań w locie"""
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+    
     async def _batch_timer(self):
         """
         Zadanie licznika czasu dla partii - uruchamia przetwarzanie partii 
@@ -250,7 +308,9 @@ class LLMBatchProcessor:
                 batch = [first_request]
                 batch_start_time = time.time()
                 
-                # Spróbuj pobrać więcej żądań z kolejki
+                # Spróbuj pobrać więcej żądań z kolejki (jeden obrót pętli, żeby
+                # współbieżnie zgłaszane żądania zdążyły trafić do kolejki)
+                await asyncio.sleep(0)
                 try:
                     while len(batch) < MAX_BATCH_SIZE and not self.pending_requests.empty():
                         # Pobierz następne żądanie bez czekania
@@ -262,22 +322,7 @@ class LLMBatchProcessor:
                 
                 # Jeśli mamy tylko jedno żądanie, przetwórz je bez wsadowo
                 if len(batch) == 1:
-                    single_request = batch[0]
-                    try:
-                        # Wywołaj LLM z pojedynczym żądaniem
-                        result = self._llm_call_func(
-                            single_request.messages,
-                            **single_request.params
-                        )
-                        # Ustaw wynik w future
-                        single_request.future.set_result(result)
-                        
-                    except Exception as e:
-                        # Obsłuż błąd i ustaw wyjątek w future
-                        single_request.future.set_exception(e)
-                        self.last_error = str(e)
-                        self.metrics.error_count += 1
-                        print(f"[ERROR] Single request processing error: {e}")
+                    await self._dispatch(batch[0])
                     
                     # Zaktualizuj metryki
                     self.metrics.total_requests += 1
@@ -311,50 +356,60 @@ class LLMBatchProcessor:
                 # Zmniejsz licznik aktywnych partii
                 self.active_batch_count -= 1
     
+    async def _dispatch(self, request: BatchRequest):
+        """Jedno wywołanie LLM z limitem współbieżności; wynik/wyjątek trafia do future"""
+        async with self._llm_semaphore:
+            self.metrics.prompt_tokens += _estimate_tokens(request.messages)
+            try:
+                result = self._llm_call_func(request.messages, **request.params)
+                if asyncio.iscoroutine(result):
+                    result = await result
+                if not request.future.done():
+                    request.future.set_result(result)
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+                self.last_error = str(e)
+                self.metrics.error_count += 1
+                print(f"[ERROR] Batch request processing error: {e}")
+    
+    async def _dispatch_group(self, group: List[BatchRequest]):
+        """Grupa z długim wspólnym prefiksem: pierwsze żądanie rozgrzewa prefix cache, reszta równolegle"""
+        prefix_tokens = _estimate_tokens(_shared_prefix([request.messages for request in group])) if len(group) > 1 else 0
+        if prefix_tokens < PREFIX_WARMUP_MIN_TOKENS:
+            await asyncio.gather(*(self._dispatch(request) for request in group))
+            return
+        
+        self.metrics.prefix_groups += 1
+        self.metrics.prefix_cache_estimate += prefix_tokens * (len(group) - 1)
+        await self._dispatch(group[0])
+        await asyncio.gather(*(self._dispatch(request) for request in group[1:]))
+    
     async def _process_batch(self, batch: List[BatchRequest]):
         """
-        Przetwarza partię żądań jednym wywołaniem LLM
+        Przetwarza partię żądań: grupuje po modelu/parametrach/prompcie systemowym
+        i wysyła równolegle (limit MAX_CONCURRENT_LLM_CALLS)
+        
+        API chat/completions nie ma wielopromptowych wywołań, więc "partia" to
+        równoległe wywołania po jednym kliencie. W grupie ze wspólnym prefiksem
+        >= PREFIX_WARMUP_MIN_TOKENS pierwsze żądanie idzie samo, a reszta dopiero
+        po nim, żeby trafiła w rozgrzany prefix cache dostawcy; grupy między sobą
+        idą równolegle. Odpowiedź API (str) nie niesie usage, więc trafienia cache
+        są tylko szacowane (prefix_cache_estimate), a nie liczone do token_savings.
         
         Args:
             batch: Lista żądań BatchRequest
         """
-        # Oszacowanie oszczędności tokenów
-        system_prompt_tokens = 0
-        shared_history_tokens = 0
-        
         try:
-            # Przygotuj wywołania LLM dla każdego żądania w partii
-            # TODO: Tutaj należy zaimplementować konkretną logikę wsadową
-            # specyficzną dla używanego modelu LLM i API
-            
-            # Prosta implementacja zastępcza: przetwarzanie sekwencyjne
-            # W rzeczywistej implementacji należy użyć bardziej zaawansowanej
-            # logiki łączenia żądań w jedno wywołanie API
+            groups: Dict[Tuple[str, str, str], List[BatchRequest]] = {}
             for request in batch:
-                try:
-                    # Wywołaj LLM dla każdego żądania
-                    result = self._llm_call_func(
-                        request.messages,
-                        **request.params
-                    )
-                    # Ustaw wynik w future
-                    request.future.set_result(result)
-                    
-                except Exception as e:
-                    # Obsłuż błąd i ustaw wyjątek w future
-                    request.future.set_exception(e)
-                    self.last_error = str(e)
-                    self.metrics.error_count += 1
-                    print(f"[ERROR] Batch request processing error: {e}")
+                groups.setdefault(_group_key(request), []).append(request)
+            
+            await asyncio.gather(*(self._dispatch_group(group) for group in groups.values()))
             
             # Zaktualizuj metryki
             self.metrics.total_requests += len(batch)
             
-            # Oszacowanie oszczędzonych tokenów (uproszczone)
-            # W rzeczywistości należy dokładniej liczyć na podstawie tokenizacji
-            token_savings = system_prompt_tokens + shared_history_tokens
-            self.metrics.token_savings += token_savings
-            
         except Exception as e:
             # Obsłuż błąd całej partii
             for request in batch:
@@ -380,6 +435,10 @@ class LLMBatchProcessor:
             "avg_wait_time_ms": round(self.metrics.avg_wait_time, 2),
             "avg_processing_time_ms": round(self.metrics.avg_processing_time, 2),
             "token_savings": self.metrics.token_savings,
+            "prompt_tokens": self.metrics.prompt_tokens,
+            "merged_requests": self.metrics.merged_requests,
+            "prefix_groups": self.metrics.prefix_groups,
+            "prefix_cache_estimate": self.metrics.prefix_cache_estimate,
             "error_count": self.metrics.error_count,
             "active_batch_count": self.active_batch_count,
             "pending_requests": self.pending_requests.qsize(),
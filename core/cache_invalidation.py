@@ -207,6 +207,8 @@ def cleanup_expired_facts(memory_manager, dry_run: bool = False) -> Dict[str, An
         dict: Cleanup stats
     """
     try:
+        # Queued facts get checked too, and a queued upsert can't resurrect a deleted one
+        memory_manager.db.flush()
         conn = memory_manager.db._conn()
         now = time.time()
         
@@ -245,11 +247,11 @@ def cleanup_expired_facts(memory_manager, dry_run: bool = False) -> Dict[str, An
         # Delete expired facts (unless dry run)
         if not dry_run and expired_ids:
             placeholders = ",".join("?" * len(expired_ids))
-            conn.execute(
-                f"UPDATE memory_nodes SET deleted = 1 WHERE id IN ({placeholders})",
-                expired_ids
-            )
-            conn.commit()
+            with memory_manager.db.writer() as wconn:
+                wconn.execute(
+                    f"UPDATE memory_nodes SET deleted = 1 WHERE id IN ({placeholders})",
+                    expired_ids
+                )
             log_info(f"[CACHE_CLEANUP] Deleted {len(expired_ids)} expired facts")
         else:
             log_info(f"[CACHE_CLEANUP] Dry run: {len(expired_ids)} facts would be deleted")
@@ -16,7 +16,7 @@ import json
 import os
 import time
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 from dataclasses import asdict
 
 # Podstawowe importy systemowe
@@ -38,6 +38,8 @@ from .advanced_cognitive_engine import (
     CognitiveResult,
     process_with_full_cognition
 )
+from .latency_budget import Deadline
+from .metrics import time_stage
 
 # Import systemu pamięci hierarchicznej (fallback)
 try:
@@ -137,6 +139,7 @@ class CognitiveEngine:
         """
         
         start_time = time.time()
+        deadline = Deadline.for_endpoint("chat")
         self.performance_stats["total_requests"] += 1
         
         try:
@@ -157,6 +160,7 @@ class CognitiveEngine:
             tool_results = await self._analyze_and_execute_tools(last_user_msg, messages, user_id)
             
             # ETAP 2: Określ tryb kognitywny na podstawie wiadomości
+            # (silnik obniża go, jeśli budżet czasu / obciążenie nie pozwala)
             cognitive_mode = await self._determine_cognitive_mode(last_user_msg, user_id, messages)
             
             # ETAP 3: Przygotuj kontekst konwersacji + wyniki tools
@@ -164,7 +168,7 @@ class CognitiveEngine:
             
             # Dodaj wyniki tools do kontekstu
             if tool_results and tool_results.get("execution"):
-                conversation_context["tool_results"] = tool_results
+                conversation_context.append(self._tool_results_context(tool_results))
             
             # ETAP 4: Przetwarzanie przez zaawansowany silnik kognitywny
             try:
@@ -175,7 +179,8 @@ class CognitiveEngine:
                     user_id=user_id,
                     conversation_context=conversation_context,
                     cognitive_mode=cognitive_mode,
-                    enable_prediction=True
+                    enable_prediction=True,
+                    deadline=deadline
                 )
                 
                 self.performance_stats["advanced_engine_usage"] += 1
@@ -195,42 +200,148 @@ class CognitiveEngine:
                 self.performance_stats["fallback_usage"] += 1
             
             # ETAP 5: Dodaj wyniki tools do odpowiedzi (JAK CHATGPT!)
-            if tool_results:
-                if "metadata" not in result:
-                    result["metadata"] = {}
-                
-                result["metadata"]["tools_used"] = tool_results.get("tools_used", [])
-                result["metadata"]["tool_plan"] = tool_results.get("plan", [])
-                result["metadata"]["tool_execution"] = tool_results.get("execution", [])
-                result["metadata"]["tool_summary"] = tool_results.get("summary", "")
-                result["metadata"]["tool_reasoning"] = tool_results.get("reasoning")
-                result["metadata"]["tool_confidence"] = tool_results.get("confidence")
-                
-                # Dodaj info o tools do odpowiedzi
-                executed_tools = tool_results.get("tools_used", [])
-                if executed_tools:
-                    tools_info = f"\n\n🔧 **Użyte narzędzia**: {', '.join(executed_tools)}\n"
-                    if tool_results.get("summary"):
-                        tools_info += f"📊 {tool_results['summary']}"
-                    result["answer"] = result.get("answer", "") + tools_info
+            self._apply_tool_results(result, tool_results)
             
             # ETAP 6: Aktualizuj statystyki
-            processing_time = time.time() - start_time
-            await self._update_performance_stats(processing_time)
-            
-            # Dodaj processing time do metadanych
-            if "metadata" not in result:
-                result["metadata"] = {}
-            result["metadata"]["processing_time"] = processing_time
-            result["metadata"]["cognitive_engine_version"] = "advanced_v2.0"
-            
-            log_info(f"[COGNITIVE_ENGINE] Przetwarzanie zakończone: {processing_time:.2f}s")
-            return result
+            return await self._finalize_result(result, start_time)
             
         except Exception as e:
             log_error(f"[COGNITIVE_ENGINE] Krytyczny błąd przetwarzania: {e}")
             return self._create_error_response(str(e))
     
+    async def process_message_stream(self, user_id: str, messages: List[Dict[str, Any]], req: Any) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Strumieniowy wariant process_message (dla /api/chat/assistant/stream)
+        
+        Przekazuje zdarzenia z AdvancedCognitiveEngine.process_message_stream:
+        {"type": "progress"} i {"type": "chunk"} z prawdziwymi tokenami LLM.
+        Ostatnie zdarzenie to {"type": "result", "result": ...} w formacie
+        process_message - jego answer może być dłuższy od wysłanych chunków
+        (fast path, fallback, info o narzędziach).
+        """
+        
+        start_time = time.time()
+        deadline = Deadline.for_endpoint("stream")
+        self.performance_stats["total_requests"] += 1
+        
+        try:
+            last_user_msg = self._extract_last_user_message(messages)
+            if not last_user_msg:
+                yield {"type": "result", "result": self._create_empty_response()}
+                return
+            
+            log_info(f"[COGNITIVE_ENGINE] Streaming: {last_user_msg[:60]}...")
+            
+            # ETAP 1: Fast Path
+            fast_path_result = await self._try_fast_path(last_user_msg, req)
+            if fast_path_result:
+                self.performance_stats["fast_path_hits"] += 1
+                yield {"type": "result", "result": fast_path_result}
+                return
+            
+            # ETAP 1.5: Tools
+            yield {"type": "progress", "stage": "tool_selection"}
+            tool_results = await self._analyze_and_execute_tools(last_user_msg, messages, user_id)
+            
+            # ETAP 2-3: Tryb + kontekst
+            yield {"type": "progress", "stage": "context"}
+            cognitive_mode = await self._determine_cognitive_mode(last_user_msg, user_id, messages)
+            conversation_context = await self._prepare_conversation_context(messages, user_id)
+            if tool_results and tool_results.get("execution"):
+                conversation_context.append(self._tool_results_context(tool_results))
+            
+            # ETAP 4: Zaawansowany silnik - tokeny lecą od razu do klienta
+            streamed: List[str] = []
+            try:
+                cognitive_result = None
+                async for event in self.advanced_engine.process_message_stream(
+                    user_message=last_user_msg,
+                    user_id=user_id,
+                    conversation_context=conversation_context,
+                    cognitive_mode=cognitive_mode,
+                    enable_prediction=True,
+                    deadline=deadline
+                ):
+                    if event["type"] == "result":
+                        cognitive_result = event["result"]
+                        continue
+                    if event["type"] == "chunk":
+                        streamed.append(event["content"])
+                    yield event
+                
+                self.performance_stats["advanced_engine_usage"] += 1
+                result = await self._convert_cognitive_result_to_api_format(
+                    cognitive_result, last_user_msg, req, tool_results
+                )
+                
+            except Exception as e:
+                log_error(f"[COGNITIVE_ENGINE] Zaawansowany silnik (stream) failed: {e}")
+                if streamed:
+                    # Część odpowiedzi już wyszła - domknij tym, co jest
+                    result = {
+                        "answer": "".join(streamed),
+                        "sources": [],
+                        "metadata": {"source": "advanced_cognitive_engine", "stream_error": str(e)}
+                    }
+                else:
+                    result = await self._fallback_processing(last_user_msg, user_id, messages, req)
+                    self.performance_stats["fallback_usage"] += 1
+            
+            # ETAP 5-6: Tools + statystyki
+            self._apply_tool_results(result, tool_results)
+            yield {"type": "result", "result": await self._finalize_result(result, start_time)}
+            
+        except Exception as e:
+            log_error(f"[COGNITIVE_ENGINE] Krytyczny błąd streamingu: {e}")
+            yield {"type": "result", "result": self._create_error_response(str(e))}
+    
+    def _tool_results_context(self, tool_results: Dict[str, Any]) -> Dict[str, Any]:
+        """Wyniki tools jako wpis kontekstu (kontekst jest listą wiadomości)"""
+        return {
+            "role": "tool",
+            "content": tool_results.get("summary", ""),
+            "type": "tool_results",
+            "tool_results": tool_results
+        }
+    
+    def _apply_tool_results(self, result: Dict[str, Any], tool_results: Optional[Dict[str, Any]]) -> None:
+        """Dodaj wyniki tools do metadanych i odpowiedzi"""
+        
+        if not tool_results:
+            return
+        
+        if "metadata" not in result:
+            result["metadata"] = {}
+        
+        result["metadata"]["tools_used"] = tool_results.get("tools_used", [])
+        result["metadata"]["tool_plan"] = tool_results.get("plan", [])
+        result["metadata"]["tool_execution"] = tool_results.get("execution", [])
+        result["metadata"]["tool_summary"] = tool_results.get("summary", "")
+        result["metadata"]["tool_reasoning"] = tool_results.get("reasoning")
+        result["metadata"]["tool_confidence"] = tool_results.get("confidence")
+        
+        # Dodaj info o tools do odpowiedzi
+        executed_tools = tool_results.get("tools_used", [])
+        if executed_tools:
+            tools_info = f"\n\n🔧 **Użyte narzędzia**: {', '.join(executed_tools)}\n"
+            if tool_results.get("summary"):
+                tools_info += f"📊 {tool_results['summary']}"
+            result["answer"] = result.get("answer", "") + tools_info
+    
+    async def _finalize_result(self, result: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        """Aktualizuj statystyki i dodaj processing time do metadanych"""
+        
+        processing_time = time.time() - start_time
+        await self._update_performance_stats(processing_time)
+        
+        if "metadata" not in result:
+            result["metadata"] = {}
+        result["metadata"]["processing_time"] = processing_time
+        result["metadata"]["cognitive_engine_version"] = "advanced_v2.0"
+        
+        log_info(f"[COGNITIVE_ENGINE] Przetwarzanie zakończone: {processing_time:.2f}s")
+        return result
+    
     def _extract_last_user_message(self, messages: List[Dict[str, Any]]) -> str:
         """Wydobądź ostatnią wiadomość użytkownika"""
         for msg in reversed(messages):
@@ -562,7 +673,7 @@ class CognitiveEngine:
                 
                 # Wywołanie LLM (synchroniczne, nie async)
                 from .llm import call_llm
-                response = call_llm(llm_messages, **tuned_params)
+                response = call_llm(llm_messages, user_id=user_id, **tuned_params)
                 
                 return {
                     "answer": response,
@@ -653,7 +764,8 @@ class CognitiveEngine:
             
             # Wykonaj wybrane tools
             log_info(f"[COGNITIVE_ENGINE] 🚀 Wykonuję {len(tools)} tools...")
-            execution_results = await execute_selected_tools(tools, user_id)
+            with time_stage("tool_execution"):
+                execution_results = await execute_selected_tools(tools, user_id)
             
             plan = self._format_tool_plan(tools)
             execution_details = self._merge_execution_with_plan(execution_results.get("results", []), plan)
@@ -55,6 +55,25 @@ LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "Qwen/Qwen3-Next-80B-A3B-In
 LLM_TIMEOUT = int(os.getenv("LLM_TIMEOUT", "45"))
 LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
 LLM_BACKOFF_S = float(os.getenv("LLM_BACKOFF_S", "1.5"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "20"))  # Cap for jittered exponential backoff
+
+# Shared httpx connection pool (core/llm.py)
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"  # Needs the `h2` package, falls back to HTTP/1.1
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_MAX_CONNECTIONS_PER_HOST = int(os.getenv("LLM_MAX_CONNECTIONS_PER_HOST", "32"))  # Concurrent requests per host
+
+# Single-flight: identical concurrent call_llm requests share one upstream call
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "1") == "1"
+LLM_SINGLE_FLIGHT_LOCK_S = int(os.getenv("LLM_SINGLE_FLIGHT_LOCK_S", "30"))  # Redis lock TTL / max wait for another worker
+
+# Semantic cache: near-duplicate questions (embedding cosine) reuse a cached answer
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"  # Opt-in
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # Min cosine of normalized user turns
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))  # Per namespace, oldest evicted first
+SEMANTIC_CACHE_SAMPLE_RATE = float(os.getenv("SEMANTIC_CACHE_SAMPLE_RATE", "0.02"))  # Hits re-asked upstream to measure false hits
+SEMANTIC_CACHE_ANSWER_MIN_SIM = float(os.getenv("SEMANTIC_CACHE_ANSWER_MIN_SIM", "0.8"))  # Below this, a sampled hit counts as false
 
 # ═══════════════════════════════════════════════════════════════════
 # MEMORY CONFIGURATION
@@ -74,6 +93,58 @@ MEMORY_AUTO_CONSOLIDATE = True  # Auto-consolidate episodes to facts
 MEMORY_CONTEXT_LIMIT = 100  # 🔥 Max memory items (było 50) - DOUBLE!
 MEMORY_ARCHIVE_DAYS = 730  # 🔥 Archive 2 lata (było 365) - DŁUGI RETENTION!
 
+# Write-behind: buffer node/FTS/metric writes and flush them in one transaction
+MEMORY_WRITE_BEHIND = os.getenv("MEMORY_WRITE_BEHIND", "0") == "1"
+MEMORY_WRITE_BEHIND_BATCH = int(os.getenv("MEMORY_WRITE_BEHIND_BATCH", "64"))  # Flush every N items
+MEMORY_WRITE_BEHIND_FLUSH_MS = int(os.getenv("MEMORY_WRITE_BEHIND_FLUSH_MS", "250"))  # ...or every M ms
+
+# Persistent per-user ANN index over memory_nodes.embedding (core/vector_index.py)
+MEMORY_VECTOR_INDEX = os.getenv("MEMORY_VECTOR_INDEX", "1") == "1"
+MEMORY_VECTOR_NPROBE = int(os.getenv("MEMORY_VECTOR_NPROBE", "8"))  # IVF lists scanned per query
+
+# Storage dtype of memory_nodes.embedding blobs: float32 | float16 | int8 (core/embedding_codec.py)
+MEMORY_EMBEDDING_DTYPE = os.getenv("MEMORY_EMBEDDING_DTYPE", "float32")
+
+# ═══════════════════════════════════════════════════════════════════
+# EMBEDDINGS
+# ═══════════════════════════════════════════════════════════════════
+
+# Provider used by embed_many (core/embeddings.py):
+#   auto   - remote API when LLM_API_KEY is set, else local model if installed
+#   remote - OpenAI-compatible /embeddings endpoint (DeepInfra)
+#   local  - sentence-transformers on CPU (torch or ONNX backend)
+#   hash   - deterministic hashing trick, no model (tests / offline dev)
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "auto")
+EMBED_URL = os.getenv("EMBED_URL", "https://api.deepinfra.com/v1/openai/embeddings")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-mpnet-base-v2")  # 768 dim
+EMBED_LOCAL_MODEL = os.getenv("EMBED_LOCAL_MODEL", EMBED_MODEL)  # Same model keeps stored vectors comparable
+EMBED_LOCAL_BACKEND = os.getenv("EMBED_LOCAL_BACKEND", "torch")  # torch | onnx
+EMBED_LOCAL_MAX_BATCH = int(os.getenv("EMBED_LOCAL_MAX_BATCH", "64"))  # Texts per forward pass
+EMBED_LOCAL_MAX_BATCH_TOKENS = int(os.getenv("EMBED_LOCAL_MAX_BATCH_TOKENS", "8192"))  # Padded tokens per pass
+EMBED_LOCAL_THREADS = int(os.getenv("EMBED_LOCAL_THREADS", "2"))  # Batches encoded in parallel
+EMBED_HASH_DIM = int(os.getenv("EMBED_HASH_DIM", "768"))
+
+# Micro-batcher: coalesce cache misses from concurrent callers into one provider call
+EMBED_BATCHER = os.getenv("EMBED_BATCHER", "1") == "1"
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))  # Texts per provider call
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))  # Max time a text waits for company
+EMBED_BATCH_CONCURRENCY = int(os.getenv("EMBED_BATCH_CONCURRENCY", "4"))  # Provider calls in flight
+
+# LRU cache in front of embed_many (core/embed_cache.py)
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # RAM tier budget
+EMBED_CACHE_DISK = os.getenv("EMBED_CACHE_DISK", "1") == "1"  # mmap tier shared by uvicorn workers
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", os.path.join(BASE_DIR, "embed_cache"))
+EMBED_CACHE_DISK_MAX_ROWS = int(os.getenv("EMBED_CACHE_DISK_MAX_ROWS", "200000"))  # Ring buffer size per dim
+
+# ═══════════════════════════════════════════════════════════════════
+# IN-MEMORY CACHES (core/middleware.py)
+# ═══════════════════════════════════════════════════════════════════
+
+CACHE_SWEEP_INTERVAL = int(os.getenv("CACHE_SWEEP_INTERVAL", "60"))  # Background expiry sweep period [s]
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+GENERAL_CACHE_MAX_BYTES = int(os.getenv("GENERAL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
 # ═══════════════════════════════════════════════════════════════════
 # RATE LIMITING
 # ═══════════════════════════════════════════════════════════════════
@@ -81,6 +152,8 @@ MEMORY_ARCHIVE_DAYS = 730  # 🔥 Archive 2 lata (było 365) - DŁUGI RETENTION!
 RATE_LIMIT_ENABLED = os.getenv("RL_DISABLE", "0") != "1"
 RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "160"))
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory | redis (shared by all uvicorn workers)
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))  # Lock shards of the in-memory limiter
 
 # ═══════════════════════════════════════════════════════════════════
 # PARALLEL PROCESSING & CONCURRENCY
@@ -89,8 +162,20 @@ RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
 MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "32"))  # Maksymalna liczba równoległych zadań
 PRIORITY_LEVELS = 3  # Liczba poziomów priorytetów (0-najwyższy, 2-najniższy)
 PARALLEL_TIMEOUT = float(os.getenv("PARALLEL_TIMEOUT", "30.0"))  # Timeout dla zadań równoległych
+PARALLEL_QUEUE_SIZE = int(os.getenv("PARALLEL_QUEUE_SIZE", "1000"))  # Limit kolejki AsyncTaskPool (backpressure)
 THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "16"))  # Rozmiar puli wątków
 LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "5"))  # Rozmiar batcha dla zapytań do LLM
+MULTI_AGENT_STRUCTURED = os.getenv("MULTI_AGENT_STRUCTURED", "1") == "1"  # Agent = 1 JSON call, batched cross-critiques
+
+# Latency budget (core/latency_budget.py): target p95 per endpoint, propagated as a Deadline
+COGNITIVE_DEADLINES = {
+    "chat": float(os.getenv("DEADLINE_CHAT_S", "20")),            # /api/chat/assistant
+    "stream": float(os.getenv("DEADLINE_STREAM_S", "30")),        # /api/chat/assistant/stream
+    "cognitive": float(os.getenv("DEADLINE_COGNITIVE_S", "45")),  # /api/cognitive/*
+}
+LLM_LATENCY_PRIOR_S = float(os.getenv("LLM_LATENCY_PRIOR_S", "3.0"))  # Estimated LLM round trip before samples arrive
+LLM_LATENCY_DEGRADE_S = float(os.getenv("LLM_LATENCY_DEGRADE_S", "8.0"))  # Upstream latency EWMA counted as full load
+COGNITIVE_MAX_INFLIGHT = int(os.getenv("COGNITIVE_MAX_INFLIGHT", "16"))  # In-flight cognitive requests counted as full load
 
 # ═══════════════════════════════════════════════════════════════════
 # EXTERNAL APIs
@@ -106,6 +191,18 @@ FIRECRAWL_BASE_URL = os.getenv("FIRECRAWL_BASE_URL", "https://api.firecrawl.dev"
 # OpenTripMap (Travel)
 OTM_API_KEY = os.getenv("OTM_API_KEY", "")
 
+# Scraped-page cache with conditional revalidation (core/page_cache.py)
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "1") == "1"
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", os.path.join(BASE_DIR, "page_cache.db"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # Compressed bodies + text
+PAGE_CACHE_DEFAULT_MAX_AGE = int(os.getenv("PAGE_CACHE_DEFAULT_MAX_AGE", "0"))  # 0 = revalidate on every use
+# Seconds a page is served without revalidation (matched by domain suffix)
+PAGE_CACHE_FRESHNESS = {
+    "arxiv.org": int(os.getenv("PAGE_CACHE_ARXIV_MAX_AGE", str(7 * 86400))),  # Abstract pages rarely change
+    "semanticscholar.org": int(os.getenv("PAGE_CACHE_S2_MAX_AGE", "86400")),
+    "wikipedia.org": int(os.getenv("PAGE_CACHE_WIKIPEDIA_MAX_AGE", "3600")),
+}
+
 # ═══════════════════════════════════════════════════════════════════
 # SYSTEM PROMPT (Mordzix Persona)
 # ═══════════════════════════════════════════════════════════════════
@@ -442,5 +539,6 @@ def get_config_summary() -> Dict[str, any]:
         "rate_limiting": {
             "enabled": RATE_LIMIT_ENABLED,
             "per_minute": RATE_LIMIT_PER_MINUTE,
+            "backend": RATE_LIMIT_BACKEND,
         }
     }
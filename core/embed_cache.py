@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+embed_cache.py - Two-tier embedding cache used by helpers.embed_many
+
+    RAM tier:  LRU (OrderedDict) keyed by sha1(model + text), bounded by bytes
+    Disk tier: one mmap'd float32 matrix per dimension + SQLite key index,
+               shared by every uvicorn worker on the host (ring buffer of
+               EMBED_CACHE_DISK_MAX_ROWS rows, oldest rows are overwritten)
+
+Disk writes are serialized across processes by SQLite (BEGIN IMMEDIATE).
+Every slot also carries a tag of its key in a parallel mmap: the writer zeroes
+the tag, overwrites the vector, then sets the new tag; readers compare the tag
+before and after copying the vector. A reader still holding the mapping of a
+key whose slot the ring just reused (another process, not yet committed) gets
+a miss, never the other key's vector.
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .helpers import log_info, log_warning, log_error
+from . import metrics
+
+
+DISK_GROW_ROWS = 4096  # Matrix files grow in steps of this many rows
+
+
+def cache_key(model: str, text: str) -> str:
+    """Cache key for (model, text)"""
+    return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _slot_tag(key: str) -> int:
+    """Non-zero 60-bit tag of a key (0 marks a slot being rewritten)"""
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:15], 16) or 1
+
+
+# ═══════════════════════════════════════════════════════════════════
+# DISK TIER
+# ═══════════════════════════════════════════════════════════════════
+
+class DiskEmbeddingTier:
+    """mmap'd float32 matrices + SQLite key index, safe across processes"""
+
+    def __init__(self, root: str, max_rows: int = 200000):
+        self.root = root
+        self.max_rows = max_rows
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._maps: Dict[int, Tuple[np.memmap, np.memmap]] = {}  # dim -> (vectors, slot tags)
+        self._conn = sqlite3.connect(os.path.join(root, "index.db"), timeout=30.0,
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                slot INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_embed_slot ON embeddings(dim, slot)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS slots (dim INTEGER PRIMARY KEY, next_slot INTEGER NOT NULL)")
+
+    def _matrix_path(self, dim: int) -> str:
+        return os.path.join(self.root, f"vectors_{dim}.f32")
+
+    def _tags_path(self, dim: int) -> str:
+        return os.path.join(self.root, f"vectors_{dim}.tag")
+
+    def _matrix(self, dim: int, min_rows: int, grow: bool = False) -> Optional[Tuple[np.memmap, np.memmap]]:
+        """(vectors, tags) mappings covering at least min_rows rows
+
+        Files only grow with grow=True (writers, inside BEGIN IMMEDIATE); a reader
+        seeing shorter files (e.g. tags missing next to an older matrix) gets None.
+        """
+        maps = self._maps.get(dim)
+        if maps is not None and maps[0].shape[0] >= min_rows:
+            return maps
+
+        path, tags_path = self._matrix_path(dim), self._tags_path(dim)
+        row_bytes = dim * 4
+        rows = min(os.path.getsize(path) // row_bytes if os.path.exists(path) else 0,
+                   os.path.getsize(tags_path) // 8 if os.path.exists(tags_path) else 0)
+        if rows < min_rows:
+            if not grow:
+                return None
+            rows = min(self.max_rows, ((min_rows + DISK_GROW_ROWS - 1) // DISK_GROW_ROWS) * DISK_GROW_ROWS)
+            for file_path, nbytes in ((path, rows * row_bytes), (tags_path, rows * 8)):
+                with open(file_path, "ab") as f:
+                    if f.tell() < nbytes:
+                        f.truncate(nbytes)
+
+        maps = (np.memmap(path, dtype=np.float32, mode="r+", shape=(rows, dim)),
+                np.memmap(tags_path, dtype=np.int64, mode="r+", shape=(rows,)))
+        self._maps[dim] = maps
+        return maps
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        if not keys:
+            return found
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, dim, slot FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, dim, slot in rows:
+                    maps = self._matrix(dim, slot + 1)
+                    if maps is None:
+                        continue
+                    mm, tags = maps
+                    tag = _slot_tag(key)
+                    if tags[slot] != tag:
+                        continue  # slot reused by another key (writer not committed yet)
+                    vec = np.array(mm[slot], dtype=np.float32)
+                    if tags[slot] == tag:  # not rewritten while copying
+                        found[key] = vec
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        by_dim: Dict[int, List] = {}
+        for key, vec in items.items():
+            by_dim.setdefault(int(vec.size), []).append((key, vec))
+
+        with self._lock:
+            for dim, entries in by_dim.items():
+                entries = entries[-self.max_rows:]
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute("SELECT next_slot FROM slots WHERE dim = ?", (dim,)).fetchone()
+                    next_slot = row[0] if row else 0
+                    slots = [(next_slot + i) % self.max_rows for i in range(len(entries))]
+
+                    mm, tags = self._matrix(dim, max(slots) + 1, grow=True)
+                    tags[slots] = 0  # readers of the old keys miss from here on
+                    for (_, vec), slot in zip(entries, slots):
+                        mm[slot] = vec
+                    tags[slots] = [_slot_tag(key) for key, _ in entries]
+                    mm.flush()
+                    tags.flush()
+
+                    # Ring buffer: drop keys that pointed at the reused slots
+                    self._conn.executemany("DELETE FROM embeddings WHERE dim = ? AND slot = ?",
+                                           [(dim, slot) for slot in slots])
+                    self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, dim, slot) VALUES (?, ?, ?)",
+                                           [(key, dim, slot) for (key, _), slot in zip(entries, slots)])
+                    self._conn.execute("INSERT OR REPLACE INTO slots (dim, next_slot) VALUES (?, ?)",
+                                       (dim, (next_slot + len(entries)) % self.max_rows))
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute("DELETE FROM slots")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        files = [f for f in os.listdir(self.root) if f.endswith(".f32")]
+        return {
+            "entries": count,
+            "max_rows": self.max_rows,
+            "bytes": sum(os.path.getsize(os.path.join(self.root, f)) for f in files),
+            "root": self.root,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            for mm, tags in self._maps.values():
+                mm.flush()
+                tags.flush()
+            self._maps.clear()
+            self._conn.close()
+
+
+# ═══════════════════════════════════════════════════════════════════
+# RAM TIER + FACADE
+# ═══════════════════════════════════════════════════════════════════
+
+class EmbeddingCache:
+    """Byte-bounded LRU with optional shared disk tier"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk: Optional[DiskEmbeddingTier] = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _put_memory(self, key: str, vec: np.ndarray) -> None:
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._data[key] = vec
+        self._bytes += vec.nbytes
+        while self._bytes > self.max_bytes and self._data:
+            _, evicted = self._data.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Look up keys in RAM, then on disk (disk hits are promoted to RAM)"""
+        found: Dict[str, np.ndarray] = {}
+        pending: List[str] = []
+        with self._lock:
+            for key in keys:
+                vec = self._data.get(key)
+                if vec is not None:
+                    self._data.move_to_end(key)
+                    found[key] = vec
+                else:
+                    pending.append(key)
+
+        disk_found: Dict[str, np.ndarray] = {}
+        if pending and self.disk is not None:
+            try:
+                disk_found = self.disk.get_many(pending)
+            except Exception as e:
+                log_error(e, "EMBED_CACHE_DISK")
+
+        with self._lock:
+            for key, vec in disk_found.items():
+                self._put_memory(key, vec)
+            found.update(disk_found)
+            hits = len(found)
+            misses = len(set(pending) - disk_found.keys())
+            self.hits += hits
+            self.disk_hits += len(disk_found)
+            self.misses += misses
+            size, used = len(self._data), self._bytes
+
+        for _ in range(hits):
+            metrics.record_embed_cache_hit()
+        for _ in range(misses):
+            metrics.record_embed_cache_miss()
+        metrics.update_embed_cache_size(size)
+        metrics.update_embed_cache_bytes(used)
+        return found
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[str, Any]) -> None:
+        """Store vectors in RAM and on disk"""
+        vectors = {key: np.asarray(vec, dtype=np.float32).ravel() for key, vec in items.items() if vec is not None}
+        vectors = {key: vec for key, vec in vectors.items() if vec.size}
+        if not vectors:
+            return
+        with self._lock:
+            for key, vec in vectors.items():
+                self._put_memory(key, vec)
+            size, used = len(self._data), self._bytes
+        if self.disk is not None:
+            try:
+                self.disk.put_many(vectors)
+            except Exception as e:
+                log_error(e, "EMBED_CACHE_DISK")
+        metrics.update_embed_cache_size(size)
+        metrics.update_embed_cache_bytes(used)
+
+    def put(self, key: str, vec: Any) -> None:
+        self.put_many({key: vec})
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "size": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / max(1, total),
+            }
+        if self.disk is not None:
+            try:
+                stats["disk"] = self.disk.stats()
+            except Exception as e:
+                stats["disk"] = {"error": str(e)}
+        return stats
+
+
+def create_embed_cache() -> EmbeddingCache:
+    """Build cache from config (disk tier falls back to RAM-only on errors)"""
+    from .config import EMBED_CACHE_MAX_BYTES, EMBED_CACHE_DISK, EMBED_CACHE_DIR, EMBED_CACHE_DISK_MAX_ROWS
+
+    disk = None
+    if EMBED_CACHE_DISK:
+        try:
+            disk = DiskEmbeddingTier(EMBED_CACHE_DIR, max_rows=EMBED_CACHE_DISK_MAX_ROWS)
+            log_info(f"Embedding disk cache at {EMBED_CACHE_DIR}", "EMBED_CACHE")
+        except Exception as e:
+            log_warning(f"Embedding disk cache disabled: {e}", "EMBED_CACHE")
+    return EmbeddingCache(max_bytes=EMBED_CACHE_MAX_BYTES, disk=disk)
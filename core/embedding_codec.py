@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+embedding_codec.py - Compact binary format for memory_nodes.embedding
+
+Blob layout (little-endian, 16 byte header, payload readable with np.frombuffer):
+
+    offset  size  field
+    0       3     magic  b"EMB"
+    3       1     format version (1)
+    4       1     dtype code: 1 = float32, 2 = float16, 3 = int8
+    5       3     reserved (zero)
+    8       4     dim (uint32)
+    12      4     scale (float32, int8 only: value = q * scale)
+    16      ...   dim * itemsize payload
+
+Legacy rows written with pickle.dumps(ndarray) are still readable through a
+restricted unpickler (numpy arrays / plain lists only) until migrated:
+
+    python -m core.embedding_codec migrate [--db PATH] [--dtype float16]
+    python -m core.embedding_codec bench [--rows 5000] [--dim 768]
+"""
+
+import io
+import os
+import sys
+import time
+import pickle
+import struct
+import sqlite3
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .helpers import log_info, log_warning, log_error
+
+
+# ═══════════════════════════════════════════════════════════════════
+# FORMAT
+# ═══════════════════════════════════════════════════════════════════
+
+MAGIC = b"EMB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<3sBB3xIf")
+HEADER_SIZE = HEADER.size  # 16
+
+DTYPE_CODES = {"float32": 1, "float16": 2, "int8": 3}
+CODE_DTYPES = {1: np.float32, 2: np.float16, 3: np.int8}
+
+# PRAGMA user_version of mem.db once all embeddings use this format
+EMBEDDING_SCHEMA_VERSION = 1
+
+
+def encode_embedding(vec: Any, dtype: str = "float32") -> Optional[bytes]:
+    """Serialize a 1-D vector to a versioned blob (None for empty input)"""
+    if vec is None:
+        return None
+    code = DTYPE_CODES.get(dtype)
+    if code is None:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+    arr = np.asarray(vec, dtype=np.float32).ravel()
+    if arr.size == 0:
+        return None
+
+    scale = 1.0
+    if code == 3:
+        peak = float(np.max(np.abs(arr)))
+        scale = peak / 127.0 if peak > 0 else 1.0
+        payload = np.clip(np.rint(arr / scale), -127, 127).astype(np.int8)
+    else:
+        payload = arr.astype(CODE_DTYPES[code])
+
+    return HEADER.pack(MAGIC, FORMAT_VERSION, code, arr.size, scale) + payload.tobytes()
+
+
+def is_encoded(blob: Optional[bytes]) -> bool:
+    """True if blob uses the versioned format (not legacy pickle)"""
+    return bool(blob) and bytes(blob[:3]) == MAGIC
+
+
+def decode_embedding(blob: Optional[bytes]) -> Optional[np.ndarray]:
+    """Deserialize blob (versioned or legacy pickle) to float32 vector"""
+    if not blob:
+        return None
+    if not is_encoded(blob):
+        return _decode_legacy(blob)
+
+    _, version, code, dim, scale = HEADER.unpack_from(blob)
+    dtype = CODE_DTYPES.get(code)
+    if version != FORMAT_VERSION or dtype is None:
+        log_warning(f"Unknown embedding blob version={version} dtype={code}", "EMBED_CODEC")
+        return None
+
+    arr = np.frombuffer(blob, dtype=dtype, count=dim, offset=HEADER_SIZE)
+    if code == 3:
+        return arr.astype(np.float32) * np.float32(scale)
+    # float32 payload stays a zero-copy view; float16 is widened for math
+    return arr if code == 1 else arr.astype(np.float32)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# LEGACY PICKLE
+# ═══════════════════════════════════════════════════════════════════
+
+_SAFE_PICKLE_GLOBALS = {
+    ("numpy", "ndarray"),
+    ("numpy", "dtype"),
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"),
+    ("numpy._core.multiarray", "scalar"),
+}
+
+
+class _EmbeddingUnpickler(pickle.Unpickler):
+    """Only allows the globals needed to rebuild a numpy array"""
+
+    def find_class(self, module, name):
+        if (module, name) in _SAFE_PICKLE_GLOBALS:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Blocked global in embedding blob: {module}.{name}")
+
+
+def _decode_legacy(blob: bytes) -> Optional[np.ndarray]:
+    try:
+        value = _EmbeddingUnpickler(io.BytesIO(blob)).load()
+        arr = np.asarray(value, dtype=np.float32).ravel()
+        return arr if arr.size else None
+    except Exception as e:
+        log_warning(f"Unreadable legacy embedding blob: {e}", "EMBED_CODEC")
+        return None
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MIGRATION
+# ═══════════════════════════════════════════════════════════════════
+
+def migrate_embeddings(conn: sqlite3.Connection, dtype: str = "float32",
+                       batch_size: int = 500) -> Dict[str, int]:
+    """
+    Re-encode legacy pickled rows in memory_nodes and bump PRAGMA user_version.
+    Caller owns the transaction (pass a writer connection).
+    """
+    stats = {"migrated": 0, "cleared": 0}
+    last_rowid = 0
+    while True:
+        rows = conn.execute("""
+            SELECT rowid, embedding FROM memory_nodes
+            WHERE rowid > ? AND embedding IS NOT NULL AND substr(embedding, 1, 3) != ?
+            ORDER BY rowid LIMIT ?
+        """, (last_rowid, MAGIC, batch_size)).fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for rowid, blob in rows:
+            last_rowid = rowid
+            blob = encode_embedding(_decode_legacy(blob), dtype)
+            updates.append((blob, rowid))
+            stats["migrated" if blob is not None else "cleared"] += 1
+        conn.executemany("UPDATE memory_nodes SET embedding = ? WHERE rowid = ?", updates)
+
+    conn.execute(f"PRAGMA user_version = {EMBEDDING_SCHEMA_VERSION}")
+    return stats
+
+
+def needs_migration(conn: sqlite3.Connection) -> bool:
+    return conn.execute("PRAGMA user_version").fetchone()[0] < EMBEDDING_SCHEMA_VERSION
+
+
+# ═══════════════════════════════════════════════════════════════════
+# BENCHMARK
+# ═══════════════════════════════════════════════════════════════════
+
+def benchmark(rows: int = 5000, dim: int = 768) -> List[Dict[str, Any]]:
+    """Compare DB size and full-scan deserialize time: pickle vs each dtype"""
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(rows, dim))  # float64, like the old sentence-transformers lists
+    results = []
+
+    encoders = [("pickle", lambda v: pickle.dumps(v), lambda b: pickle.loads(b))]
+    encoders += [(name, lambda v, n=name: encode_embedding(v, n), decode_embedding) for name in DTYPE_CODES]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, encode, decode in encoders:
+            path = os.path.join(tmp, f"{name}.db")
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, embedding BLOB)")
+            conn.executemany("INSERT INTO t (embedding) VALUES (?)", ((encode(v),) for v in vectors))
+            conn.commit()
+            conn.execute("VACUUM")
+
+            blobs = [r[0] for r in conn.execute("SELECT embedding FROM t")]
+            t0 = time.perf_counter()
+            decoded = [decode(b) for b in blobs]
+            decode_ms = (time.perf_counter() - t0) * 1000
+            conn.close()
+
+            err = float(np.max(np.abs(np.asarray(decoded, dtype=np.float64) - vectors)))
+            results.append({
+                "format": name,
+                "db_bytes": os.path.getsize(path),
+                "decode_ms": round(decode_ms, 2),
+                "us_per_row": round(decode_ms * 1000 / rows, 2),
+                "max_abs_error": round(err, 5),
+            })
+    return results
+
+
+# ═══════════════════════════════════════════════════════════════════
+# CLI
+# ═══════════════════════════════════════════════════════════════════
+
+def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memory embedding blob tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Convert pickled embeddings in place")
+    migrate.add_argument("--db", default=None, help="Database path (default: DB_PATH)")
+    migrate.add_argument("--dtype", default=None, choices=sorted(DTYPE_CODES))
+    bench = sub.add_parser("bench", help="Compare size / decode time vs pickle")
+    bench.add_argument("--rows", type=int, default=5000)
+    bench.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        print(f"{'format':<10}{'db size':>14}{'decode ms':>12}{'us/row':>10}{'max err':>10}")
+        for r in benchmark(args.rows, args.dim):
+            print(f"{r['format']:<10}{r['db_bytes']:>14,}{r['decode_ms']:>12}{r['us_per_row']:>10}{r['max_abs_error']:>10}")
+        return 0
+
+    from .config import DB_PATH, MEMORY_EMBEDDING_DTYPE
+
+    path = args.db or DB_PATH
+    conn = sqlite3.connect(path)
+    try:
+        t0 = time.time()
+        stats = migrate_embeddings(conn, dtype=args.dtype or MEMORY_EMBEDDING_DTYPE)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log_error(e, "EMBED_CODEC")
+        return 1
+    finally:
+        conn.close()
+    log_info(f"Migrated {path}: {stats} in {time.time() - t0:.2f}s", "EMBED_CODEC")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+embeddings.py - Pluggable embedding providers behind helpers.embed_many
+
+Providers (EMBED_PROVIDER in core/config.py):
+    RemoteEmbeddingProvider  - OpenAI-compatible /embeddings API (urllib)
+    LocalEmbeddingProvider   - sentence-transformers on CPU (torch or ONNX),
+                               length-sorted dynamic batches capped by a padded
+                               token budget, encoded on a small thread pool
+    HashingEmbeddingProvider - deterministic hashing trick (no model, no network)
+
+Every provider exposes `name` (used in cache keys), `dim` (None until known)
+and `embed(texts) -> List[List[float]]` returning one vector per input
+(`[]` for inputs that failed).
+
+EmbeddingBatcher sits between embed_many's cache and the provider: texts from
+concurrent callers (threads or event loops) wait up to EMBED_BATCH_MAX_WAIT_MS,
+identical texts share one slot, and the batch goes out as one provider call.
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+from .config import (
+    HTTP_TIMEOUT, LLM_API_KEY,
+    EMBED_PROVIDER, EMBED_URL, EMBED_MODEL,
+    EMBED_LOCAL_MODEL, EMBED_LOCAL_BACKEND, EMBED_LOCAL_MAX_BATCH,
+    EMBED_LOCAL_MAX_BATCH_TOKENS, EMBED_LOCAL_THREADS, EMBED_HASH_DIM,
+    EMBED_BATCHER, EMBED_BATCH_MAX, EMBED_BATCH_MAX_WAIT_MS, EMBED_BATCH_CONCURRENCY
+)
+from .helpers import log_info, log_warning, log_error, tokenize
+from . import metrics
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SentenceTransformer = None
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+
+class EmbeddingProvider:
+    """Base interface"""
+
+    name = "base"
+    dim: Optional[int] = None
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.name, "dim": self.dim}
+
+
+# ═══════════════════════════════════════════════════════════════════
+# REMOTE (DeepInfra / OpenAI-compatible)
+# ═══════════════════════════════════════════════════════════════════
+
+class RemoteEmbeddingProvider(EmbeddingProvider):
+    """POST {"model", "input"} to an OpenAI-compatible embeddings endpoint"""
+
+    def __init__(self, url: str = EMBED_URL, model: str = EMBED_MODEL, api_key: str = LLM_API_KEY,
+                 timeout: float = HTTP_TIMEOUT):
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.name = model
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        req = Request(
+            self.url,
+            data=json.dumps({"model": self.model, "input": texts}).encode("utf-8"),
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            method="POST"
+        )
+        with urlopen(req, timeout=self.timeout) as r:
+            j = json.loads(r.read().decode("utf-8", "replace"))
+
+        out: List[List[float]] = [[] for _ in texts]
+        for pos, item in enumerate(j.get("data", [])):
+            idx = item.get("index", pos)
+            if 0 <= idx < len(out) and item.get("embedding"):
+                out[idx] = item["embedding"]
+                self.dim = self.dim or len(item["embedding"])
+        return out
+
+
+# ═══════════════════════════════════════════════════════════════════
+# LOCAL (sentence-transformers on CPU)
+# ═══════════════════════════════════════════════════════════════════
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """sentence-transformers model on CPU with token-budgeted dynamic batching"""
+
+    def __init__(self, model: str = EMBED_LOCAL_MODEL, backend: str = EMBED_LOCAL_BACKEND,
+                 max_batch: int = EMBED_LOCAL_MAX_BATCH, max_batch_tokens: int = EMBED_LOCAL_MAX_BATCH_TOKENS,
+                 threads: int = EMBED_LOCAL_THREADS):
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            raise RuntimeError("sentence-transformers is not installed")
+        self.model_name = model
+        self.backend = backend
+        self.max_batch = max(1, max_batch)
+        self.max_batch_tokens = max(1, max_batch_tokens)
+        self.name = f"local:{backend}:{model}"
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="embed-local")
+        self.batches = 0
+        self.texts = 0
+
+    def _get_model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    kwargs = {"device": "cpu"}
+                    if self.backend == "onnx":
+                        kwargs["backend"] = "onnx"  # sentence-transformers >= 3.2
+                    try:
+                        model = SentenceTransformer(self.model_name, **kwargs)
+                    except TypeError:
+                        log_warning("ONNX backend unsupported by installed sentence-transformers, using torch",
+                                    "EMBED_LOCAL")
+                        model = SentenceTransformer(self.model_name, device="cpu")
+                    self.dim = model.get_sentence_embedding_dimension()
+                    self._model = model
+                    log_info(f"Loaded local embedding model {self.model_name} ({self.dim} dim)", "EMBED_LOCAL")
+        return self._model
+
+    def _count_tokens(self, model, text: str) -> int:
+        tokenizer = getattr(model, "tokenizer", None)
+        limit = getattr(model, "max_seq_length", 512) or 512
+        if tokenizer is not None:
+            try:
+                return min(limit, len(tokenizer(text, add_special_tokens=True, truncation=False)["input_ids"]))
+            except Exception:
+                pass
+        return min(limit, len(text) // 4 + 2)
+
+    def _plan_batches(self, lengths: List[int]) -> List[List[int]]:
+        """
+        Group indices sorted by length so padding is minimal; a batch closes when
+        it hits max_batch texts or its padded size (n * longest) exceeds the budget.
+        """
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches: List[List[int]] = []
+        current: List[int] = []
+        for idx in order:
+            longest = lengths[idx]  # ascending order: the new text is the longest
+            if current and (len(current) >= self.max_batch or (len(current) + 1) * longest > self.max_batch_tokens):
+                batches.append(current)
+                current = []
+            current.append(idx)
+        if current:
+            batches.append(current)
+        return batches
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        model = self._get_model()
+        lengths = [self._count_tokens(model, t) for t in texts]
+        batches = self._plan_batches(lengths)
+
+        def encode(batch: List[int]) -> np.ndarray:
+            return model.encode([texts[i] for i in batch], batch_size=len(batch),
+                                convert_to_numpy=True, show_progress_bar=False)
+
+        out: List[List[float]] = [[] for _ in texts]
+        for batch, vectors in zip(batches, self._pool.map(encode, batches)):
+            for idx, vec in zip(batch, vectors):
+                out[idx] = vec.astype(np.float32).tolist()
+        self.batches += len(batches)
+        self.texts += len(texts)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "model": self.model_name,
+            "backend": self.backend,
+            "loaded": self._model is not None,
+            "batches": self.batches,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+# ═══════════════════════════════════════════════════════════════════
+# HASHING TRICK (deterministic, for tests)
+# ═══════════════════════════════════════════════════════════════════
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Signed feature hashing of tokens + character trigrams, L2-normalized"""
+
+    def __init__(self, dim: int = EMBED_HASH_DIM):
+        self.dim = dim
+        self.name = f"hash:{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        grams = [tok[i:i + 3] for tok in tokens for i in range(max(1, len(tok) - 2))]
+        return tokens + [f"#{g}" for g in grams]
+
+    def _vector(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vec[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = float(np.linalg.norm(vec))
+        return (vec / norm).tolist() if norm else vec.tolist()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MICRO-BATCHER
+# ═══════════════════════════════════════════════════════════════════
+
+class EmbeddingBatcher:
+    """
+    Coalesce embed requests from concurrent callers into batched provider calls.
+
+    A dispatcher thread closes a batch when it reaches max_batch texts or its
+    oldest text has waited max_wait_ms; up to `concurrency` batches are in
+    flight at once (while all slots are busy the next batch keeps filling).
+    """
+
+    def __init__(self, provider: EmbeddingProvider, max_batch: int = EMBED_BATCH_MAX,
+                 max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS, concurrency: int = EMBED_BATCH_CONCURRENCY):
+        self.provider = provider
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pending: "OrderedDict[str, tuple]" = OrderedDict()  # text -> (future, enqueued_at)
+        self._cond = threading.Condition()
+        self._slots = threading.Semaphore(max(1, concurrency))
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="embed-batch")
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # Stats
+        self.requested = 0
+        self.deduplicated = 0
+        self.batches = 0
+        self.texts_sent = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        """Queue texts; returns one future per text (identical pending texts share a future)"""
+        futures = []
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("EmbeddingBatcher is closed")
+            self._ensure_thread()
+            now = time.monotonic()
+            for text in texts:
+                self.requested += 1
+                entry = self._pending.get(text)
+                if entry is None:
+                    entry = (Future(), now)
+                    self._pending[text] = entry
+                else:
+                    self.deduplicated += 1
+                futures.append(entry[0])
+            self._cond.notify()
+        return futures
+
+    def embed(self, texts: List[str], timeout: Optional[float] = None) -> List[List[float]]:
+        """Blocking API (threads, sync code)"""
+        return [f.result(timeout=timeout) for f in self.submit(texts)]
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Async API - awaits the same shared futures without blocking the loop"""
+        return list(await asyncio.gather(*(asyncio.wrap_future(f) for f in self.submit(texts))))
+
+    def _take_batch(self) -> List[tuple]:
+        """Wait for a full batch or the oldest deadline; caller holds the condition"""
+        while not self._pending and not self._closed:
+            self._cond.wait()
+        while self._pending and len(self._pending) < self.max_batch and not self._closed:
+            oldest = next(iter(self._pending.values()))[1]
+            remaining = oldest + self.max_wait - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        batch = []
+        while self._pending and len(batch) < self.max_batch:
+            text, (future, enqueued) = self._pending.popitem(last=False)
+            batch.append((text, future, enqueued))
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            self._slots.acquire()  # don't close a batch while every slot is busy
+            with self._cond:
+                batch = self._take_batch()
+                if not batch and self._closed:
+                    self._slots.release()
+                    return
+            if not batch:
+                self._slots.release()
+                continue
+            dispatched = time.monotonic()
+            for _, _, enqueued in batch:
+                wait = dispatched - enqueued
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+                metrics.observe_embed_batch_wait(wait)
+            self.batches += 1
+            self.texts_sent += len(batch)
+            metrics.record_embed_batch(len(batch) / self.max_batch)
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: List[tuple]) -> None:
+        try:
+            vectors = self.provider.embed([text for text, _, _ in batch])
+            for (_, future, _), vec in zip(batch, vectors):
+                future.set_result(vec)
+            for _, future, _ in batch[len(vectors):]:
+                future.set_result([])
+        except Exception as e:
+            log_error(e, "EMBED_BATCHER")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._pool.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "requested": self.requested,
+            "deduplicated": self.deduplicated,
+            "batches": self.batches,
+            "avg_batch_size": round(self.texts_sent / self.batches, 2) if self.batches else 0.0,
+            "avg_fill_ratio": round(self.texts_sent / (self.batches * self.max_batch), 3) if self.batches else 0.0,
+            "avg_added_latency_ms": round(self.wait_total * 1000 / self.texts_sent, 2) if self.texts_sent else 0.0,
+            "max_added_latency_ms": round(self.wait_max * 1000, 2),
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+# ═══════════════════════════════════════════════════════════════════
+# SELECTION
+# ═══════════════════════════════════════════════════════════════════
+
+_PROVIDER: Optional[EmbeddingProvider] = None
+_PROVIDER_RESOLVED = False
+_PROVIDER_LOCK = threading.Lock()
+_BATCHER: Optional[EmbeddingBatcher] = None
+
+
+def create_embedding_provider(kind: str = EMBED_PROVIDER) -> Optional[EmbeddingProvider]:
+    """Build provider by name; None when nothing usable is configured"""
+    kind = (kind or "auto").lower()
+    if kind == "hash":
+        return HashingEmbeddingProvider()
+    if kind == "local":
+        return LocalEmbeddingProvider()
+    if kind == "remote":
+        return RemoteEmbeddingProvider() if EMBED_URL and EMBED_MODEL and LLM_API_KEY else None
+    if kind == "auto":
+        if EMBED_URL and EMBED_MODEL and LLM_API_KEY:
+            return RemoteEmbeddingProvider()
+        if SENTENCE_TRANSFORMERS_AVAILABLE:
+            return LocalEmbeddingProvider()
+        return None
+    raise ValueError(f"Unknown EMBED_PROVIDER: {kind}")
+
+
+def get_embedding_provider() -> Optional[EmbeddingProvider]:
+    """Process-wide provider (resolved once)"""
+    global _PROVIDER, _PROVIDER_RESOLVED
+    if not _PROVIDER_RESOLVED:
+        with _PROVIDER_LOCK:
+            if not _PROVIDER_RESOLVED:
+                try:
+                    _PROVIDER = create_embedding_provider()
+                except Exception as e:
+                    log_error(e, "EMBED_PROVIDER")
+                    _PROVIDER = None
+                if _PROVIDER is None:
+                    log_warning("No embedding provider available - semantic search disabled", "EMBED_PROVIDER")
+                else:
+                    log_info(f"Embedding provider: {_PROVIDER.name}", "EMBED_PROVIDER")
+                _PROVIDER_RESOLVED = True
+    return _PROVIDER
+
+
+def set_embedding_provider(provider: Optional[EmbeddingProvider]) -> None:
+    """Override provider (tests, runtime switch)"""
+    global _PROVIDER, _PROVIDER_RESOLVED, _BATCHER
+    with _PROVIDER_LOCK:
+        _PROVIDER = provider
+        _PROVIDER_RESOLVED = True
+        old, _BATCHER = _BATCHER, None
+    if old is not None:
+        old.close()
+
+
+def get_embedding_batcher() -> Optional[EmbeddingBatcher]:
+    """Process-wide micro-batcher for the current provider (None if disabled/no provider)"""
+    global _BATCHER
+    provider = get_embedding_provider()
+    if not EMBED_BATCHER or provider is None:
+        return None
+    if _BATCHER is None or _BATCHER.provider is not provider:
+        with _PROVIDER_LOCK:
+            if _BATCHER is None or _BATCHER.provider is not provider:
+                _BATCHER = EmbeddingBatcher(provider)
+    return _BATCHER
+
+
+def get_embedding_batcher_stats() -> Dict[str, Any]:
+    """Batcher stats without creating one"""
+    return _BATCHER.stats() if _BATCHER is not None else {"enabled": EMBED_BATCHER}
+
+
+def embed_uncached(texts: List[str]) -> List[List[float]]:
+    """Provider call for cache misses, routed through the micro-batcher when enabled"""
+    batcher = get_embedding_batcher()
+    if batcher is not None:
+        return batcher.embed(texts)
+    provider = get_embedding_provider()
+    return provider.embed(texts) if provider is not None else [[] for _ in texts]
+
+
+async def aembed_uncached(texts: List[str]) -> List[List[float]]:
+    """embed_uncached for the event loop: awaits the batcher, or runs the provider in a thread"""
+    batcher = get_embedding_batcher()
+    if batcher is not None:
+        return await batcher.aembed(texts)
+    provider = get_embedding_provider()
+    if provider is None:
+        return [[] for _ in texts]
+    return await asyncio.to_thread(provider.embed, texts)
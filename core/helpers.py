@@ -9,13 +9,17 @@ import json
 import math
 import hashlib
 import hmac
+import threading
 from typing import Any, Dict, List, Tuple
 from urllib.parse import parse_qs
 from urllib.request import Request, urlopen
 from collections import Counter
 from dataclasses import dataclass, asdict
 
+import numpy as np
+
 from .config import HTTP_TIMEOUT, LLM_API_KEY, AUTH_TOKEN
+from .sparse_rank import cached_index
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -230,6 +234,10 @@ def tfidf_cosine(query: str, docs: List[str]) -> List[float]:
     """
     Calculate TF-IDF cosine similarity between query and documents
     
+    Scores all documents in one pass over a sparse inverted index
+    (core/sparse_rank.py) - document frequencies are counted once, not per document,
+    and the index of a document list is reused by later queries over the same list.
+    
     Args:
         query: Query text
         docs: List of document texts
@@ -237,36 +245,9 @@ def tfidf_cosine(query: str, docs: List[str]) -> List[float]:
     Returns:
         List[float]: Cosine similarity scores for each document
     """
-    tq = tokenize(query)
-    dts = [tokenize(d) for d in docs]
-    vq = tfidf_vec(tq, dts)
-    
-    out = []
-    key_terms = set([t for t in tq if len(t) > 3])
-    
-    for dt in dts:
-        vd = tfidf_vec(dt, dts)
-        keys = set(vq.keys()) | set(vd.keys())
-        num = 0.0
-        
-        for term in keys:
-            a = vq.get(term, 0.0)
-            b = vd.get(term, 0.0)
-            term_bonus = 2.5 if term in key_terms else 1.0
-            
-            if " " in term:
-                words = len(term.split())
-                if words > 1:
-                    term_bonus *= 1.0 + 0.5 * words
-            
-            boost = 1 + 0.8 * math.tanh(4 * a * b - 0.6)
-            num += (a * b) * boost * term_bonus
-        
-        den = (sum(x * x for x in vq.values()) ** 0.5) * (sum(x * x for x in vd.values()) ** 0.5)
-        score = 0.0 if den == 0 else (num / den)
-        out.append(score ** 0.8)
-    
-    return out
+    if not docs:
+        return []
+    return cached_index(docs, tokenize).tfidf_cosine(tokenize(query)).tolist()
 
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -280,120 +261,143 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
     Returns:
         float: Cosine similarity (0-1)
     """
-    if not a or not b:
+    if a is None or b is None or len(a) == 0 or len(b) == 0:
+        return 0.0
+    
+    va = np.asarray(a, dtype=np.float32).ravel()
+    vb = np.asarray(b, dtype=np.float32).ravel()
+    if va.size != vb.size:
         return 0.0
     
-    s = sum(x * y for x, y in zip(a, b))
-    na = math.sqrt(sum(x * x for x in a)) or 1e-9
-    nb = math.sqrt(sum(y * y for y in b)) or 1e-9
+    na = float(np.linalg.norm(va)) or 1e-9
+    nb = float(np.linalg.norm(vb)) or 1e-9
     
-    return s / (na * nb)
+    return float(va @ vb) / (na * nb)
 
 
 # ═══════════════════════════════════════════════════════════════════
 # EMBEDDINGS WITH CACHE
 # ═══════════════════════════════════════════════════════════════════
 
-_EMBED_CACHE = {}
-_EMBED_CACHE_HITS = 0
-_EMBED_CACHE_MISSES = 0
+_EMBED_CACHE = None  # core.embed_cache.EmbeddingCache, created on first use
+_EMBED_CACHE_LOCK = threading.Lock()
 
-# Embedding configuration (loaded from env if available)
+# Embedding configuration lives in config.py (EMBED_PROVIDER, EMBED_URL, EMBED_MODEL, ...)
 # 🔥 UPGRADED: all-mpnet-base-v2 (768 dim) - było all-MiniLM-L6-v2 (384 dim)
-EMBED_URL = "https://api.deepinfra.com/v1/openai/embeddings"
-EMBED_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+
+def _get_embed_cache():
+    """Lazily build the RAM+disk embedding cache (avoids import cycle with core.embed_cache)"""
+    global _EMBED_CACHE
+    if _EMBED_CACHE is None:
+        with _EMBED_CACHE_LOCK:
+            if _EMBED_CACHE is None:
+                from .embed_cache import create_embed_cache
+                _EMBED_CACHE = create_embed_cache()
+    return _EMBED_CACHE
+
+
+def _embed_lookup(texts: List[str]):
+    """Cache pass shared by embed_many/aembed_many -> (cache, keys, result, missing), None without provider"""
+    from .embeddings import get_embedding_provider
+    provider = get_embedding_provider()
+    if provider is None:
+        return None
+    
+    from .embed_cache import cache_key
+    cache = _get_embed_cache()
+    keys = [cache_key(provider.name, text) for text in texts]
+    
+    # Check cache (RAM LRU, then shared disk tier)
+    cached = cache.get_many(keys)
+    result = [cached[k].tolist() if k in cached else None for k in keys]
+    
+    # Unique texts still missing (same text twice in one call -> one provider input)
+    missing: Dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            missing.setdefault(key, text)
+    return cache, keys, result, missing
+
+
+def _embed_store(cache, keys: List[str], result: list, missing: Dict[str, str], embeddings) -> None:
+    """Update cache and results with freshly generated embeddings"""
+    fresh = {key: emb for key, emb in zip(missing, embeddings) if emb}
+    cache.put_many(fresh)
+    for i, key in enumerate(keys):
+        if result[i] is None and key in fresh:
+            result[i] = fresh[key]
 
 
 def embed_many(texts: List[str]) -> List[List[float]]:
     """
     Generate embeddings for multiple texts with caching
     
+    Blocks until the micro-batcher answers - from async code use aembed_many().
+    
     Args:
         texts: List of texts to embed
         
     Returns:
         List[List[float]]: List of embedding vectors
     """
-    global _EMBED_CACHE, _EMBED_CACHE_HITS, _EMBED_CACHE_MISSES
-    
-    if not EMBED_URL or not EMBED_MODEL or not LLM_API_KEY:
+    from .embeddings import embed_uncached
+    from .metrics import time_stage
+    state = _embed_lookup(texts)
+    if state is None:
         return []
-    
-    result = []
-    texts_to_embed = []
-    indices = []
-    
-    # Check cache for each text
-    for i, text in enumerate(texts):
-        text_hash = hashlib.md5(text.encode()).hexdigest()
-        if text_hash in _EMBED_CACHE:
-            result.append(_EMBED_CACHE[text_hash])
-            _EMBED_CACHE_HITS += 1
-        else:
-            result.append(None)  # placeholder
-            texts_to_embed.append(text)
-            indices.append(i)
-            _EMBED_CACHE_MISSES += 1
-    
-    # If everything from cache, return
-    if not texts_to_embed:
-        return result
+    cache, keys, result, missing = state
     
     # Otherwise, generate embeddings for new texts
-    payload = {"model": EMBED_MODEL, "input": texts_to_embed}
-    
-    try:
-        req = Request(
-            EMBED_URL,
-            data=json.dumps(payload).encode("utf-8"),
-            headers={
-                "Authorization": f"Bearer {LLM_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            method="POST"
-        )
-        
-        with urlopen(req, timeout=HTTP_TIMEOUT) as r:
-            j = json.loads(r.read().decode("utf-8", "replace"))
-        
-        embeddings = [d.get("embedding") for d in j.get("data", []) if d.get("embedding")]
-        
-        # Update cache and results
-        for i, (text, embedding) in enumerate(zip(texts_to_embed, embeddings)):
-            if embedding:
-                text_hash = hashlib.md5(text.encode()).hexdigest()
-                _EMBED_CACHE[text_hash] = embedding
-                result[indices[i]] = embedding
-        
-        # If cache too large, remove oldest entries
-        if len(_EMBED_CACHE) > 1000:
-            for k in list(_EMBED_CACHE.keys())[:200]:
-                del _EMBED_CACHE[k]
-                
-    except Exception as e:
-        log_error(e, "EMBED")
+    if missing:
+        try:
+            with time_stage("embeddings"):
+                embeddings = embed_uncached(list(missing.values()))
+            _embed_store(cache, keys, result, missing, embeddings)
+        except Exception as e:
+            log_error(e, "EMBED")
     
     # Replace remaining None with empty lists
-    for i in range(len(result)):
-        if result[i] is None:
-            result[i] = []
+    return [vec if vec is not None else [] for vec in result]
+
+
+async def aembed_many(texts: List[str]) -> List[List[float]]:
+    """
+    Async embed_many() for code running on the event loop
     
-    return result
+    Cache tiers (the disk tier is SQLite) run in a worker thread; cache misses
+    await the micro-batcher futures instead of blocking in Future.result().
+    """
+    import asyncio
+    from .embeddings import aembed_uncached
+    from .metrics import time_stage
+    state = await asyncio.to_thread(_embed_lookup, texts)
+    if state is None:
+        return []
+    cache, keys, result, missing = state
+    
+    if missing:
+        try:
+            with time_stage("embeddings"):
+                embeddings = await aembed_uncached(list(missing.values()))
+            await asyncio.to_thread(_embed_store, cache, keys, result, missing, embeddings)
+        except Exception as e:
+            log_error(e, "EMBED")
+    
+    return [vec if vec is not None else [] for vec in result]
 
 
-def get_embed_cache_stats() -> Dict[str, int]:
+def get_embed_cache_stats() -> Dict[str, Any]:
     """
     Get embedding cache statistics
     
     Returns:
-        Dict with hits, misses, size
+        Dict with hits, misses, size, bytes (+ disk tier, micro-batcher)
     """
-    return {
-        "hits": _EMBED_CACHE_HITS,
-        "misses": _EMBED_CACHE_MISSES,
-        "size": len(_EMBED_CACHE),
-        "hit_rate": _EMBED_CACHE_HITS / max(1, _EMBED_CACHE_HITS + _EMBED_CACHE_MISSES)
-    }
+    from .embeddings import get_embedding_batcher_stats
+    stats = _get_embed_cache().stats()
+    stats["batcher"] = get_embedding_batcher_stats()
+    return stats
 
 
 # Alias for backward compatibility with memory.py
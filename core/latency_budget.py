@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+latency_budget.py - Request deadlines and load signals for the cognitive pipeline
+
+Deadline     - absolute (monotonic) deadline created per request from
+               COGNITIVE_DEADLINES and passed explicitly down the call chain:
+               CognitiveEngine -> AdvancedCognitiveEngine -> MultiAgentOrchestrator /
+               SelfReflectionEngine. Stages ask `fits(llm_rounds)` before spending
+               LLM round trips and run under `within_deadline`.
+LoadMonitor  - EWMA of upstream LLM latency (fed by llm._allm_request) and the
+               number of in-flight cognitive requests; `pressure()` >= 1.0 means
+               the engine should pick cheaper cognitive modes.
+"""
+
+import asyncio
+import functools
+import inspect
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, Optional
+
+from .config import (
+    COGNITIVE_DEADLINES, LLM_LATENCY_PRIOR_S, LLM_LATENCY_DEGRADE_S, COGNITIVE_MAX_INFLIGHT
+)
+
+
+class Deadline:
+    """Time budget of one request"""
+
+    __slots__ = ("budget_s", "started", "expires_at")
+
+    def __init__(self, budget_s: float):
+        self.budget_s = budget_s
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget_s
+
+    @classmethod
+    def for_endpoint(cls, endpoint: str) -> "Deadline":
+        return cls(COGNITIVE_DEADLINES.get(endpoint, COGNITIVE_DEADLINES["chat"]))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def fits(self, llm_rounds: float, monitor: "LoadMonitor" = None) -> bool:
+        """Czy zostało czasu na llm_rounds sekwencyjnych wywołań LLM (wg EWMA latencji)"""
+        monitor = monitor or get_load_monitor()
+        return self.remaining() >= llm_rounds * monitor.llm_latency()
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Pozostały czas, opcjonalnie ograniczony do cap (np. LLM_TIMEOUT)"""
+        remaining = self.remaining()
+        return remaining if cap is None else min(remaining, cap)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"budget_s": self.budget_s, "elapsed_s": self.elapsed(), "remaining_s": self.remaining()}
+
+
+async def within_deadline(awaitable: Awaitable, deadline: Optional[Deadline], default: Any = None) -> Any:
+    """Await z limitem pozostałego budżetu; po przekroczeniu zwraca default"""
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, deadline.timeout())
+    except asyncio.TimeoutError:
+        return default
+
+
+class LoadMonitor:
+    """Upstream LLM latency (EWMA) + in-flight cognitive requests"""
+
+    def __init__(self, alpha: float = 0.2, prior_latency: float = LLM_LATENCY_PRIOR_S):
+        self.alpha = alpha
+        self._llm_latency = prior_latency
+        self._samples = 0
+        self.inflight = 0
+        self._lock = threading.Lock()
+
+    def record_llm_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._samples += 1
+            self._llm_latency += self.alpha * (seconds - self._llm_latency)
+
+    def llm_latency(self) -> float:
+        return self._llm_latency
+
+    @contextmanager
+    def track(self):
+        """Licz żądanie jako in-flight na czas bloku"""
+        with self._lock:
+            self.inflight += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+    def pressure(self) -> float:
+        """Max z obciążenia kolejki i latencji upstream (1.0 = pełne obciążenie)"""
+        return max(self.inflight / max(1, COGNITIVE_MAX_INFLIGHT),
+                   self._llm_latency / max(1e-6, LLM_LATENCY_DEGRADE_S))
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "llm_latency_ewma_s": self._llm_latency,
+            "llm_latency_samples": self._samples,
+            "inflight": self.inflight,
+            "pressure": self.pressure(),
+        }
+
+
+_load_monitor = LoadMonitor()
+
+
+def get_load_monitor() -> LoadMonitor:
+    return _load_monitor
+
+
+def track_inflight(func):
+    """Dekorator: wywołanie (coroutine lub async generator) liczy się jako in-flight"""
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def gen_wrapper(*args, **kwargs):
+            with _load_monitor.track():
+                agen = func(*args, **kwargs)
+                try:
+                    async for item in agen:
+                        yield item
+                finally:
+                    await agen.aclose()
+        return gen_wrapper
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with _load_monitor.track():
+            return await func(*args, **kwargs)
+    return wrapper
@@ -4,17 +4,28 @@
 LLM module - Language Model interaction with retry logic and fallback
 """
 
+import json
 import time
-import httpx
+import random
+import asyncio
 import hashlib
-import json
-from typing import List, Dict, Any, Optional
+import threading
+import weakref
+import concurrent.futures
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
 
 from .config import (
     LLM_BASE_URL, LLM_API_KEY, LLM_MODEL, LLM_FALLBACK_MODEL,
-    LLM_TIMEOUT, LLM_RETRIES, LLM_BACKOFF_S
+    LLM_TIMEOUT, LLM_RETRIES, LLM_BACKOFF_S, LLM_BACKOFF_MAX_S,
+    LLM_HTTP2, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE, LLM_KEEPALIVE_EXPIRY,
+    LLM_MAX_CONNECTIONS_PER_HOST, LLM_SINGLE_FLIGHT, LLM_SINGLE_FLIGHT_LOCK_S,
+    SEMANTIC_CACHE_ENABLED
 )
 from .helpers import log_error, log_warning, log_info
+from . import metrics
+from .latency_budget import get_load_monitor
 
 # Import Redis cache
 try:
@@ -37,17 +48,149 @@ def _generate_cache_key(messages: List[dict], model: str, **opts) -> str:
         "temperature": opts.get("temperature"),
         "max_tokens": opts.get("max_tokens")
     }
+    if opts.get("user_id"):  # per-user answers (unset keeps existing keys valid)
+        cache_data["user_id"] = opts["user_id"]
     cache_string = json.dumps(cache_data, sort_keys=True)
     return f"llm:{hashlib.sha256(cache_string.encode()).hexdigest()}"
 
 
+# ═══════════════════════════════════════════════════════════════════
+# SHARED HTTP CLIENT
+# ═══════════════════════════════════════════════════════════════════
+
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# One AsyncClient (connection pool) per event loop: uvicorn runs a single loop,
+# so in the server this is one process-wide pool with keep-alive connections.
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_HOST_LIMITS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+_CLIENT_LOCK = threading.Lock()
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Pooled AsyncClient bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        with _CLIENT_LOCK:
+            client = _ASYNC_CLIENTS.get(loop)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(
+                    http2=LLM_HTTP2 and HTTP2_AVAILABLE,
+                    timeout=LLM_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                    ),
+                )
+                _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+def _host_limit(url: str) -> asyncio.Semaphore:
+    """Per-host concurrency cap (per event loop)"""
+    loop = asyncio.get_running_loop()
+    limits = _HOST_LIMITS.setdefault(loop, {})
+    host = httpx.URL(url).host
+    sem = limits.get(host)
+    if sem is None:
+        sem = limits[host] = asyncio.Semaphore(LLM_MAX_CONNECTIONS_PER_HOST)
+    return sem
+
+
+class _SyncLoopThread:
+    """Background event loop that runs the async client for legacy sync callers"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _ensure(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None or self._loop.is_closed():
+            with self._lock:
+                if self._loop is None or self._loop.is_closed():
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="llm-sync-loop", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def run(self, coro):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self._loop:
+            raise RuntimeError("Sync LLM shim called from its own loop - use the async API")
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure()).result()
+
+    def close(self) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        client = _ASYNC_CLIENTS.get(loop)
+        if client is not None:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+_SYNC_LOOP = _SyncLoopThread()
+
+
+async def close_llm_clients() -> None:
+    """Close pooled clients (app shutdown)"""
+    try:
+        client = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+    finally:
+        await asyncio.to_thread(_SYNC_LOOP.close)
+
+
+def _backoff_delay(attempt: int, base_s: float, retry_after: Optional[str] = None) -> float:
+    """Full-jitter exponential backoff (honours Retry-After when the server sends it)"""
+    if retry_after:
+        try:
+            return min(LLM_BACKOFF_MAX_S, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX_S, base_s * (2 ** (attempt - 1))))
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS
+    return isinstance(exc, (httpx.TransportError, httpx.TimeoutException, ValueError))
+
+
 # ═══════════════════════════════════════════════════════════════════
 # LLM REQUEST FUNCTIONS
 # ═══════════════════════════════════════════════════════════════════
 
-def _llm_request(messages: List[dict], model: str, **opts) -> str:
+def _build_payload(messages: List[dict], model: str, **opts) -> Dict[str, Any]:
+    payload = {"model": model, "messages": messages}
+    
+    # Add optional parameters
+    if "temperature" in opts and opts.get("temperature") is not None:
+        payload["temperature"] = float(opts.get("temperature"))
+    
+    if "max_tokens" in opts and opts.get("max_tokens") is not None:
+        try:
+            payload["max_tokens"] = int(opts.get("max_tokens"))
+        except Exception:
+            pass
+    return payload
+
+
+async def _allm_request(messages: List[dict], model: str, **opts) -> str:
     """
-    Send request to DeepInfra with retry/backoff and shorter timeout
+    Send request to DeepInfra over the shared async pool with retry/backoff
     
     Args:
         messages: List of message dicts with 'role' and 'content'
@@ -56,99 +199,213 @@ def _llm_request(messages: List[dict], model: str, **opts) -> str:
             - temperature: float (0.0-1.0)
             - max_tokens: int
             - timeout_s: float (timeout in seconds)
+            - retries: int
+            - backoff_s: float (base for jittered exponential backoff)
             
     Returns:
         str: LLM response content
         
     Raises:
-        Exception: If all retries fail
+        Exception: If all retries fail (non-retryable errors fail fast)
     """
     url = f"{LLM_BASE_URL}/chat/completions"
     headers = {
         "Authorization": f"Bearer {LLM_API_KEY}",
         "Content-Type": "application/json",
     }
-    
-    payload = {"model": model, "messages": messages}
-    
-    # Add optional parameters
-    if "temperature" in opts and opts.get("temperature") is not None:
-        payload["temperature"] = float(opts.get("temperature"))
-    
-    if "max_tokens" in opts and opts.get("max_tokens") is not None:
-        try:
-            payload["max_tokens"] = int(opts.get("max_tokens"))
-        except Exception:
-            pass
+    payload = _build_payload(messages, model, **opts)
     
     # Retry logic
-    retries = opts.get("retries", LLM_RETRIES)
-    backoff_s = opts.get("backoff_s", LLM_BACKOFF_S)
-    last_exc: Optional[Exception] = None
+    retries = max(1, int(opts.get("retries", LLM_RETRIES)))
+    backoff_s = float(opts.get("backoff_s", LLM_BACKOFF_S))
+    timeout_s = float(opts.get("timeout_s", LLM_TIMEOUT))
+    client = _get_async_client()
     
     for attempt in range(1, retries + 1):
+        retry_after = None
         try:
-            timeout_s = float(opts.get("timeout_s", LLM_TIMEOUT))
+            async with _host_limit(url):
+                sent_at = time.monotonic()
+                try:
+                    r = await client.post(url, headers=headers, json=payload, timeout=timeout_s)
+                except httpx.TimeoutException:
+                    # Timeouts count too - they are the strongest "upstream is slow" signal
+                    get_load_monitor().record_llm_latency(time.monotonic() - sent_at)
+                    metrics.observe_stage("llm", time.monotonic() - sent_at)
+                    raise
+                get_load_monitor().record_llm_latency(time.monotonic() - sent_at)
+                metrics.observe_stage("llm", time.monotonic() - sent_at)
+            retry_after = r.headers.get("retry-after")
+            r.raise_for_status()
+            data = r.json()
             
-            with httpx.Client(timeout=timeout_s) as client:
-                r = client.post(url, headers=headers, json=payload)
-                r.raise_for_status()
-                data = r.json()
-                
-                content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                
-                if attempt > 1:
-                    log_info(f"LLM request succeeded on attempt {attempt}", "LLM")
-                
-                return content
-                
-        except Exception as e:
-            last_exc = e
+            content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+            
+            if attempt > 1:
+                log_info(f"LLM request succeeded on attempt {attempt}", "LLM")
             
-            if attempt < retries:
-                sleep_time = backoff_s * attempt
-                log_warning(f"LLM request failed (attempt {attempt}/{retries}), retrying in {sleep_time}s: {e}", "LLM")
-                time.sleep(sleep_time)
+            return content
+            
+        except Exception as e:
+            if attempt < retries and _is_retryable(e):
+                sleep_time = _backoff_delay(attempt, backoff_s, retry_after)
+                log_warning(f"LLM request failed (attempt {attempt}/{retries}), retrying in {sleep_time:.2f}s: {e}", "LLM")
+                await asyncio.sleep(sleep_time)
             else:
                 log_error(e, "LLM_REQUEST")
                 raise
     
     # Should not reach here, but just in case
-    raise last_exc if last_exc else Exception("Unknown LLM error")
+    raise Exception("Unknown LLM error")
 
 
-def call_llm(messages: List[dict], **opts) -> str:
+def _llm_request(messages: List[dict], model: str, **opts) -> str:
+    """Sync shim for _allm_request (legacy callers)"""
+    return _SYNC_LOOP.run(_allm_request(messages, model, **opts))
+
+
+# ═══════════════════════════════════════════════════════════════════
+# SINGLE-FLIGHT (identical concurrent requests -> one upstream call)
+# ═══════════════════════════════════════════════════════════════════
+
+# cache_key -> concurrent.futures.Future; thread-safe so callers on the uvicorn
+# loop and on _SYNC_LOOP (sync call_llm shim) coalesce with each other
+_INFLIGHT: Dict[str, concurrent.futures.Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+_INFLIGHT_TASKS: set = set()
+_SINGLE_FLIGHT_STATS = {"leaders": 0, "coalesced_local": 0, "coalesced_redis": 0}
+
+
+async def _single_flight(key: str, factory) -> str:
+    """
+    Await one shared execution of factory() per key
+    
+    The leader runs factory() as its own task, so a cancelled caller (client
+    disconnect) does not cancel the request the other callers are waiting on.
+    """
+    with _INFLIGHT_LOCK:
+        shared = _INFLIGHT.get(key)
+        leader = shared is None
+        if leader:
+            shared = concurrent.futures.Future()
+            _INFLIGHT[key] = shared
+            _SINGLE_FLIGHT_STATS["leaders"] += 1
+        else:
+            _SINGLE_FLIGHT_STATS["coalesced_local"] += 1
+
+    if leader:
+        async def run():
+            try:
+                result = await factory()
+            except BaseException as e:
+                with _INFLIGHT_LOCK:
+                    _INFLIGHT.pop(key, None)
+                shared.set_exception(e)
+            else:
+                with _INFLIGHT_LOCK:
+                    _INFLIGHT.pop(key, None)
+                shared.set_result(result)
+
+        task = asyncio.ensure_future(run())
+        _INFLIGHT_TASKS.add(task)
+        task.add_done_callback(_INFLIGHT_TASKS.discard)
+    else:
+        metrics.record_llm_coalesced("local")
+
+    return await asyncio.shield(asyncio.wrap_future(shared))
+
+
+async def _acquire_flight_lock(redis, cache_key: str) -> Tuple[bool, Optional[str]]:
+    """
+    Cross-worker single-flight via a short Redis lock (SET NX EX)
+    
+    Returns (owner, result):
+        owner=True  - this worker calls the API and must delete the lock
+        owner=False - result is the answer cached by the worker holding the
+                      lock, or None if it gave up / timed out (call the API)
+    
+    The Redis client is synchronous, so every call runs in a worker thread;
+    polling backs off from 50ms to 500ms.
     """
-    Call LLM with fallback mechanism + Redis cache
+    lock_key = f"{cache_key}:flight"
+    if await asyncio.to_thread(redis.set, lock_key, "1", ttl=LLM_SINGLE_FLIGHT_LOCK_S, nx=True):
+        return True, None
+    
+    deadline = time.monotonic() + LLM_SINGLE_FLIGHT_LOCK_S
+    delay = 0.05
+    while time.monotonic() < deadline:
+        if not await asyncio.to_thread(redis.exists, lock_key):
+            # Lock gone (leader finished or Redis unusable) - last cache check
+            cached = await asyncio.to_thread(redis.get, cache_key)
+            if cached is not None:
+                break
+            return False, None
+        await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        delay = min(delay * 2, 0.5)
+    else:
+        return False, None
+
+    _SINGLE_FLIGHT_STATS["coalesced_redis"] += 1
+    metrics.record_llm_coalesced("redis")
+    return False, cached
+
+
+def get_single_flight_stats() -> Dict[str, int]:
+    """Single-flight counters (this process)"""
+    with _INFLIGHT_LOCK:
+        return dict(_SINGLE_FLIGHT_STATS, inflight=len(_INFLIGHT))
+
+
+async def acall_llm(messages: List[dict], **opts) -> str:
+    """
+    Call LLM with fallback mechanism + Redis cache (native async)
     
     1️⃣ Check Redis cache
     2️⃣ If miss → Try main model (LLM_MODEL)
     3️⃣ If fails → try fallback model (LLM_FALLBACK_MODEL)
     4️⃣ Store result in Redis cache
     
+    Identical concurrent calls (same _generate_cache_key) share one upstream
+    request: in-process via _single_flight, across workers via a Redis lock.
+    With SEMANTIC_CACHE_ENABLED, an exact miss falls back to the semantic
+    cache (near-duplicate last user turn, same system prompt/history).
+    skip_cache=True opts out of all of these (caller wants an independent sample).
+    
     Args:
         messages: List of message dicts with 'role' and 'content'
         **opts: Optional parameters:
             - temperature: float (0.0-1.0)
             - max_tokens: int
             - timeout_s: float
-            - skip_cache: bool (default: False) - skip Redis cache
+            - skip_cache: bool (default: False) - skip Redis cache and single-flight
             - cache_ttl: int (default: 3600) - cache TTL in seconds
+            - semantic_namespace: str (default: "chat") - semantic cache partition
+            - user_id: str - cache scope; cached answers are never shared across users
         
     Returns:
         str: LLM response content (or error message if both fail)
     """
-    # Check if cache should be used
     skip_cache = opts.pop("skip_cache", False)
     cache_ttl = opts.pop("cache_ttl", 3600)  # 1 hour default
+    namespace = opts.pop("semantic_namespace", "chat")
+
+    if skip_cache or not LLM_SINGLE_FLIGHT:
+        return await _acall_llm_cached(messages, skip_cache, cache_ttl, namespace, **opts)
+
+    key = _generate_cache_key(messages, LLM_MODEL, **opts)
+    return await _single_flight(key, lambda: _acall_llm_cached(messages, skip_cache, cache_ttl, namespace, **opts))
+
+
+async def _acall_llm_cached(messages: List[dict], skip_cache: bool, cache_ttl: int,
+                            namespace: str = "chat", **opts) -> str:
+    """Exact cache -> semantic cache -> (cross-worker lock) -> main model -> fallback -> cache store"""
+    flight_lock = None
+    semantic = None
     
     # Try Redis cache first (unless skip_cache=True)
     if REDIS_AVAILABLE and not skip_cache:
         try:
-            redis = get_redis()
-            cache_key = _generate_cache_key(messages, LLM_MODEL, **opts)
-            
-            cached_result = redis.get(cache_key)
+            cached_result = await asyncio.to_thread(get_redis().get, _generate_cache_key(messages, LLM_MODEL, **opts))
             if cached_result is not None:
                 log_info(f"[CACHE HIT] LLM response from Redis", "LLM")
                 return cached_result
@@ -157,16 +414,99 @@ def call_llm(messages: List[dict], **opts) -> str:
         except Exception as e:
             log_warning(f"Redis cache check failed: {e}", "LLM")
     
+    if SEMANTIC_CACHE_ENABLED and not skip_cache:
+        try:
+            semantic_answer, semantic = await _semantic_lookup(messages, namespace, **opts)
+            if semantic_answer is not None:
+                return semantic_answer
+        except Exception as e:
+            log_warning(f"Semantic cache lookup failed: {e}", "LLM")
+    
+    if REDIS_AVAILABLE and not skip_cache and LLM_SINGLE_FLIGHT:
+        try:
+            redis = get_redis()
+            cache_key = _generate_cache_key(messages, LLM_MODEL, **opts)
+            owner, flight_result = await _acquire_flight_lock(redis, cache_key)
+            if flight_result is not None:
+                log_info(f"[SINGLE-FLIGHT] LLM response from another worker", "LLM")
+                return flight_result
+            if owner:
+                flight_lock = f"{cache_key}:flight"
+        except Exception as e:
+            log_warning(f"Redis single-flight lock failed: {e}", "LLM")
+    
+    try:
+        result = await _acall_llm_upstream(messages, skip_cache, cache_ttl, **opts)
+        if semantic is not None and not result.startswith("[LLM-FAIL]"):
+            cache, query, vec, scope = semantic
+            cache.store(namespace, query, vec, scope, result)
+        return result
+    finally:
+        if flight_lock is not None:
+            try:
+                await asyncio.to_thread(get_redis().delete, flight_lock)
+            except Exception as e:
+                log_warning(f"Redis single-flight unlock failed: {e}", "LLM")
+
+
+_SEMANTIC_SAMPLE_TASKS: set = set()
+
+
+async def _semantic_lookup(messages: List[dict], namespace: str, **opts) -> Tuple[Optional[str], Optional[tuple]]:
+    """
+    Semantic cache lookup for the last user turn
+    
+    Returns (cached answer, None) on a hit, or (None, store context) on a miss
+    so the caller can store the fresh answer without embedding the turn twice.
+    A sample of hits is re-asked upstream in the background to measure false hits.
+    """
+    from .semantic_cache import get_semantic_cache, split_messages
+    
+    query, scope = split_messages(messages, LLM_MODEL, **opts)
+    if query is None:
+        return None, None
+    
+    cache = get_semantic_cache()
+    vec = await asyncio.to_thread(cache.embed_query, query)
+    found = cache.lookup(namespace, vec, scope)
+    if found is None:
+        metrics.record_llm_semantic_cache("miss")
+        return None, (cache, query, vec, scope)
+    
+    entry, score = found
+    metrics.record_llm_semantic_cache("hit")
+    log_info(f"[SEMANTIC HIT] {score:.3f} ~ '{entry.query[:60]}'", "LLM")
+    if cache.should_sample():
+        task = asyncio.create_task(_semantic_sample(cache, messages, query, entry, score, **opts))
+        _SEMANTIC_SAMPLE_TASKS.add(task)
+        task.add_done_callback(_SEMANTIC_SAMPLE_TASKS.discard)
+    return entry.answer, None
+
+
+async def _semantic_sample(cache, messages: List[dict], query: str, entry, score: float, **opts) -> None:
+    """Fresh upstream answer for a served semantic hit -> false-hit accounting"""
+    try:
+        fresh = await _acall_llm_upstream(messages, True, 0, **opts)
+        if fresh.startswith("[LLM-FAIL]"):
+            return
+        if await asyncio.to_thread(cache.record_sample, query, entry, score, fresh):
+            metrics.record_llm_semantic_cache("false_hit")
+    except Exception as e:
+        log_warning(f"Semantic cache sample failed: {e}", "LLM")
+
+
+async def _acall_llm_upstream(messages: List[dict], skip_cache: bool, cache_ttl: int, **opts) -> str:
+    """Main model with fallback; successful answers are stored in Redis"""
     # Try main model
     try:
-        result = _llm_request(messages, LLM_MODEL, **opts)
+        result = await _allm_request(messages, LLM_MODEL, **opts)
         
         # Store in Redis cache
         if REDIS_AVAILABLE and not skip_cache:
             try:
                 redis = get_redis()
                 cache_key = _generate_cache_key(messages, LLM_MODEL, **opts)
-                redis.set(cache_key, result, ttl=cache_ttl)
+                await asyncio.to_thread(redis.set, cache_key, result, ttl=cache_ttl)
                 log_info(f"[CACHE STORE] Saved LLM response to Redis (TTL: {cache_ttl}s)", "LLM")
             except Exception as e:
                 log_warning(f"Redis cache store failed: {e}", "LLM")
@@ -178,14 +518,15 @@ def call_llm(messages: List[dict], **opts) -> str:
         
         # Try fallback model
         try:
-            result = _llm_request(messages, LLM_FALLBACK_MODEL, **opts)
+            result = await _allm_request(messages, LLM_FALLBACK_MODEL, **opts)
             
-            # Store fallback result in cache with shorter TTL
+            # Store fallback result with shorter TTL under the main-model key:
+            # that is the key the cache lookup and single-flight waiters read
             if REDIS_AVAILABLE and not skip_cache:
                 try:
                     redis = get_redis()
-                    cache_key = _generate_cache_key(messages, LLM_FALLBACK_MODEL, **opts)
-                    redis.set(cache_key, result, ttl=cache_ttl // 2)  # Half TTL for fallback
+                    cache_key = _generate_cache_key(messages, LLM_MODEL, **opts)
+                    await asyncio.to_thread(redis.set, cache_key, result, ttl=cache_ttl // 2)  # Half TTL for fallback
                 except Exception:
                     pass
             
@@ -196,6 +537,23 @@ def call_llm(messages: List[dict], **opts) -> str:
             return f"[LLM-FAIL] Main: {str(e1)[:100]}... Fallback: {str(e2)[:100]}"
 
 
+def call_llm(messages: List[dict], **opts) -> str:
+    """
+    Call LLM with fallback mechanism + Redis cache (sync shim over acall_llm)
+    
+    Runs on a background event loop so legacy sync callers share the pooled
+    async client. From async code use `await acall_llm(...)` instead.
+    
+    Args:
+        messages: List of message dicts with 'role' and 'content'
+        **opts: See acall_llm
+        
+    Returns:
+        str: LLM response content (or error message if both fail)
+    """
+    return _SYNC_LOOP.run(acall_llm(messages, **opts))
+
+
 def call_llm_once(prompt: str, temperature: float = 0.8, **opts) -> str:
     """
     Call LLM with a single user prompt (convenience function)
@@ -247,8 +605,9 @@ async def call_llm_stream(messages: List[dict], **opts):
     timeout_s = float(opts.get("timeout_s", LLM_TIMEOUT))
     
     try:
-        async with httpx.AsyncClient(timeout=timeout_s) as client:
-            async with client.stream("POST", url, headers=headers, json=payload) as response:
+        client = _get_async_client()
+        async with _host_limit(url):
+            async with client.stream("POST", url, headers=headers, json=payload, timeout=timeout_s) as response:
                 response.raise_for_status()
                 
                 async for line in response.aiter_lines():
@@ -259,7 +618,6 @@ async def call_llm_stream(messages: List[dict], **opts):
                             break
                         
                         try:
-                            import json
                             data = json.loads(data_str)
                             content = data.get("choices", [{}])[0].get("delta", {}).get("content", "")
                             
@@ -379,6 +737,9 @@ def get_llm_config() -> Dict[str, Any]:
         "timeout": LLM_TIMEOUT,
         "retries": LLM_RETRIES,
         "backoff": LLM_BACKOFF_S,
+        "http2": LLM_HTTP2 and HTTP2_AVAILABLE,
+        "max_connections": LLM_MAX_CONNECTIONS,
+        "max_connections_per_host": LLM_MAX_CONNECTIONS_PER_HOST,
         "api_key_set": bool(LLM_API_KEY)
     }
 
@@ -394,8 +755,8 @@ class LLMClient:
     """
     
     async def chat_completion(self, messages: List[dict], **opts) -> str:
-        """Async wrapper dla call_llm"""
-        return call_llm(messages, **opts)
+        """Natywnie async - nie blokuje event loopa"""
+        return await acall_llm(messages, **opts)
     
     def chat_completion_sync(self, messages: List[dict], **opts) -> str:
         """Sync wrapper dla call_llm"""
@@ -41,26 +41,35 @@ import json
 import uuid
 import sqlite3
 import hashlib
-import pickle
 import numpy as np
 import asyncio
+import atexit
 import threading
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Any, Dict, List, Tuple, Optional, Set, Union
-from collections import Counter, deque, defaultdict
+from collections import Counter, OrderedDict, deque, defaultdict
 from dataclasses import dataclass, asdict, field
 from datetime import datetime, timedelta
 
 # Core imports
 from .config import (
     BASE_DIR, DB_PATH, STM_LIMIT, STM_CONTEXT_WINDOW,
-    LTM_IMPORTANCE_THRESHOLD, LTM_CACHE_SIZE
+    LTM_IMPORTANCE_THRESHOLD, LTM_CACHE_SIZE,
+    MEMORY_WRITE_BEHIND, MEMORY_WRITE_BEHIND_BATCH, MEMORY_WRITE_BEHIND_FLUSH_MS,
+    MEMORY_VECTOR_INDEX, MEMORY_VECTOR_NPROBE, MEMORY_EMBEDDING_DTYPE
 )
 from .helpers import (
     log_info, log_warning, log_error,
     tokenize, make_id, tfidf_cosine,
     embed_texts, cosine_similarity
 )
+from .vector_index import VectorIndexManager
+from .metrics import time_stage
+from .embedding_codec import encode_embedding, decode_embedding, migrate_embeddings, needs_migration
+from .memory_scoring import (
+    score_candidates, EPISODIC_WEIGHTS, SEMANTIC_WEIGHTS, CROSS_LAYER_WEIGHTS
+)
 
 # Redis cache (optional)
 try:
@@ -96,6 +105,13 @@ AUTO_CONSOLIDATION_INTERVAL = 180  # 🔥 3 minutes (było 10min) - HARDCORE!
 CLEANUP_INTERVAL = 1800  # 30 minutes (było 1h)
 BACKUP_INTERVAL = 43200  # 12 hours (było 24h)
 
+# SQLite connection pool
+DB_POOL_MAX_READERS = int(os.getenv("MEM_DB_MAX_READERS", "64"))  # Soft cap on per-thread readers
+DB_WRITER_TIMEOUT = float(os.getenv("MEM_DB_WRITER_TIMEOUT", "30.0"))  # Max wait for the writer (s)
+
+# Retrieval
+RECENT_EPISODES_WINDOW = 20  # Newest episodes always scored next to ANN neighbours
+
 # Storage paths
 LTM_STORAGE_ROOT = os.getenv("LTM_STORAGE_ROOT", os.path.join(BASE_DIR, "ltm_storage"))
 VECTOR_INDEX_PATH = os.path.join(LTM_STORAGE_ROOT, "vector_indices")
@@ -222,19 +238,48 @@ class MemorySearchResult:
 # DATABASE LAYER
 # ═══════════════════════════════════════════════════════════════════════════════
 
-class MemoryDatabase:
-    """SQLite database layer with optimizations"""
-    
-    def __init__(self, db_path: str = DB_PATH):
+class SQLiteConnectionPool:
+    """
+    Connection pool: one reader per thread + a single shared writer.
+
+    PRAGMAs are applied once, when a connection is opened. Readers live in
+    thread-local storage and are reused for the thread's lifetime; all writes
+    are serialized through one writer connection (SQLite allows one writer
+    anyway, so this replaces busy-waiting inside SQLite with a Python lock
+    whose wait times we can measure).
+    """
+
+    def __init__(self, db_path: str, max_readers: int = DB_POOL_MAX_READERS,
+                 writer_timeout: float = DB_WRITER_TIMEOUT):
         self.db_path = db_path
-        self._lock = threading.Lock()
-        self._init_db()
-    
-    def _conn(self) -> sqlite3.Connection:
-        """Get optimized database connection"""
+        self.max_readers = max_readers
+        self.writer_timeout = writer_timeout
+
+        self._local = threading.local()
+        self._readers: Dict[threading.Thread, sqlite3.Connection] = {}
+        self._readers_lock = threading.Lock()
+
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.RLock()
+        self._writer_depth = 0
+
+        # Stats
+        self._stats_lock = threading.Lock()
+        self._connections_opened = 0
+        self._readers_created = 0
+        self._reader_overflows = 0
+        self._writer_acquisitions = 0
+        self._writer_contended = 0
+        self._writer_waiting = 0
+        self._writer_wait_total = 0.0
+        self._writer_wait_max = 0.0
+        self._writer_hold_total = 0.0
+
+    def _open(self) -> sqlite3.Connection:
+        """Open connection and apply PRAGMAs (once per connection)"""
         conn = sqlite3.connect(self.db_path, check_same_thread=False)
         conn.row_factory = sqlite3.Row
-        
+
         # Performance optimizations (🔥 HARDCORE TUNING!)
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA synchronous=NORMAL;")
@@ -245,12 +290,367 @@ class MemoryDatabase:
         conn.execute("PRAGMA page_size=8192;")  # 8KB pages
         conn.execute("PRAGMA busy_timeout=30000;")  # 30s timeout
         conn.execute("PRAGMA wal_autocheckpoint=20000;")  # 🔥 WAL checkpoint 20k (było 5k default)
-        
+
+        with self._stats_lock:
+            self._connections_opened += 1
         return conn
-    
+
+    def _prune_dead_readers(self) -> None:
+        """Close readers owned by threads that no longer exist (caller holds _readers_lock)"""
+        for thread in [t for t in self._readers if not t.is_alive()]:
+            try:
+                self._readers.pop(thread).close()
+            except Exception:
+                pass
+
+    def get_reader(self) -> sqlite3.Connection:
+        """Get this thread's reader connection (opened on first use)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        conn = self._open()
+        with self._readers_lock:
+            if len(self._readers) >= self.max_readers:
+                self._prune_dead_readers()
+            if len(self._readers) >= self.max_readers:
+                # Soft cap: still serve the thread, but make saturation visible
+                self._reader_overflows += 1
+                log_warning(f"Reader pool saturated ({len(self._readers)}/{self.max_readers})", "MEMORY_DB")
+            self._readers[threading.current_thread()] = conn
+            self._readers_created += 1
+
+        self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Context manager yielding this thread's reader connection"""
+        yield self.get_reader()
+
+    @contextmanager
+    def writer(self):
+        """
+        Exclusive access to the single writer connection.
+
+        Commits when the outermost block exits cleanly, rolls back on error.
+        Re-entrant within one thread (nested blocks share the transaction).
+        """
+        t0 = time.perf_counter()
+        acquired = self._writer_lock.acquire(blocking=False)
+        if not acquired:
+            with self._stats_lock:
+                self._writer_contended += 1
+                self._writer_waiting += 1
+            try:
+                acquired = self._writer_lock.acquire(timeout=self.writer_timeout)
+            finally:
+                with self._stats_lock:
+                    self._writer_waiting -= 1
+            if not acquired:
+                raise TimeoutError(f"Memory DB writer busy for more than {self.writer_timeout}s")
+
+        waited = time.perf_counter() - t0
+        held_from = time.perf_counter()
+        self._writer_depth += 1
+        outermost = self._writer_depth == 1
+        try:
+            if self._writer is None:
+                self._writer = self._open()
+            conn = self._writer
+            try:
+                yield conn
+                if outermost:
+                    conn.commit()
+            except BaseException:
+                if outermost:
+                    conn.rollback()
+                raise
+        finally:
+            self._writer_depth -= 1
+            if outermost:
+                with self._stats_lock:
+                    self._writer_acquisitions += 1
+                    self._writer_wait_total += waited
+                    self._writer_wait_max = max(self._writer_wait_max, waited)
+                    self._writer_hold_total += time.perf_counter() - held_from
+            self._writer_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool saturation and wait-time statistics"""
+        with self._readers_lock:
+            readers_open = len(self._readers)
+        with self._stats_lock:
+            acq = self._writer_acquisitions
+            return {
+                "connections_opened": self._connections_opened,
+                "readers_open": readers_open,
+                "readers_created": self._readers_created,
+                "max_readers": self.max_readers,
+                "reader_saturation": readers_open / max(1, self.max_readers),
+                "reader_overflows": self._reader_overflows,
+                "writer_acquisitions": acq,
+                "writer_contended": self._writer_contended,
+                "writer_saturation": self._writer_contended / max(1, acq),
+                "writer_waiting": self._writer_waiting,
+                "writer_wait_avg_ms": (self._writer_wait_total / max(1, acq)) * 1000,
+                "writer_wait_max_ms": self._writer_wait_max * 1000,
+                "writer_hold_avg_ms": (self._writer_hold_total / max(1, acq)) * 1000,
+            }
+
+    def close(self) -> None:
+        """Close all pooled connections"""
+        with self._writer_lock:
+            if self._writer is not None:
+                try:
+                    self._writer.close()
+                except Exception:
+                    pass
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._readers.values():
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._readers.clear()
+        self._local = threading.local()
+
+
+class WriteBehindQueue:
+    """
+    Write-behind buffer for node upserts (+ FTS) and analytics rows.
+
+    Writes are queued in RAM and flushed by a background thread in a single
+    writer transaction every `batch_size` items or `flush_interval_ms`,
+    whichever comes first. Pending nodes stay visible through overlay()
+    (read-your-writes) until their transaction commits. Remaining items are
+    flushed on close() and at interpreter exit.
+    """
+
+    def __init__(self, db: 'MemoryDatabase', batch_size: int = MEMORY_WRITE_BEHIND_BATCH,
+                 flush_interval_ms: int = MEMORY_WRITE_BEHIND_FLUSH_MS):
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000.0
+        self.max_pending = self.batch_size * 16  # Backpressure: caller flushes inline above this
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending_nodes: "OrderedDict[str, MemoryNode]" = OrderedDict()
+        self._pending_metrics: List[Tuple[str, float, str, float]] = []
+        self._inflight_nodes: Dict[str, MemoryNode] = {}
+        self._first_pending_at: Optional[float] = None
+        self._closed = False
+
+        # Stats
+        self._flushes = 0
+        self._items_flushed = 0
+        self._flush_errors = 0
+        self._inline_flushes = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="memory-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _pending_count(self) -> int:
+        return len(self._pending_nodes) + len(self._pending_metrics)
+
+    def put_node(self, node: MemoryNode) -> None:
+        """Queue node upsert (coalesces repeated writes of the same node)"""
+        def add():
+            self._pending_nodes[node.id] = node
+            self._pending_nodes.move_to_end(node.id)
+        self._enqueue(add)
+
+    def put_metric(self, metric_name: str, metric_value: float, metadata_json: str, timestamp: float) -> None:
+        """Queue analytics row"""
+        self._enqueue(lambda: self._pending_metrics.append((metric_name, metric_value, metadata_json, timestamp)))
+
+    def _enqueue(self, add) -> None:
+        with self._cond:
+            add()
+            if self._first_pending_at is None:
+                self._first_pending_at = time.time()
+            pending = self._pending_count()
+            closed = self._closed
+            self._cond.notify()
+
+        if closed:
+            # Late writes after shutdown go straight to the DB
+            self.flush()
+        elif pending >= self.max_pending:
+            self._inline_flushes += 1
+            self.flush()
+
+    def _run(self) -> None:
+        """Background flush loop"""
+        while True:
+            with self._cond:
+                while not self._closed and self._first_pending_at is None:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                deadline = self._first_pending_at + self.flush_interval
+                while (not self._closed and self._first_pending_at is not None
+                       and self._pending_count() < self.batch_size):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(timeout=remaining)
+            self.flush()
+
+    def flush(self) -> int:
+        """Flush everything queued so far in one transaction; returns item count"""
+        with self._flush_lock:
+            with self._cond:
+                nodes = self._pending_nodes
+                metrics = self._pending_metrics
+                self._pending_nodes = OrderedDict()
+                self._pending_metrics = []
+                self._first_pending_at = None
+                self._inflight_nodes = dict(nodes)
+
+            count = len(nodes) + len(metrics)
+            if not count:
+                return 0
+
+            t0 = time.perf_counter()
+            try:
+                with self.db.writer() as conn:
+                    for node in nodes.values():
+                        self.db._write_node(conn, node)
+                    if metrics:
+                        conn.executemany("""
+                            INSERT INTO memory_analytics (metric_name, metric_value, metadata, timestamp)
+                            VALUES (?, ?, ?, ?)
+                        """, metrics)
+            except Exception as e:
+                # Requeue so nothing is lost; newer versions of a node win
+                self._flush_errors += 1
+                log_error(e, "MEMORY_WRITE_BEHIND")
+                with self._cond:
+                    for node_id, node in nodes.items():
+                        self._pending_nodes.setdefault(node_id, node)
+                    self._pending_metrics[:0] = metrics
+                    if self._first_pending_at is None:
+                        self._first_pending_at = time.time()
+                return 0
+            finally:
+                with self._cond:
+                    self._inflight_nodes = {}
+
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            self._flushes += 1
+            self._items_flushed += count
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            return count
+
+    def get_node(self, node_id: str) -> Optional[MemoryNode]:
+        """Unflushed version of a node, if any"""
+        with self._cond:
+            return self._pending_nodes.get(node_id) or self._inflight_nodes.get(node_id)
+
+    def pending_ids(self) -> Set[str]:
+        with self._cond:
+            return set(self._pending_nodes) | set(self._inflight_nodes)
+
+    def overlay(self, query: str = "", layer: Optional[str] = None,
+                user_id: Optional[str] = None) -> List[MemoryNode]:
+        """Unflushed nodes matching search_nodes() filters"""
+        with self._cond:
+            candidates = {**self._inflight_nodes, **self._pending_nodes}
+
+        matches = [n for n in candidates.values()
+                   if (not layer or n.layer == layer) and (not user_id or n.user_id == user_id)]
+        if query:
+            terms = [t for t in query.lower().split() if t]
+            matches = [n for n in matches if any(t in n.content.lower() for t in terms)]
+
+        matches.sort(key=lambda n: n.accessed_at, reverse=True)
+        return matches
+
+    def close(self) -> None:
+        """Stop the flush thread and flush what is left (idempotent)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5.0)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = self._pending_count()
+        return {
+            "enabled": True,
+            "pending": pending,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "flushes": self._flushes,
+            "items_flushed": self._items_flushed,
+            "avg_batch_size": self._items_flushed / max(1, self._flushes),
+            "inline_flushes": self._inline_flushes,
+            "flush_errors": self._flush_errors,
+            "last_flush_ms": self._last_flush_ms,
+            "max_flush_ms": self._max_flush_ms,
+        }
+
+
+class MemoryDatabase:
+    """SQLite database layer with optimizations"""
+
+    def __init__(self, db_path: str = DB_PATH, write_behind: bool = MEMORY_WRITE_BEHIND,
+                 vector_index: bool = MEMORY_VECTOR_INDEX):
+        self.db_path = db_path
+        self.pool = SQLiteConnectionPool(db_path)
+        self._init_db()
+        self._migrate_embeddings()
+        self.write_behind: Optional[WriteBehindQueue] = WriteBehindQueue(self) if write_behind else None
+        
+        # ANN index files live next to a non-default DB so test/tmp DBs don't share them
+        index_root = VECTOR_INDEX_PATH if db_path == DB_PATH else f"{db_path}.vectors"
+        self.vectors: Optional[VectorIndexManager] = (
+            VectorIndexManager(index_root, source=self.iter_embeddings, nprobe=MEMORY_VECTOR_NPROBE)
+            if vector_index else None
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get this thread's pooled connection (legacy accessor, prefer reader()/writer())"""
+        return self.pool.get_reader()
+
+    def reader(self):
+        """Pooled read connection (context manager)"""
+        return self.pool.reader()
+
+    def writer(self):
+        """Serialized write connection, commits on exit (context manager)"""
+        return self.pool.writer()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool statistics"""
+        return self.pool.stats()
+
+    def flush(self) -> int:
+        """Flush pending write-behind items (no-op in direct mode)"""
+        return self.write_behind.flush() if self.write_behind is not None else 0
+
+    def close(self) -> None:
+        """Flush pending writes, persist vector indexes and close pooled connections"""
+        if self.write_behind is not None:
+            self.write_behind.close()
+        if self.vectors is not None:
+            self.vectors.save_all()
+        self.pool.close()
+
     def _init_db(self) -> None:
         """Initialize all database tables and indices"""
-        with self._lock, self._conn() as conn:
+        with self.writer() as conn:
             c = conn.cursor()
             
             # ═══════════════════════════════════════════════════════════
@@ -400,111 +800,171 @@ class MemoryDatabase:
             conn.commit()
             log_info("Memory database initialized successfully", "MEMORY_DB")
     
+    def _migrate_embeddings(self) -> None:
+        """One-shot conversion of pickled embeddings to the binary blob format"""
+        try:
+            with self.writer() as conn:
+                if not needs_migration(conn):
+                    return
+                t0 = time.time()
+                stats = migrate_embeddings(conn, dtype=MEMORY_EMBEDDING_DTYPE)
+            if stats["migrated"] or stats["cleared"]:
+                log_info(f"Embeddings migrated to binary format: {stats} in {time.time() - t0:.2f}s", "MEMORY_DB")
+        except Exception as e:
+            log_error(e, "MEMORY_DB_MIGRATE")
+    
     def save_node(self, node: MemoryNode) -> None:
-        """Save or update memory node"""
-        with self._lock, self._conn() as conn:
-            # Serialize complex fields
-            tags_json = json.dumps(node.tags)
-            metadata_json = json.dumps(node.metadata)
-            connections_json = json.dumps(node.connections)
-            embedding_bytes = pickle.dumps(node._embedding) if node._embedding is not None else None
-            
-            conn.execute("""
-                INSERT OR REPLACE INTO memory_nodes 
-                (id, layer, content, user_id, tags, metadata, importance, confidence,
-                 created_at, accessed_at, access_count, connections, embedding, deleted)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
-            """, (
-                node.id, node.layer, node.content, node.user_id,
-                tags_json, metadata_json, node.importance, node.confidence,
-                node.created_at, node.accessed_at, node.access_count,
-                connections_json, embedding_bytes
-            ))
-            
-            # Update FTS index
+        """Save or update memory node (queued when write-behind is enabled)"""
+        if self.write_behind is not None:
+            self.write_behind.put_node(node)
+        else:
+            with self.writer() as conn:
+                self._write_node(conn, node)
+        
+        if self.vectors is not None and node._embedding is not None:
             try:
-                conn.execute("""
-                    INSERT OR REPLACE INTO memory_fts (content, tags, user_id, node_id)
-                    VALUES (?, ?, ?, ?)
-                """, (node.content, " ".join(node.tags), node.user_id, node.id))
-            except:
-                pass  # FTS not available
-            
-            conn.commit()
+                self.vectors.add(node.user_id, node.id, node.layer, node._embedding)
+            except Exception as e:
+                log_error(e, "VECTOR_INDEX_ADD")
+    
+    def _write_node(self, conn: sqlite3.Connection, node: MemoryNode) -> None:
+        """Upsert node row and its FTS entry on an open writer connection"""
+        # Serialize complex fields
+        tags_json = json.dumps(node.tags)
+        metadata_json = json.dumps(node.metadata)
+        connections_json = json.dumps(node.connections)
+        embedding_bytes = encode_embedding(node._embedding, MEMORY_EMBEDDING_DTYPE)
+        
+        conn.execute("""
+            INSERT OR REPLACE INTO memory_nodes 
+            (id, layer, content, user_id, tags, metadata, importance, confidence,
+             created_at, accessed_at, access_count, connections, embedding, deleted)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+        """, (
+            node.id, node.layer, node.content, node.user_id,
+            tags_json, metadata_json, node.importance, node.confidence,
+            node.created_at, node.accessed_at, node.access_count,
+            connections_json, embedding_bytes
+        ))
+        
+        # Update FTS index
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO memory_fts (content, tags, user_id, node_id)
+                VALUES (?, ?, ?, ?)
+            """, (node.content, " ".join(node.tags), node.user_id, node.id))
+        except:
+            pass  # FTS not available
     
     def load_node(self, node_id: str) -> Optional[MemoryNode]:
         """Load memory node by ID"""
-        with self._conn() as conn:
+        if self.write_behind is not None:
+            pending = self.write_behind.get_node(node_id)
+            if pending is not None:
+                return pending
+        
+        with self.reader() as conn:
             row = conn.execute("""
                 SELECT * FROM memory_nodes WHERE id = ? AND deleted = 0
             """, (node_id,)).fetchone()
             
-            if not row:
-                return None
-            
-            # Deserialize
-            node = MemoryNode(
-                id=row["id"],
-                layer=row["layer"],
-                content=row["content"],
-                user_id=row["user_id"],
-                tags=json.loads(row["tags"] or "[]"),
-                metadata=json.loads(row["metadata"] or "{}"),
-                importance=row["importance"],
-                confidence=row["confidence"],
-                created_at=row["created_at"],
-                accessed_at=row["accessed_at"],
-                access_count=row["access_count"],
-                connections=json.loads(row["connections"] or "{}")
-            )
-            
-            # Deserialize embedding if exists
-            if row["embedding"]:
-                try:
-                    node._embedding = pickle.loads(row["embedding"])
-                except:
-                    pass
-            
-            return node
+            return self._row_to_node(row) if row else None
+    
+    def load_nodes(self, node_ids: List[str]) -> Dict[str, MemoryNode]:
+        """Load many nodes in one query (id -> node, missing/deleted ids skipped)"""
+        found: Dict[str, MemoryNode] = {}
+        if self.write_behind is not None:
+            for node_id in node_ids:
+                pending = self.write_behind.get_node(node_id)
+                if pending is not None:
+                    found[node_id] = pending
+        
+        missing = [nid for nid in node_ids if nid not in found]
+        if missing:
+            with self.reader() as conn:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT * FROM memory_nodes WHERE id IN ({placeholders}) AND deleted = 0", chunk
+                    ).fetchall()
+                    for row in rows:
+                        found[row["id"]] = self._row_to_node(row)
+        return found
+    
+    @staticmethod
+    def _decode_embedding(blob: Optional[bytes]) -> Optional[np.ndarray]:
+        """Deserialize embedding column (versioned blob, legacy pickle fallback)"""
+        return decode_embedding(blob)
+    
+    @classmethod
+    def _row_to_node(cls, row: sqlite3.Row) -> MemoryNode:
+        """Deserialize memory_nodes row"""
+        node = MemoryNode(
+            id=row["id"],
+            layer=row["layer"],
+            content=row["content"],
+            user_id=row["user_id"],
+            tags=json.loads(row["tags"] or "[]"),
+            metadata=json.loads(row["metadata"] or "{}"),
+            importance=row["importance"],
+            confidence=row["confidence"],
+            created_at=row["created_at"],
+            accessed_at=row["accessed_at"],
+            access_count=row["access_count"],
+            connections=json.loads(row["connections"] or "{}")
+        )
+        node._embedding = cls._decode_embedding(row["embedding"])
+        return node
     
     def search_nodes(self, query: str = "", layer: Optional[str] = None,
                      user_id: Optional[str] = None, limit: int = 100) -> List[MemoryNode]:
-        """Search memory nodes with filters"""
-        with self._conn() as conn:
+        """Search memory nodes with filters (layer/user_id apply with and without a query)"""
+        with self.reader() as conn:
             sql = "SELECT * FROM memory_nodes WHERE deleted = 0"
             params = []
             
+            # Qualified: memory_fts has its own user_id column
+            filters = ""
+            filter_params: List[Any] = []
+            if layer:
+                filters += " AND memory_nodes.layer = ?"
+                filter_params.append(layer)
+            if user_id:
+                filters += " AND memory_nodes.user_id = ?"
+                filter_params.append(user_id)
+            
             if query:
-                # Try FTS first
+                # Try FTS first (filtered inside the ranked query, so other users' hits don't use up the limit)
                 try:
-                    fts_sql = """
-                        SELECT node_id FROM memory_fts 
-                        WHERE memory_fts MATCH ? 
+                    fts_sql = f"""
+                        SELECT memory_fts.node_id FROM memory_fts
+                        JOIN memory_nodes ON memory_nodes.id = memory_fts.node_id
+                        WHERE memory_fts MATCH ? AND memory_nodes.deleted = 0{filters}
                         ORDER BY bm25(memory_fts) 
                         LIMIT ?
                     """
-                    fts_results = conn.execute(fts_sql, (query, limit)).fetchall()
+                    fts_results = conn.execute(fts_sql, (query, *filter_params, limit)).fetchall()
                     if fts_results:
                         node_ids = [r["node_id"] for r in fts_results]
                         placeholders = ",".join("?" * len(node_ids))
                         sql = f"SELECT * FROM memory_nodes WHERE id IN ({placeholders}) AND deleted = 0"
                         params = node_ids
+                    else:
+                        sql += " AND content LIKE ?"
+                        params.append(f"%{query}%")
                 except:
                     # Fallback to LIKE search
                     sql += " AND content LIKE ?"
                     params.append(f"%{query}%")
             
-            if layer and not query:
-                sql += " AND layer = ?"
-                params.append(layer)
-            
-            if user_id and not query:
-                sql += " AND user_id = ?"
-                params.append(user_id)
+            sql += filters
+            params.extend(filter_params)
             
             if not query:
-                sql += " ORDER BY accessed_at DESC LIMIT ?"
-                params.append(limit)
+                sql += " ORDER BY accessed_at DESC"
+            sql += " LIMIT ?"
+            params.append(limit)
             
             rows = conn.execute(sql, params).fetchall()
             
@@ -512,45 +972,83 @@ class MemoryDatabase:
             nodes = []
             for row in rows:
                 try:
-                    node = MemoryNode(
-                        id=row["id"],
-                        layer=row["layer"],
-                        content=row["content"],
-                        user_id=row["user_id"],
-                        tags=json.loads(row["tags"] or "[]"),
-                        metadata=json.loads(row["metadata"] or "{}"),
-                        importance=row["importance"],
-                        confidence=row["confidence"],
-                        created_at=row["created_at"],
-                        accessed_at=row["accessed_at"],
-                        access_count=row["access_count"],
-                        connections=json.loads(row["connections"] or "{}")
-                    )
-                    if row["embedding"]:
-                        try:
-                            node._embedding = pickle.loads(row["embedding"])
-                        except:
-                            pass
-                    nodes.append(node)
+                    nodes.append(self._row_to_node(row))
                 except Exception as e:
                     log_error(e, "LOAD_NODE")
-            
-            return nodes
+        
+        # Read-your-writes: unflushed nodes shadow their stored versions
+        if self.write_behind is not None:
+            pending_ids = self.write_behind.pending_ids()
+            if pending_ids:
+                overlay = self.write_behind.overlay(query, layer, user_id)
+                nodes = overlay + [n for n in nodes if n.id not in pending_ids]
+                nodes = nodes[:limit]
+        
+        return nodes
     
     def soft_delete_node(self, node_id: str) -> None:
         """Soft delete memory node"""
-        with self._lock, self._conn() as conn:
+        self.flush()  # A queued upsert must not resurrect the node later
+        with self.writer() as conn:
+            row = conn.execute("SELECT user_id FROM memory_nodes WHERE id = ?", (node_id,)).fetchone()
             conn.execute("UPDATE memory_nodes SET deleted = 1 WHERE id = ?", (node_id,))
-            conn.commit()
+        
+        if self.vectors is not None and row is not None:
+            self.vectors.remove(row["user_id"], node_id)
+    
+    def iter_embeddings(self, user_id: Optional[str] = None):
+        """Yield (node_id, user_id, layer, embedding) for live nodes with embeddings"""
+        sql = "SELECT id, user_id, layer, embedding FROM memory_nodes WHERE deleted = 0 AND embedding IS NOT NULL"
+        params: List[Any] = []
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            params.append(user_id)
+        
+        with self.reader() as conn:
+            for row in conn.execute(sql, params).fetchall():
+                embedding = self._decode_embedding(row["embedding"])
+                if embedding is not None:
+                    yield row["id"], row["user_id"], row["layer"], embedding
+    
+    def vector_search(self, query_emb: Any, user_id: str, layers: Optional[List[str]] = None,
+                      k: int = 20) -> List[Tuple[MemoryNode, float]]:
+        """ANN top-k over the user's nodes -> [(node, cosine)]"""
+        if self.vectors is None:
+            return []
+        
+        hits = self.vectors.search(user_id, query_emb, k=k, layers=layers)
+        if not hits:
+            return []
+        
+        nodes = self.load_nodes([node_id for node_id, _ in hits])
+        results = []
+        for node_id, score in hits:
+            node = nodes.get(node_id)
+            if node is None:
+                # Deleted outside save_node/soft_delete_node (cleanup, archive) - drop lazily
+                self.vectors.remove(user_id, node_id)
+                continue
+            results.append((node, score))
+        return results
+    
+    def rebuild_vector_index(self, user_id: Optional[str] = None) -> Dict[str, int]:
+        """Rebuild ANN index from stored embeddings (all users or one user)"""
+        if self.vectors is None:
+            return {}
+        self.flush()
+        return self.vectors.rebuild(self.iter_embeddings(user_id), user_id=user_id)
     
     def record_metric(self, metric_name: str, metric_value: float, metadata: Dict[str, Any] = None) -> None:
         """Record analytics metric"""
-        with self._lock, self._conn() as conn:
+        if self.write_behind is not None:
+            self.write_behind.put_metric(metric_name, metric_value, json.dumps(metadata or {}), time.time())
+            return
+        
+        with self.writer() as conn:
             conn.execute("""
                 INSERT INTO memory_analytics (metric_name, metric_value, metadata, timestamp)
                 VALUES (?, ?, ?, ?)
             """, (metric_name, metric_value, json.dumps(metadata or {}), time.time()))
-            conn.commit()
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -701,6 +1199,36 @@ class ShortTermMemory:
             self._conversations[user_id].clear()
 
 
+def _merge_nodes(*groups: List[MemoryNode]) -> List[MemoryNode]:
+    """Concatenate node lists, keeping the first occurrence of each id"""
+    seen: Set[str] = set()
+    merged = []
+    for group in groups:
+        for node in group:
+            if node.id not in seen:
+                seen.add(node.id)
+                merged.append(node)
+    return merged
+
+
+def _embed_query(query: str) -> np.ndarray:
+    """Query embedding as float32 array (empty when embeddings are unavailable)"""
+    embeddings = embed_texts([query])
+    return np.asarray(embeddings[0], dtype=np.float32) if embeddings else np.empty(0, dtype=np.float32)
+
+
+def _ensure_embeddings(nodes: List[MemoryNode]) -> None:
+    """Embed nodes stored without a vector in one batched call (kept in memory only)"""
+    missing = [node for node in nodes if node._embedding is None]
+    if not missing:
+        return
+    embeddings = embed_texts([node.content for node in missing])
+    if len(embeddings) != len(missing):
+        return
+    for node, emb in zip(missing, embeddings):
+        node._embedding = np.asarray(emb, dtype=np.float32)
+
+
 class EpisodicMemory:
     """L1: Recent events and conversations"""
     
@@ -742,40 +1270,35 @@ class EpisodicMemory:
     
     def find_related_episodes(self, query: str, user_id: str, limit: int = 10) -> List[MemorySearchResult]:
         """Find episodes related to query"""
-        # Get all episodes
-        all_episodes = self.get_recent_episodes(user_id, limit=200)
+        # Generate query embedding
+        query_emb = _embed_query(query)
+        
+        if self.db.vectors is not None and query_emb.size:
+            # ANN neighbours from the whole history + a few newest episodes for recency
+            all_episodes = _merge_nodes(
+                [node for node, _ in self.db.vector_search(query_emb, user_id, layers=["L1"], k=limit * 4)],
+                self.get_recent_episodes(user_id, limit=RECENT_EPISODES_WINDOW)
+            )
+        else:
+            all_episodes = self.get_recent_episodes(user_id, limit=200)
         
         if not all_episodes:
             return []
         
-        # Generate query embedding
-        query_emb = np.array(embed_texts([query])[0])
+        # Score episodes (semantic 0.7 + recency 0.3) in one vectorized pass
+        if query_emb.size:
+            _ensure_embeddings(all_episodes)
+        scored = score_candidates(query_emb, all_episodes, EPISODIC_WEIGHTS, top_k=limit)
         
-        # Score episodes
-        results = []
-        for ep in all_episodes:
-            ep_emb = ep.get_embedding()
-            
-            # Semantic similarity
-            semantic_score = float(cosine_similarity(query_emb, ep_emb))
-            
-            # Recency bonus
-            age_hours = (time.time() - ep.created_at) / 3600
-            recency_score = 1.0 / (1.0 + 0.01 * age_hours)
-            
-            # Combined score
-            total_score = semantic_score * 0.7 + recency_score * 0.3
-            
-            results.append(MemorySearchResult(
+        return [
+            MemorySearchResult(
                 node=ep,
                 score=total_score,
                 match_type="semantic",
-                context={"semantic": semantic_score, "recency": recency_score}
-            ))
-        
-        # Sort and return top results
-        results.sort(key=lambda r: r.score, reverse=True)
-        return results[:limit]
+                context={"semantic": parts["semantic"], "recency": parts["recency"]}
+            )
+            for ep, total_score, parts in scored
+        ]
 
 
 class SemanticMemory:
@@ -846,48 +1369,35 @@ class SemanticMemory:
     def search_facts(self, query: str, user_id: Optional[str] = None,
                      limit: int = 20, min_confidence: float = 0.4) -> List[MemorySearchResult]:
         """Hybrid search: BM25 + Vector similarity (🔥 UPGRADED SCORING!)"""
+        # Generate query embedding
+        query_emb = _embed_query(query)
+        
         # Text search (BM25 via FTS)
         text_nodes = self.db.search_nodes(query=query, layer="L2", user_id=user_id, limit=limit * 2)
         
+        # Vector search (ANN) - finds facts with no keyword overlap
+        if user_id and self.db.vectors is not None and query_emb.size:
+            ann_nodes = [node for node, _ in self.db.vector_search(query_emb, user_id, layers=["L2"], k=limit * 2)]
+            text_nodes = _merge_nodes(text_nodes, ann_nodes)
+        
         if not text_nodes:
             return []
         
-        # Generate query embedding
-        query_emb = np.array(embed_texts([query])[0])
+        # Score facts: semantic 0.7 + confidence 0.2 + importance 0.1 (vectorized)
+        if query_emb.size:
+            _ensure_embeddings(text_nodes)
+        scored = score_candidates(query_emb, text_nodes, SEMANTIC_WEIGHTS, top_k=limit,
+                                  min_confidence=min_confidence)
         
-        # Score facts
-        results = []
-        for node in text_nodes:
-            if node.confidence < min_confidence:
-                continue
-            
-            node_emb = node.get_embedding()
-            
-            # Semantic similarity
-            semantic_score = float(cosine_similarity(query_emb, node_emb))
-            
-            # 🔥 Layer priority boost (L2=1.0, L1=0.7, L0=0.5)
-            layer_boost = 1.0  # L2 semantic - HIGHEST PRIORITY!
-            
-            # Confidence bonus
-            conf_bonus = node.confidence * 0.2
-            
-            # Importance bonus
-            imp_bonus = node.importance * 0.1
-            
-            # Combined score with layer boost
-            total_score = (semantic_score * 0.7 + conf_bonus + imp_bonus) * layer_boost
-            
-            results.append(MemorySearchResult(
+        return [
+            MemorySearchResult(
                 node=node,
                 score=total_score,
                 match_type="hybrid",
-                context={"semantic": semantic_score, "confidence": node.confidence}
-            ))
-        
-        # Sort and return
-        results.sort(key=lambda r: r.score, reverse=True)
-        return results[:limit]
+                context={"semantic": parts["semantic"], "confidence": node.confidence}
+            )
+            for node, total_score, parts in scored
+        ]
     
     def consolidate_from_episodes(self, episodes: List[MemoryNode], user_id: str) -> Optional[str]:
         """Consolidate episodes into semantic fact"""
@@ -930,7 +1440,7 @@ class ProceduralMemory:
         """Learn or update procedure"""
         proc_id = make_id(trigger_intent)
         
-        with self.db._conn() as conn:
+        with self.db.writer() as conn:
             row = conn.execute("""
                 SELECT * FROM memory_procedures WHERE trigger_intent = ?
             """, (trigger_intent,)).fetchone()
@@ -971,15 +1481,13 @@ class ProceduralMemory:
                     json.dumps(context or {}), time.time(), time.time(),
                     json.dumps([])
                 ))
-            
-            conn.commit()
         
         log_info(f"[L3] Learned procedure: {trigger_intent}", "PROCEDURAL")
         return proc_id
     
     def get_procedure(self, trigger_intent: str) -> Optional[Dict[str, Any]]:
         """Get procedure by intent"""
-        with self.db._conn() as conn:
+        with self.db.reader() as conn:
             row = conn.execute("""
                 SELECT * FROM memory_procedures WHERE trigger_intent = ?
             """, (trigger_intent,)).fetchone()
@@ -1036,7 +1544,7 @@ class MentalModels:
         
         # Save model
         model_id = f"user_profile_{user_id}"
-        with self.db._conn() as conn:
+        with self.db.writer() as conn:
             conn.execute("""
                 INSERT OR REPLACE INTO memory_mental_models
                 (id, model_type, subject, confidence, evidence_count, model_data,
@@ -1049,14 +1557,13 @@ class MentalModels:
                 json.dumps([f.id for f in semantic_facts]),
                 time.time(), time.time(), confidence
             ))
-            conn.commit()
         
         log_info(f"[L4] Built user profile for {user_id}", "MENTAL_MODELS")
         return model_id
     
     def get_user_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user profile model"""
-        with self.db._conn() as conn:
+        with self.db.reader() as conn:
             row = conn.execute("""
                 SELECT * FROM memory_mental_models 
                 WHERE model_type = 'user_profile' AND subject = ?
@@ -1135,6 +1642,12 @@ class UnifiedMemorySystem:
         self._running = False
         log_info("Background tasks stopped", "MEMORY")
     
+    def shutdown(self) -> None:
+        """Stop background tasks, flush pending writes and close DB connections"""
+        self.stop_background_tasks()
+        self.db.close()
+        log_info("Memory system shut down", "MEMORY")
+    
     def process_conversation_turn(self, user_id: str, user_message: str,
                                   assistant_response: str, intent: str = "chat",
                                   metadata: Dict[str, Any] = None) -> Dict[str, Any]:
@@ -1172,6 +1685,7 @@ class UnifiedMemorySystem:
             "timestamp": time.time()
         }
     
+    @time_stage("memory_search")
     def retrieve_context(self, query: str, user_id: str, max_results: int = 10) -> Dict[str, Any]:
         """Retrieve comprehensive context across all layers"""
         # L0: STM
@@ -1200,7 +1714,28 @@ class UnifiedMemorySystem:
             "confidence": avg_confidence,
             "total_results": len(episodic_results) + len(semantic_results)
         }
-    
+
+    @time_stage("memory_search")
+    def search_hybrid(self, query: str, user_id: str = "default", limit: int = 10,
+                      layers: Tuple[str, ...] = ("L1", "L2")) -> List[Dict[str, Any]]:
+        """Cross-layer search: FTS + ANN candidates scored together in one pass"""
+        query_emb = _embed_query(query)
+
+        groups = [self.db.search_nodes(query=query, layer=layer, user_id=user_id, limit=limit * 2)
+                  for layer in layers]
+        if self.db.vectors is not None and query_emb.size:
+            groups.append([node for node, _ in self.db.vector_search(query_emb, user_id, layers=list(layers), k=limit * 4)])
+        candidates = _merge_nodes(*groups)
+
+        if query_emb.size:
+            _ensure_embeddings(candidates)
+        scored = score_candidates(query_emb, candidates, CROSS_LAYER_WEIGHTS, top_k=limit)
+
+        return [
+            {"id": node.id, "layer": node.layer, "content": node.content, "score": total_score, **parts}
+            for node, total_score, parts in scored
+        ]
+
     def auto_consolidate(self, user_id: str = None) -> Dict[str, Any]:
         """Automatic memory consolidation (L1 -> L2 -> L4)"""
         stats = {
@@ -1231,6 +1766,10 @@ class UnifiedMemorySystem:
                 self.mental_models.build_user_profile(uid, semantic_facts, episodes)
                 stats["models_updated"] += 1
         
+        # Persist vector indexes touched since the last run
+        if self.db.vectors is not None:
+            self.db.vectors.save_all()
+        
         log_info(f"Consolidation complete: {stats}", "MEMORY")
         return stats
     
@@ -1239,7 +1778,8 @@ class UnifiedMemorySystem:
         cutoff_time = time.time() - (max_age_days * 24 * 3600)
         deleted_count = 0
         
-        with self.db._conn() as conn:
+        self.db.flush()  # A queued upsert must not resurrect deleted nodes later
+        with self.db.writer() as conn:
             # Soft delete old, low-importance episodic memories
             result = conn.execute("""
                 UPDATE memory_nodes
@@ -1250,14 +1790,13 @@ class UnifiedMemorySystem:
                   AND deleted = 0
             """, (cutoff_time,))
             deleted_count = result.rowcount
-            conn.commit()
         
         log_info(f"Cleaned up {deleted_count} old memories", "MEMORY")
         return {"deleted_count": deleted_count}
     
     def get_health_stats(self) -> Dict[str, Any]:
         """Get comprehensive memory system health statistics"""
-        with self.db._conn() as conn:
+        with self.db.reader() as conn:
             stats = {
                 "L0_stm": {
                     "active_conversations": len(self.stm._conversations),
@@ -1282,7 +1821,10 @@ class UnifiedMemorySystem:
                 "cache": {
                     "ram_size": len(self.cache._ram_cache),
                     "redis_available": self.cache.redis is not None
-                }
+                },
+                "db_pool": self.db.pool_stats(),
+                "write_behind": self.db.write_behind.stats() if self.db.write_behind is not None else {"enabled": False},
+                "vector_index": self.db.vectors.stats() if self.db.vectors is not None else {"enabled": False}
             }
         
         # Calculate overall health score
@@ -1299,7 +1841,7 @@ class UnifiedMemorySystem:
     
     def _get_all_users(self) -> List[str]:
         """Get list of all users with memories"""
-        with self.db._conn() as conn:
+        with self.db.reader() as conn:
             rows = conn.execute("SELECT DISTINCT user_id FROM memory_nodes WHERE deleted=0").fetchall()
             return [r["user_id"] for r in rows]
 
@@ -1348,6 +1890,19 @@ def memory_consolidate_now(user_id: str = None) -> Dict[str, Any]:
     return get_memory_system().auto_consolidate(user_id)
 
 
+def memory_rebuild_vector_index(user_id: str = None) -> Dict[str, int]:
+    """Rebuild ANN vector index from stored embeddings"""
+    return get_memory_system().db.rebuild_vector_index(user_id)
+
+
+def memory_shutdown() -> None:
+    """Flush pending writes and release DB connections (app shutdown hook)"""
+    global _memory_system
+    if _memory_system is not None:
+        _memory_system.shutdown()
+        _memory_system = None
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # LEGACY SUPPORT - TimeManager for backward compatibility
 # ═══════════════════════════════════════════════════════════════════════════════
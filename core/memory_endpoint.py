@@ -5,6 +5,8 @@ Memory System REST API Endpoints
 Provides HTTP interface to unified memory system
 """
 
+import asyncio
+
 from fastapi import APIRouter, HTTPException, Depends, Query, Body
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
@@ -17,7 +19,8 @@ from .memory import (
     memory_search,
     memory_add_fact,
     memory_get_health,
-    memory_consolidate_now
+    memory_consolidate_now,
+    memory_rebuild_vector_index
 )
 from .helpers import log_info, log_error
 from .cache_invalidation import cleanup_expired_facts, get_cache_ttl, get_fact_age_str
@@ -204,7 +207,9 @@ async def search_memories(
     ```
     """
     try:
-        results = memory_search(
+        # memory_search is synchronous (SQLite + blocking embeddings) - keep it off the loop
+        results = await asyncio.to_thread(
+            memory_search,
             query=request.query,
             user_id=user["user_id"],
             max_results=request.max_results
@@ -293,6 +298,38 @@ async def trigger_consolidation(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/vector-index/rebuild", response_model=MemoryResponse)
+async def rebuild_vector_index(
+    user_id: Optional[str] = Query(None, description="Specific user ID (default: all users, admin only)"),
+    user=Depends(get_current_user)
+):
+    """
+    Rebuild the ANN vector index (L1/L2 semantic search) from stored embeddings
+    
+    **Use Cases:**
+    - After changing the embedding model (dimension change)
+    - After bulk imports or manual DB edits
+    - Index files lost or corrupted
+    
+    **CLI equivalent:** `python -m core.vector_index rebuild [--user USER_ID]`
+    """
+    try:
+        target_user = user_id if user_id == user["user_id"] or user.get("role") == "admin" else user["user_id"]
+        
+        counts = await asyncio.to_thread(memory_rebuild_vector_index, target_user)
+        
+        log_info(f"Vector index rebuilt: {len(counts)} users", "MEMORY_API")
+        
+        return MemoryResponse(
+            success=True,
+            data={"users": counts, "total_vectors": sum(counts.values())},
+            message=f"Rebuilt {len(counts)} vector index(es)"
+        )
+    except Exception as e:
+        log_error(e, "MEMORY_API")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/stats/user", response_model=MemoryResponse)
 async def get_user_memory_stats(user=Depends(get_current_user)):
     """
@@ -453,7 +490,7 @@ async def get_memory_insights(user=Depends(get_current_user)):
         # ═══ CONSOLIDATION METRICS ═══
         
         # Query consolidation history
-        with mem.db._conn() as conn:
+        with mem.db.reader() as conn:
             cursor = conn.execute("""
                 SELECT COUNT(*) FROM memory_nodes 
                 WHERE layer='L2' AND user_id=? AND deleted=0
@@ -1199,7 +1236,8 @@ async def clear_user_memory(
             cleared.append("L0_STM")
         
         if "L1" in target_layers or "L2" in target_layers or "L4" in target_layers:
-            with mem.db._conn() as conn:
+            mem.db.flush()  # A queued upsert must not resurrect cleared nodes later
+            with mem.db.writer() as conn:
                 if "L1" in target_layers:
                     conn.execute("UPDATE memory_nodes SET deleted=1 WHERE user_id=? AND layer='L1'", (user_id,))
                     cleared.append("L1_Episodic")
@@ -1209,7 +1247,6 @@ async def clear_user_memory(
                 if "L4" in target_layers:
                     conn.execute("DELETE FROM memory_mental_models WHERE subject=?", (user_id,))
                     cleared.append("L4_Models")
-                conn.commit()
         
         # Clear cache
         mem.cache.clear(user_id)
@@ -1246,7 +1283,7 @@ async def list_conversations(
         mem = get_memory_system()
         
         # Get episodes (L1) grouped by conversation_id from memory_nodes
-        with mem.db._conn() as conn:
+        with mem.db.reader() as conn:
             rows = conn.execute("""
                 SELECT 
                     json_extract(metadata, '$.conversation_id') as conv_id,
@@ -1298,7 +1335,7 @@ async def get_conversation_messages(
         mem = get_memory_system()
         
         # Get all L1 nodes for this conversation from memory_nodes
-        with mem.db._conn() as conn:
+        with mem.db.reader() as conn:
             rows = conn.execute("""
                 SELECT id, content, metadata, created_at
                 FROM memory_nodes
@@ -1372,7 +1409,8 @@ async def delete_conversation(
         user_id = user.get("username", "guest")
         mem = get_memory_system()
         
-        with mem.db._conn() as conn:
+        mem.db.flush()  # A queued upsert must not resurrect deleted messages later
+        with mem.db.writer() as conn:
             result = conn.execute("""
                 UPDATE memory_nodes 
                 SET deleted = 1 
@@ -1380,7 +1418,6 @@ async def delete_conversation(
                     AND layer = 'L1'
                     AND json_extract(metadata, '$.conversation_id') = ?
             """, (user_id, conversation_id))
-            conn.commit()
             deleted_count = result.rowcount
         
         return MemoryResponse(
@@ -10,6 +10,7 @@ import json
 import gzip
 import shutil
 import pickle
+import sqlite3
 import threading
 import time
 from pathlib import Path
@@ -73,15 +74,13 @@ class MemoryBackupManager:
                 mem = get_memory_system()
                 db_backup_path = os.path.join(backup_dir, "memory.db")
                 
-                with mem.db._conn() as conn:
-                    # Use SQLite backup API for consistency
-                    backup_conn = mem.db._conn()
-                    backup_conn.execute("BEGIN IMMEDIATE")
-                    conn.backup(backup_conn)
-                    backup_conn.commit()
-                    backup_conn.close()
-                
-                shutil.copy2(mem.db.db_path, db_backup_path)
+                with mem.db.reader() as conn:
+                    # Use SQLite backup API for consistency (pooled connections stay open)
+                    backup_conn = sqlite3.connect(db_backup_path)
+                    try:
+                        conn.backup(backup_conn)
+                    finally:
+                        backup_conn.close()
                 
                 # 2. Backup vector indices (if exist)
                 if os.path.exists(VECTOR_INDEX_PATH):
@@ -265,8 +264,11 @@ class MemoryArchiveManager:
             mem = get_memory_system()
             
             try:
+                # Queued upserts first: they would resurrect archived nodes later
+                mem.db.flush()
+                
                 # Get old memories from DB
-                with mem.db._conn() as conn:
+                with mem.db.reader() as conn:
                     query = """
                         SELECT * FROM memory_nodes 
                         WHERE created_at < ? AND deleted = 0
@@ -316,11 +318,10 @@ class MemoryArchiveManager:
                         total_archived += len(memories)
                         
                         # Mark as archived in DB (soft delete)
-                        with mem.db._conn() as conn:
+                        with mem.db.writer() as conn:
                             memory_ids = [m["id"] for m in memories]
                             placeholders = ",".join("?" * len(memory_ids))
                             conn.execute(f"UPDATE memory_nodes SET deleted=1 WHERE id IN ({placeholders})", memory_ids)
-                            conn.commit()
                 
                 log_info(f"Archived {total_archived} old memories", "PERSISTENCE")
                 
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+memory_scoring.py - Vectorized candidate scoring for memory retrieval
+
+Candidates from any layer (L0-L4) are scored in one NumPy pass:
+    - embeddings stacked into a contiguous float32 matrix -> cosine via one matmul
+    - recency, confidence, importance and layer boost as column vectors
+    - top-k selected with argpartition (O(n)) and only the k winners sorted
+
+Nodes are duck-typed (id, layer, created_at, confidence, importance, _embedding)
+so the module has no dependency on core.memory.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# ═══════════════════════════════════════════════════════════════════
+# WEIGHTS
+# ═══════════════════════════════════════════════════════════════════
+
+# Layer priority (L2 semantic facts rank highest)
+LAYER_BOOST = {"L0": 0.5, "L1": 0.7, "L2": 1.0, "L3": 0.8, "L4": 0.9}
+
+
+@dataclass(frozen=True)
+class ScoringWeights:
+    """Linear blend: total = (sum of weighted components) * layer boost"""
+    semantic: float = 0.7
+    recency: float = 0.0
+    confidence: float = 0.0
+    importance: float = 0.0
+    recency_rate: float = 0.01  # recency = 1 / (1 + rate * age_hours)
+    layer_boost: Dict[str, float] = field(default_factory=dict)
+
+
+EPISODIC_WEIGHTS = ScoringWeights(semantic=0.7, recency=0.3)
+SEMANTIC_WEIGHTS = ScoringWeights(semantic=0.7, confidence=0.2, importance=0.1, layer_boost={"L2": 1.0})
+CROSS_LAYER_WEIGHTS = ScoringWeights(semantic=0.6, recency=0.1, confidence=0.2, importance=0.1,
+                                     layer_boost=LAYER_BOOST)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# SCORING
+# ═══════════════════════════════════════════════════════════════════
+
+def stack_embeddings(vectors: Sequence[Any], dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stack vectors into an (n, dim) float32 matrix.
+    Rows that are missing or have another dimension stay zero; mask marks valid rows.
+    """
+    if vectors and all(v is not None and getattr(v, "size", -1) == dim for v in vectors):
+        # Fast path: every row is already an ndarray of the right size
+        matrix = np.stack(vectors).astype(np.float32, copy=False).reshape(len(vectors), dim)
+        return matrix, np.ones(len(vectors), dtype=bool)
+
+    matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+    valid = np.zeros(len(vectors), dtype=bool)
+    for i, vec in enumerate(vectors):
+        if vec is None:
+            continue
+        arr = np.asarray(vec, dtype=np.float32).ravel()
+        if arr.size == dim:
+            matrix[i] = arr
+            valid[i] = True
+    return matrix, valid
+
+
+def cosine_scores(query: Any, matrix: np.ndarray, valid: Optional[np.ndarray] = None) -> np.ndarray:
+    """Cosine similarity of query against every row (0 for invalid/zero rows)"""
+    q = np.asarray(query, dtype=np.float32).ravel()
+    q_norm = float(np.linalg.norm(q))
+    if matrix.size == 0 or q_norm == 0.0:
+        return np.zeros(len(matrix), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1.0
+    scores = (matrix @ q) / (norms * q_norm)
+    if valid is not None:
+        scores[~valid] = 0.0
+    return scores
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(n)
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def score_candidates(query_emb: Any, nodes: Sequence[Any], weights: ScoringWeights = CROSS_LAYER_WEIGHTS,
+                     top_k: Optional[int] = None, min_confidence: float = 0.0,
+                     now: Optional[float] = None) -> List[Tuple[Any, float, Dict[str, float]]]:
+    """
+    Score nodes against query embedding in one pass.
+
+    Returns:
+        [(node, total_score, {"semantic", "recency", "confidence", "importance"})] best first
+    """
+    if not nodes:
+        return []
+    now = time.time() if now is None else now
+    query = np.asarray(query_emb, dtype=np.float32).ravel() if query_emb is not None else np.empty(0)
+
+    confidence = np.fromiter((n.confidence for n in nodes), dtype=np.float32, count=len(nodes))
+    importance = np.fromiter((n.importance for n in nodes), dtype=np.float32, count=len(nodes))
+    created = np.fromiter((n.created_at for n in nodes), dtype=np.float64, count=len(nodes))
+
+    if query.size:
+        matrix, valid = stack_embeddings([n._embedding for n in nodes], query.size)
+        semantic = cosine_scores(query, matrix, valid)
+    else:
+        semantic = np.zeros(len(nodes), dtype=np.float32)
+
+    age_hours = np.maximum(now - created, 0.0) / 3600.0
+    recency = (1.0 / (1.0 + weights.recency_rate * age_hours)).astype(np.float32)
+
+    total = (semantic * weights.semantic + recency * weights.recency
+             + confidence * weights.confidence + importance * weights.importance)
+    if weights.layer_boost:
+        total *= np.fromiter((weights.layer_boost.get(n.layer, 1.0) for n in nodes),
+                             dtype=np.float32, count=len(nodes))
+    if min_confidence > 0.0:
+        total[confidence < min_confidence] = -np.inf
+
+    k = len(nodes) if top_k is None else top_k
+    order = top_k_indices(total, k)
+    return [
+        (nodes[i], float(total[i]), {
+            "semantic": float(semantic[i]),
+            "recency": float(recency[i]),
+            "confidence": float(confidence[i]),
+            "importance": float(importance[i]),
+        })
+        for i in order if np.isfinite(total[i])
+    ]
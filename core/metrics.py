@@ -6,9 +6,11 @@ from __future__ import annotations
 
 import os
 import sqlite3
+import threading
 import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, Optional
 
 PROMETHEUS_AVAILABLE = False
 try:  # pragma: no cover - optional dependency
@@ -30,6 +32,15 @@ except ImportError:  # pragma: no cover - fallback if prometheus_client missing
 APP_START_TIME = time.time()
 registry = CollectorRegistry() if PROMETHEUS_AVAILABLE else None
 
+# Request latency is dominated by LLM round trips (seconds to minutes), not web-app milliseconds
+REQUEST_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+STAGE_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+# Cardinality guard: distinct `endpoint` label values (route templates) before folding into "other"
+METRICS_MAX_ENDPOINTS = int(os.getenv("METRICS_MAX_ENDPOINTS", "300"))
+UNMATCHED_ENDPOINT = "unmatched"
+OVERFLOW_ENDPOINT = "other"
+
 if PROMETHEUS_AVAILABLE:
     REQUESTS_TOTAL = Counter(
         "mordzix_requests_total",
@@ -41,6 +52,14 @@ if PROMETHEUS_AVAILABLE:
         "mordzix_request_duration_seconds",
         "Request duration",
         ["method", "endpoint"],
+        buckets=REQUEST_LATENCY_BUCKETS,
+        registry=registry,
+    )
+    STAGE_DURATION = Histogram(
+        "mordzix_stage_duration_seconds",
+        "Duration of pipeline stages (memory search, LLM round trip, embeddings, tool execution)",
+        ["stage"],
+        buckets=STAGE_LATENCY_BUCKETS,
         registry=registry,
     )
     ERRORS_TOTAL = Counter(
@@ -69,11 +88,28 @@ if PROMETHEUS_AVAILABLE:
         "LLM cache misses",
         registry=registry,
     )
+    LLM_COALESCED = Counter(
+        "mordzix_llm_coalesced_total",
+        "LLM calls served by an identical in-flight request (single-flight)",
+        ["scope"],
+        registry=registry,
+    )
+    LLM_SEMANTIC_CACHE = Counter(
+        "mordzix_llm_semantic_cache_total",
+        "Semantic LLM cache lookups (hit/miss) and sampled false hits",
+        ["result"],
+        registry=registry,
+    )
     EMBED_CACHE_SIZE = Gauge(
         "mordzix_embed_cache_size",
         "Embedding cache size",
         registry=registry,
     )
+    EMBED_CACHE_BYTES = Gauge(
+        "mordzix_embed_cache_bytes",
+        "Embedding cache RAM tier size in bytes",
+        registry=registry,
+    )
     EMBED_CACHE_HITS = Counter(
         "mordzix_embed_cache_hits_total",
         "Embedding cache hits",
@@ -84,10 +120,33 @@ if PROMETHEUS_AVAILABLE:
         "Embedding cache misses",
         registry=registry,
     )
+    EMBED_BATCH_FILL = Histogram(
+        "mordzix_embed_batch_fill_ratio",
+        "Embedding micro-batch size / max batch size",
+        buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0),
+        registry=registry,
+    )
+    EMBED_BATCH_WAIT = Histogram(
+        "mordzix_embed_batch_wait_seconds",
+        "Latency added by the embedding micro-batcher (queue wait before dispatch)",
+        buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+        registry=registry,
+    )
+    LLM_STREAM_TTFT = Histogram(
+        "mordzix_llm_stream_ttft_seconds",
+        "Time from request start to the first streamed LLM token",
+        buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0),
+        registry=registry,
+    )
+    LLM_STREAM_TOKENS_PER_SECOND = Histogram(
+        "mordzix_llm_stream_tokens_per_second",
+        "Streamed LLM decode rate (chunks per second after the first token)",
+        buckets=(1, 5, 10, 20, 40, 60, 100, 200),
+        registry=registry,
+    )
     STM_MESSAGES = Gauge(
         "mordzix_stm_messages",
         "Number of STM messages",
-        ["user_id"],
         registry=registry,
     )
     LTM_FACTS = Gauge(
@@ -113,14 +172,22 @@ if PROMETHEUS_AVAILABLE:
 else:  # pragma: no cover - ensure names exist for importers
     REQUESTS_TOTAL = None
     REQUEST_DURATION = None
+    STAGE_DURATION = None
     ERRORS_TOTAL = None
     UPTIME_GAUGE = None
     LLM_CACHE_SIZE = None
     LLM_CACHE_HITS = None
     LLM_CACHE_MISSES = None
+    LLM_COALESCED = None
+    LLM_SEMANTIC_CACHE = None
     EMBED_CACHE_SIZE = None
+    EMBED_CACHE_BYTES = None
     EMBED_CACHE_HITS = None
     EMBED_CACHE_MISSES = None
+    EMBED_BATCH_FILL = None
+    EMBED_BATCH_WAIT = None
+    LLM_STREAM_TTFT = None
+    LLM_STREAM_TOKENS_PER_SECOND = None
     STM_MESSAGES = None
     LTM_FACTS = None
     PSYCHE_MOOD = None
@@ -130,6 +197,31 @@ else:  # pragma: no cover - ensure names exist for importers
 _METRICS_ENDPOINT_REQUESTS = 0
 _METRICS_ENDPOINT_ERRORS = 0
 
+_endpoint_labels: set = set()
+_endpoint_labels_lock = threading.Lock()
+
+
+def endpoint_label(scope: Dict[str, Any]) -> str:
+    """
+    Bounded `endpoint` label for an ASGI request scope.
+
+    Uses the matched route template (`/api/memory/conversations/{id}`), never the
+    raw path. Unmatched requests (404 scans, mounts) share one label and label
+    values beyond METRICS_MAX_ENDPOINTS fold into "other".
+    """
+
+    route = scope.get("route")
+    template = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if not template:
+        return UNMATCHED_ENDPOINT
+    if template in _endpoint_labels:
+        return template
+    with _endpoint_labels_lock:
+        if len(_endpoint_labels) >= METRICS_MAX_ENDPOINTS:
+            return OVERFLOW_ENDPOINT
+        _endpoint_labels.add(template)
+    return template
+
 
 def record_request(method: str, endpoint: str, status: int, duration: float) -> None:
     """Record request counters if Prometheus is enabled."""
@@ -175,11 +267,26 @@ def record_llm_cache_miss() -> None:
         LLM_CACHE_MISSES.inc()
 
 
+def record_llm_coalesced(scope: str) -> None:
+    if PROMETHEUS_AVAILABLE and LLM_COALESCED is not None:
+        LLM_COALESCED.labels(scope=scope).inc()
+
+
+def record_llm_semantic_cache(result: str) -> None:
+    if PROMETHEUS_AVAILABLE and LLM_SEMANTIC_CACHE is not None:
+        LLM_SEMANTIC_CACHE.labels(result=result).inc()
+
+
 def update_embed_cache_size(size: int) -> None:
     if PROMETHEUS_AVAILABLE and EMBED_CACHE_SIZE is not None:
         EMBED_CACHE_SIZE.set(size)
 
 
+def update_embed_cache_bytes(size_bytes: int) -> None:
+    if PROMETHEUS_AVAILABLE and EMBED_CACHE_BYTES is not None:
+        EMBED_CACHE_BYTES.set(size_bytes)
+
+
 def record_embed_cache_hit() -> None:
     if PROMETHEUS_AVAILABLE and EMBED_CACHE_HITS is not None:
         EMBED_CACHE_HITS.inc()
@@ -190,6 +297,39 @@ def record_embed_cache_miss() -> None:
         EMBED_CACHE_MISSES.inc()
 
 
+def record_embed_batch(fill_ratio: float) -> None:
+    if PROMETHEUS_AVAILABLE and EMBED_BATCH_FILL is not None:
+        EMBED_BATCH_FILL.observe(fill_ratio)
+
+
+def observe_embed_batch_wait(seconds: float) -> None:
+    if PROMETHEUS_AVAILABLE and EMBED_BATCH_WAIT is not None:
+        EMBED_BATCH_WAIT.observe(seconds)
+
+
+def observe_llm_stream(ttft: float, tokens_per_second: float) -> None:
+    if PROMETHEUS_AVAILABLE and LLM_STREAM_TTFT is not None:
+        LLM_STREAM_TTFT.observe(ttft)
+    if PROMETHEUS_AVAILABLE and LLM_STREAM_TOKENS_PER_SECOND is not None and tokens_per_second > 0:
+        LLM_STREAM_TOKENS_PER_SECOND.observe(tokens_per_second)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    if PROMETHEUS_AVAILABLE and STAGE_DURATION is not None:
+        STAGE_DURATION.labels(stage=stage).observe(seconds)
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    """Time a block (or a sync function, used as a decorator) into STAGE_DURATION."""
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
 def _collect_db_stats() -> Dict[str, Any]:
     result: Dict[str, Any] = {}
     db_path = os.getenv("MEM_DB")
@@ -300,6 +440,8 @@ def reset_metrics_for_tests() -> None:
     global _METRICS_ENDPOINT_REQUESTS, _METRICS_ENDPOINT_ERRORS
     _METRICS_ENDPOINT_REQUESTS = 0
     _METRICS_ENDPOINT_ERRORS = 0
+    with _endpoint_labels_lock:
+        _endpoint_labels.clear()
 
     if not PROMETHEUS_AVAILABLE:
         return
@@ -308,6 +450,8 @@ def reset_metrics_for_tests() -> None:
         REQUESTS_TOTAL.clear()  # type: ignore[attr-defined]
     if REQUEST_DURATION is not None:
         REQUEST_DURATION.clear()  # type: ignore[attr-defined]
+    if STAGE_DURATION is not None:
+        STAGE_DURATION.clear()  # type: ignore[attr-defined]
     if ERRORS_TOTAL is not None:
         ERRORS_TOTAL.clear()  # type: ignore[attr-defined]
     if LLM_CACHE_SIZE is not None:
@@ -323,7 +467,7 @@ def reset_metrics_for_tests() -> None:
     if EMBED_CACHE_MISSES is not None:
         EMBED_CACHE_MISSES._value.set(0)  # type: ignore[attr-defined]
     if STM_MESSAGES is not None:
-        STM_MESSAGES.clear()  # type: ignore[attr-defined]
+        STM_MESSAGES.set(0)
     if LTM_FACTS is not None:
         LTM_FACTS.set(0)
     if PSYCHE_MOOD is not None:
@@ -339,16 +483,26 @@ __all__ = [
     "registry",
     "REQUESTS_TOTAL",
     "REQUEST_DURATION",
+    "STAGE_DURATION",
     "ERRORS_TOTAL",
+    "endpoint_label",
     "record_request",
     "record_error",
     "increment_metrics_endpoint_requests",
     "record_llm_cache_hit",
     "record_llm_cache_miss",
     "update_llm_cache_size",
+    "record_llm_coalesced",
+    "record_llm_semantic_cache",
     "record_embed_cache_hit",
     "record_embed_cache_miss",
     "update_embed_cache_size",
+    "update_embed_cache_bytes",
+    "record_embed_batch",
+    "observe_embed_batch_wait",
+    "observe_llm_stream",
+    "observe_stage",
+    "time_stage",
     "export_metrics",
     "health_payload",
     "summary_stats",
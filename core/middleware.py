@@ -4,10 +4,14 @@
 Middleware Module - Cache & Rate Limiting
 """
 
+import sys
+import math
 import time
+import weakref
 import hashlib
 import threading
-from typing import Dict, Any, Optional
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 import json
 
@@ -29,76 +33,165 @@ class CacheStats:
     misses: int = 0
     size: int = 0
     max_size: int = 1000
+    bytes: int = 0
+    evictions: int = 0
+    expirations: int = 0
 
     @property
     def hit_rate(self) -> float:
         total = self.hits + self.misses
         return self.hits / total if total > 0 else 0.0
 
+def _estimate_size(value: Any) -> int:
+    """Przybliżony rozmiar wartości w bajtach (budżet pamięci cache)"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8', errors='ignore'))
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
 class SimpleCache:
-    """Prosty cache w pamięci z TTL"""
+    """
+    Cache w pamięci: LRU + TTL + budżet bajtów, operacje O(1) (zamortyzowane)
+
+    - self.cache (OrderedDict) trzyma kolejność LRU: get przesuwa klucz na koniec,
+      eviction zdejmuje z początku, gdy przekroczone max_size lub max_bytes
+    - TTL jest wspólny dla całego cache, więc kolejka wstawień jest zarazem
+      kolejką wygasania - sweep zdejmuje z jej początku tylko wygasłe wpisy
+    - wspólny wątek w tle wywołuje sweep_expired co CACHE_SWEEP_INTERVAL s
+    """
 
-    def __init__(self, max_size: int = 1000, ttl: int = 3600):
+    def __init__(self, max_size: int = 1000, ttl: int = 3600, max_bytes: Optional[int] = None):
         self.max_size = max_size
         self.ttl = ttl
-        self.cache: Dict[str, Dict[str, Any]] = {}
-        self.stats = CacheStats()
+        self.max_bytes = max_bytes
+        self.cache: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()  # key -> (value, expires_at, nbytes)
+        self._expiry: Deque[Tuple[float, str]] = deque()  # (expires_at, key) w kolejności wstawień
+        self._stats = CacheStats(max_size=max_size)
         self.lock = threading.Lock()
+        _register_cache(self)
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def _remove(self, key: str) -> None:
+        _, _, nbytes = self.cache.pop(key)
+        self._stats.bytes -= nbytes
 
     def get(self, key: str) -> Optional[Any]:
         with self.lock:
-            if key not in self.cache:
-                self.stats.misses += 1
+            entry = self.cache.get(key)
+            if entry is None:
+                self._stats.misses += 1
                 return None
 
-            entry = self.cache[key]
-            if time.time() - entry['timestamp'] > self.ttl:
-                del self.cache[key]
-                self.stats.misses += 1
+            value, expires_at, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self._stats.expirations += 1
+                self._stats.misses += 1
                 return None
 
-            self.stats.hits += 1
-            return entry['value']
+            self.cache.move_to_end(key)
+            self._stats.hits += 1
+            return value
 
     def put(self, key: str, value: Any) -> None:
+        nbytes = _estimate_size(value)
+        with self.lock:
+            if key in self.cache:
+                self._remove(key)
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return  # Większe niż cały budżet - nie wypychaj reszty
+
+            expires_at = time.time() + self.ttl
+            self.cache[key] = (value, expires_at, nbytes)
+            self._expiry.append((expires_at, key))
+            self._stats.bytes += nbytes
+
+            # Najdawniej używane wypadają pierwsze
+            while len(self.cache) > self.max_size or (
+                self.max_bytes is not None and self._stats.bytes > self.max_bytes
+            ):
+                oldest_key = next(iter(self.cache))
+                self._remove(oldest_key)
+                self._stats.evictions += 1
+
+            self._stats.size = len(self.cache)
+
+    def sweep_expired(self) -> int:
+        """Usuń wygasłe wpisy (wywoływane przez wątek w tle)"""
+        removed = 0
         with self.lock:
             now = time.time()
-
-            # Usuń stare wpisy jeśli cache pełny
-            if len(self.cache) >= self.max_size:
-                oldest_keys = sorted(
-                    self.cache.keys(),
-                    key=lambda k: self.cache[k]['timestamp']
-                )[:100]  # usuń 100 najstarszych
-                for old_key in oldest_keys:
-                    del self.cache[old_key]
-
-            self.cache[key] = {
-                'value': value,
-                'timestamp': now
-            }
-            self.stats.size = len(self.cache)
+            while self._expiry and self._expiry[0][0] <= now:
+                expires_at, key = self._expiry.popleft()
+                entry = self.cache.get(key)
+                # Wpis mógł zostać nadpisany później (nowszy expires_at) lub już usunięty
+                if entry is not None and entry[1] == expires_at:
+                    self._remove(key)
+                    removed += 1
+            if len(self._expiry) > 2 * len(self.cache) + 1000:
+                # Wpisy po eviction/nadpisaniu czekają w kolejce do wygaśnięcia - kompaktuj
+                self._expiry = deque((exp, k) for exp, k in self._expiry
+                                     if k in self.cache and self.cache[k][1] == exp)
+            self._stats.expirations += removed
+            self._stats.size = len(self.cache)
+        return removed
 
     def invalidate(self) -> None:
         with self.lock:
             self.cache.clear()
-            self.stats = CacheStats()
+            self._expiry.clear()
+            self._stats = CacheStats(max_size=self.max_size)
 
     def stats(self) -> Dict[str, Any]:
         with self.lock:
             return {
-                'hits': self.stats.hits,
-                'misses': self.stats.misses,
-                'hit_rate': self.stats.hit_rate,
-                'size': self.stats.size,
-                'max_size': self.max_size
+                'hits': self._stats.hits,
+                'misses': self._stats.misses,
+                'hit_rate': self._stats.hit_rate,
+                'size': len(self.cache),
+                'max_size': self.max_size,
+                'bytes': self._stats.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self._stats.evictions,
+                'expirations': self._stats.expirations,
+                'ttl': self.ttl
             }
 
+_caches: "weakref.WeakSet[SimpleCache]" = weakref.WeakSet()
+_sweeper_lock = threading.Lock()
+_sweeper_started = False
+
+def _sweep_loop() -> None:
+    while True:
+        time.sleep(CACHE_SWEEP_INTERVAL)
+        for cache in list(_caches):
+            try:
+                removed = cache.sweep_expired()
+                if removed and isinstance(cache, LLMCACHE):
+                    update_llm_cache_size(len(cache))
+            except Exception as e:
+                log_warning(f"Cache sweep failed: {e}", "MIDDLEWARE")
+
+def _register_cache(cache: SimpleCache) -> None:
+    """Dopisz cache do sweepu w tle (jeden wątek na proces, start przy pierwszym cache)"""
+    global _sweeper_started
+    _caches.add(cache)
+    with _sweeper_lock:
+        if not _sweeper_started and CACHE_SWEEP_INTERVAL > 0:
+            threading.Thread(target=_sweep_loop, name="cache-sweeper", daemon=True).start()
+            _sweeper_started = True
+
 class LLMCACHE(SimpleCache):
     """Cache dla odpowiedzi LLM"""
 
     def __init__(self):
-        super().__init__(max_size=1000, ttl=7200)  # 2h TTL dla LLM
+        super().__init__(max_size=1000, ttl=7200, max_bytes=LLM_CACHE_MAX_BYTES)  # 2h TTL dla LLM
 
     def make_key(self, messages: list, **kwargs) -> str:
         """Utwórz klucz cache na podstawie wiadomości i parametrów"""
@@ -129,7 +222,7 @@ class SearchCache(SimpleCache):
     """Cache dla wyników wyszukiwania"""
 
     def __init__(self):
-        super().__init__(max_size=500, ttl=3600)  # 1h TTL dla search
+        super().__init__(max_size=500, ttl=3600, max_bytes=SEARCH_CACHE_MAX_BYTES)  # 1h TTL dla search
 
     def make_key(self, query: str, engine: str = 'duckduckgo') -> str:
         """Utwórz klucz cache dla wyszukiwania"""
@@ -140,7 +233,7 @@ class GeneralCache(SimpleCache):
     """Ogólny cache dla różnych danych"""
 
     def __init__(self):
-        super().__init__(max_size=200, ttl=1800)  # 30min TTL
+        super().__init__(max_size=200, ttl=1800, max_bytes=GENERAL_CACHE_MAX_BYTES)  # 30min TTL
 
 # ═══════════════════════════════════════════════════════════════════
 # RATE LIMITER
@@ -148,95 +241,145 @@ class GeneralCache(SimpleCache):
 
 @dataclass
 class RateLimitEntry:
-    count: int = 0
-    window_start: float = 0.0
+    tat: float = 0.0           # Theoretical arrival time (GCRA)
+    last_call_ts: float = 0.0
 
-class RateLimiter:
-    """Rate limiter oparty na sliding window"""
+class _RateLimitShard:
+    """Część kluczy limitera z własnym lockiem; wygasłe wpisy sprzątane leniwie"""
+
+    __slots__ = ("entries", "lock", "next_sweep")
 
     def __init__(self):
+        self.entries: Dict[Tuple[str, str], RateLimitEntry] = {}
+        self.lock = threading.Lock()
+        self.next_sweep = 0.0
+
+# GCRA atomowo w Redis (czas serwera Redis - wspólny zegar dla wszystkich workerów)
+_GCRA_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local tat = tonumber(redis.call('HGET', KEYS[1], 'tat')) or now
+if tat < now then tat = now end
+local new_tat = tat + interval
+if new_tat - now > window then
+    return {0, tostring(tat - now)}
+end
+redis.call('HSET', KEYS[1], 'tat', tostring(new_tat), 'last', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((new_tat - now) * 1000))
+return {1, tostring(new_tat - now)}
+"""
+
+class RateLimiter:
+    """
+    Rate limiter GCRA (token bucket: `limit` żądań na `window` sekund, równomierne
+    odnawianie co window/limit)
+
+    Stan klucza to jedna liczba (TAT), więc sprawdzenie jest O(1). Klucze są
+    rozłożone na shardy z osobnymi lockami, a wygasłe wpisy shard sprząta sam
+    najwyżej raz na okno. Backend "redis" trzyma TAT w Redis (skrypt Lua),
+    żeby limity obowiązywały łącznie dla wszystkich workerów.
+    """
+
+    def __init__(self, backend: str = RATE_LIMIT_BACKEND, shards: int = RATE_LIMIT_SHARDS):
         self.limits = {
-            'default': {'limit': 160, 'window': 60},  # 160/min
+            'default': {'limit': RATE_LIMIT_PER_MINUTE, 'window': RATE_LIMIT_WINDOW},  # 160/min
             'chat': {'limit': 100, 'window': 60},     # 100/min dla chat
             'search': {'limit': 50, 'window': 60},    # 50/min dla search
             'admin': {'limit': 30, 'window': 60},     # 30/min dla admin
         }
-        self.requests: Dict[str, RateLimitEntry] = {}
-        self.lock = threading.Lock()
+        self._shards = [_RateLimitShard() for _ in range(max(1, shards))]
+        self.backend = backend
+        self._redis_script = None
+        if backend == "redis":
+            self._init_redis()
+
+    def _init_redis(self) -> None:
+        try:
+            from .redis_middleware import get_redis
+            client = getattr(get_redis(), "client", None)
+            if client is None:
+                raise RuntimeError("Redis niedostępny")
+            self._redis_script = client.register_script(_GCRA_LUA)
+            log_info("Rate limiter: Redis GCRA backend", "MIDDLEWARE")
+        except Exception as e:
+            log_warning(f"Rate limiter: Redis backend unavailable ({e}), using in-memory limits", "MIDDLEWARE")
+            self.backend = "memory"
+
+    def _config(self, endpoint_type: str) -> Tuple[int, float]:
+        config = self.limits.get(endpoint_type, self.limits['default'])
+        return config['limit'], float(config['window'])
+
+    def _shard(self, key: str, endpoint_type: str) -> _RateLimitShard:
+        return self._shards[hash((endpoint_type, key)) % len(self._shards)]
+
+    def _sweep(self, shard: _RateLimitShard, now: float, window: float) -> None:
+        # Wpis z TAT w przeszłości nie różni się od braku wpisu
+        if now >= shard.next_sweep:
+            shard.entries = {k: e for k, e in shard.entries.items() if e.tat > now}
+            shard.next_sweep = now + window
 
     def is_allowed(self, key: str, endpoint_type: str = 'default') -> bool:
         """Sprawdź czy request jest dozwolony"""
-        with self.lock:
+        limit, window = self._config(endpoint_type)
+        interval = window / limit
+
+        if self._redis_script is not None:
+            try:
+                allowed, _ = self._redis_script(keys=[f"rl:{endpoint_type}:{key}"], args=[interval, window])
+                return bool(int(allowed))
+            except Exception as e:
+                log_warning(f"Rate limiter Redis error, falling back to in-memory: {e}", "MIDDLEWARE")
+
+        shard = self._shard(key, endpoint_type)
+        with shard.lock:
             now = time.time()
+            self._sweep(shard, now, window)
 
-            # Pobierz konfigurację dla typu endpointu
-            config = self.limits.get(endpoint_type, self.limits['default'])
-            limit = config['limit']
-            window = config['window']
-
-            # Wyczyść stare wpisy
-            to_remove = []
-            for req_key, entry in self.requests.items():
-                if now - entry.window_start > window:
-                    to_remove.append(req_key)
-
-            for req_key in to_remove:
-                del self.requests[req_key]
-
-            # Sprawdź aktualne użycie
-            if key not in self.requests:
-                self.requests[key] = RateLimitEntry(count=1, window_start=now)
-                return True
-
-            entry = self.requests[key]
-
-            # Jeśli okno czasowe się skończyło, resetuj
-            if now - entry.window_start > window:
-                entry.count = 1
-                entry.window_start = now
-                return True
-
-            # Sprawdź limit
-            if entry.count >= limit:
+            entry = shard.entries.get((endpoint_type, key))
+            tat = max(entry.tat, now) if entry else now
+            if tat + interval - now > window:
                 return False
 
-            entry.count += 1
+            if entry is None:
+                entry = shard.entries[(endpoint_type, key)] = RateLimitEntry()
+            entry.tat = tat + interval
+            entry.last_call_ts = now
             return True
 
     def get_usage(self, key: str, endpoint_type: str = 'default') -> Dict[str, Any]:
         """Pobierz aktualne użycie dla użytkownika"""
-        with self.lock:
-            now = time.time()
-            config = self.limits.get(endpoint_type, self.limits['default'])
-
-            if key not in self.requests:
-                return {
-                    'count': 0,
-                    'limit': config['limit'],
-                    'window': config['window'],
-                    'remaining': config['limit'],
-                    'last_call_ts': 0
-                }
-
-            entry = self.requests[key]
-
-            # Jeśli okno się skończyło, zwróć 0
-            if now - entry.window_start > config['window']:
-                return {
-                    'count': 0,
-                    'limit': config['limit'],
-                    'window': config['window'],
-                    'remaining': config['limit'],
-                    'last_call_ts': 0
-                }
-
-            return {
-                'count': entry.count,
-                'limit': config['limit'],
-                'window': config['window'],
-                'remaining': max(0, config['limit'] - entry.count),
-                'last_call_ts': entry.window_start
-            }
+        limit, window = self._config(endpoint_type)
+        interval = window / limit
+        now = time.time()
+        tat, last_call_ts = now, 0
+
+        if self._redis_script is not None:
+            try:
+                from .redis_middleware import get_redis
+                stored = get_redis().client.hmget(f"rl:{endpoint_type}:{key}", "tat", "last")
+                if stored[0] is not None:
+                    # TAT liczone zegarem Redis - porównanie z lokalnym zegarem jest przybliżone
+                    tat, last_call_ts = float(stored[0]), float(stored[1] or 0)
+            except Exception as e:
+                log_warning(f"Rate limiter Redis usage error: {e}", "MIDDLEWARE")
+        else:
+            shard = self._shard(key, endpoint_type)
+            with shard.lock:
+                entry = shard.entries.get((endpoint_type, key))
+                if entry is not None:
+                    tat, last_call_ts = entry.tat, entry.last_call_ts
+
+        # Zużyte "tokeny" = ile odstępów interval pozostało do TAT
+        count = min(limit, max(0, math.ceil((tat - now) / interval - 1e-9)))
+        return {
+            'count': count,
+            'limit': limit,
+            'window': window,
+            'remaining': limit - count,
+            'last_call_ts': last_call_ts if count else 0
+        }
 
 # ═══════════════════════════════════════════════════════════════════
 # GLOBAL INSTANCES
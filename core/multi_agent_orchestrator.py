@@ -8,10 +8,19 @@ a główny „ego" wybiera najlepszą. Efekt: kreatywność + kontrola jakości
 
 Autor: Zaawansowany System Kognitywny MRD  
 Data: 15 października 2025
+
+Tryb strukturalny (MULTI_AGENT_STRUCTURED): agent zwraca odpowiedź, rozumowanie,
+alternatywy i słabości w jednym wywołaniu JSON, a krytyki wzajemne powstają
+w jednym wywołaniu zamiast N*(N-1). Porównanie z trybem klasycznym:
+    
+    python -m core.multi_agent_orchestrator bench [--agents 4] [--latency 0.2]
 """
 
+import argparse
 import asyncio
 import json
+import re
+import sys
 import time
 from datetime import datetime
 from typing import Dict, List, Any, Optional, Tuple, Set
@@ -23,8 +32,41 @@ import hashlib
 from .config import *
 from .llm import get_llm_client
 from .memory import get_memory_manager
-from .hierarchical_memory import get_hierarchical_memory
+from .hierarchical_memory import get_hierarchical_memory_system
 from .helpers import log_info, log_error, log_warning
+from .latency_budget import Deadline
+
+# Sekwencyjne rundy LLM pełnej sesji: agent (4) + debata (4) + synteza (1) + ewaluacja (2)
+SESSION_LLM_ROUNDS = 11
+AGENT_EXTRAS_LLM_ROUNDS = 3   # rozumowanie, alternatywy, błędy (po odpowiedzi agenta)
+DEBATE_LLM_ROUNDS = 4
+EVALUATION_LLM_ROUNDS = 2     # jakość syntezy + emergencja
+LOW_BUDGET_MAX_AGENTS = 3
+
+# Tryb strukturalny: agent (1) + debata (2: niezgody/krytyki/konsensus równolegle, podsumowanie)
+STRUCTURED_SESSION_LLM_ROUNDS = 6
+STRUCTURED_DEBATE_LLM_ROUNDS = 2
+MAX_CROSS_CRITIQUES = 10
+
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """Obiekt JSON z odpowiedzi LLM (toleruje bloki ```json i tekst wokół)"""
+    match = _JSON_OBJECT_RE.search(text or "")
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _str_list(value: Any, limit: int = 3) -> List[str]:
+    if not isinstance(value, list):
+        return []
+    return [str(item).strip() for item in value if str(item).strip()][:limit]
 
 class AgentRole(Enum):
     """Role wewnętrznych agentów"""
@@ -87,10 +129,16 @@ class MultiAgentOrchestrator:
     - Zapewnia kontrolę jakości przez krytyczne oceny
     """
     
-    def __init__(self):
-        self.llm_client = get_llm_client()
-        self.memory = get_memory_manager()
-        self.hierarchical_memory = get_hierarchical_memory()
+    def __init__(self, structured_output: Optional[bool] = None, llm_client: Any = None,
+                 memory: Any = None, hierarchical_memory: Any = None):
+        # Zależności można wstrzyknąć (benchmark, testy) - wtedy nie dotykamy bazy pamięci
+        self.llm_client = llm_client if llm_client is not None else get_llm_client()
+        self.memory = memory if memory is not None else get_memory_manager()
+        self.hierarchical_memory = (hierarchical_memory if hierarchical_memory is not None
+                                    else get_hierarchical_memory_system())
+        
+        # Jedno wywołanie JSON na agenta + krytyki w jednym wywołaniu
+        self.structured_output = MULTI_AGENT_STRUCTURED if structured_output is None else structured_output
         
         # Definicje agent-personas
         self.agent_personas = self._create_agent_personas()
@@ -219,7 +267,8 @@ class MultiAgentOrchestrator:
         query: str, 
         context: Dict[str, Any] = None,
         active_agents: List[AgentRole] = None,
-        consensus_method: str = "weighted_synthesis"
+        consensus_method: str = "weighted_synthesis",
+        deadline: Optional[Deadline] = None
     ) -> ConsensusResult:
         """
         Przeprowadź wieloagentową sesję generowania odpowiedzi
@@ -229,6 +278,8 @@ class MultiAgentOrchestrator:
             context: Dodatkowy kontekst
             active_agents: Lista aktywnych agentów (None = wszystkie)
             consensus_method: Metoda osiągania konsensusu
+            deadline: Budżet czasu żądania - przy niskim budżecie mniej agentów,
+                      bez dodatkowych analiz, debaty i ewaluacji (synteza zawsze)
             
         Returns:
             ConsensusResult: Wynik konsensusu z finalną odpowiedzią
@@ -240,15 +291,25 @@ class MultiAgentOrchestrator:
         if active_agents is None:
             active_agents = list(AgentRole)
         
+        session_rounds = STRUCTURED_SESSION_LLM_ROUNDS if self.structured_output else SESSION_LLM_ROUNDS
+        debate_rounds = STRUCTURED_DEBATE_LLM_ROUNDS if self.structured_output else DEBATE_LLM_ROUNDS
+        
+        if deadline is not None and not deadline.fits(session_rounds) and len(active_agents) > LOW_BUDGET_MAX_AGENTS:
+            # Najlepiej oceniani agenci (wagi uczą się z poprzednich sesji)
+            active_agents = sorted(active_agents, key=lambda role: self.agent_weights[role], reverse=True)[:LOW_BUDGET_MAX_AGENTS]
+        
         try:
             log_info(f"[MULTI_AGENT] Rozpoczynam sesję z {len(active_agents)} agentami")
             start_time = time.time()
             
             # FAZA 1: Generacja odpowiedzi od każdego agenta
-            agent_responses = await self._collect_agent_responses(query, context, active_agents)
+            agent_responses = await self._collect_agent_responses(query, context, active_agents, deadline)
             
-            # FAZA 2: Wewnętrzna debata między agentami
-            debate_results = await self._conduct_agent_debate(agent_responses, query)
+            # FAZA 2: Wewnętrzna debata między agentami (debata + synteza muszą się zmieścić)
+            if deadline is None or deadline.fits(debate_rounds + 1):
+                debate_results = await self._conduct_agent_debate(agent_responses, query)
+            else:
+                debate_results = {"debate_summary": "Debata pominięta (budżet czasu)"}
             
             # FAZA 3: Synteza konsensusu
             consensus = await self._synthesize_consensus(
@@ -256,10 +317,11 @@ class MultiAgentOrchestrator:
             )
             
             # FAZA 4: Ewaluacja jakości i emergencji
-            consensus.synthesis_quality = await self._evaluate_synthesis_quality(consensus)
-            consensus.emergence_level = await self._detect_emergence_level(
-                agent_responses, consensus.final_response
-            )
+            if deadline is None or deadline.fits(EVALUATION_LLM_ROUNDS):
+                consensus.synthesis_quality = await self._evaluate_synthesis_quality(consensus)
+                consensus.emergence_level = await self._detect_emergence_level(
+                    agent_responses, consensus.final_response
+                )
             
             # FAZA 5: Aktualizacja wag agentów na podstawie performance
             await self._update_agent_weights(agent_responses, consensus)
@@ -312,7 +374,8 @@ class MultiAgentOrchestrator:
         self, 
         query: str, 
         context: Dict[str, Any], 
-        active_agents: List[AgentRole]
+        active_agents: List[AgentRole],
+        deadline: Optional[Deadline] = None
     ) -> List[AgentResponse]:
         """Zbierz odpowiedzi od wszystkich aktywnych agentów"""
         
@@ -321,7 +384,7 @@ class MultiAgentOrchestrator:
         # Generuj odpowiedzi równolegle dla wydajności
         tasks = []
         for role in active_agents:
-            task = self._generate_agent_response(role, query, context)
+            task = self._generate_agent_response(role, query, context, deadline)
             tasks.append(task)
         
         responses = await asyncio.gather(*tasks, return_exceptions=True)
@@ -340,9 +403,10 @@ class MultiAgentOrchestrator:
         self, 
         role: AgentRole, 
         query: str, 
-        context: Dict[str, Any]
+        context: Dict[str, Any],
+        deadline: Optional[Deadline] = None
     ) -> AgentResponse:
-        """Wygeneruj odpowiedź dla konkretnego agenta"""
+        """Wygeneruj odpowiedź dla konkretnego agenta (analizy dodatkowe tylko gdy starcza budżetu)"""
         
         persona = self.agent_personas[role]
         start_time = time.time()
@@ -373,19 +437,29 @@ class MultiAgentOrchestrator:
             # Generuj odpowiedź z personalnym systemem prompt
             system_prompt = f"Jesteś {persona.name}. " + persona.description + f" Zawsze zachowujesz się zgodnie ze swoją rolą {role.value}."
             
-            response_content = await self.llm_client.chat_completion([
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": agent_prompt}
-            ])
-            
-            # Generuj proces rozumowania
-            reasoning = await self._generate_agent_reasoning(persona, query, response_content)
-            
-            # Identyfikuj alternatywne perspektywy
-            alternatives = await self._identify_alternative_perspectives(persona, response_content)
+            if self.structured_output:
+                response_content, reasoning, alternatives, flaws = await self._generate_structured_agent_response(
+                    persona, system_prompt, agent_prompt
+                )
+            else:
+                response_content = await self.llm_client.chat_completion([
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": agent_prompt}
+                ])
+                reasoning, alternatives, flaws = "", [], []
             
-            # Znajdź potencjalne błędy
-            flaws = await self._identify_potential_flaws(persona, response_content)
+            # Debata, synteza i ewaluacja też muszą się zmieścić po analizach agenta
+            if not self.structured_output and (
+                deadline is None or deadline.fits(AGENT_EXTRAS_LLM_ROUNDS + DEBATE_LLM_ROUNDS + 1 + EVALUATION_LLM_ROUNDS)
+            ):
+                # Generuj proces rozumowania
+                reasoning = await self._generate_agent_reasoning(persona, query, response_content)
+                
+                # Identyfikuj alternatywne perspektywy
+                alternatives = await self._identify_alternative_perspectives(persona, response_content)
+                
+                # Znajdź potencjalne błędy
+                flaws = await self._identify_potential_flaws(persona, response_content)
             
             # Oblicz score pewności i kreatywności
             confidence_score = self._calculate_agent_confidence(persona, response_content, context)
@@ -420,6 +494,42 @@ class MultiAgentOrchestrator:
                 processing_time=time.time() - start_time
             )
     
+    async def _generate_structured_agent_response(
+        self,
+        persona: AgentPersona,
+        system_prompt: str,
+        agent_prompt: str
+    ) -> Tuple[str, str, List[str], List[str]]:
+        """Odpowiedź, rozumowanie, alternatywy i słabości agenta w jednym wywołaniu JSON"""
+        
+        structured_prompt = agent_prompt + f"""
+        Zwróć WYŁĄCZNIE obiekt JSON:
+        {{
+            "answer": "twoja odpowiedź (200-400 słów)",
+            "reasoning": "2-3 zdania: jak doszedłeś do odpowiedzi (styl: {persona.thinking_style})",
+            "alternatives": ["2-3 alternatywne podejścia, które zauważasz (choć niekoniecznie popierasz)"],
+            "flaws": ["potencjalne słabości odpowiedzi (twoje ograniczenia: {', '.join(persona.weakness_areas)})"]
+        }}
+        """
+        
+        raw = await self.llm_client.chat_completion([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": structured_prompt}
+        ])
+        
+        data = _parse_json_object(raw)
+        if not data or not str(data.get("answer", "")).strip():
+            # Model zignorował format - cały tekst to odpowiedź, bez dodatkowych wywołań
+            log_warning(f"[MULTI_AGENT] {persona.name}: odpowiedź bez poprawnego JSON")
+            return raw, "", [], []
+        
+        return (
+            str(data["answer"]).strip(),
+            str(data.get("reasoning", "")).strip(),
+            _str_list(data.get("alternatives")),
+            _str_list(data.get("flaws"))
+        )
+    
     async def _generate_agent_reasoning(
         self, 
         persona: AgentPersona, 
@@ -583,6 +693,23 @@ class MultiAgentOrchestrator:
         if len(agent_responses) < 2:
             return {"debate_summary": "Za mało agentów do debaty"}
         
+        if self.structured_output:
+            # Niezgody, krytyki (jedno wywołanie) i konsensus są niezależne - jedna runda
+            disagreements, cross_critiques, consensus_areas = await asyncio.gather(
+                self._identify_disagreements(agent_responses),
+                self._conduct_batched_critiques(agent_responses),
+                self._find_consensus_areas(agent_responses)
+            )
+            debate_summary = await self._summarize_debate(
+                agent_responses, disagreements, cross_critiques, consensus_areas, original_query
+            )
+            return {
+                "disagreements": disagreements,
+                "cross_critiques": cross_critiques,
+                "consensus_areas": consensus_areas,
+                "debate_summary": debate_summary
+            }
+        
         # Znajdź główne punkty niezgody
         disagreements = await self._identify_disagreements(agent_responses)
         
@@ -654,6 +781,53 @@ class MultiAgentOrchestrator:
         
         return critiques[:10]  # Ogranicz do 10 najważniejszych krytyk
     
+    async def _conduct_batched_critiques(self, agent_responses: List[AgentResponse]) -> List[str]:
+        """Wszystkie krytyki wzajemne w jednym wywołaniu (każde stanowisko w prompcie raz)"""
+        
+        positions = "\n\n".join(
+            f"{resp.agent_name} ({resp.agent_role.value}): {resp.response_content}"
+            for resp in agent_responses
+        )
+        names = [resp.agent_name for resp in agent_responses]
+        
+        critiques_prompt = f"""
+        Stanowiska agentów:
+        
+        {positions}
+        
+        Każdy agent komentuje stanowiska pozostałych z perspektywy swojej roli:
+        krótka (2-3 zdania) konstruktywna krytyka lub komentarz.
+        Wybierz najważniejsze pary (maksymalnie {MAX_CROSS_CRITIQUES}).
+        
+        Zwróć WYŁĄCZNIE obiekt JSON:
+        {{"critiques": [{{"critic": "nazwa agenta", "target": "nazwa agenta", "critique": "tekst"}}]}}
+        """
+        
+        try:
+            raw = await self.llm_client.chat_completion([{
+                "role": "system",
+                "content": "Prowadzisz rundę krytyki wzajemnej agentów: " + ", ".join(names) + "."
+            }, {
+                "role": "user",
+                "content": critiques_prompt
+            }])
+            
+            data = _parse_json_object(raw) or {}
+            critiques = []
+            for item in data.get("critiques", []):
+                if not isinstance(item, dict):
+                    continue
+                critic, target = item.get("critic"), item.get("target")
+                critique = str(item.get("critique", "")).strip()
+                if critique and critic != target:
+                    critiques.append(f"{critic} → {target}: {critique}")
+            
+            return critiques[:MAX_CROSS_CRITIQUES]
+        
+        except Exception as e:
+            log_warning(f"[MULTI_AGENT] Błąd krytyk wzajemnych: {e}")
+            return []
+    
     async def _generate_cross_critique(
         self, 
         critic: AgentResponse, 
@@ -1052,8 +1226,74 @@ async def multi_agent_response(
         query, context, active_agents, method
     )
 
+class _CountingLLMClient:
+    """Symulowany LLM do benchmarku: stała latencja, liczy wywołania i tokeny (~4 znaki/token)"""
+    
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+    
+    async def chat_completion(self, messages: List[dict], **opts) -> str:
+        await asyncio.sleep(self.latency_s)
+        prompt = " ".join(m.get("content", "") for m in messages)
+        if '"critiques"' in prompt:
+            reply = json.dumps({"critiques": [
+                {"critic": "A", "target": "B", "critique": "Brakuje danych. " * 8}
+            ] * 6}, ensure_ascii=False)
+        elif '"answer"' in prompt:
+            reply = json.dumps({
+                "answer": "Odpowiedź agenta z argumentami. " * 40,
+                "reasoning": "Rozumowanie krok po kroku. " * 4,
+                "alternatives": ["Alternatywne podejście. " * 3] * 3,
+                "flaws": ["Możliwa słabość. " * 3] * 2
+            }, ensure_ascii=False)
+        elif "liczbę" in prompt:
+            reply = "0.7"
+        else:
+            reply = "• Punkt wypowiedzi modelu. " * 15
+        self.calls += 1
+        self.prompt_tokens += len(prompt) // 4
+        self.completion_tokens += len(reply) // 4
+        return reply
+
+
+class _BenchMemory:
+    """Atrapa pamięci do benchmarku: bez bazy, bez zapisów w mem.db"""
+
+async def benchmark(agents: int = 4, latency_s: float = 0.2) -> List[Dict[str, Any]]:
+    """Wywołania LLM, tokeny i czas sesji: tryb klasyczny vs strukturalny (symulowany LLM i pamięć)"""
+    roles = list(AgentRole)[:agents]
+    rows = []
+    for structured in (False, True):
+        client = _CountingLLMClient(latency_s)
+        orchestrator = MultiAgentOrchestrator(structured_output=structured, llm_client=client,
+                                              memory=_BenchMemory(), hierarchical_memory=_BenchMemory())
+        started = time.perf_counter()
+        await orchestrator.orchestrate_multi_agent_response("Czy praca zdalna zwiększa produktywność?",
+                                                            {"topic": "praca"}, roles)
+        rows.append({
+            "mode": "structured" if structured else "classic",
+            "llm_calls": client.calls,
+            "prompt_tokens": client.prompt_tokens,
+            "completion_tokens": client.completion_tokens,
+            "wall_s": round(time.perf_counter() - started, 2),
+        })
+    return rows
+
+
 # Test funkcji
-if __name__ == "__main__":
+if __name__ == "__main__" and sys.argv[1:2] == ["bench"]:
+    parser = argparse.ArgumentParser(prog="python -m core.multi_agent_orchestrator bench")
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="Symulowana latencja wywołania LLM [s]")
+    args = parser.parse_args(sys.argv[2:])
+    print(f"{'mode':<12}{'llm calls':>10}{'prompt tok':>12}{'compl tok':>11}{'wall s':>8}")
+    for row in asyncio.run(benchmark(args.agents, args.latency)):
+        print(f"{row['mode']:<12}{row['llm_calls']:>10}{row['prompt_tokens']:>12}"
+              f"{row['completion_tokens']:>11}{row['wall_s']:>8}")
+elif __name__ == "__main__":
     async def test_multi_agent():
         """Test systemu wieloagentowego"""
         
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+page_cache.py - On-disk cache of scraped pages with conditional revalidation
+
+Used by research._http_text. One SQLite row per canonical URL holds the
+zlib-compressed body, the extraction result (title, text, published date)
+and the validators (ETag / Last-Modified) of the last 200 response:
+
+    fresh  (age < max-age of the domain policy) -> served without a request
+    stale  -> conditional GET (If-None-Match / If-Modified-Since); a 304
+              refreshes fetched_at and reuses the stored extraction
+
+The file is shared by every uvicorn worker (WAL). Total size is bounded by
+PAGE_CACHE_MAX_BYTES; least recently used pages are evicted first.
+"""
+
+import os
+import time
+import zlib
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from .helpers import log_info, log_warning
+
+
+EVICT_EVERY_PUTS = 32  # Size check (SUM over the table) runs once per this many writes
+
+
+@dataclass
+class CachedPage:
+    url: str
+    title: str
+    text: str
+    published: Optional[str]  # ISO-8601
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+    body_z: bytes
+
+    def html(self) -> str:
+        return zlib.decompress(self.body_z).decode("utf-8", errors="replace") if self.body_z else ""
+
+    def published_dt(self) -> Optional[datetime]:
+        try:
+            return datetime.fromisoformat(self.published) if self.published else None
+        except ValueError:
+            return None
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+
+class PageCache:
+    """SQLite page store + per-domain freshness policy"""
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024,
+                 freshness: Optional[Dict[str, int]] = None, default_max_age: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.freshness = dict(freshness or {})
+        self.default_max_age = default_max_age
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()  # record() is called on the event loop, never waits for SQLite
+        self._puts = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                title TEXT,
+                text TEXT,
+                published TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                body_z BLOB,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages(accessed_at)")
+
+    def max_age_for(self, domain: str, default: Optional[int] = None) -> int:
+        """Freshness [s] of the most specific matching domain suffix (en.wikipedia.org -> wikipedia.org)"""
+        domain = (domain or "").lower()
+        best = None
+        for suffix, max_age in self.freshness.items():
+            if (domain == suffix or domain.endswith("." + suffix)) and (best is None or len(suffix) > len(best[0])):
+                best = (suffix, max_age)
+        if best is not None:
+            return best[1]
+        return self.default_max_age if default is None else default
+
+    @staticmethod
+    def conditional_headers(page: CachedPage) -> Dict[str, str]:
+        headers = {}
+        if page.etag:
+            headers["If-None-Match"] = page.etag
+        if page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, title, text, published, etag, last_modified, fetched_at, body_z "
+                "FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+        return CachedPage(*row)
+
+    def record(self, outcome: str) -> None:
+        """Count a lookup outcome: hit (fresh) | revalidated (304) | miss (full download)"""
+        with self._stats_lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "revalidated":
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def put(self, url: str, body: bytes, title: str, text: str, published: Optional[datetime],
+            etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        body_z = zlib.compress(body or b"", 6)
+        size = len(body_z) + len((text or "").encode("utf-8")) + len(title or "")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, title, text, published, etag, last_modified, "
+                "fetched_at, accessed_at, body_z, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, title or "", text or "", published.isoformat() if published else None,
+                 etag, last_modified, now, now, body_z, size)
+            )
+            self._puts += 1
+            if self._puts % EVICT_EVERY_PUTS == 0:
+                self._evict()
+
+    def touch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """Revalidated (304): page is fresh again, server may have sent new validators"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ?, accessed_at = ?, etag = COALESCE(?, etag), "
+                "last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (now, now, etag, last_modified, url)
+            )
+
+    def _evict(self) -> None:
+        """Drop least recently used pages until total size is under 90% of the budget"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for url, size in self._conn.execute("SELECT url, size FROM pages ORDER BY accessed_at"):
+            if total <= target:
+                break
+            doomed.append((url,))
+            total -= size
+        self._conn.executemany("DELETE FROM pages WHERE url = ?", doomed)
+        self.evictions += len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+            lookups = self.hits + self.revalidated + self.misses
+            return {
+                "pages": count,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.revalidated) / max(1, lookups),
+                "path": self.path,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_page_cache() -> Optional[PageCache]:
+    """Build cache from config (None when disabled or the file cannot be opened)"""
+    from .config import (
+        PAGE_CACHE_ENABLED, PAGE_CACHE_PATH, PAGE_CACHE_MAX_BYTES,
+        PAGE_CACHE_FRESHNESS, PAGE_CACHE_DEFAULT_MAX_AGE
+    )
+
+    if not PAGE_CACHE_ENABLED:
+        return None
+    try:
+        cache = PageCache(PAGE_CACHE_PATH, max_bytes=PAGE_CACHE_MAX_BYTES,
+                          freshness=PAGE_CACHE_FRESHNESS, default_max_age=PAGE_CACHE_DEFAULT_MAX_AGE)
+        log_info(f"Page cache at {PAGE_CACHE_PATH}", "PAGE_CACHE")
+        return cache
+    except Exception as e:
+        log_warning(f"Page cache disabled: {e}", "PAGE_CACHE")
+        return None
@@ -13,7 +13,7 @@ import logging
 from typing import List, Dict, Any, Callable, TypeVar, Awaitable, Optional, Union, Tuple
 from collections import deque
 
-from .config import MAX_CONCURRENCY, PARALLEL_TIMEOUT, PRIORITY_LEVELS
+from .config import MAX_CONCURRENCY, PARALLEL_TIMEOUT, PARALLEL_QUEUE_SIZE, PRIORITY_LEVELS
 from .helpers import log_info, log_warning, log_error
 
 # Generyczny typ dla funkcji
@@ -24,39 +24,66 @@ R = TypeVar('R')
 # ASYNCHRONICZNA PULA ZADAŃ Z PRIORYTETAMI
 # ═══════════════════════════════════════════════════════════════════
 
+def _percentile(samples, q: float) -> float:
+    """Percentyl (nearest-rank) z próbek; 0.0 gdy brak danych"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
 class AsyncTaskPool:
     """
     Zaawansowana pula zadań asynchronicznych z obsługą priorytetów i limitem współbieżności
+    
+    - do max_workers zadań wykonuje się równolegle (dispatcher nie czeka na zadanie)
+    - ścisła kolejność priorytetów: wolny slot zawsze dostaje zadanie z najniższym
+      numerem priorytetu, w obrębie priorytetu FIFO
+    - timeout per zadanie, anulowanie przez Future.cancel() (w kolejce lub w trakcie)
+    - ograniczona kolejka: submit/schedule czekają na miejsce (backpressure)
     """
     
-    def __init__(self, max_workers: int = MAX_CONCURRENCY):
+    SAMPLE_WINDOW = 1000  # Liczba ostatnich pomiarów per priorytet dla p50/p95
+    
+    def __init__(self, max_workers: int = MAX_CONCURRENCY, max_queue_size: int = PARALLEL_QUEUE_SIZE):
         """Inicjalizuje pulę zadań z maksymalną liczbą równoległych zadań"""
         self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
         self.active_tasks = 0
-        self.semaphore = asyncio.Semaphore(max_workers)
         self.task_queues = {priority: deque() for priority in range(PRIORITY_LEVELS)}
-        self.event = asyncio.Event()
         self.running = False
         self.processor_task = None
+        self._loop = None
+        self._running_tasks = set()
+        self._wait_samples = {priority: deque(maxlen=self.SAMPLE_WINDOW) for priority in range(PRIORITY_LEVELS)}
+        self._run_samples = {priority: deque(maxlen=self.SAMPLE_WINDOW) for priority in range(PRIORITY_LEVELS)}
         self._stats = {
             "submitted": 0,
             "completed": 0,
             "failed": 0,
+            "timed_out": 0,
+            "cancelled": 0,
             "avg_wait_time": 0.0,
             "avg_process_time": 0.0,
         }
     
     async def start(self):
-        """Uruchamia przetwarzanie zadań"""
-        if self.running:
+        """Uruchamia przetwarzanie zadań (w bieżącej pętli zdarzeń)"""
+        loop = asyncio.get_running_loop()
+        if self.running and self._loop is loop:
             return
-            
+        
+        # Prymitywy asyncio są związane z pętlą - twórz je przy (re)starcie
+        self._loop = loop
+        self.semaphore = asyncio.Semaphore(self.max_workers)
+        self.event = asyncio.Event()
+        self._space = asyncio.Condition()
         self.running = True
         self.processor_task = asyncio.create_task(self._process_queue())
-        log_info(f"AsyncTaskPool uruchomiony (max_workers={self.max_workers})", "PARALLEL")
+        log_info(f"AsyncTaskPool uruchomiony (max_workers={self.max_workers}, max_queue={self.max_queue_size})", "PARALLEL")
         
     async def stop(self):
-        """Zatrzymuje przetwarzanie zadań"""
+        """Zatrzymuje przetwarzanie: anuluje zadania w kolejce, czeka na uruchomione"""
         if not self.running:
             return
             
@@ -65,12 +92,44 @@ class AsyncTaskPool:
             self.event.set()  # Obudź procesor kolejki
             await self.processor_task
             self.processor_task = None
+        
+        for queue in self.task_queues.values():
+            while queue:
+                queue.popleft()[3].cancel()
+                self._stats["cancelled"] += 1
+        if self._running_tasks:
+            await asyncio.gather(*self._running_tasks, return_exceptions=True)
         log_info("AsyncTaskPool zatrzymany", "PARALLEL")
     
+    def _pending(self) -> int:
+        return sum(len(q) for q in self.task_queues.values())
+    
+    async def schedule(self, func: Callable[..., Awaitable[T]], *args,
+                       priority: int = 1, timeout: float = PARALLEL_TIMEOUT, **kwargs) -> "asyncio.Future[T]":
+        """
+        Dodaje zadanie do kolejki i zwraca Future (bez czekania na wynik)
+        
+        Czeka, jeśli kolejka jest pełna. future.cancel() usuwa zadanie z kolejki
+        albo przerywa je, jeśli już się wykonuje.
+        """
+        await self.start()
+            
+        priority = max(0, min(PRIORITY_LEVELS - 1, priority))
+        
+        # Backpressure - czekaj na miejsce w kolejce
+        async with self._space:
+            await self._space.wait_for(lambda: self._pending() < self.max_queue_size)
+        
+        task_future = self._loop.create_future()
+        self._stats["submitted"] += 1
+        self.task_queues[priority].append((func, args, kwargs, task_future, time.perf_counter(), timeout, priority))
+        self.event.set()  # Powiadom procesor o nowym zadaniu
+        return task_future
+    
     async def submit(self, func: Callable[..., Awaitable[T]], *args, 
                      priority: int = 1, timeout: float = PARALLEL_TIMEOUT, **kwargs) -> T:
         """
-        Dodaje zadanie do puli z określonym priorytetem
+        Dodaje zadanie do puli z określonym priorytetem i czeka na wynik
         
         Args:
             func: Funkcja asynchroniczna do wykonania
@@ -82,67 +141,96 @@ class AsyncTaskPool:
         Returns:
             Wynik funkcji
         """
-        if not self.running:
-            await self.start()
-            
-        priority = max(0, min(PRIORITY_LEVELS - 1, priority))
-        task_future = asyncio.Future()
-        submit_time = time.time()
-        
-        self._stats["submitted"] += 1
-        self.task_queues[priority].append((func, args, kwargs, task_future, submit_time, timeout))
-        self.event.set()  # Powiadom procesor o nowym zadaniu
-        
-        return await task_future
+        task_future = await self.schedule(func, *args, priority=priority, timeout=timeout, **kwargs)
+        try:
+            return await asyncio.shield(task_future)
+        except asyncio.CancelledError:
+            task_future.cancel()  # Wywołujący anulowany -> anuluj zadanie w puli
+            raise
+    
+    def _next_task(self):
+        """Zdejmij zadanie o najwyższym priorytecie (pomija anulowane w kolejce)"""
+        for priority in range(PRIORITY_LEVELS):
+            queue = self.task_queues[priority]
+            while queue:
+                item = queue.popleft()
+                if item[3].cancelled():
+                    self._stats["cancelled"] += 1
+                    continue
+                return item
+        return None
     
     async def _process_queue(self):
-        """Główna pętla przetwarzania kolejki zadań"""
+        """Dispatcher: zajmij slot, wybierz zadanie o najwyższym priorytecie, uruchom w tle"""
         while self.running:
-            # Sprawdź czy są zadania w kolejce
-            task_found = False
-            
-            # Sprawdź zadania według priorytetu
-            for priority in range(PRIORITY_LEVELS):
-                if self.task_queues[priority]:
-                    task_found = True
-                    
-                    # Czekaj na dostępny slot
-                    async with self.semaphore:
-                        self.active_tasks += 1
-                        try:
-                            func, args, kwargs, future, submit_time, timeout = self.task_queues[priority].popleft()
-                            
-                            # Uruchom zadanie
-                            wait_time = time.time() - submit_time
-                            self._update_wait_stats(wait_time)
-                            
-                            start_time = time.time()
-                            try:
-                                result = await asyncio.wait_for(func(*args, **kwargs), timeout)
-                                future.set_result(result)
-                                self._stats["completed"] += 1
-                            except asyncio.TimeoutError:
-                                future.set_exception(TimeoutError(f"Zadanie przekroczyło timeout {timeout}s"))
-                                log_warning(f"Zadanie {func.__name__} przekroczyło timeout {timeout}s", "PARALLEL")
-                                self._stats["failed"] += 1
-                            except Exception as e:
-                                future.set_exception(e)
-                                log_error(e, f"PARALLEL_{func.__name__}")
-                                self._stats["failed"] += 1
-                            finally:
-                                self._update_process_stats(time.time() - start_time)
-                        finally:
-                            self.active_tasks -= 1
-                    
-                    break  # Przetworzono zadanie, wróć do najwyższego priorytetu
-            
-            # Jeśli nie ma zadań, czekaj na powiadomienie
-            if not task_found:
+            await self.semaphore.acquire()
+            item = None
+            while self.running:
+                item = self._next_task()
+                if item is not None:
+                    break
+                async with self._space:
+                    self._space.notify_all()  # Anulowane zadania mogły zwolnić miejsce
                 self.event.clear()
                 try:
                     await asyncio.wait_for(self.event.wait(), 1.0)
                 except asyncio.TimeoutError:
                     pass  # Okresowe budzenie do sprawdzenia warunków
+            
+            if item is None:
+                self.semaphore.release()
+                break
+            
+            async with self._space:
+                self._space.notify_all()  # Zwolniło się miejsce w kolejce
+            
+            self.active_tasks += 1
+            task = asyncio.create_task(self._run_task(item))
+            self._running_tasks.add(task)
+            task.add_done_callback(self._running_tasks.discard)
+    
+    async def _run_task(self, item):
+        """Wykonaj pojedyncze zadanie z timeoutem; zwalnia slot po zakończeniu"""
+        func, args, kwargs, future, submit_time, timeout, priority = item
+        start_time = time.perf_counter()
+        wait_time = start_time - submit_time
+        self._update_wait_stats(wait_time)
+        self._wait_samples[priority].append(wait_time)
+        
+        current = asyncio.current_task()
+        
+        def cancel_on_abort(fut):
+            if fut.cancelled():
+                current.cancel()  # Wywołujący anulował zadanie w trakcie wykonania
+        
+        future.add_done_callback(cancel_on_abort)
+        
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+            if not future.done():
+                future.set_result(result)
+            self._stats["completed"] += 1
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.set_exception(TimeoutError(f"Zadanie przekroczyło timeout {timeout}s"))
+            log_warning(f"Zadanie {func.__name__} przekroczyło timeout {timeout}s", "PARALLEL")
+            self._stats["failed"] += 1
+            self._stats["timed_out"] += 1
+        except asyncio.CancelledError:
+            future.cancel()
+            self._stats["cancelled"] += 1
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            log_error(e, f"PARALLEL_{func.__name__}")
+            self._stats["failed"] += 1
+        finally:
+            future.remove_done_callback(cancel_on_abort)
+            run_time = time.perf_counter() - start_time
+            self._update_process_stats(run_time)
+            self._run_samples[priority].append(run_time)
+            self.active_tasks -= 1
+            self.semaphore.release()
     
     def _update_wait_stats(self, wait_time: float):
         """Aktualizuje statystyki czasu oczekiwania"""
@@ -163,11 +251,22 @@ class AsyncTaskPool:
             self._stats["avg_process_time"] = process_time
     
     def get_stats(self) -> Dict[str, Any]:
-        """Zwraca statystyki puli zadań"""
+        """Zwraca statystyki puli zadań (z głębokością kolejki i p50/p95 per priorytet)"""
         stats = dict(self._stats)
         stats["active"] = self.active_tasks
-        stats["pending"] = sum(len(q) for q in self.task_queues.values())
+        stats["pending"] = self._pending()
+        stats["max_queue_size"] = self.max_queue_size
         stats["utilization"] = self.active_tasks / self.max_workers if self.max_workers > 0 else 0
+        stats["priorities"] = {
+            priority: {
+                "queued": len(self.task_queues[priority]),
+                "wait_p50": _percentile(self._wait_samples[priority], 0.50),
+                "wait_p95": _percentile(self._wait_samples[priority], 0.95),
+                "run_p50": _percentile(self._run_samples[priority], 0.50),
+                "run_p95": _percentile(self._run_samples[priority], 0.95),
+            }
+            for priority in range(PRIORITY_LEVELS)
+        }
         return stats
 
 
@@ -253,6 +352,70 @@ async def priority_parallel_map(func: Callable[[T], Awaitable[R]], items: List[T
         
     return results
 
+async def run_stage_dag(stages: Dict[str, Tuple[Tuple[str, ...], Callable[..., Awaitable[Any]]]],
+                        timings: Optional[Dict[str, float]] = None,
+                        concurrent: bool = True) -> Dict[str, Any]:
+    """
+    Wykonuje etapy jako DAG - etap startuje, gdy tylko skończą się jego zależności
+    
+    Args:
+        stages: nazwa -> (zależności, funkcja async); funkcja dostaje wyniki
+                zależności jako kwargs (nazwa etapu -> wynik)
+        timings: słownik uzupełniany o "<nazwa>_time" (czas samego etapu, bez czekania)
+        concurrent: False = etapy po kolei w porządku topologicznym
+        
+    Returns:
+        Słownik nazwa -> wynik etapu (wyjątek etapu anuluje pozostałe i propaguje)
+    """
+    # Porządek topologiczny (Kahn) - wykrywa cykle i nieznane zależności
+    remaining = {name: set(deps) for name, (deps, _) in stages.items()}
+    for name, deps in remaining.items():
+        unknown = deps - stages.keys()
+        if unknown:
+            raise ValueError(f"Etap {name} zależy od nieznanych etapów: {sorted(unknown)}")
+    order = []
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Cykl w zależnościach etapów: {sorted(remaining)}")
+        for name in ready:
+            order.append(name)
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    
+    results: Dict[str, Any] = {}
+    
+    async def run(name: str, dep_results: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        result = await stages[name][1](**dep_results)
+        if timings is not None:
+            timings[f"{name}_time"] = time.perf_counter() - started
+        return result
+    
+    if not concurrent:
+        for name in order:
+            results[name] = await run(name, {dep: results[dep] for dep in stages[name][0]})
+        return results
+    
+    tasks: Dict[str, asyncio.Task] = {}
+    
+    async def run_after_deps(name: str) -> Any:
+        deps = stages[name][0]
+        dep_values = await asyncio.gather(*(tasks[dep] for dep in deps))
+        return await run(name, dict(zip(deps, dep_values)))
+    
+    for name in order:
+        tasks[name] = asyncio.create_task(run_after_deps(name))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return {name: task.result() for name, task in tasks.items()}
+
 # Inicjalizacja puli zadań
 async def initialize():
     """Inicjalizuje pule zadań"""
@@ -5,19 +5,29 @@ Research Module - autonauka, web_learn, web scraping
 FULL LOGIC - NO PLACEHOLDERS!
 """
 
-import os, re, sys, time, json, uuid, asyncio, contextlib, hashlib, dataclasses, math
+import os, re, sys, time, json, uuid, asyncio, contextlib, hashlib, dataclasses, math, weakref, threading
+import multiprocessing
 import datetime
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Tuple, Optional
 from urllib.parse import quote_plus, urlparse, urlencode, parse_qsl, urlunparse
 from collections import Counter, defaultdict
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
 import html as html_lib, unicodedata
 
 import httpx
+import numpy as np
 from bs4 import BeautifulSoup
 from readability import Document as ReadabilityDoc
 
+try:
+    import lxml  # noqa: F401  (szybszy parser dla BeautifulSoup)
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
 from .config import (
     SERPAPI_KEY, FIRECRAWL_API_KEY, BASE_DIR, DB_PATH, HTTP_TIMEOUT,
     LLM_BASE_URL, LLM_API_KEY, LLM_MODEL
@@ -35,7 +45,10 @@ except ImportError:
     def ltm_add(*args, **kwargs): pass
     def cache_get(*args, **kwargs): return None
     def cache_put(*args, **kwargs): pass
-from .llm import call_llm
+from .llm import call_llm, acall_llm
+from .middleware import SimpleCache
+from .sparse_rank import cached_index
+from .metrics import observe_stage
 
 # ═══════════════════════════════════════════════════════════════════
 # CONFIGURATION
@@ -56,6 +69,26 @@ FIRECRAWL_KEY = FIRECRAWL_API_KEY
 OPENTRIPMAP_KEY = os.getenv("OTM_API_KEY", "")
 OVERPASS_URL = "https://overpass-api.de/api/interpreter"
 
+# 🔥 Wspólna pula HTTP + scheduler pobrań (search, scraping, research_collect)
+WEB_MAX_CONNECTIONS = int(os.getenv("WEB_MAX_CONNECTIONS", "32"))
+WEB_MAX_KEEPALIVE = int(os.getenv("WEB_MAX_KEEPALIVE", "16"))
+WEB_GLOBAL_CONCURRENCY = int(os.getenv("WEB_GLOBAL_CONCURRENCY", "16"))  # Równoległe żądania (wszystkie domeny)
+WEB_DOMAIN_CONCURRENCY = int(os.getenv("WEB_DOMAIN_CONCURRENCY", "2"))  # Równoległe żądania do jednej domeny
+WEB_DOMAIN_DELAY = float(os.getenv("WEB_DOMAIN_DELAY", "0.25"))  # Odstęp między startami żądań do domeny [s]
+WEB_BANDWIDTH_BPS = int(os.getenv("WEB_BANDWIDTH_BPS", "0"))  # Budżet pobierania [B/s], 0 = bez limitu
+
+# 🔥 Ekstrakcja HTML (readability + BeautifulSoup) w puli procesów - poza pętlą asyncio
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(4, max(2, os.cpu_count() or 1)))))  # 0 = w wątku (bez puli)
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "10"))  # Limit ekstrakcji jednej strony [s]
+EXTRACT_MAX_DOC_BYTES = int(os.getenv("EXTRACT_MAX_DOC_BYTES", str(1024 * 1024)))  # Reszta strony nie jest pobierana
+
+# 🔥 Ekstrakcja faktów LLM: fragmenty wielu stron w jednym promptcie, cache per (fragment, zapytanie)
+FACT_CHUNK_CHARS = int(os.getenv("FACT_CHUNK_CHARS", "900"))  # Fragment strony w promptcie
+FACT_BATCH_TOKENS = int(os.getenv("FACT_BATCH_TOKENS", "3000"))  # Budżet wejścia jednego promptu (~4 znaki/token)
+FACT_BATCH_CONCURRENCY = int(os.getenv("FACT_BATCH_CONCURRENCY", "4"))  # Równoległe prompty
+FACT_CACHE_TTL = int(os.getenv("FACT_CACHE_TTL", str(24 * 3600)))
+FACT_CACHE_MAX_BYTES = int(os.getenv("FACT_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
 # 🔥 REAL-TIME WEB CONFIG (UPGRADED!)
 REAL_TIME_WEB = os.getenv("REAL_TIME_WEB", "1") == "1"  # Zawsze świeże dane
 WEB_CACHE_DISABLED = os.getenv("WEB_CACHE_DISABLED", "1") == "1"  # Wyłącz old cache
@@ -85,6 +118,7 @@ class LearnResult:
     citations: List[str]
     materials: List[Material]
     draft: Optional[str]
+    timings: Dict[str, float] = field(default_factory=dict)
 
 # ═══════════════════════════════════════════════════════════════════
 # TEXT UTILITIES
@@ -183,9 +217,127 @@ def _recency_score(dt: Optional[datetime]) -> float:
 # HTTP CLIENT
 # ═══════════════════════════════════════════════════════════════════
 
-def _client() -> httpx.AsyncClient:
-    headers = {"User-Agent": USER_AGENT, "Accept": "text/html,application/json;q=0.9,*/*;q=0.8"}
-    return httpx.AsyncClient(follow_redirects=True, timeout=WEB_HTTP_TIMEOUT, headers=headers)
+_DEFAULT_HEADERS = {"User-Agent": USER_AGENT, "Accept": "text/html,application/json;q=0.9,*/*;q=0.8"}
+
+class _DomainSlot:
+    __slots__ = ("sem", "next_start", "active")
+    def __init__(self, limit: int):
+        self.sem = asyncio.Semaphore(limit)
+        self.next_start = 0.0
+        self.active = 0
+
+class _FetchScheduler:
+    """
+    Scheduler pobrań dla jednej pętli asyncio:
+    - limit równoległych żądań na domenę + odstęp grzecznościowy między ich startami
+    - globalny limit równoległości (wszystkie domeny)
+    - opcjonalny budżet przepustowości [B/s] - pobrane bajty przesuwają termin kolejnego startu
+    """
+    MAX_IDLE_DOMAINS = 1024
+
+    def __init__(self, global_limit: int = WEB_GLOBAL_CONCURRENCY, domain_limit: int = WEB_DOMAIN_CONCURRENCY,
+                 domain_delay: float = WEB_DOMAIN_DELAY, bandwidth_bps: int = WEB_BANDWIDTH_BPS):
+        self.global_sem = asyncio.Semaphore(max(1, global_limit))
+        self.domain_limit = max(1, domain_limit)
+        self.domain_delay = max(0.0, domain_delay)
+        self.bandwidth_bps = bandwidth_bps
+        self._domains: Dict[str, _DomainSlot] = {}
+        self._bw_free_at = 0.0
+        self.stats: Counter = Counter()
+
+    def _slot_for(self, domain: str) -> _DomainSlot:
+        slot = self._domains.get(domain)
+        if slot is None:
+            if len(self._domains) >= self.MAX_IDLE_DOMAINS:
+                now = time.monotonic()
+                self._domains = {d: s for d, s in self._domains.items() if s.active or s.next_start > now}
+            slot = self._domains[domain] = _DomainSlot(self.domain_limit)
+        return slot
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url: str):
+        dslot = self._slot_for(_domain(url))
+        dslot.active += 1
+        try:
+            async with dslot.sem:
+                # Termin startu rezerwowany przed snem - kolejni do tej domeny ustawiają się w odstępach
+                now = time.monotonic()
+                start_at = max(now, dslot.next_start)
+                dslot.next_start = start_at + self.domain_delay
+                if start_at > now:
+                    self.stats["polite_waits"] += 1
+                    await asyncio.sleep(start_at - now)
+                bw_wait = self._bw_free_at - time.monotonic()
+                if bw_wait > 0:
+                    self.stats["bandwidth_waits"] += 1
+                    await asyncio.sleep(bw_wait)
+                async with self.global_sem:
+                    self.stats["requests"] += 1
+                    yield
+        finally:
+            dslot.active -= 1
+
+    def account(self, nbytes: int) -> None:
+        self.stats["bytes"] += nbytes
+        if self.bandwidth_bps > 0:
+            self._bw_free_at = max(time.monotonic(), self._bw_free_at) + nbytes / self.bandwidth_bps
+
+# Klient i scheduler per pętla asyncio (prymitywy asyncio są związane z pętlą);
+# w serwerze (jedna pętla uvicorn) to jedna pula keep-alive na proces
+_WEB_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_SCHEDULERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _FetchScheduler]" = weakref.WeakKeyDictionary()
+
+def _get_web_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _WEB_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = _WEB_CLIENTS[loop] = httpx.AsyncClient(
+            follow_redirects=True, timeout=WEB_HTTP_TIMEOUT, headers=_DEFAULT_HEADERS,
+            limits=httpx.Limits(max_connections=WEB_MAX_CONNECTIONS, max_keepalive_connections=WEB_MAX_KEEPALIVE),
+        )
+    return client
+
+def _get_scheduler() -> _FetchScheduler:
+    loop = asyncio.get_running_loop()
+    sched = _SCHEDULERS.get(loop)
+    if sched is None:
+        sched = _SCHEDULERS[loop] = _FetchScheduler()
+    return sched
+
+async def _fetch(method: str, url: str, **kwargs) -> httpx.Response:
+    """Żądanie przez wspólną pulę połączeń, w limitach schedulera"""
+    sched = _get_scheduler()
+    async with sched.slot(url):
+        r = await _get_web_client().request(method, url, **kwargs)
+    sched.account(len(r.content))
+    return r
+
+async def _fetch_page(url: str, **kwargs) -> Tuple[httpx.Response, bytes]:
+    """GET strony strumieniowo; treść ucięta do EXTRACT_MAX_DOC_BYTES (reszty nie pobieramy)"""
+    sched = _get_scheduler()
+    chunks: List[bytes] = []; size = 0
+    async with sched.slot(url):
+        async with _get_web_client().stream("GET", url, **kwargs) as r:
+            async for chunk in r.aiter_bytes():
+                chunks.append(chunk); size += len(chunk)
+                if size >= EXTRACT_MAX_DOC_BYTES: break
+    body = b"".join(chunks)[:EXTRACT_MAX_DOC_BYTES]
+    sched.account(len(body))
+    return r, body
+
+def _decode_body(r: httpx.Response, body: bytes) -> str:
+    try:
+        return body.decode(r.charset_encoding or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+async def close_web_clients() -> None:
+    """Zamknij pulę HTTP bieżącej pętli (shutdown aplikacji / koniec _run_sync)"""
+    loop = asyncio.get_running_loop()
+    _SCHEDULERS.pop(loop, None)
+    client = _WEB_CLIENTS.pop(loop, None)
+    if client is not None:
+        await client.aclose()
 
 # ═══════════════════════════════════════════════════════════════════
 # SEARCH FUNCTIONS
@@ -194,33 +346,30 @@ def _client() -> httpx.AsyncClient:
 async def _ddg_search(q: str, k: int) -> List[Tuple[str,str]]:
     url = "https://duckduckgo.com/html/"
     out: List[Tuple[str,str]] = []
-    async with _client() as cl:
-        r = await cl.post(url, data={"q": q})
-        r.raise_for_status()
-        soup = BeautifulSoup(r.text, "html.parser")
-        for a in soup.select("a.result__a"):
-            href = a.get("href"); title = _norm_text(a.text)
-            if href and title:
-                out.append((title, href))
-            if len(out)>=k: break
+    r = await _fetch("POST", url, data={"q": q})
+    r.raise_for_status()
+    soup = BeautifulSoup(r.text, "html.parser")
+    for a in soup.select("a.result__a"):
+        href = a.get("href"); title = _norm_text(a.text)
+        if href and title:
+            out.append((title, href))
+        if len(out)>=k: break
     return out
 
 async def _wiki_search(q: str, k: int) -> List[Tuple[str,str]]:
     api = "https://en.wikipedia.org/w/api.php"
     params = {"action":"opensearch","format":"json","limit":str(k),"search":q}
-    async with _client() as cl:
-        r = await cl.get(api, params=params)
-        r.raise_for_status()
-        js = r.json()
+    r = await _fetch("GET", api, params=params)
+    r.raise_for_status()
+    js = r.json()
     return [(_norm_text(t), l) for t,l in zip(js[1], js[3])]
 
 async def _arxiv_search(q: str, k: int) -> List[Tuple[str,str]]:
     api = "http://export.arxiv.org/api/query"
     params = {"search_query": q, "start":"0", "max_results": str(k)}
-    async with _client() as cl:
-        r = await cl.get(api, params=params)
-        r.raise_for_status()
-        soup = BeautifulSoup(r.text, "xml")
+    r = await _fetch("GET", api, params=params)
+    r.raise_for_status()
+    soup = BeautifulSoup(r.text, "xml")
     out=[]
     for e in soup.select("entry"):
         t = _norm_text(e.select_one("title").text if e.select_one("title") else "")
@@ -231,10 +380,9 @@ async def _arxiv_search(q: str, k: int) -> List[Tuple[str,str]]:
 async def _s2_search(q: str, k: int) -> List[Tuple[str,str]]:
     api = "https://api.semanticscholar.org/graph/v1/paper/search"
     params = {"query": q, "limit": str(k), "fields":"title,url"}
-    async with _client() as cl:
-        r = await cl.get(api, params=params)
-        if r.status_code >= 400: return []
-        js = r.json()
+    r = await _fetch("GET", api, params=params)
+    if r.status_code >= 400: return []
+    js = r.json()
     out=[]
     for it in js.get("data", []):
         t = _norm_text(it.get("title") or ""); u = it.get("url")
@@ -245,10 +393,9 @@ async def _serpapi_search(q: str, k: int) -> List[Tuple[str,str]]:
     if not SERPAPI_KEY: return []
     api = "https://serpapi.com/search.json"
     params = {"engine":"google","q":q,"num":str(k),"api_key":SERPAPI_KEY}
-    async with _client() as cl:
-        r = await cl.get(api, params=params)
-        if r.status_code >= 400: return []
-        js = r.json()
+    r = await _fetch("GET", api, params=params)
+    if r.status_code >= 400: return []
+    js = r.json()
     out=[]
     for it in js.get("organic_results", []):
         t=_norm_text(it.get("title","")); u=it.get("link")
@@ -263,7 +410,8 @@ async def _search_all(query: str, mode: str) -> List[Tuple[str,str]]:
         tasks += [_s2_search(query, min(5, AUTO_TOPK)), _arxiv_search(query, min(5, AUTO_TOPK))]
         if SERPAPI_KEY: tasks.append(_serpapi_search(query, AUTO_TOPK))
     results: List[Tuple[str,str]] = []
-    for out in await _gather_with_limit(tasks, limit=4):
+    # Każdy backend to inna domena - limity trzyma _FetchScheduler
+    for out in await asyncio.gather(*tasks, return_exceptions=True):
         if not isinstance(out, Exception): results.extend(out or [])
     bydom: Dict[str, int] = defaultdict(int); filtered=[]
     for (t,u) in results:
@@ -282,99 +430,224 @@ async def _firecrawl(url: str) -> Optional[str]:
     api = "https://api.firecrawl.dev/v1/scrape"
     payload = {"url": url, "formats":["markdown","html","rawHtml"], "actions":[]}
     headers = {"Authorization": f"Bearer {FIRECRAWL_KEY}", "Content-Type":"application/json"}
-    async with _client() as cl:
-        r = await cl.post(api, json=payload, headers=headers)
-        if r.status_code >= 400:
-            return None
-        js = r.json()
+    r = await _fetch("POST", api, json=payload, headers=headers)
+    if r.status_code >= 400:
+        return None
+    js = r.json()
     text = js.get("markdown") or js.get("html") or js.get("rawHtml")
     if not text: return None
-    return _norm_text(BeautifulSoup(text, "html.parser").get_text(" "))
-
-async def _http_text(url: str) -> Optional[Tuple[str, str, Optional[datetime]]]:
-    async with _client() as cl:
-        r = await cl.get(url)
-        if r.status_code >= 400 or not r.text:
-            return None
-        html_txt = r.text
-        doc = ReadabilityDoc(html_txt)
-        title = _norm_text(doc.short_title() or "")
-        article_html = doc.summary(html_partial=True)
-        soup = BeautifulSoup(article_html, "html.parser")
-        dt = _parse_date_from_html(soup)
-        text = _norm_text(soup.get_text(" "))
-        if len(text) < 200:
-            soup2 = BeautifulSoup(html_txt, "html.parser")
-            dt = dt or _parse_date_from_html(soup2)
-            text = _norm_text(soup2.get_text(" "))
-        return (title, text, dt)
+    return _norm_text(BeautifulSoup(text, HTML_PARSER).get_text(" "))
+
+# Strony trzymane na dysku (core/page_cache.py); w trybie real-time każda strona
+# jest rewalidowana przy każdym użyciu (conditional GET, polityka domen pominięta),
+# inaczej świeża wg PAGE_CACHE_FRESHNESS, a nieznane domeny przez 30 min
+_PAGE_CACHE = None
+_PAGE_CACHE_LOCK = threading.Lock()
+_PAGE_DEFAULT_MAX_AGE = 1800
+
+def _get_page_cache():
+    global _PAGE_CACHE
+    if _PAGE_CACHE is None:
+        with _PAGE_CACHE_LOCK:
+            if _PAGE_CACHE is None:
+                from .page_cache import create_page_cache
+                _PAGE_CACHE = create_page_cache() or False
+    return _PAGE_CACHE or None
+
+async def _http_text(url: str, timer: Optional["_StageTimer"] = None) -> Optional[Tuple[str, str, Optional[datetime]]]:
+    timer = timer or _StageTimer()
+    key = _canonical_url(url)
+    # SQLite (blokady WAL współdzielone przez workery, zlib, eviction) poza pętlą asyncio
+    cache = await asyncio.to_thread(_get_page_cache) if _PAGE_CACHE is None else (_PAGE_CACHE or None)
+    cached = await asyncio.to_thread(cache.get, key) if cache else None
+    max_age = cache.max_age_for(_domain(key), _PAGE_DEFAULT_MAX_AGE) if cache and not REAL_TIME_WEB else 0
+    if cached is not None and cached.age() < max_age:
+        cache.record("hit")
+        return (cached.title, cached.text, cached.published_dt())
+    
+    with timer.stage("fetch"):
+        r, body = await _fetch_page(url, headers=cache.conditional_headers(cached) if cached else None)
+    if r.status_code == 304 and cached is not None:
+        await asyncio.to_thread(cache.touch, key, r.headers.get("etag"), r.headers.get("last-modified"))
+        cache.record("revalidated")
+        return (cached.title, cached.text, cached.published_dt())
+    if r.status_code >= 400 or not body:
+        return None
+    try:
+        with timer.stage("parse"):
+            title, text, dt = await _run_extract(_extract_article, _decode_body(r, body))
+    except asyncio.TimeoutError:
+        log_warning(f"Extraction timeout ({EXTRACT_TIMEOUT}s): {url}", "RESEARCH")
+        return None
+    
+    if cache:
+        cache.record("miss")
+        etag, last_modified = r.headers.get("etag"), r.headers.get("last-modified")
+        # Bez walidatorów i bez okresu świeżości wpis i tak nie oszczędziłby pobrania
+        if "no-store" not in r.headers.get("cache-control", "") and (etag or last_modified or max_age > 0):
+            await asyncio.to_thread(cache.put, key, body, title, text, dt, etag, last_modified)
+    return (title, text, dt)
+
+def _extract_article(html_txt: str) -> Tuple[str, str, Optional[datetime]]:
+    """Readability + tekst + data publikacji (uruchamiane w puli procesów, patrz _run_extract)"""
+    doc = ReadabilityDoc(html_txt)
+    title = _norm_text(doc.short_title() or "")
+    article_html = doc.summary(html_partial=True)
+    soup = BeautifulSoup(article_html, HTML_PARSER)
+    dt = _parse_date_from_html(soup)
+    text = _norm_text(soup.get_text(" "))
+    if len(text) < 200:
+        soup2 = BeautifulSoup(html_txt, HTML_PARSER)
+        dt = dt or _parse_date_from_html(soup2)
+        text = _norm_text(soup2.get_text(" "))
+    return (title, text, dt)
 
 def extract_text(html: str) -> Tuple[str, str]:
     try:
         doc = ReadabilityDoc(html)
         title = doc.short_title()
-        soup = BeautifulSoup(doc.summary(html_partial=True), "html.parser")
+        soup = BeautifulSoup(doc.summary(html_partial=True), HTML_PARSER)
         return title, soup.get_text(" ", strip=True)
     except Exception:
         txt=re.sub(r"\s+"," ", re.sub(r"<.*?>"," ", html))
         return "", txt.strip()
 
+# Pula procesów na ekstrakcję: readability/BeautifulSoup to czyste CPU, w pętli
+# asyncio duża strona blokowała wszystkie inne żądania workera na setki ms.
+# Funkcje ekstrakcji są na poziomie modułu (pickle przez referencję).
+# Workery startują przez forkserver (spawn poza Linuksem), nie fork: fork
+# wielowątkowego procesu (httpx, write-behind, batcher) kopiuje cudze zablokowane
+# locki. Pula powstaje przy starcie aplikacji (start_extract_pool).
+_EXTRACT_MP = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+_EXTRACT_POOL: Optional[ProcessPoolExecutor] = None
+_EXTRACT_POOL_LOCK = threading.Lock()
+# Zadania w locie per pula i zadania, które przekroczyły limit (pula wycofana)
+_EXTRACT_JOBS: "weakref.WeakKeyDictionary[ProcessPoolExecutor, set]" = weakref.WeakKeyDictionary()
+_EXTRACT_RETIRED: "weakref.WeakKeyDictionary[ProcessPoolExecutor, set]" = weakref.WeakKeyDictionary()
+# Co najwyżej EXTRACT_WORKERS zadań w locie na pętlę: zadanie startuje od razu,
+# więc EXTRACT_TIMEOUT mierzy samą ekstrakcję, a nie czekanie w kolejce puli
+_EXTRACT_SLOTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _get_extract_pool() -> Optional[ProcessPoolExecutor]:
+    global _EXTRACT_POOL
+    if EXTRACT_WORKERS <= 0:
+        return None
+    if _EXTRACT_POOL is None:
+        with _EXTRACT_POOL_LOCK:
+            if _EXTRACT_POOL is None:
+                _EXTRACT_POOL = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=_EXTRACT_MP)
+    return _EXTRACT_POOL
+
+def _extract_warmup() -> bool:
+    return True
+
+def start_extract_pool() -> None:
+    """Hook startowy: utwórz pulę i uruchom workery teraz, a nie przy pierwszej stronie"""
+    pool = _get_extract_pool()
+    if pool is not None:
+        pool.submit(_extract_warmup)
+
+def _get_extract_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _EXTRACT_SLOTS.get(loop)
+    if sem is None:
+        sem = _EXTRACT_SLOTS[loop] = asyncio.Semaphore(max(1, EXTRACT_WORKERS))
+    return sem
+
+def _track_extract_job(pool: ProcessPoolExecutor, fut) -> None:
+    with _EXTRACT_POOL_LOCK:
+        _EXTRACT_JOBS.setdefault(pool, set()).add(fut)
+    fut.add_done_callback(lambda f: _extract_job_done(pool, f))
+
+def _extract_job_done(pool: ProcessPoolExecutor, fut) -> None:
+    with _EXTRACT_POOL_LOCK:
+        jobs = _EXTRACT_JOBS.setdefault(pool, set()); jobs.discard(fut)
+        stuck = _EXTRACT_RETIRED.get(pool)
+        idle = stuck is not None and jobs <= stuck
+    if idle: shutdown_extract_pool(pool, kill=True)
+
+def _retire_extract_pool(pool: ProcessPoolExecutor, stuck_fut) -> None:
+    """Zawieszone zadanie: nowe idą do świeżej puli, a stara jest zabijana dopiero,
+    gdy skończą się w niej pozostałe (zdrowe) zadania - ich wyniki nie przepadają"""
+    global _EXTRACT_POOL
+    with _EXTRACT_POOL_LOCK:
+        if pool is _EXTRACT_POOL:
+            _EXTRACT_POOL = None
+        stuck = _EXTRACT_RETIRED.setdefault(pool, set()); stuck.add(stuck_fut)
+        idle = _EXTRACT_JOBS.get(pool, set()) <= stuck
+    if idle: shutdown_extract_pool(pool, kill=True)
+
+async def _run_extract(fn, *args, retry: bool = True):
+    """fn(*args) w puli procesów z limitem EXTRACT_TIMEOUT (EXTRACT_WORKERS=0 - w wątku)"""
+    if _get_extract_pool() is None:
+        return await asyncio.wait_for(asyncio.to_thread(fn, *args), EXTRACT_TIMEOUT)
+    pool = None
+    try:
+        async with _get_extract_slots():
+            pool = _get_extract_pool()
+            fut = pool.submit(fn, *args)
+            _track_extract_job(pool, fut)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(fut), EXTRACT_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Patologiczna strona nadal zajmuje workera - wymień pulę dla kolejnych zadań
+                log_warning(f"Extraction exceeded {EXTRACT_TIMEOUT}s, recycling worker pool", "RESEARCH")
+                _retire_extract_pool(pool, fut)
+                raise
+    except BrokenProcessPool:
+        # Padł worker (albo pula zabita przy zamykaniu) - jedna ponowna próba w nowej puli
+        shutdown_extract_pool(pool)
+        if not retry:
+            raise
+    return await _run_extract(fn, *args, retry=False)
+
+def shutdown_extract_pool(pool: Optional[ProcessPoolExecutor] = None, kill: bool = False) -> None:
+    """Zamknij pulę ekstrakcji (domyślnie bieżącą); kill=True przerywa pracujące procesy"""
+    global _EXTRACT_POOL
+    with _EXTRACT_POOL_LOCK:
+        pool = pool or _EXTRACT_POOL
+        if pool is _EXTRACT_POOL:
+            _EXTRACT_POOL = None
+    if pool is None:
+        return
+    if kill:
+        for proc in list((getattr(pool, "_processes", None) or {}).values()):
+            proc.terminate()
+    # Bez cancel_futures: na wyniki zadań w kolejce mogą jeszcze czekać inni
+    pool.shutdown(wait=False)
+
+class _StageTimer:
+    """Czasy etapów jednego zapytania (fetch/parse/chunk/rank), sumowane po źródłach"""
+    def __init__(self):
+        self.totals: Dict[str, float] = defaultdict(float)
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            self.totals[name] += dt
+            observe_stage(f"research_{name}", dt)
+    def to_dict(self) -> Dict[str, float]:
+        return {k: round(v, 4) for k, v in self.totals.items()}
+
 # ═══════════════════════════════════════════════════════════════════
 # BM25 RANKING
 # ═══════════════════════════════════════════════════════════════════
 
-class BM25:
-    def __init__(self, corpus_tokens: List[List[str]], k1: float=1.5, b: float=0.75):
-        self.k1, self.b = k1, b
-        self.docs = corpus_tokens
-        self.N = len(corpus_tokens)
-        self.df = Counter()
-        self.avgdl = 1.0
-        self._build()
-    def _build(self):
-        lengths = []
-        for doc in self.docs:
-            unique_terms = set(doc)
-            for t in unique_terms:
-                self.df[t]+=1
-            lengths.append(len(doc))
-        self.avgdl = sum(lengths)/max(1,len(lengths))
-    def score(self, q: List[str], doc: List[str]) -> float:
-        f = Counter(doc); dl = len(doc); sc = 0.0
-        for term in q:
-            n_qi = self.df.get(term,0)
-            if n_qi==0: continue
-            idf = math.log(1 + (self.N - n_qi + 0.5)/(n_qi + 0.5))
-            freq = f.get(term,0)
-            denom = freq + self.k1*(1 - self.b + self.b*dl/self.avgdl)
-            sc += idf * (freq*(self.k1+1))/max(1e-9, denom)
-        return sc
-
-def _cosine_hash(q_tokens: List[str], d_tokens: List[str]) -> float:
-    qset, dset = set(q_tokens), set(d_tokens)
-    inter = len(qset & dset)
-    denom = math.sqrt(len(qset)*len(dset)) or 1.0
-    return inter/denom
-
-def _jaccard(q_tokens: List[str], d_tokens: List[str]) -> float:
-    qset, dset = set(q_tokens), set(d_tokens)
-    if not qset or not dset: return 0.0
-    return len(qset & dset)/len(qset | dset)
-
 def _hybrid_rank(query: str, chunks: List[str]) -> List[Tuple[int,float]]:
+    """BM25 + overlap; indeks fragmentów strony współdzielony między zapytaniami (cached_index)"""
     q_tokens = _tokenize(query)
-    c_tokens = [_tokenize(c) for c in chunks]
-    bm25 = BM25(c_tokens)
-    scores = []
-    for i, dtok in enumerate(c_tokens):
-        s = 0.50*bm25.score(q_tokens, dtok) + 0.35*_cosine_hash(q_tokens, dtok) + 0.15*_jaccard(q_tokens, dtok)
-        scores.append((i, s))
-    scores.sort(key=lambda x: x[1], reverse=True)
-    return scores
+    index = cached_index(chunks, _tokenize)
+    cosine, jaccard = index.overlap(q_tokens)
+    scores = 0.50*index.bm25(q_tokens) + 0.35*cosine + 0.15*jaccard
+    return [(int(i), float(scores[i])) for i in np.argsort(-scores, kind="stable")]
 
 def rank_hybrid(chunks: List[str], q: str, topk: int = 6) -> List[Tuple[str,float]]:
+    """TF-IDF + embeddingi; blokuje na embeddingach - w kodzie async używaj arank_hybrid"""
     if not chunks: return []
-    tfidf=_tfidf_cos(q, chunks)
     emb=[0.0]*len(chunks)
     from .helpers import embed_many
     try:
@@ -382,6 +655,22 @@ def rank_hybrid(chunks: List[str], q: str, topk: int = 6) -> List[Tuple[str,floa
         if qv and ev:
             qv=qv[0]; emb=[_vec_cos(qv,e) for e in ev]
     except Exception: pass
+    return _blend_rank(chunks, q, emb, topk)
+
+async def arank_hybrid(chunks: List[str], q: str, topk: int = 6) -> List[Tuple[str,float]]:
+    """rank_hybrid dla pętli zdarzeń: embeddingi przez aembed_many (micro-batcher bez blokowania)"""
+    if not chunks: return []
+    emb=[0.0]*len(chunks)
+    from .helpers import aembed_many
+    try:
+        qv, ev = await asyncio.gather(aembed_many([q]), aembed_many(chunks))
+        if qv and ev:
+            qv=qv[0]; emb=[_vec_cos(qv,e) for e in ev]
+    except Exception: pass
+    return _blend_rank(chunks, q, emb, topk)
+
+def _blend_rank(chunks: List[str], q: str, emb: List[float], topk: int) -> List[Tuple[str,float]]:
+    tfidf=_tfidf_cos(q, chunks)
     out=[]
     for i,ch in enumerate(chunks):
         score=0.58*(tfidf[i] if i<len(tfidf) else 0.0) + 0.42*(emb[i] if i<len(emb) else 0.0)
@@ -424,7 +713,7 @@ def _fallback_fact_extract(prompt: str) -> str:
     for line in (prompt or "").splitlines():
         line=line.strip()
         if not line: continue
-        m = re.search(r"(https?://\S+)", line)
+        m = re.search(r"(https?://[^\s\]\)]+)", line)
         if m:
             url = m.group(1)
             fact = _normalize_ws(line.replace(url,"")).strip(" -:—")
@@ -432,59 +721,115 @@ def _fallback_fact_extract(prompt: str) -> str:
                 facts.append({"fact": fact, "source": url})
     return json.dumps(facts[:8], ensure_ascii=False)
 
-def _llm_chat(system: str, user: str, maxtok: int=1024, temp: float=0.2) -> str:
+async def _allm_chat(system: str, user: str, maxtok: int=1024, temp: float=0.2, skip_cache: bool=False) -> Optional[str]:
+    """Async LLM przez wspólną pulę llm.py; None bez skonfigurowanego LLM lub przy błędzie"""
     if not LLM_BASE_URL or not LLM_API_KEY:
-        return _fallback_fact_extract(user)
-    headers = {"Authorization": f"Bearer {LLM_API_KEY}", "Content-Type":"application/json"}
-    payload = {
-        "model": LLM_MODEL,
-        "messages": [{"role":"system","content":system},{"role":"user","content":user}],
-        "max_tokens": maxtok,
-        "temperature": temp,
-    }
+        return None
+    messages = [{"role":"system","content":system},{"role":"user","content":user}]
     try:
-        resp = httpx.post(LLM_BASE_URL.rstrip("/") + "/chat/completions", json=payload, headers=headers, timeout=WEB_HTTP_TIMEOUT)
-        resp.raise_for_status()
-        js = resp.json()
-        return js["choices"][0]["message"]["content"]
-    except Exception:
-        return _fallback_fact_extract(user)
-
-def _llm_extract_facts(query: str, materials: List[Tuple[str,str,str]]) -> List[Tuple[str,str]]:
-    lines = [f"Q: {query}"]
-    for (u,t,txt) in materials:
-        snippet = _normalize_ws(txt[:900])
-        lines.append(f"- {t} [{u}] :: {snippet}")
-    user_prompt = "\n".join(lines)
-    raw = _llm_chat(_FACT_SYS, user_prompt, maxtok=800, temp=0.1)
+        out = await acall_llm(messages, max_tokens=maxtok, temperature=temp, skip_cache=skip_cache,
+                              timeout_s=WEB_HTTP_TIMEOUT, semantic_namespace="research")
+    except Exception as e:
+        log_warning(f"LLM call failed: {e}", "RESEARCH"); return None
+    if not out or out.startswith("[LLM-FAIL]"): return None
+    return out
+
+def _parse_facts(raw: str) -> Optional[List[Tuple[str,str]]]:
+    """[(fakt, kanoniczny URL)] z odpowiedzi JSON; None gdy to nie jest tablica JSON"""
+    data = None
+    with contextlib.suppress(Exception): data = json.loads(raw)
+    if data is None and "[" in raw:
+        with contextlib.suppress(Exception): data = json.loads(raw[raw.index("["):raw.rindex("]")+1])
+    if not isinstance(data, list): return None
+    facts=[]
+    for it in data:
+        if not isinstance(it, dict): continue
+        fact = _norm_text(str(it.get("fact") or ""))
+        src = it.get("source")
+        if fact and src and len(fact)>=30:
+            facts.append((fact, _canonical_url(str(src))))
+    return facts
+
+def _sentence_facts(txt: str, limit: int = 6) -> List[str]:
     facts=[]
-    with contextlib.suppress(Exception):
-        data = json.loads(raw)
-        if isinstance(data, list):
-            for it in data:
-                fact = _norm_text(it.get("fact",""))
-                src = it.get("source")
-                if fact and src and len(fact)>=30:
-                    facts.append((fact, _canonical_url(src)))
-    if not facts:
-        for (u, t, txt) in materials:
-            sentences = re.split(r"(?<=[\.\!\?])\s+", txt)
-            for s in sentences:
-                s=_norm_text(s)
-                if 60 <= len(s) <= 300 and s.lower() not in ("copyright","all rights reserved"):
-                    facts.append((s, _canonical_url(u)))
-                    if len(facts)>=6: break
-            if len(facts)>=6: break
-    return facts[:12]
+    for s in re.split(r"(?<=[\.\!\?])\s+", txt):
+        s=_norm_text(s)
+        if 60 <= len(s) <= 300 and s.lower() not in ("copyright","all rights reserved"):
+            facts.append(s)
+            if len(facts)>=limit: break
+    return facts
+
+# Fakty per (fragment strony, zapytanie): ta sama strona w kolejnym researchu
+# (także w innym zestawie stron, czyli innym promptcie) nie kosztuje wywołania LLM
+_FACT_CACHE = SimpleCache(max_size=5000, ttl=FACT_CACHE_TTL, max_bytes=FACT_CACHE_MAX_BYTES)
+
+def _fact_cache_key(query: str, snippet: str) -> str:
+    base = f"{LLM_MODEL}\x00{_norm_text(query).lower()}\x00{snippet}"
+    return hashlib.sha1(base.encode("utf-8")).hexdigest()
+
+def _approx_tokens(s: str) -> int:
+    return len(s)//4 + 1
+
+def _pack_fact_batches(query: str, lines: List[str], budget: int) -> List[List[int]]:
+    """Zachłanne pakowanie linii materiałów w prompty do budżetu tokenów (min. 1 linia na prompt)"""
+    base = _approx_tokens(_FACT_SYS) + _approx_tokens(f"Q: {query}")
+    batches: List[List[int]] = []; cur: List[int] = []; used = base
+    for i, line in enumerate(lines):
+        cost = _approx_tokens(line)
+        if cur and used + cost > budget:
+            batches.append(cur); cur = []; used = base
+        cur.append(i); used += cost
+    if cur: batches.append(cur)
+    return batches
+
+async def _extract_facts_batched(query: str, materials: List[Tuple[str,str,str]]) -> List[List[Tuple[str,str]]]:
+    """
+    Fakty dla wielu stron naraz (materials: [(url, tytuł, wybrany fragment)]).
+
+    Strony bez wpisu w _FACT_CACHE są pakowane w prompty do FACT_BATCH_TOKENS,
+    prompty idą równolegle (FACT_BATCH_CONCURRENCY) przez async klienta llm.py
+    z pominięciem jego cache (semantyczny mógłby oddać odpowiedź na prompt
+    z innymi stronami; dokładny cache to _FACT_CACHE). Fakty wracają do stron
+    tylko po dokładnym URL źródła. Strona bez faktów z LLM (brak LLM, błąd,
+    pominięta w odpowiedzi) dostaje zdania z własnego tekstu - bez zapisu do
+    cache, więc następnym razem znowu trafia do LLM.
+    Zwraca [(fakt, url)] dla każdego materiału, w kolejności wejścia.
+    """
+    items = []
+    for (u, t, txt) in materials:
+        u = _canonical_url(u); snippet = _normalize_ws(txt[:FACT_CHUNK_CHARS])
+        items.append((u, t, txt, f"- {t} [{u}] :: {snippet}", _fact_cache_key(query, snippet)))
+    found: List[Optional[List[str]]] = [_FACT_CACHE.get(it[4]) for it in items]
+    todo = [i for i, f in enumerate(found) if f is None]
+
+    async def _run(batch: List[int]) -> None:
+        user_prompt = "\n".join([f"Q: {query}"] + [items[i][3] for i in batch])
+        raw = await _allm_chat(_FACT_SYS, user_prompt, maxtok=min(4000, 600*len(batch)), temp=0.1, skip_cache=True)
+        parsed = _parse_facts(raw) if raw is not None else None
+        if parsed is None: return
+        by_url = {items[i][0]: i for i in batch}; out: Dict[int, List[str]] = {i: [] for i in batch}
+        for fact, src in parsed:
+            i = by_url.get(src)
+            if i is not None and len(out[i]) < 12: out[i].append(fact)
+        for i, facts in out.items():
+            if facts: found[i] = facts; _FACT_CACHE.put(items[i][4], facts)
+
+    if todo:
+        batches = _pack_fact_batches(query, [items[i][3] for i in todo], FACT_BATCH_TOKENS)
+        await _gather_with_limit([_run([todo[j] for j in b]) for b in batches], FACT_BATCH_CONCURRENCY)
+    return [[(f, it[0]) for f in (facts or _sentence_facts(it[2]))] for it, facts in zip(items, found)]
 
 # ═══════════════════════════════════════════════════════════════════
 # URL INGESTION
 # ═══════════════════════════════════════════════════════════════════
 
-async def _ingest_url(query: str, title: str, url: str, topk_chunks: int = 2) -> Optional[Tuple[Material, List[Tuple[str,str]]]]:
+async def _ingest_url(query: str, title: str, url: str, topk_chunks: int = 2,
+                      timer: Optional[_StageTimer] = None) -> Optional[Tuple[Material, str]]:
+    """Pobranie + wybór najlepszych fragmentów; fakty wyciąga potem _extract_facts_batched"""
+    timer = timer or _StageTimer()
     url_c = _canonical_url(url)
     https_ok = url_c.startswith("https")
-    fetched = await _http_text(url_c)
+    fetched = await _http_text(url_c, timer)
     if not fetched:
         txt = await _firecrawl(url_c)
         if not txt: return None
@@ -493,20 +838,21 @@ async def _ingest_url(query: str, title: str, url: str, topk_chunks: int = 2) ->
     else:
         title2, text, dt = fetched
     if not text or len(text) < 200: return None
-    parts = _chunks(text)
-    ranked = _hybrid_rank(query, parts)[:topk_chunks]
+    with timer.stage("chunk"):
+        parts = _chunks(text)
+    with timer.stage("rank"):
+        ranked = _hybrid_rank(query, parts)[:topk_chunks]
     picked = " ".join(parts[i] for i,_ in ranked)
     dom = _domain(url_c)
     trust = _trust(url_c, https_ok)
     recency = _recency_score(dt)
-    facts = _llm_extract_facts(query, [(url_c, title2 or title or "", picked)])
     material = Material(
         title=title2 or title or None,
         url=url_c, domain=dom, trust=trust, recency=recency,
         snippet=_norm_text(picked[:600]),
-        facts=[f for f,_ in facts] if facts else [],
+        facts=[],
     )
-    return material, facts
+    return material, picked
 
 # ═══════════════════════════════════════════════════════════════════
 # DEDUPLICATION
@@ -543,8 +889,10 @@ async def _gather_with_limit(coros: List, limit: int) -> List[Any]:
 # PIPELINE
 # ═══════════════════════════════════════════════════════════════════
 
-async def _pipeline(query: str, mode: str) -> Tuple[List[Material], List[Tuple[str,str]]]:
-    pairs = await _search_all(query, mode)
+async def _pipeline(query: str, mode: str, timer: Optional[_StageTimer] = None) -> Tuple[List[Material], List[Tuple[str,str]]]:
+    timer = timer or _StageTimer()
+    with timer.stage("search"):
+        pairs = await _search_all(query, mode)
     
     max_fetch = {
         "fast": min(3, AUTO_FETCH), 
@@ -553,31 +901,57 @@ async def _pipeline(query: str, mode: str) -> Tuple[List[Material], List[Tuple[s
         "full": max(5, AUTO_FETCH)
     }.get(mode, AUTO_FETCH)
     
-    fetch_tasks = []
+    candidates = []
     domain_counter = Counter()
     
     for t, u in pairs:
         domain = _domain(u)
         if domain_counter[domain] < AUTON_DOMAIN_MAX:
             domain_counter[domain] += 1
-            fetch_tasks.append(_ingest_url(query, t, u))
-            if len(fetch_tasks) >= max_fetch * 2:
+            candidates.append((t, u))
+            if len(candidates) >= max_fetch * 2:
                 break
     
-    outs = await _gather_with_limit(fetch_tasks[:max_fetch], limit=CONCURRENCY)
-    materials: List[Material] = []; facts_all: List[Tuple[str,str]] = []
+    # Najpierw max_fetch najwyżej ocenionych (równolegle, limity trzyma _FetchScheduler);
+    # kolejny kandydat startuje tylko w miejsce nieudanego, a strony wracają
+    # w kolejności wyszukiwarki - szybsza strona nie wypiera lepszej
+    remaining = iter(enumerate(candidates))
+    running: Dict[asyncio.Future, int] = {}
+    results: Dict[int, Tuple[Material, str]] = {}
     
-    for out in outs:
-        if isinstance(out, Exception) or out is None: 
-            continue
-        m, facts = out
-        
-        if m and (not m.facts or len(m.facts) == 0) and m.snippet and len(m.snippet) > 300:
-            additional_facts = _llm_extract_facts(query, [(m.url or "", m.title or "", m.snippet or "")])
-            if additional_facts:
-                m.facts = [f for f, _ in additional_facts]
-                facts_all.extend(additional_facts)
-        
+    def _start_next() -> None:
+        nxt = next(remaining, None)
+        if nxt is not None:
+            rank, (t, u) = nxt
+            running[asyncio.ensure_future(_ingest_url(query, t, u, timer=timer))] = rank
+    
+    try:
+        for _ in range(max_fetch):
+            _start_next()
+        while running:
+            done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                rank = running.pop(fut)
+                try:
+                    out = fut.result()
+                except Exception:
+                    out = None
+                if out is not None:
+                    results[rank] = out
+                else:
+                    _start_next()
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+    outs = [results[rank] for rank in sorted(results)]
+    
+    # Jedna runda ekstrakcji faktów dla wszystkich stron (zamiast wywołania LLM na stronę)
+    with timer.stage("facts"):
+        per_page = await _extract_facts_batched(query, [(m.url or "", m.title or "", picked) for m, picked in outs])
+    materials: List[Material] = []; facts_all: List[Tuple[str,str]] = []
+    for (m, _), facts in zip(outs, per_page):
+        m.facts = [f for f, _ in facts]
         materials.append(m)
         facts_all.extend(facts)
     
@@ -640,14 +1014,15 @@ def _vote_and_store(facts: List[Tuple[str,str]], prof: Dict[str,dict]) -> Tuple[
 # DRAFT GENERATION
 # ═══════════════════════════════════════════════════════════════════
 
-def _llm_draft(query: str, materials: List[Material]) -> str:
+async def _llm_draft(query: str, materials: List[Material]) -> str:
     if not materials: return ""
     bullets=[]
     for m in materials[:6]:
         if not m or not m.url: continue
-        bullets.append(f"- [{m.title or m.url}]({_canonical_url(m.url)}) trust={m.trust:.2f if m.trust else 0.0} recency={m.recency:.2f if m.recency else 0.0}")
+        bullets.append(f"- [{m.title or m.url}]({_canonical_url(m.url)}) trust={m.trust or 0.0:.2f} recency={m.recency or 0.0:.2f}")
     pre = f"Query: {query}\nMaterials:\n" + "\n".join(bullets) + "\n\nSynthesis:\n"
-    return _llm_chat("Write a concise, source-grounded synthesis. 5–8 bullet points. No fluff.", pre, maxtok=700, temp=0.2)
+    raw = await _allm_chat("Write a concise, source-grounded synthesis. 5–8 bullet points. No fluff.", pre, maxtok=700, temp=0.2)
+    return raw if raw is not None else _fallback_fact_extract(pre)
 
 # ═══════════════════════════════════════════════════════════════════
 # WEB LEARN
@@ -655,12 +1030,16 @@ def _llm_draft(query: str, materials: List[Material]) -> str:
 
 async def _web_learn_async(query: str, mode: str) -> LearnResult:
     prof = _load_profile()
-    materials, facts = await _pipeline(query, mode)
+    timer = _StageTimer()
+    t0 = time.perf_counter()
+    materials, facts = await _pipeline(query, mode, timer)
     ltm_ids, citations = _vote_and_store(facts, prof)
-    draft = _llm_draft(query, materials)
+    with timer.stage("draft"):
+        draft = await _llm_draft(query, materials)
     trust_avg = float(sum(m.trust or 0 for m in materials)/max(1,len(materials)))
+    timings = timer.to_dict(); timings["total"] = round(time.perf_counter() - t0, 4)
     return LearnResult(query=query,count=len(materials),trust_avg=trust_avg,backend="async-httpx",
-                       ltm_ids=ltm_ids,citations=citations,materials=materials,draft=draft)
+                       ltm_ids=ltm_ids,citations=citations,materials=materials,draft=draft,timings=timings)
 
 def _run_sync(coro):
     loop = asyncio.new_event_loop()
@@ -669,6 +1048,7 @@ def _run_sync(coro):
         return loop.run_until_complete(coro)
     finally:
         try:
+            loop.run_until_complete(close_web_clients())
             loop.run_until_complete(loop.shutdown_asyncgens())
         except Exception:
             pass
@@ -689,6 +1069,7 @@ def web_learn(query: str, mode: str="full", **kwargs) -> Dict[str, Any]:
             "citations": res.citations,
             "materials": [dataclasses.asdict(m) for m in res.materials],
             "draft": res.draft,
+            "timings": res.timings,
         }
     except Exception as e:
         log_error(e, "WEB_LEARN")
@@ -713,25 +1094,22 @@ async def serpapi_search(q: str, engine: str = "google", params: dict = None) ->
     p = {"engine": engine, "q": q, "api_key": SERPAPI_KEY}
     if params: p.update(params)
     from .config import WEB_USER_AGENT
-    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT, headers={"User-Agent":WEB_USER_AGENT}) as c:
-        r = await c.get(base, params=p)
-        try: return {"ok": r.status_code==200, "status": r.status_code, "data": r.json()}
-        except: return {"ok": False, "raw": r.text}
+    r = await _fetch("GET", base, params=p, headers={"User-Agent":WEB_USER_AGENT}, timeout=HTTP_TIMEOUT)
+    try: return {"ok": r.status_code==200, "status": r.status_code, "data": r.json()}
+    except: return {"ok": False, "raw": r.text}
 
 async def firecrawl_scrape(url: str) -> dict:
     if not FIRECRAWL_KEY: return {"ok": False, "error": "FIRECRAWL_KEY missing"}
     endpoint = "https://api.firecrawl.dev/v1/scrape"
     headers = {"Authorization": f"Bearer {FIRECRAWL_KEY}"}
-    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as c:
-        r = await c.post(endpoint, headers=headers, json={"url": url})
-        try: return {"ok": r.status_code==200, "data": r.json()}
-        except: return {"ok": False, "raw": r.text}
+    r = await _fetch("POST", endpoint, headers=headers, json={"url": url}, timeout=HTTP_TIMEOUT)
+    try: return {"ok": r.status_code==200, "data": r.json()}
+    except: return {"ok": False, "raw": r.text}
 
 async def wiki_search(q: str, n: int = 5) -> List[str]:
     url = f"https://en.wikipedia.org/w/api.php?action=query&list=search&srsearch={quote_plus(q)}&utf8=&format=json&srlimit={n}"
-    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as c:
-        r = await c.get(url); j = r.json()
-        return [f"https://en.wikipedia.org/wiki/{quote_plus(p['title'])}" for p in j.get("query",{}).get("search",[])]
+    r = await _fetch("GET", url, timeout=HTTP_TIMEOUT); j = r.json()
+    return [f"https://en.wikipedia.org/wiki/{quote_plus(p['title'])}" for p in j.get("query",{}).get("search",[])]
 
 def store_docs(items: List[dict]):
     conn=_db(); c=conn.cursor()
@@ -742,39 +1120,46 @@ def store_docs(items: List[dict]):
         except Exception: pass
     conn.commit(); conn.close()
 
-async def research_collect(q: str, max_sites: int = 10) -> List[dict]:
+async def research_collect(q: str, max_sites: int = 10, timer: Optional[_StageTimer] = None) -> List[dict]:
     from .config import WEB_USER_AGENT
-    links=[]
+    # Wyszukiwarki i strony równolegle - limity domen/globalne trzyma _FetchScheduler
+    searches = []
     if SERPAPI_KEY:
-        s = await serpapi_search(q, "google", params={"num": max_sites})
-        for o in (s.get("data",{}) or {}).get("organic_results", [])[:max_sites]:
-            if o.get("link"): links.append(o["link"])
-        sch = await serpapi_search(q, "google_scholar", params={"num":3})
-        for o in (sch.get("data",{}) or {}).get("organic_results", [])[:3]:
+        searches += [(serpapi_search(q, "google", params={"num": max_sites}), max_sites),
+                     (serpapi_search(q, "google_scholar", params={"num":3}), 3)]
+    searches.append((wiki_search(q, n=3), 3))
+    results = await asyncio.gather(*[s for s, _ in searches], return_exceptions=True)
+    links=[]
+    for res, (_, cap) in zip(results, searches):
+        if isinstance(res, Exception): continue
+        if isinstance(res, list):
+            links += res; continue
+        for o in (res.get("data",{}) or {}).get("organic_results", [])[:cap]:
             if o.get("link"): links.append(o["link"])
-    links += await wiki_search(q, n=3)
     seen=set(); ulist=[]
     for u in links:
         if u and u not in seen: seen.add(u); ulist.append(u)
-    out=[]
-    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT, headers={"User-Agent":WEB_USER_AGENT}, follow_redirects=True) as c:
-        res=await asyncio.gather(*[c.get(u) for u in ulist[:max_sites]], return_exceptions=True)
-        for u, r in zip(ulist[:max_sites], res):
-            if isinstance(r, Exception):
-                if FIRECRAWL_KEY:
-                    fr=await firecrawl_scrape(u)
-                    if fr.get("ok") and fr.get("data") and fr["data"].get("content"):
-                        out.append({"url":u,"title":fr["data"].get("title",""),"text":fr["data"]["content"],"source":"firecrawl"})
-                continue
-            html=r.text or ""
-            if FIRECRAWL_KEY:
-                fr=await firecrawl_scrape(u)
-                if fr.get("ok") and fr["data"].get("content"):
-                    out.append({"url":u,"title":fr["data"].get("title",""),"text":fr["data"]["content"],"source":"firecrawl"})
-                    continue
-            title, text = extract_text(html)
-            out.append({"url":u,"title":title,"text":text,"source":"web"})
-    return out
+
+    timer = timer or _StageTimer()
+    
+    async def _collect_one(u: str) -> Optional[dict]:
+        try:
+            with timer.stage("fetch"):
+                r, body = await _fetch_page(u, headers={"User-Agent":WEB_USER_AGENT}, timeout=HTTP_TIMEOUT)
+        except Exception:
+            r = None
+        if FIRECRAWL_KEY:
+            fr=await firecrawl_scrape(u)
+            if fr.get("ok") and fr.get("data") and fr["data"].get("content"):
+                return {"url":u,"title":fr["data"].get("title",""),"text":fr["data"]["content"],"source":"firecrawl"}
+        if r is None:
+            return None
+        with timer.stage("parse"):
+            title, text = await _run_extract(extract_text, _decode_body(r, body))
+        return {"url":u,"title":title,"text":text,"source":"web"}
+
+    res=await asyncio.gather(*[_collect_one(u) for u in ulist[:max_sites]], return_exceptions=True)
+    return [it for it in res if isinstance(it, dict)]
 
 # ═══════════════════════════════════════════════════════════════════
 # HIERARCHICAL MEMORY INTEGRATION
@@ -955,7 +1340,8 @@ async def autonauka(q: str, topk: int = 10, deep_research: bool = False, use_ext
                 "is_deep_research": deep_research,
                 "source_count": len(result.get("materials", [])),
                 "powered_by": "autonauka-web-real-time",
-                "real_time": True  # Fresh from web!
+                "real_time": True,  # Fresh from web!
+                "timings": result.get("timings", {})
             }
             
             # 🔥 NEW: Save to UNIFIED MEMORY (L2 semantic facts)
@@ -1041,7 +1427,9 @@ async def autonauka(q: str, topk: int = 10, deep_research: bool = False, use_ext
         ])
     
     all_items = []
-    tasks = [research_collect(variant, max_sites=8 if deep_research else 6) for variant in expanded_variants]
+    timer = _StageTimer()
+    t0 = time.perf_counter()
+    tasks = [research_collect(variant, max_sites=8 if deep_research else 6, timer=timer) for variant in expanded_variants]
     results = await asyncio.gather(*tasks, return_exceptions=True)
     
     for res in results:
@@ -1073,7 +1461,7 @@ async def autonauka(q: str, topk: int = 10, deep_research: bool = False, use_ext
     items = items[:20 if deep_research else 15]
     
     if not items:
-        fallback_items = await research_collect(q.split()[-1] if len(q.split()) > 1 else q, max_sites=10)
+        fallback_items = await research_collect(q.split()[-1] if len(q.split()) > 1 else q, max_sites=10, timer=timer)
         items = fallback_items
     
     try:
@@ -1099,10 +1487,12 @@ async def autonauka(q: str, topk: int = 10, deep_research: bool = False, use_ext
                 recency_bonus = 1.1 + (0.1 * (1 - age_days/30))
         
         chunk_size = 320 if deep_research else 280
-        ch = chunk_text(it.get("text", ""), max_words=chunk_size)
+        with timer.stage("chunk"):
+            ch = chunk_text(it.get("text", ""), max_words=chunk_size)
         chunk_count = min(6 if deep_research else 5, len(ch))
         
-        top = rank_hybrid(ch, q, topk=chunk_count)
+        with timer.stage("rank"):
+            top = await arank_hybrid(ch, q, topk=chunk_count)
         
         boosted_top = [(c, s * source_quality * recency_bonus) for c, s in top]
         
@@ -1142,13 +1532,14 @@ async def autonauka(q: str, topk: int = 10, deep_research: bool = False, use_ext
     ctx = []; cites = []; fact_highlights = []
     
     try:
-        related_facts = ltm_search_hybrid(q, 8)
+        # Wyszukiwanie w pamięci jest synchroniczne (SQLite + embeddingi) - poza pętlą
+        related_facts = await asyncio.to_thread(ltm_search_hybrid, q, 8)
         
         tags_search_terms = q.split()[:3]
         for term in tags_search_terms:
             if len(term) > 3:
                 try:
-                    tag_facts = ltm_search_hybrid(term, limit=3)
+                    tag_facts = await asyncio.to_thread(ltm_search_hybrid, term, limit=3)
                     if tag_facts:
                         related_facts.extend(tag_facts)
                 except:
@@ -1190,7 +1581,8 @@ async def autonauka(q: str, topk: int = 10, deep_research: bool = False, use_ext
         "sources": cites[:max(12, topk)],
         "is_deep_research": deep_research,
         "source_count": len(items),
-        "powered_by": "monolit-engine"
+        "powered_by": "monolit-engine",
+        "timings": {**timer.to_dict(), "total": round(time.perf_counter() - t0, 4)}
     }
     
     # NEW: Store fallback research results in hierarchical memory too
@@ -1290,7 +1682,7 @@ def travel_search(city: str, what: str="attractions"):
     if not center: return {"ok":False,"error":"geoname not found"}
     lon,lat=center
     if what=="hotels":
-        items=asyncio.run(serp_maps(f"{city} hotels", 20))
+        items=_run_sync(serp_maps(f"{city} hotels", 20))
     elif what=="restaurants":
         q=f"""
 [out:json][timeout:25];
@@ -1312,7 +1704,7 @@ out center 60;
         except Exception:
             items=[]
     else:
-        items=asyncio.run(serp_maps(f"{city} attractions", 20))
+        items=_run_sync(serp_maps(f"{city} attractions", 20))
     return {"ok":True,"center":{"lon":lon,"lat":lat},"items":items}
 
 # ═══════════════════════════════════════════════════════════════════
@@ -1324,14 +1716,13 @@ async def duck_news(q: str, limit:int=10) -> Dict[str,Any]:
     url=f"https://duckduckgo.com/html/?q={quote_plus(q)}&iar=news&ia=news"
     items=[]
     try:
-        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT, headers={"User-Agent":WEB_USER_AGENT}) as c:
-            r=await c.get(url)
-            html=r.text
-            for m in re.finditer(r'<a[^>]+class="result__a"[^>]+href="([^"]+)"[^>]*>(.*?)</a>', html, re.I|re.S):
-                link=m.group(1); title=re.sub("<.*?>","",m.group(2)).strip()
-                if link and title:
-                    items.append({"title":title, "link":link})
-                if len(items)>=limit: break
+        r=await _fetch("GET", url, headers={"User-Agent":WEB_USER_AGENT}, timeout=HTTP_TIMEOUT)
+        html=r.text
+        for m in re.finditer(r'<a[^>]+class="result__a"[^>]+href="([^"]+)"[^>]*>(.*?)</a>', html, re.I|re.S):
+            link=m.group(1); title=re.sub("<.*?>","",m.group(2)).strip()
+            if link and title:
+                items.append({"title":title, "link":link})
+            if len(items)>=limit: break
     except Exception as e:
         return {"ok":False,"error":str(e)}
     return {"ok":True,"items":items}
@@ -1350,7 +1741,7 @@ async def news_search(q: str, limit:int=12):
 __all__ = [
     'autonauka', 'web_learn', 'answer_with_sources',
     'research_collect', 'serpapi_search', 'firecrawl_scrape',
-    'chunk_text', 'rank_hybrid', 'store_docs',
+    'chunk_text', 'rank_hybrid', 'arank_hybrid', 'store_docs',
     'travel_search', 'otm_geoname', 'serp_maps',
     'duck_news', 'news_search', 'extract_text'
 ]
@@ -22,6 +22,7 @@ from .llm import get_llm_client
 from .memory import get_memory_manager
 from .hierarchical_memory import get_hierarchical_memory
 from .helpers import log_info, log_error, log_warning
+from .latency_budget import Deadline
 
 class ReflectionDepth(Enum):
     """Poziomy głębokości introspekcji"""
@@ -257,7 +258,8 @@ class SelfReflectionEngine:
         query: str, 
         initial_response: str, 
         depth: ReflectionDepth = ReflectionDepth.MEDIUM,
-        user_id: str = "system"
+        user_id: str = "system",
+        deadline: Optional[Deadline] = None
     ) -> ReflectionCycle:
         """
         Przeprowadź pełny cykl refleksji nad odpowiedzią
@@ -267,37 +269,54 @@ class SelfReflectionEngine:
             initial_response: Pierwsza wersja odpowiedzi
             depth: Głębokość refleksji
             user_id: ID użytkownika dla kontekstu
+            deadline: Budżet czasu żądania - ewaluacja i poprawa są obowiązkowe,
+                      meta-komentarz / insights / korekty tylko gdy starcza czasu,
+                      a przy ciasnym budżecie głębokość spada do MEDIUM
             
         Returns:
             ReflectionCycle: Kompletny cykl z poprawioną odpowiedzią
         """
         start_time = time.time()
         
+        def fits(llm_rounds: int) -> bool:
+            return deadline is None or deadline.fits(llm_rounds)
+        
         try:
+            if not fits(5) and depth.value > ReflectionDepth.MEDIUM.value:
+                depth = ReflectionDepth.MEDIUM
+            
             log_info(f"[SELF_REFLECTION] Rozpoczynam refleksję poziomu {depth.name}")
             
             # FAZA 1: Ewaluacja
             evaluation = await self._evaluate_response(query, initial_response, depth)
             
-            # FAZA 2: Meta-komentarz
-            meta_commentary = await self._generate_meta_commentary(
-                query, initial_response, evaluation, depth
-            )
+            # FAZA 2: Meta-komentarz (opcjonalny - poprawa musi się jeszcze zmieścić)
+            meta_commentary = ""
+            if fits(2):
+                meta_commentary = await self._generate_meta_commentary(
+                    query, initial_response, evaluation, depth
+                )
             
             # FAZA 3: Poprawa odpowiedzi
-            improved_response = await self._improve_response(
-                query, initial_response, evaluation, depth
-            )
+            improved_response = initial_response
+            if fits(1):
+                improved_response = await self._improve_response(
+                    query, initial_response, evaluation, depth
+                )
             
             # FAZA 4: Analiza zdobytych insights
-            insights_gained = await self._extract_insights(
-                query, initial_response, improved_response, evaluation
-            )
+            insights_gained = []
+            if fits(1):
+                insights_gained = await self._extract_insights(
+                    query, initial_response, improved_response, evaluation
+                )
             
             # FAZA 5: Identyfikacja korekt
-            corrections_made = await self._identify_corrections(
-                initial_response, improved_response
-            )
+            corrections_made = []
+            if fits(1):
+                corrections_made = await self._identify_corrections(
+                    initial_response, improved_response
+                )
             
             # Oblicz score refleksji
             reflection_score = await self._calculate_reflection_score(
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+semantic_cache.py - Opt-in semantic (embedding similarity) response cache for call_llm
+
+Exact caches (Redis in call_llm, middleware.LLMCACHE) only hit on byte-identical
+message JSON. This tier matches near-duplicate questions:
+
+    key    = embedding(normalized last user turn)
+    scope  = sha1(model + params + user_id + every message before the last user turn)
+             (system prompt, history) - only the last turn is matched fuzzily
+    index  = one matrix of unit vectors per namespace, rows filtered by scope
+    TTL    = cache_invalidation.CACHE_TTL_RULES[detect_category(user turn)]
+
+False hits are measured, not guessed: a sample of hits (SEMANTIC_CACHE_SAMPLE_RATE)
+also calls the model and compares the fresh answer with the cached one.
+"""
+
+import re
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .helpers import log_info, log_warning, embed_many
+from .cache_invalidation import CACHE_TTL_RULES, detect_category
+
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, drop punctuation, collapse whitespace"""
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", text.lower())).strip()
+
+
+def split_messages(messages: List[Dict[str, Any]], model: str, **opts) -> Tuple[Optional[str], str]:
+    """
+    (last user turn, scope hash) for a chat request
+
+    Scope covers model, sampling params, the user_id option and all messages
+    before the last user turn, so follow-ups in different conversations (or of
+    different users) never share answers.
+    """
+    last_user = None
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "user":
+            last_user = i
+            break
+    if last_user is None or last_user != len(messages) - 1:
+        return None, ""
+
+    content = messages[last_user].get("content")
+    if not isinstance(content, str) or not content.strip():
+        return None, ""
+
+    scope_data = repr((model, opts.get("temperature"), opts.get("max_tokens"), opts.get("user_id"),
+                       [(m.get("role"), m.get("content")) for m in messages[:last_user]]))
+    return content, hashlib.sha1(scope_data.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class SemanticEntry:
+    query: str
+    scope: str
+    answer: str
+    category: str
+    created_at: float
+    expires_at: float
+    hits: int = 0
+
+
+class _NamespaceIndex:
+    """Unit-vector matrix + entries for one namespace (brute-force cosine)"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: List[SemanticEntry] = []
+        self.vectors: Optional[np.ndarray] = None
+
+    def _drop(self, keep: np.ndarray) -> None:
+        self.entries = [e for e, k in zip(self.entries, keep) if k]
+        self.vectors = self.vectors[keep] if self.entries else None
+
+    def purge_expired(self, now: float) -> int:
+        if not self.entries:
+            return 0
+        keep = np.array([e.expires_at > now for e in self.entries])
+        removed = int((~keep).sum())
+        if removed:
+            self._drop(keep)
+        return removed
+
+    def search(self, vec: np.ndarray, scope: str) -> Tuple[Optional[SemanticEntry], float]:
+        if self.vectors is None:
+            return None, 0.0
+        scores = self.vectors @ vec
+        mask = np.array([e.scope == scope for e in self.entries])
+        if not mask.any():
+            return None, 0.0
+        scores = np.where(mask, scores, -1.0)
+        best = int(np.argmax(scores))
+        return self.entries[best], float(scores[best])
+
+    def add(self, vec: np.ndarray, entry: SemanticEntry) -> int:
+        evicted = 0
+        if len(self.entries) >= self.max_entries:
+            # Oldest first (entries are append-ordered)
+            evicted = len(self.entries) - self.max_entries + 1
+            keep = np.zeros(len(self.entries), dtype=bool)
+            keep[evicted:] = True
+            self._drop(keep)
+        self.entries.append(entry)
+        row = vec[None, :]
+        self.vectors = row if self.vectors is None else np.vstack([self.vectors, row])
+        return evicted
+
+
+class SemanticCache:
+    """Per-namespace semantic cache with hit-rate and false-hit accounting"""
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 5000,
+                 sample_rate: float = 0.02, answer_min_similarity: float = 0.8):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.sample_rate = sample_rate
+        self.answer_min_similarity = answer_min_similarity
+        self._indexes: Dict[str, _NamespaceIndex] = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.expired = 0
+        self.evictions = 0
+        self.samples = 0
+        self.false_hits = 0
+        self.recent_samples: deque = deque(maxlen=50)
+
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        """Unit vector for text (None if the embedding provider is unavailable)"""
+        vectors = embed_many([text])
+        if not vectors or vectors[0] is None:
+            return None
+        vec = np.asarray(vectors[0], dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else None
+
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        return self.embed(normalize_query(query))
+
+    def lookup(self, namespace: str, vec: Optional[np.ndarray], scope: str) -> Optional[Tuple[SemanticEntry, float]]:
+        """Best cached entry above threshold for (namespace, scope), or None"""
+        with self._lock:
+            self.lookups += 1
+            index = self._indexes.get(namespace)
+            if index is None or vec is None:
+                return None
+            self.expired += index.purge_expired(time.time())
+            entry, score = index.search(vec, scope)
+            if entry is None or score < self.threshold:
+                return None
+            entry.hits += 1
+            self.hits += 1
+        return entry, score
+
+    def store(self, namespace: str, query: str, vec: Optional[np.ndarray], scope: str, answer: str) -> None:
+        if vec is None:
+            return
+        category = detect_category(query)
+        ttl = CACHE_TTL_RULES.get(category, CACHE_TTL_RULES["default"])
+        now = time.time()
+        entry = SemanticEntry(query=query, scope=scope, answer=answer, category=category,
+                              created_at=now, expires_at=now + ttl)
+        with self._lock:
+            index = self._indexes.setdefault(namespace, _NamespaceIndex(self.max_entries))
+            self.evictions += index.add(vec, entry)
+            self.stores += 1
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record_sample(self, query: str, entry: SemanticEntry, score: float, fresh_answer: str) -> bool:
+        """Compare a cached answer with a fresh one; returns True for a false hit"""
+        cached_vec = self.embed(entry.answer)
+        fresh_vec = self.embed(fresh_answer)
+        similarity = float(cached_vec @ fresh_vec) if cached_vec is not None and fresh_vec is not None else 0.0
+        false_hit = similarity < self.answer_min_similarity
+        with self._lock:
+            self.samples += 1
+            if false_hit:
+                self.false_hits += 1
+            self.recent_samples.append({
+                "query": query[:200],
+                "matched_query": entry.query[:200],
+                "query_similarity": round(score, 4),
+                "answer_similarity": round(similarity, 4),
+                "false_hit": false_hit,
+                "category": entry.category,
+                "at": time.time(),
+            })
+        if false_hit:
+            log_warning(f"Semantic cache false hit: '{query[:60]}' ~ '{entry.query[:60]}' ({score:.3f})", "SEMANTIC_CACHE")
+        return false_hit
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "hit_rate": self.hits / max(1, self.lookups),
+                "stores": self.stores,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "size": sum(len(i.entries) for i in self._indexes.values()),
+                "namespaces": {name: len(i.entries) for name, i in self._indexes.items()},
+                "threshold": self.threshold,
+                "sampled": self.samples,
+                "false_hits": self.false_hits,
+                "false_hit_rate": self.false_hits / max(1, self.samples),
+                "recent_samples": list(self.recent_samples),
+            }
+
+
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Global semantic cache built from config"""
+    global _semantic_cache
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                from .config import (SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES,
+                                     SEMANTIC_CACHE_SAMPLE_RATE, SEMANTIC_CACHE_ANSWER_MIN_SIM)
+                _semantic_cache = SemanticCache(
+                    threshold=SEMANTIC_CACHE_THRESHOLD,
+                    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                    sample_rate=SEMANTIC_CACHE_SAMPLE_RATE,
+                    answer_min_similarity=SEMANTIC_CACHE_ANSWER_MIN_SIM,
+                )
+                log_info(f"Semantic LLM cache enabled (threshold={SEMANTIC_CACHE_THRESHOLD})", "SEMANTIC_CACHE")
+    return _semantic_cache
+
+
+def get_semantic_cache_stats() -> Dict[str, Any]:
+    """Stats for /api/admin (enabled flag + counters when the cache exists)"""
+    from .config import SEMANTIC_CACHE_ENABLED
+    if _semantic_cache is None:
+        return {"enabled": SEMANTIC_CACHE_ENABLED, "lookups": 0, "hits": 0, "hit_rate": 0.0}
+    return dict(_semantic_cache.stats(), enabled=SEMANTIC_CACHE_ENABLED)
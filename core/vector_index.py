@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+vector_index.py - Persistent per-user ANN index over memory_nodes.embedding
+
+IVF (inverted file) index built with NumPy:
+    - vectors are L2-normalized float32 rows, score = dot product (cosine)
+    - below IVF_MIN_POINTS the index is searched exhaustively (exact, one matmul)
+    - above it, k-means centroids split vectors into lists; a query scans only
+      the `nprobe` closest lists
+    - adds/updates/removes are incremental; files are saved atomically
+      (tmp + os.replace) to {VECTOR_INDEX_PATH}/{user}.npz
+
+Every uvicorn worker holds its own copy of an index. Saves take an exclusive
+file lock ({user}.npz.lock) and first merge the file written by another
+worker (unsaved local changes are replayed on top of it), and lookups reload
+a file that changed on disk - so no worker drops another worker's vectors.
+
+Rebuild from the database:
+    python -m core.vector_index rebuild [--user USER_ID]
+"""
+
+import os
+import re
+import sys
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .helpers import log_info, log_warning, log_error
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock (single worker)
+    fcntl = None
+
+
+# ═══════════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════════
+
+IVF_MIN_POINTS = 4096        # Below this: exact flat search
+IVF_KMEANS_ITERS = 12        # k-means iterations on (re)train
+IVF_TRAIN_SAMPLE = 20000     # Max vectors used to train centroids
+IVF_RETRAIN_GROWTH = 4.0     # Retrain when index grew 4x since last training
+DEFAULT_NPROBE = 8           # Lists scanned per query
+SAVE_EVERY_N_CHANGES = 64    # Persist after this many unsaved changes
+
+
+def _normalize(vec: Any) -> Optional[np.ndarray]:
+    """Return L2-normalized float32 vector or None for empty/zero vectors"""
+    if vec is None:
+        return None
+    arr = np.asarray(vec, dtype=np.float32).reshape(-1)
+    if arr.size == 0:
+        return None
+    norm = float(np.linalg.norm(arr))
+    if norm == 0.0 or not np.isfinite(norm):
+        return None
+    return arr / norm
+
+
+def _file_sig(path: str) -> Optional[Tuple[int, int]]:
+    """(inode, mtime) of the index file - os.replace gives every save a new inode"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Exclusive lock across processes (and threads: one open file per holder)"""
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _kmeans(data: np.ndarray, k: int, iters: int = IVF_KMEANS_ITERS, seed: int = 42) -> np.ndarray:
+    """Spherical k-means on normalized rows, returns (k, dim) centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        for c in range(k):
+            members = data[assign == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+            else:
+                # Re-seed empty cluster with a random point
+                centroid = data[rng.integers(len(data))]
+            norm = np.linalg.norm(centroid)
+            centroids[c] = centroid / norm if norm > 0 else centroid
+    return centroids.astype(np.float32)
+
+
+# ═══════════════════════════════════════════════════════════════════
+# SINGLE USER INDEX
+# ═══════════════════════════════════════════════════════════════════
+
+class UserVectorIndex:
+    """IVF index for one user's memory nodes"""
+
+    def __init__(self, user_id: str, path: str, dim: Optional[int] = None):
+        self.user_id = user_id
+        self.path = path
+        self.dim = dim
+        self._lock = threading.RLock()
+
+        self._vecs = np.zeros((0, dim or 0), dtype=np.float32)
+        self._n = 0
+        self._ids: List[str] = []
+        self._layers: List[str] = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._row_of: Dict[str, int] = {}
+
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._trained_on = 0
+        self._dirty = 0
+
+        # Changes since the last save (node_id -> (layer, vec) or None = removed),
+        # replayed on top of the file when another worker saved it in between
+        self._pending: Dict[str, Optional[Tuple[str, np.ndarray]]] = {}
+        self._disk_sig: Optional[Tuple[int, int]] = None
+
+    # ─── size / capacity ─────────────────────────────────────────────
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def _ensure_capacity(self, extra: int = 1) -> None:
+        need = self._n + extra
+        if need <= len(self._vecs):
+            return
+        cap = max(64, len(self._vecs) * 2, need)
+        vecs = np.zeros((cap, self.dim), dtype=np.float32)
+        vecs[:self._n] = self._vecs[:self._n]
+        alive = np.zeros(cap, dtype=bool)
+        alive[:self._n] = self._alive[:self._n]
+        assign = np.full(cap, -1, dtype=np.int32)
+        assign[:self._n] = self._assign[:self._n]
+        self._vecs, self._alive, self._assign = vecs, alive, assign
+
+    # ─── mutations ───────────────────────────────────────────────────
+
+    def add(self, node_id: str, layer: str, embedding: Any) -> bool:
+        """Insert or update a vector; returns False if the embedding is unusable"""
+        vec = _normalize(embedding)
+        if vec is None:
+            return False
+
+        with self._lock:
+            if self.dim is None or (self._n == 0 and self.dim != vec.size):
+                self.dim = vec.size
+                self._vecs = np.zeros((0, self.dim), dtype=np.float32)
+            if vec.size != self.dim:
+                return False  # Embedding model changed - needs rebuild
+
+            row = self._row_of.get(node_id)
+            if row is None:
+                self._ensure_capacity()
+                row = self._n
+                self._n += 1
+                self._ids.append(node_id)
+                self._layers.append(layer)
+                self._row_of[node_id] = row
+            else:
+                self._layers[row] = layer
+
+            self._vecs[row] = vec
+            self._alive[row] = True
+            self._pending[node_id] = (layer, vec)
+            if self._centroids is not None:
+                self._assign[row] = int(np.argmax(self._centroids @ vec))
+            else:
+                self._assign[row] = -1
+            self._dirty += 1
+            return True
+
+    def remove(self, node_id: str) -> bool:
+        with self._lock:
+            row = self._row_of.pop(node_id, None)
+            if row is None:
+                return False
+            self._alive[row] = False
+            self._pending[node_id] = None
+            self._dirty += 1
+            return True
+
+    def _compact(self) -> None:
+        """Drop tombstoned rows (caller holds lock)"""
+        if len(self._row_of) == self._n:
+            return
+        keep = np.flatnonzero(self._alive[:self._n])
+        self._vecs = self._vecs[keep].copy()
+        self._assign = self._assign[keep].copy()
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._ids = [self._ids[i] for i in keep]
+        self._layers = [self._layers[i] for i in keep]
+        self._n = len(keep)
+        self._row_of = {nid: i for i, nid in enumerate(self._ids)}
+
+    def train(self) -> None:
+        """(Re)train IVF centroids - flat index if too small"""
+        with self._lock:
+            self._compact()
+            n = self._n
+            if n < IVF_MIN_POINTS:
+                self._centroids = None
+                self._assign = np.full(len(self._vecs), -1, dtype=np.int32)
+                self._trained_on = 0
+                return
+
+            data = self._vecs[:n]
+            sample = data
+            if n > IVF_TRAIN_SAMPLE:
+                idx = np.random.default_rng(0).choice(n, size=IVF_TRAIN_SAMPLE, replace=False)
+                sample = data[idx]
+
+            nlist = max(8, int(np.sqrt(n)))
+            self._centroids = _kmeans(sample, nlist)
+            self._assign = np.full(len(self._vecs), -1, dtype=np.int32)
+            self._assign[:n] = np.argmax(data @ self._centroids.T, axis=1).astype(np.int32)
+            self._trained_on = n
+            self._dirty += 1
+
+    def _needs_training(self) -> bool:
+        alive = len(self._row_of)
+        if self._centroids is None:
+            return alive >= IVF_MIN_POINTS
+        return alive >= self._trained_on * IVF_RETRAIN_GROWTH or alive < IVF_MIN_POINTS // 2
+
+    # ─── search ──────────────────────────────────────────────────────
+
+    def search(self, query: Any, k: int = 10, layers: Optional[Sequence[str]] = None,
+               nprobe: int = DEFAULT_NPROBE) -> List[Tuple[str, float]]:
+        """Top-k (node_id, cosine) for query, optionally filtered by layers"""
+        q = _normalize(query)
+        if q is None or k <= 0:
+            return []
+
+        with self._lock:
+            if self._n == 0 or q.size != self.dim:
+                return []
+
+            mask = self._alive[:self._n].copy()
+            if layers:
+                wanted = set(layers)
+                mask &= np.fromiter((l in wanted for l in self._layers), dtype=bool, count=self._n)
+            if self._centroids is not None:
+                probe = np.argsort(-(self._centroids @ q))[:max(1, nprobe)]
+                mask &= np.isin(self._assign[:self._n], probe)
+
+            rows = np.flatnonzero(mask)
+            if rows.size == 0:
+                return []
+
+            scores = self._vecs[rows] @ q
+            if rows.size > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(rows.size)
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[rows[i]], float(scores[i])) for i in top]
+
+    # ─── persistence ─────────────────────────────────────────────────
+
+    def refresh(self) -> bool:
+        """Adopt the file saved by another worker; unsaved local changes are replayed on top"""
+        sig = _file_sig(self.path)
+        if sig is None or sig == self._disk_sig:
+            return False
+        disk = UserVectorIndex.load(self.user_id, self.path)
+        with self._lock:
+            for node_id, change in self._pending.items():
+                if change is None:
+                    disk.remove(node_id)
+                else:
+                    disk.add(node_id, *change)
+            for attr in ("dim", "_vecs", "_n", "_ids", "_layers", "_alive", "_row_of",
+                         "_centroids", "_assign", "_trained_on", "_disk_sig"):
+                setattr(self, attr, getattr(disk, attr))
+        return True
+
+    def save(self, merge: bool = True) -> None:
+        """Persist under the file lock; merge=False overwrites (rebuild from the database)"""
+        Path(os.path.dirname(self.path)).mkdir(parents=True, exist_ok=True)
+        with _file_lock(f"{self.path}.lock"):
+            if merge:
+                self.refresh()
+            self._write()
+
+    def _write(self) -> None:
+        with self._lock:
+            if self._needs_training():
+                self.train()
+            self._compact()
+            n = self._n
+            tmp = f"{self.path}.tmp.npz"
+            np.savez(
+                tmp,
+                vectors=self._vecs[:n],
+                ids=np.array(self._ids, dtype=str),
+                layers=np.array(self._layers, dtype=str),
+                assign=self._assign[:n],
+                centroids=self._centroids if self._centroids is not None else np.zeros((0, self.dim or 0), dtype=np.float32),
+                meta=np.array([self.dim or 0, self._trained_on], dtype=np.int64),
+            )
+            os.replace(tmp, self.path)
+            self._dirty = 0
+            self._pending.clear()
+            self._disk_sig = _file_sig(self.path)
+
+    @classmethod
+    def load(cls, user_id: str, path: str) -> 'UserVectorIndex':
+        sig = _file_sig(path)  # before reading: a newer file replaced meanwhile is picked up next time
+        with np.load(path, allow_pickle=False) as data:
+            dim, trained_on = (int(x) for x in data["meta"])
+            index = cls(user_id, path, dim=dim or None)
+            vecs = data["vectors"].astype(np.float32)
+            index._vecs = vecs.copy() if len(vecs) else np.zeros((0, dim), dtype=np.float32)
+            index._n = len(vecs)
+            index._ids = [str(x) for x in data["ids"]]
+            index._layers = [str(x) for x in data["layers"]]
+            index._alive = np.ones(index._n, dtype=bool)
+            index._assign = data["assign"].astype(np.int32)
+            centroids = data["centroids"]
+            index._centroids = centroids.astype(np.float32) if len(centroids) else None
+            index._trained_on = trained_on
+            index._row_of = {nid: i for i, nid in enumerate(index._ids)}
+            index._disk_sig = sig
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "vectors": len(self._row_of),
+                "dim": self.dim,
+                "ivf_lists": 0 if self._centroids is None else len(self._centroids),
+                "unsaved_changes": self._dirty,
+            }
+
+
+# ═══════════════════════════════════════════════════════════════════
+# MANAGER (all users)
+# ═══════════════════════════════════════════════════════════════════
+
+class VectorIndexManager:
+    """
+    Lazily loads per-user indexes from disk.
+
+    `source` supplies (node_id, user_id, layer, embedding) rows for a user
+    (or all users) and is used to build an index that has no file yet.
+    """
+
+    def __init__(self, root: str, source=None, nprobe: int = DEFAULT_NPROBE):
+        self.root = root
+        self.source = source
+        self.nprobe = nprobe
+        self._indexes: Dict[str, UserVectorIndex] = {}
+        self._lock = threading.Lock()
+        Path(root).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, user_id: str) -> str:
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", user_id)[:48]
+        digest = hashlib.md5(user_id.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.root, f"{safe}_{digest}.npz")
+
+    def get(self, user_id: str) -> UserVectorIndex:
+        """Get user index (load from disk, or build from source on first use)"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            try:
+                index.refresh()  # another worker saved it since
+            except Exception as e:
+                log_warning(f"Vector index reload failed for {user_id}: {e}", "VECTOR_INDEX")
+            return index
+
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                return index
+
+            path = self._path(user_id)
+            index = None
+            if os.path.exists(path):
+                try:
+                    index = UserVectorIndex.load(user_id, path)
+                except Exception as e:
+                    log_warning(f"Corrupt vector index for {user_id}, rebuilding: {e}", "VECTOR_INDEX")
+            if index is None:
+                index = UserVectorIndex(user_id, path)
+                if self.source is not None:
+                    self._fill(index, self.source(user_id))
+                    index.save()
+            self._indexes[user_id] = index
+            return index
+
+    @staticmethod
+    def _fill(index: UserVectorIndex, rows: Iterable[Tuple[str, str, str, Any]]) -> int:
+        added = 0
+        for node_id, _user, layer, embedding in rows:
+            if index.add(node_id, layer, embedding):
+                added += 1
+        index.train()
+        return added
+
+    def add(self, user_id: str, node_id: str, layer: str, embedding: Any) -> None:
+        index = self.get(user_id)
+        if index.add(node_id, layer, embedding) and index._dirty >= SAVE_EVERY_N_CHANGES:
+            self._save_safely(index)
+
+    def remove(self, user_id: str, node_id: str) -> None:
+        index = self.get(user_id)
+        if index.remove(node_id) and index._dirty >= SAVE_EVERY_N_CHANGES:
+            self._save_safely(index)
+
+    def search(self, user_id: str, query: Any, k: int = 10,
+               layers: Optional[Sequence[str]] = None) -> List[Tuple[str, float]]:
+        return self.get(user_id).search(query, k=k, layers=layers, nprobe=self.nprobe)
+
+    def save_all(self) -> int:
+        """Persist indexes with unsaved changes; returns number saved"""
+        with self._lock:
+            indexes = list(self._indexes.values())
+        saved = 0
+        for index in indexes:
+            if index._dirty:
+                self._save_safely(index)
+                saved += 1
+        return saved
+
+    def _save_safely(self, index: UserVectorIndex) -> None:
+        try:
+            index.save()
+        except Exception as e:
+            log_error(e, "VECTOR_INDEX_SAVE")
+
+    def rebuild(self, rows: Iterable[Tuple[str, str, str, Any]],
+                user_id: Optional[str] = None) -> Dict[str, int]:
+        """Rebuild indexes from (node_id, user_id, layer, embedding) rows"""
+        fresh: Dict[str, UserVectorIndex] = {}
+        counts: Dict[str, int] = {}
+        for node_id, uid, layer, embedding in rows:
+            if user_id is not None and uid != user_id:
+                continue
+            index = fresh.get(uid)
+            if index is None:
+                index = fresh[uid] = UserVectorIndex(uid, self._path(uid))
+            if index.add(node_id, layer, embedding):
+                counts[uid] = counts.get(uid, 0) + 1
+
+        if user_id is not None and user_id not in fresh:
+            fresh[user_id] = UserVectorIndex(user_id, self._path(user_id))
+            counts[user_id] = 0
+
+        for uid, index in fresh.items():
+            index.train()
+            index.save(merge=False)
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            self._indexes.update(fresh)
+
+        log_info(f"Rebuilt {len(fresh)} vector indexes ({sum(counts.values())} vectors)", "VECTOR_INDEX")
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            loaded = dict(self._indexes)
+        return {
+            "enabled": True,
+            "root": self.root,
+            "loaded_users": len(loaded),
+            "vectors": sum(len(i) for i in loaded.values()),
+            "nprobe": self.nprobe,
+        }
+
+
+# ═══════════════════════════════════════════════════════════════════
+# CLI
+# ═══════════════════════════════════════════════════════════════════
+
+def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memory vector index maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="Rebuild ANN index from memory_nodes.embedding")
+    rebuild.add_argument("--user", default=None, help="Only this user (default: all users)")
+    args = parser.parse_args(argv)
+
+    from .memory import get_memory_system
+
+    mem = get_memory_system()
+    t0 = time.time()
+    counts = mem.db.rebuild_vector_index(user_id=args.user)
+    print(f"Rebuilt {len(counts)} index(es), {sum(counts.values())} vectors in {time.time() - t0:.2f}s")
+    mem.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
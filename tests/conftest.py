@@ -12,6 +12,10 @@ from fastapi.testclient import TestClient
 # Add parent to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+# Deterministic offline embeddings (no DeepInfra calls from tests)
+os.environ.setdefault("EMBED_PROVIDER", "hash")
+os.environ.setdefault("EMBED_CACHE_DISK", "0")
+
 @pytest.fixture
 def client():
     """FastAPI test client"""
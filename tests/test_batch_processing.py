@@ -154,4 +154,72 @@ class TestBatchProcessing:
         await shutdown_batch_processor()
         
         # Sprawdź, czy procesor jest zatrzymany
-        assert batch_processor.running is False
\ No newline at end of file
+        assert batch_processor.running is False
+
+
+class TestCoreBatchProcessing:
+    """Test dla core/batch_processing.py (symulowany LLM, bez sieci)"""
+    
+    @pytest.mark.asyncio
+    async def test_batch_dispatch_merges_identical_requests(self):
+        """Test: wywołania idą równolegle, a identyczne żądania w locie są łączone"""
+        import time
+        from core.batch_processing import LLMBatchProcessor
+        
+        calls = []
+        
+        async def fake_llm(messages, **params):
+            calls.append(messages[-1]["content"])
+            await asyncio.sleep(0.1)
+            return f"odp: {messages[-1]['content']}"
+        
+        processor = LLMBatchProcessor()
+        processor._llm_call_func = fake_llm
+        system = {"role": "system", "content": "Jesteś pomocnym asystentem AI. " * 10}
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            processor.submit([system, {"role": "user", "content": f"pytanie {i % 4}"}], {"temperature": 0.3})
+            for i in range(8)
+        ))
+        elapsed = time.perf_counter() - start
+        await processor.stop()
+        metrics = processor.get_metrics()
+        
+        assert results[0] == results[4] == "odp: pytanie 0"
+        assert sorted(calls) == [f"pytanie {i}" for i in range(4)]
+        assert elapsed < 0.35  # 4 wywołania po 0.1s nie idą po kolei
+        assert metrics["merged_requests"] == 4
+        assert metrics["token_savings"] == metrics["prompt_tokens"]  # 4 połączone kopie 4 wysłanych promptów
+        assert metrics["prefix_groups"] == 0  # krótki wspólny prefiks: bez rundy rozgrzewającej
+    
+    @pytest.mark.asyncio
+    async def test_batch_long_prefix_warms_cache_first(self):
+        """Test: grupa z długim wspólnym prefiksem wysyła najpierw jedno żądanie, potem resztę równolegle"""
+        import time
+        from core.batch_processing import BatchRequest, LLMBatchProcessor, PREFIX_WARMUP_MIN_TOKENS
+        
+        spans = {}
+        
+        async def fake_llm(messages, **params):
+            start = time.perf_counter()
+            await asyncio.sleep(0.1)
+            spans[messages[-1]["content"]] = (start, time.perf_counter())
+            return "ok"
+        
+        processor = LLMBatchProcessor()
+        processor._llm_call_func = fake_llm
+        system = {"role": "system", "content": "x" * (PREFIX_WARMUP_MIN_TOKENS * 4 + 100)}
+        batch = [BatchRequest(id=str(i), messages=[system, {"role": "user", "content": f"q{i}"}], params={})
+                 for i in range(4)]
+        start = time.perf_counter()
+        await processor._process_batch(batch)
+        elapsed = time.perf_counter() - start
+        metrics = processor.get_metrics()
+        
+        assert all(request.future.result() == "ok" for request in batch)
+        first = min(spans.values())
+        rest = [span for span in spans.values() if span is not first]
+        assert len(rest) == 3 and all(start >= first[1] for start, _ in rest)
+        assert max(start for start, _ in rest) - min(start for start, _ in rest) < 0.05
+        assert 0.2 <= elapsed < 0.35
+        assert metrics["prefix_groups"] == 1 and metrics["token_savings"] == 0
@@ -60,6 +60,155 @@ class TestHelpers:
         from core import helpers
         assert hasattr(helpers, 'log_info') or hasattr(helpers, 'log_error')
 
+    def test_embed_cache_lru_and_disk(self, tmp_path):
+        """Test embedding cache evicts by bytes (LRU) and serves evicted keys from disk"""
+        import numpy as np
+        from core.embed_cache import EmbeddingCache, DiskEmbeddingTier, cache_key
+
+        cache = EmbeddingCache(max_bytes=3 * 8 * 4, disk=DiskEmbeddingTier(str(tmp_path), max_rows=100))
+        keys = [cache_key("model", f"text {i}") for i in range(4)]
+        for i, key in enumerate(keys[:3]):
+            cache.put(key, np.full(8, i, dtype=np.float32))
+        cache.get(keys[0])                 # touch -> keys[1] is now least recently used
+        cache.put(keys[3], np.full(8, 3, dtype=np.float32))
+
+        assert len(cache) == 3 and cache.stats()["bytes"] == 3 * 8 * 4
+        assert keys[1] not in cache._data
+
+        fresh = EmbeddingCache(disk=DiskEmbeddingTier(str(tmp_path), max_rows=100))  # e.g. another worker
+        assert np.allclose(fresh.get(keys[1]), 1.0)
+        assert fresh.stats()["disk_hits"] == 1
+    
+    def test_disk_tier_reused_slot_never_serves_other_key(self, tmp_path):
+        """Test a reader with a stale key->slot mapping misses instead of reading the slot's new vector"""
+        import numpy as np
+        from core.embed_cache import DiskEmbeddingTier, cache_key, _slot_tag
+        
+        writer = DiskEmbeddingTier(str(tmp_path), max_rows=2)
+        reader = DiskEmbeddingTier(str(tmp_path), max_rows=2)  # another worker
+        k0, k1, k2 = (cache_key("m", t) for t in ("a", "b", "c"))
+        writer.put_many({k0: np.zeros(8, dtype=np.float32), k1: np.ones(8, dtype=np.float32)})
+        assert set(reader.get_many([k0, k1])) == {k0, k1}
+        
+        # Ring wrap in progress: slot 0 already holds k2's vector, index rows not committed yet
+        mm, tags = writer._matrix(8, 1)
+        tags[0] = 0
+        mm[0] = np.full(8, 2, dtype=np.float32)
+        tags[0] = _slot_tag(k2)
+        assert set(reader.get_many([k0, k1])) == {k1}
+        
+        writer.put_many({k2: np.full(8, 2, dtype=np.float32)})
+        found = reader.get_many([k0, k2])
+        assert set(found) == {k2} and np.allclose(found[k2], 2.0)
+        writer.close()
+        reader.close()
+
+    def test_hashing_embedding_provider(self):
+        """Test hashing backend is deterministic and keeps related texts closer"""
+        from core.helpers import cosine_similarity
+        from core.embeddings import HashingEmbeddingProvider
+
+        provider = HashingEmbeddingProvider(dim=256)
+        a, b, c = provider.embed(["lubię kawę z mlekiem", "lubię kawę bez mleka", "pogoda w Krakowie"])
+        assert len(a) == 256 and provider.embed(["lubię kawę z mlekiem"])[0] == a
+        assert cosine_similarity(a, b) > cosine_similarity(a, c)
+
+    def test_embedding_batcher_coalesces(self):
+        """Test concurrent single-text calls are deduplicated and sent as few batches"""
+        import threading
+        from core.embeddings import EmbeddingBatcher, HashingEmbeddingProvider
+
+        provider = HashingEmbeddingProvider(dim=32)
+        batcher = EmbeddingBatcher(provider, max_batch=64, max_wait_ms=20, concurrency=1)
+        results = {}
+
+        def call(i):
+            results[i] = batcher.embed([f"tekst {i % 5}"])[0]
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(30)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        batcher.close()
+
+        stats = batcher.stats()
+        assert results[0] == results[5] == provider.embed(["tekst 0"])[0]
+        assert stats["requested"] == 30 and stats["deduplicated"] > 0
+        assert stats["batches"] < 30
+    
+    def test_aembed_many_does_not_block_loop(self, monkeypatch):
+        """Test async embeddings await the micro-batcher while the event loop keeps running"""
+        import asyncio
+        import time
+        from core import embeddings, helpers
+        from core.embed_cache import EmbeddingCache
+        from core.embeddings import HashingEmbeddingProvider
+        
+        class SlowProvider(HashingEmbeddingProvider):
+            def embed(self, texts):
+                time.sleep(0.3)
+                return super().embed(texts)
+        
+        provider = SlowProvider(dim=32)
+        monkeypatch.setattr(embeddings, "EMBED_BATCHER", True)
+        monkeypatch.setattr(embeddings, "_PROVIDER", provider)
+        monkeypatch.setattr(embeddings, "_PROVIDER_RESOLVED", True)
+        monkeypatch.setattr(embeddings, "_BATCHER", None)
+        monkeypatch.setattr(helpers, "_EMBED_CACHE", EmbeddingCache())
+        ticks = []
+        
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.02)
+        
+        async def run():
+            task = asyncio.create_task(ticker())
+            vectors = await helpers.aembed_many(["jeden", "dwa", "jeden"])
+            task.cancel()
+            return vectors
+        
+        vectors = asyncio.run(run())
+        embeddings.get_embedding_batcher().close()
+        assert vectors[0] == vectors[2] == HashingEmbeddingProvider(dim=32).embed(["jeden"])[0]
+        assert len(ticks) >= 5  # a blocking call would freeze the ticker for 0.3s
+        assert helpers.embed_many(["dwa"]) == [vectors[1]]  # cached by the async path
+    
+    def test_sparse_index_matches_reference_scoring(self):
+        """Test the inverted-index ranker reproduces per-document BM25 / TF-IDF scores"""
+        import numpy as np
+        from core.helpers import tfidf_cosine, tokenize
+        from core.sparse_rank import SparseIndex, _reference_bm25, _reference_tfidf_cosine, _synthetic_corpus
+        
+        corpus = _synthetic_corpus(200, words=40) + [[]]
+        query = ["term1", "term2", "term2", "term50", "unseen"]
+        index = SparseIndex(corpus[:120])
+        index.add(corpus[120:])  # incremental add == one-shot build
+        assert np.allclose(index.bm25(query), _reference_bm25(corpus, query))
+        assert np.allclose(index.tfidf_cosine(query), _reference_tfidf_cosine(corpus, query))
+        
+        docs = ["Kot siedzi na płocie i miauczy", "Pies szczeka na kota", "Tekst o programowaniu"]
+        scores = tfidf_cosine("kot na płocie", docs)
+        assert np.allclose(scores, _reference_tfidf_cosine([tokenize(d) for d in docs], tokenize("kot na płocie")))
+        assert scores[0] > scores[1] and tfidf_cosine("kot", []) == []
+    
+    def test_sparse_index_reused_across_queries(self, monkeypatch):
+        """Test ranking the same chunks for another query reuses the built index"""
+        from core import research, sparse_rank
+        
+        built = []
+        monkeypatch.setattr(sparse_rank, "_INDEX_CACHE", type(sparse_rank._INDEX_CACHE)())
+        monkeypatch.setattr(sparse_rank.SparseIndex, "_build",
+                            lambda self, _orig=sparse_rank.SparseIndex._build: (built.append(self), _orig(self))[1])
+        chunks = ["Kot siedzi na płocie", "Pies szczeka na kota", "Tekst o programowaniu w Pythonie"]
+        first = research._hybrid_rank("kot na płocie", chunks)
+        research._hybrid_rank("programowanie w Pythonie", list(chunks))
+        research.rank_hybrid(chunks, "pies", topk=2)
+        research.rank_hybrid(chunks, "kot", topk=2)
+        assert first[0][0] == 0
+        assert len({id(index) for index in built}) == 2  # one per tokenizer, not one per query
+
 
 class TestMemory:
     """Test core/memory.py"""
@@ -80,6 +229,186 @@ class TestMemory:
         messages = stm_get_context(user="test_user")
         assert len(messages) > 0
 
+    def test_db_connection_pool(self, tmp_path):
+        """Test pooled connections are reused and writes are serialized"""
+        import threading
+        from core.memory import MemoryDatabase, MemoryNode
+
+        db = MemoryDatabase(db_path=str(tmp_path / "pool.db"))
+        assert db._conn() is db._conn()  # one reader per thread
+
+        def writer(i):
+            for j in range(10):
+                db.save_node(MemoryNode(id=f"{i}-{j}", layer="L1", content=f"msg {i} {j}", user_id="pool"))
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(db.search_nodes(layer="L1", user_id="pool", limit=100)) == 40
+        stats = db.pool_stats()
+        assert stats["writer_acquisitions"] >= 40
+        assert stats["connections_opened"] <= 2 + 4  # writer + main reader + worker readers
+        db.close()
+
+    def test_write_behind_read_your_writes(self, tmp_path):
+        """Test queued writes are visible before flush and persisted on close"""
+        import sqlite3
+        from core.memory import MemoryDatabase, MemoryNode
+
+        db_path = str(tmp_path / "wb.db")
+        db = MemoryDatabase(db_path=db_path, write_behind=True)
+        db.write_behind.flush_interval = 60.0  # keep items queued during the test
+
+        db.save_node(MemoryNode(id="wb-1", layer="L2", content="lubię kawę", user_id="wb"))
+        db.record_metric("test_metric", 1.0)
+
+        assert db.load_node("wb-1").content == "lubię kawę"
+        assert [n.id for n in db.search_nodes(layer="L2", user_id="wb")] == ["wb-1"]
+        assert db.write_behind.stats()["pending"] == 2
+
+        db.close()
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM memory_nodes").fetchone()[0] == 1
+        assert conn.execute("SELECT COUNT(*) FROM memory_analytics").fetchone()[0] == 1
+        conn.close()
+
+    def test_bulk_delete_flushes_queued_writes(self, tmp_path):
+        """Test a queued upsert cannot resurrect a node removed by a bulk soft delete"""
+        import sqlite3
+        import time
+        from core.memory import MemoryDatabase, MemoryNode, UnifiedMemorySystem
+        
+        db_path = str(tmp_path / "bulk.db")
+        db = MemoryDatabase(db_path=db_path, write_behind=True)
+        db.write_behind.flush_interval = 60.0
+        old = time.time() - 200 * 24 * 3600
+        node = MemoryNode(id="old-1", layer="L1", content="stara rozmowa", user_id="u", importance=0.1, created_at=old)
+        db.save_node(node)
+        db.flush()
+        db.save_node(node)  # e.g. an access update still waiting in the queue
+        db.save_node(MemoryNode(id="old-2", layer="L1", content="jeszcze w kolejce", user_id="u",
+                                importance=0.1, created_at=old))
+        
+        system = UnifiedMemorySystem.__new__(UnifiedMemorySystem)
+        system.db = db
+        assert system.cleanup_old_memories(max_age_days=90)["deleted_count"] == 2
+        db.close()
+        
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM memory_nodes WHERE deleted = 0").fetchone()[0] == 0
+        conn.close()
+    
+    def test_search_isolates_users(self, tmp_path, monkeypatch):
+        """Test query searches (FTS, write-behind overlay, hybrid) never return another user's nodes"""
+        import numpy as np
+        from core import memory
+        from core.memory import MemoryDatabase, MemoryNode, UnifiedMemorySystem
+        
+        db = MemoryDatabase(db_path=str(tmp_path / "iso.db"), write_behind=True)
+        db.write_behind.flush_interval = 60.0
+        db.save_node(MemoryNode(id="a-l2", layer="L2", content="alice drinks espresso daily", user_id="alice"))
+        db.save_node(MemoryNode(id="a-l1", layer="L1", content="alice mentioned espresso", user_id="alice"))
+        db.save_node(MemoryNode(id="b-l2", layer="L2", content="bob drinks tea daily", user_id="bob"))
+        assert [n.id for n in db.search_nodes(query="espresso", user_id="bob")] == []  # queued (overlay)
+        db.flush()
+        db.save_node(MemoryNode(id="b-l2-new", layer="L2", content="bob tried espresso once", user_id="bob"))
+        
+        assert [n.id for n in db.search_nodes(query="espresso", user_id="bob")] == ["b-l2-new"]
+        assert [n.id for n in db.search_nodes(query="espresso", layer="L2", user_id="alice")] == ["a-l2"]
+        
+        monkeypatch.setattr(memory, "_embed_query", lambda q: np.empty(0, dtype=np.float32))
+        system = UnifiedMemorySystem.__new__(UnifiedMemorySystem)
+        system.db = db
+        assert {r["id"] for r in system.search_hybrid("espresso", user_id="bob")} == {"b-l2-new"}
+        assert {r["id"] for r in system.search_hybrid("espresso", user_id="alice")} == {"a-l2", "a-l1"}
+        db.close()
+    
+    def test_vector_index_search(self, tmp_path):
+        """Test ANN index filters by layer, handles removal and survives reload"""
+        import numpy as np
+        from core.vector_index import UserVectorIndex
+
+        rng = np.random.default_rng(0)
+        vecs = rng.normal(size=(50, 16)).astype(np.float32)
+        path = str(tmp_path / "u.npz")
+        index = UserVectorIndex("u", path)
+        for i, vec in enumerate(vecs):
+            index.add(f"n{i}", "L1" if i % 2 else "L2", vec)
+
+        assert index.search(vecs[3], k=1)[0][0] == "n3"
+        assert all(int(nid[1:]) % 2 == 0 for nid, _ in index.search(vecs[3], k=5, layers=["L2"]))
+
+        index.remove("n3")
+        index.save()
+        reloaded = UserVectorIndex.load("u", path)
+        assert len(reloaded) == 49
+        assert reloaded.search(vecs[3], k=1)[0][0] != "n3"
+    
+    def test_vector_index_workers_merge_saves(self, tmp_path):
+        """Test two workers sharing one index file keep each other's changes"""
+        import numpy as np
+        from core.vector_index import VectorIndexManager
+        
+        vecs = np.random.default_rng(1).normal(size=(20, 16)).astype(np.float32)
+        w1, w2 = VectorIndexManager(str(tmp_path)), VectorIndexManager(str(tmp_path))
+        w1.get("u"), w2.get("u")
+        for i in range(10):
+            w1.add("u", f"a{i}", "L1", vecs[i])
+            w2.add("u", f"b{i}", "L1", vecs[10 + i])
+        w1.save_all()
+        w2.save_all()  # used to overwrite w1's file
+        
+        assert len(VectorIndexManager(str(tmp_path)).get("u")) == 20
+        assert w1.search("u", vecs[15], k=1)[0][0] == "b5"  # reloaded after w2 saved
+        
+        w2.remove("u", "a3")
+        w2.save_all()
+        w1.add("u", "a10", "L1", vecs[0])
+        w1.save_all()
+        ids = {nid for nid, _ in VectorIndexManager(str(tmp_path)).search("u", vecs[3], k=30)}
+        assert "a3" not in ids and {"a10", "b5"} <= ids
+
+    def test_embedding_blob_format(self):
+        """Test versioned embedding blobs round-trip and legacy pickles stay readable"""
+        import pickle
+        import numpy as np
+        from core.embedding_codec import encode_embedding, decode_embedding
+
+        vec = np.random.default_rng(0).normal(size=384)
+        assert len(encode_embedding(vec, "float32")) == 16 + 384 * 4
+        assert np.allclose(decode_embedding(encode_embedding(vec, "float32")), vec, atol=1e-6)
+        assert np.allclose(decode_embedding(encode_embedding(vec, "float16")), vec, atol=1e-2)
+        assert np.allclose(decode_embedding(encode_embedding(vec, "int8")), vec, atol=0.05)
+        assert np.allclose(decode_embedding(pickle.dumps(vec)), vec, atol=1e-6)
+        assert decode_embedding(pickle.dumps(print)) is None  # non-array globals are refused
+
+    def test_vectorized_scoring_matches_loop(self):
+        """Test batch scoring ranks like the per-node formula and honours min_confidence"""
+        import numpy as np
+        from core.helpers import cosine_similarity
+        from core.memory import MemoryNode
+        from core.memory_scoring import score_candidates, SEMANTIC_WEIGHTS
+
+        rng = np.random.default_rng(1)
+        nodes = []
+        for i in range(200):
+            node = MemoryNode(id=str(i), layer="L2", content=f"fact {i}",
+                              confidence=float(rng.random()), importance=float(rng.random()))
+            node._embedding = rng.normal(size=32).astype(np.float32)
+            nodes.append(node)
+        query = rng.normal(size=32)
+
+        expected = sorted(
+            (n for n in nodes if n.confidence >= 0.4),
+            key=lambda n: cosine_similarity(query, n._embedding) * 0.7 + n.confidence * 0.2 + n.importance * 0.1,
+            reverse=True
+        )[:10]
+        scored = score_candidates(query, nodes, SEMANTIC_WEIGHTS, top_k=10, min_confidence=0.4)
+        assert [n.id for n, _, _ in scored] == [n.id for n in expected]
+
 
 class TestLLM:
     """Test core/llm.py"""
@@ -89,6 +418,464 @@ class TestLLM:
         from core import llm
         assert hasattr(llm, 'LLM_BASE_URL') or hasattr(llm, 'LLM_API_KEY')
 
+    def test_chat_completion_runs_concurrently(self):
+        """Test LLMClient.chat_completion awaits the pooled client instead of blocking the loop"""
+        import asyncio
+        import time
+        import httpx
+        from core import llm
+
+        async def handler(request):
+            await asyncio.sleep(0.2)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            llm._ASYNC_CLIENTS[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            client = llm.get_llm_client()
+            start = time.perf_counter()
+            results = await asyncio.gather(*(
+                client.chat_completion([{"role": "user", "content": str(i)}], skip_cache=True) for i in range(5)
+            ))
+            await llm._ASYNC_CLIENTS.pop(loop).aclose()
+            return results, time.perf_counter() - start
+
+        results, elapsed = asyncio.run(run())
+        assert results == ["ok"] * 5
+        assert elapsed < 0.8  # serial calls would take >= 1s
+
+
+    def test_identical_calls_single_flight(self):
+        """Test concurrent identical calls share one upstream request"""
+        import asyncio
+        import httpx
+        from core import llm
+
+        upstream = []
+
+        async def handler(request):
+            upstream.append(request)
+            await asyncio.sleep(0.1)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "jedna odpowiedź"}}]})
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            llm._ASYNC_CLIENTS[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            messages = [{"role": "user", "content": "single-flight test"}]
+            before = llm.get_single_flight_stats()
+            results = await asyncio.gather(*(llm.acall_llm(list(messages), temperature=0.1) for _ in range(6)))
+            after = llm.get_single_flight_stats()
+            await llm._ASYNC_CLIENTS.pop(loop).aclose()
+            return results, after["coalesced_local"] - before["coalesced_local"]
+
+        results, coalesced = asyncio.run(run())
+        assert results == ["jedna odpowiedź"] * 6
+        assert len(upstream) == 1 and coalesced == 5
+    
+    def test_redis_flight_waiter_gets_fallback_answer(self, monkeypatch):
+        """Test a cross-worker waiter polls Redis off the loop and sees the leader's fallback answer"""
+        import asyncio
+        import json
+        import threading
+        import httpx
+        from core import llm
+        
+        class FakeRedis:
+            def __init__(self):
+                self.data, self.threads = {}, set()
+            
+            def set(self, key, value, ttl=None, nx=False):
+                self.threads.add(threading.get_ident())
+                if nx and key in self.data:
+                    return False
+                self.data[key] = value
+                return True
+            
+            def get(self, key):
+                self.threads.add(threading.get_ident())
+                return self.data.get(key)
+            
+            def exists(self, key):
+                self.threads.add(threading.get_ident())
+                return key in self.data
+            
+            def delete(self, key):
+                self.data.pop(key, None)
+        
+        redis = FakeRedis()
+        monkeypatch.setattr(llm, "REDIS_AVAILABLE", True)
+        monkeypatch.setattr(llm, "get_redis", lambda: redis)
+        monkeypatch.setattr(llm, "LLM_FALLBACK_MODEL", "fallback-model")
+        upstream = []
+        
+        async def handler(request):
+            model = json.loads(request.content)["model"]
+            upstream.append(model)
+            if model == llm.LLM_MODEL:
+                return httpx.Response(400, json={"error": "main down"})
+            return httpx.Response(200, json={"choices": [{"message": {"content": "z fallbacku"}}]})
+        
+        async def run():
+            loop = asyncio.get_running_loop()
+            llm._ASYNC_CLIENTS[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            messages = [{"role": "user", "content": "flight fallback test"}]
+            flight_key = f"{llm._generate_cache_key(messages, llm.LLM_MODEL)}:flight"
+            redis.data[flight_key] = "1"  # another worker leads
+            waiter = asyncio.create_task(llm.acall_llm(list(messages)))
+            await asyncio.sleep(0.1)
+            leader = await llm._acall_llm_upstream(list(messages), False, 60)
+            redis.delete(flight_key)
+            answer = await asyncio.wait_for(waiter, 5)
+            await llm._ASYNC_CLIENTS.pop(loop).aclose()
+            return leader, answer
+        
+        leader, answer = asyncio.run(run())
+        assert leader == answer == "z fallbacku"
+        assert upstream == [llm.LLM_MODEL, llm.LLM_FALLBACK_MODEL]  # the waiter made no call
+        assert threading.get_ident() not in redis.threads
+
+    def test_semantic_cache_near_duplicates(self, monkeypatch):
+        """Test paraphrases reuse an answer above the threshold and only within the same user/model/system scope"""
+        import asyncio
+        import httpx
+        from core import llm, semantic_cache
+
+        upstream = []
+
+        async def handler(request):
+            upstream.append(request)
+            return httpx.Response(200, json={"choices": [{"message": {"content": f"odpowiedź {len(upstream)}"}}]})
+
+        monkeypatch.setattr(llm, "SEMANTIC_CACHE_ENABLED", True)
+        monkeypatch.setattr(semantic_cache, "_semantic_cache", semantic_cache.SemanticCache(threshold=0.85, sample_rate=0))
+
+        async def ask(question, system="Jesteś pomocny.", user_id="u1"):
+            messages = [{"role": "system", "content": system}, {"role": "user", "content": question}]
+            return await llm.acall_llm(messages, semantic_namespace="test", user_id=user_id)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            llm._ASYNC_CLIENTS[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            out = {
+                "first": await ask("Jaka jest pogoda w Warszawie?"),
+                "normalized": await ask("jaka jest   pogoda w Warszawie!!"),
+                "paraphrase": await ask("Jaka jest dzisiaj pogoda w Warszawie?"),      # cosine ~0.87
+                "below_threshold": await ask("Jaka będzie pogoda w Warszawie?"),       # cosine ~0.80
+                "other_question": await ask("Ile kosztuje bilet do Krakowa?"),
+                "other_system": await ask("Jaka jest pogoda w Warszawie?", system="Odpowiadaj krótko."),
+                "other_user": await ask("Jaka jest pogoda w Warszawie?", user_id="u2"),
+            }
+            monkeypatch.setattr(llm, "LLM_MODEL", "other-model")
+            out["other_model"] = await ask("Jaka jest pogoda w Warszawie?")
+            await llm._ASYNC_CLIENTS.pop(loop).aclose()
+            return out
+
+        out = asyncio.run(run())
+        stats = semantic_cache.get_semantic_cache_stats()
+        assert out["first"] == out["normalized"] == out["paraphrase"] == "odpowiedź 1"
+        assert [out[k] for k in ("below_threshold", "other_question", "other_system", "other_user", "other_model")] == \
+            [f"odpowiedź {i}" for i in range(2, 7)]
+        assert len(upstream) == 6
+        assert stats["hits"] == 2 and stats["lookups"] == 8 and stats["namespaces"] == {"test": 6}
+
+
+class TestCognitiveEngine:
+    """Test core/advanced_cognitive_engine.py"""
+
+    def test_stream_yields_llm_tokens(self):
+        """Test final generation streams tokens as they arrive and ends with the full result"""
+        import asyncio
+        import json
+        import time
+        import httpx
+        from core import llm
+        from core.advanced_cognitive_engine import get_advanced_cognitive_engine, CognitiveMode
+
+        async def handler(request):
+            async def sse():
+                for word in ["Ala ", "ma ", "kota"]:
+                    await asyncio.sleep(0.1)
+                    yield f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n".encode()
+                yield b"data: [DONE]\n\n"
+            return httpx.Response(200, content=sse(), headers={"content-type": "text/event-stream"})
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            llm._ASYNC_CLIENTS[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            engine = get_advanced_cognitive_engine()
+            events = []
+            async for event in engine.process_message_stream("test", "stream_user", [], CognitiveMode.BASIC,
+                                                             enable_prediction=False):
+                events.append((time.perf_counter(), event))
+            await llm._ASYNC_CLIENTS.pop(loop).aclose()
+            return events
+
+        events = asyncio.run(run())
+        chunks = [(t, e["content"]) for t, e in events if e["type"] == "chunk"]
+        result = events[-1][1]["result"]
+
+        assert [c for _, c in chunks] == ["Ala ", "ma ", "kota"]
+        assert chunks[-1][0] - chunks[0][0] >= 0.15  # tokens are forwarded as they arrive
+        assert events[0][1]["type"] == "progress"
+        assert result.primary_response == "Ala ma kota"
+        assert result.processing_metrics["llm_tokens_per_second"] > 0
+
+    def test_independent_stages_run_concurrently(self, monkeypatch):
+        """Test inner language and memory search overlap and stage timings are recorded"""
+        import asyncio
+        import time
+        from core.advanced_cognitive_engine import AdvancedCognitiveEngine, CognitiveMode
+
+        engine = AdvancedCognitiveEngine()
+
+        async def slow_inner_language(user_message, conversation_context=None):
+            await asyncio.sleep(0.2)
+            return {}
+
+        async def slow_memory_search(user_message, user_id, inner_thought, deadline=None):
+            await asyncio.sleep(0.2)
+            return [], {}
+
+        async def generate(user_message, memory_context, compressed_knowledge, inner_thought, cognitive_mode,
+                           deadline=None):
+            return "odpowiedź"
+
+        monkeypatch.setattr(engine, "_process_inner_language", slow_inner_language)
+        monkeypatch.setattr(engine, "_enhanced_memory_search", slow_memory_search)
+        monkeypatch.setattr(engine, "_generate_enhanced_response", generate)
+
+        async def run():
+            started = time.perf_counter()
+            result = await engine.process_message("test", "dag_user", [], CognitiveMode.BASIC)
+            elapsed = time.perf_counter() - started
+            await asyncio.gather(*engine._background_tasks)
+            return result, elapsed
+
+        result, elapsed = asyncio.run(run())
+        metrics = result.processing_metrics
+        assert result.primary_response == "odpowiedź"
+        assert elapsed < 0.35  # 2 × 0.2s stages overlap
+        assert metrics["inner_language_time"] >= 0.2 and metrics["memory_search_time"] >= 0.2
+        assert "response_generation_time" in metrics
+        assert engine.processing_stats["total_requests"] == 1  # stats updated off the response path
+
+
+    def test_mode_fits_latency_budget(self):
+        """Test cognitive mode is downgraded when the deadline or load does not allow it"""
+        import asyncio
+        from core import latency_budget
+        from core.latency_budget import Deadline, LoadMonitor, track_inflight, within_deadline
+        from core.advanced_cognitive_engine import get_advanced_cognitive_engine, CognitiveMode
+
+        monitor = LoadMonitor(prior_latency=1.0)
+        original = latency_budget._load_monitor
+        latency_budget._load_monitor = monitor
+        try:
+            engine = get_advanced_cognitive_engine()
+            metrics = {}
+            assert engine.fit_mode_to_budget(CognitiveMode.FULL_COGNITIVE, Deadline(60)) == CognitiveMode.FULL_COGNITIVE
+            assert engine.fit_mode_to_budget(CognitiveMode.FULL_COGNITIVE, Deadline(8), metrics) == CognitiveMode.ADVANCED
+            assert metrics["mode_downgraded"] == 1.0
+            assert engine.fit_mode_to_budget(CognitiveMode.MULTI_AGENT, Deadline(0.5)) == CognitiveMode.BASIC
+
+            # Slow upstream -> pressure >= 1.0 caps the mode even without a deadline
+            for _ in range(20):
+                monitor.record_llm_latency(12.0)
+            assert monitor.pressure() >= 1.0
+            assert engine.fit_mode_to_budget(CognitiveMode.FULL_COGNITIVE) == CognitiveMode.ADVANCED
+
+            @track_inflight
+            async def request():
+                assert monitor.inflight == 1
+                return await within_deadline(asyncio.sleep(1, result="late"), Deadline(0.05), "skipped")
+
+            assert asyncio.run(request()) == "skipped"
+            assert monitor.inflight == 0
+        finally:
+            latency_budget._load_monitor = original
+
+class TestMultiAgent:
+    """Test core/multi_agent_orchestrator.py"""
+
+    def test_structured_mode_collapses_llm_calls(self, monkeypatch):
+        """Test structured agents + batched critiques need far fewer LLM calls than the classic path"""
+        import asyncio
+        from core import multi_agent_orchestrator as orchestrator
+        
+        def no_real_memory():
+            raise AssertionError("benchmark must not touch the memory database")
+        
+        monkeypatch.setattr(orchestrator, "get_memory_manager", no_real_memory)
+        monkeypatch.setattr(orchestrator, "get_hierarchical_memory_system", no_real_memory)
+        classic, structured = asyncio.run(orchestrator.benchmark(agents=3, latency_s=0.01))
+
+        # 3 agents (1 call each) + disagreements/critiques/consensus + summary + synthesis + 2 evaluations
+        assert structured["llm_calls"] == 3 + 3 + 1 + 1 + 2
+        assert classic["llm_calls"] > 2 * structured["llm_calls"]
+        assert structured["prompt_tokens"] < classic["prompt_tokens"]
+        assert orchestrator._parse_json_object('```json\n{"answer": "x"}\n```') == {"answer": "x"}
+
+class TestParallel:
+    """Test core/parallel.py"""
+
+    def test_task_pool_concurrency_and_priority(self):
+        """Test pool runs N tasks at once and hands free slots to the highest priority first"""
+        import asyncio
+        import time
+        from core.parallel import AsyncTaskPool
+
+        async def work(delay, tag, order):
+            order.append(tag)
+            await asyncio.sleep(delay)
+            return tag
+
+        async def run():
+            pool = AsyncTaskPool(max_workers=4, max_queue_size=16)
+            order = []
+            start = time.perf_counter()
+            results = await asyncio.gather(*(pool.submit(work, 0.1, i, order) for i in range(8)))
+            elapsed = time.perf_counter() - start
+
+            order.clear()
+            busy = [asyncio.create_task(pool.submit(work, 0.05, "busy", order)) for _ in range(4)]
+            await asyncio.sleep(0.01)
+            low = asyncio.create_task(pool.submit(work, 0.01, "low", order, priority=2))
+            high = asyncio.create_task(pool.submit(work, 0.01, "high", order, priority=0))
+            await asyncio.gather(*busy, low, high)
+
+            with pytest.raises(TimeoutError):
+                await pool.submit(work, 1.0, "slow", order, timeout=0.05)
+            stats = pool.get_stats()
+            await pool.stop()
+            return results, elapsed, order, stats
+
+        results, elapsed, order, stats = asyncio.run(run())
+        assert results == list(range(8))
+        assert elapsed < 0.35  # two waves of 4, not 8 serial tasks
+        assert order[4:6] == ["high", "low"]
+        assert stats["timed_out"] == 1 and stats["priorities"][1]["run_p95"] >= 0.05
+
+    def test_stage_dag_dependencies(self):
+        """Test run_stage_dag passes dependency results, overlaps independent stages and rejects cycles"""
+        import asyncio
+        import time
+        import pytest
+        from core.parallel import run_stage_dag
+
+        async def slow(value):
+            await asyncio.sleep(0.1)
+            return value
+
+        stages = {
+            "a": ((), lambda: slow(1)),
+            "b": ((), lambda: slow(2)),
+            "sum": (("a", "b"), lambda a, b: slow(a + b)),
+        }
+
+        async def run():
+            timings = {}
+            started = time.perf_counter()
+            results = await run_stage_dag(stages, timings)
+            return results, timings, time.perf_counter() - started
+
+        results, timings, elapsed = asyncio.run(run())
+        assert results == {"a": 1, "b": 2, "sum": 3}
+        assert elapsed < 0.25 and set(timings) == {"a_time", "b_time", "sum_time"}
+
+        with pytest.raises(ValueError):
+            asyncio.run(run_stage_dag({"x": (("y",), slow), "y": (("x",), slow)}))
+
+
+class TestMiddleware:
+    """Test core/middleware.py"""
+
+    def test_rate_limiter_gcra(self, monkeypatch):
+        """Test token bucket burst, gradual refill, per-key isolation and lazy expiry"""
+        from core import middleware
+        from core.middleware import RateLimiter
+
+        now = [1000.0]
+        monkeypatch.setattr(middleware.time, "time", lambda: now[0])
+        limiter = RateLimiter(backend="memory", shards=1)
+        limiter.limits["test"] = {"limit": 5, "window": 10}
+
+        assert all(limiter.is_allowed("alice", "test") for _ in range(5))
+        assert not limiter.is_allowed("alice", "test")
+        assert limiter.is_allowed("bob", "test")
+        assert limiter.get_usage("alice", "test")["remaining"] == 0
+
+        now[0] += 2.0  # one token back every window/limit seconds
+        assert limiter.is_allowed("alice", "test")
+        assert not limiter.is_allowed("alice", "test")
+
+        now[0] += 60.0
+        assert limiter.get_usage("alice", "test")["count"] == 0
+        limiter.is_allowed("carol", "test")  # triggers the shard sweep
+        assert sum(len(shard.entries) for shard in limiter._shards) == 1
+
+    def test_simple_cache_lru_ttl_bytes(self, monkeypatch):
+        """Test LRU eviction, byte budget, TTL sweep and the stats API"""
+        from core import middleware
+        from core.middleware import SimpleCache
+
+        now = [1000.0]
+        monkeypatch.setattr(middleware.time, "time", lambda: now[0])
+        cache = SimpleCache(max_size=3, ttl=10, max_bytes=40)
+
+        for key in "abc":
+            cache.put(key, "x" * 10)
+        assert cache.get("a") == "x" * 10  # a becomes most recently used
+        cache.put("d", "x" * 10)
+        assert list(cache.cache) == ["c", "a", "d"]
+
+        cache.put("e", "y" * 25)  # over the byte budget -> LRU entries go first
+        assert list(cache.cache) == ["d", "e"]
+
+        now[0] += 11
+        assert cache.sweep_expired() == 2
+        stats = cache.stats()
+        assert stats["size"] == 0 and stats["bytes"] == 0
+        assert stats["evictions"] == 3 and stats["expirations"] == 2
+        assert stats["hits"] == 1
+
+class TestMetrics:
+    """Test core/metrics.py"""
+
+    def test_endpoint_label_uses_route_template(self, monkeypatch):
+        """Test request metrics are labelled by route template with a bounded label set"""
+        from fastapi import FastAPI, Request
+        from fastapi.testclient import TestClient
+        from core import metrics
+
+        metrics.reset_metrics_for_tests()
+        app = FastAPI()
+        labels = []
+
+        @app.middleware("http")
+        async def capture(request: Request, call_next):
+            response = await call_next(request)
+            labels.append(metrics.endpoint_label(request.scope))
+            return response
+
+        @app.get("/api/memory/conversations/{conversation_id}")
+        async def conversation(conversation_id: str):
+            return {"id": conversation_id}
+
+        @app.get("/api/files/download")
+        async def download(name: str = ""):
+            return {"name": name}
+
+        client = TestClient(app)
+        client.get("/api/memory/conversations/abc")
+        client.get("/api/memory/conversations/def")
+        client.get("/random/scan/path")
+        monkeypatch.setattr(metrics, "METRICS_MAX_ENDPOINTS", 1)
+        client.get("/api/files/download?name=x.txt")
+
+        assert labels == ["/api/memory/conversations/{conversation_id}",
+                          "/api/memory/conversations/{conversation_id}",
+                          metrics.UNMATCHED_ENDPOINT, metrics.OVERFLOW_ENDPOINT]
+        metrics.reset_metrics_for_tests()
 
 class TestSemantic:
     """Test core/semantic.py"""
@@ -106,6 +893,275 @@ class TestResearch:
         """Test research module"""
         from core import research
         assert hasattr(research, 'chunk_text')
+    
+    def test_fetch_scheduler_pools_and_caps_domains(self):
+        """Test searches share one pooled client and per-domain concurrency/politeness limits"""
+        import asyncio
+        import time
+        import httpx
+        from core import research
+        
+        active = {}
+        peak = {}
+        
+        async def handler(request):
+            host = request.url.host
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+            await asyncio.sleep(0.05)
+            active[host] -= 1
+            return httpx.Response(200, json={"data": [{"title": "Paper", "url": "https://x.org/p"}]})
+        
+        async def run():
+            loop = asyncio.get_running_loop()
+            research._WEB_CLIENTS[loop] = client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            research._SCHEDULERS[loop] = research._FetchScheduler(global_limit=8, domain_limit=1, domain_delay=0)
+            start = time.perf_counter()
+            await asyncio.gather(*(research._s2_search(f"q{i}", 1) for i in range(3)),
+                                 *(research._fetch("GET", f"https://site{i}.example/") for i in range(3)))
+            capped = time.perf_counter() - start
+            assert research._get_web_client() is client
+            
+            # Politeness: starts to one domain are spaced by domain_delay even below the cap
+            polite = research._SCHEDULERS[loop] = research._FetchScheduler(domain_limit=4, domain_delay=0.1)
+            start = time.perf_counter()
+            await asyncio.gather(*(research._fetch("GET", "https://polite.example/") for _ in range(3)))
+            spaced = time.perf_counter() - start
+            await research.close_web_clients()
+            return capped, spaced, polite.stats
+        
+        capped, spaced, stats = asyncio.run(run())
+        assert peak["api.semanticscholar.org"] == 1
+        assert all(peak[f"site{i}.example"] == 1 for i in range(3))
+        assert 0.15 <= capped < 0.4  # same-domain calls serialized, other domains in parallel
+        assert spaced >= 0.2 and stats["polite_waits"] == 2 and stats["requests"] == 3
+    
+    def test_page_cache_conditional_revalidation(self, tmp_path, monkeypatch):
+        """Test scraped pages are revalidated with ETag (304 reuses the stored extraction; always in real-time mode)"""
+        import asyncio
+        import httpx
+        from core import research
+        from core.page_cache import PageCache
+        
+        page = "<html><head><title>Cached</title></head><body><article>" + "<p>Stored paragraph text.</p>" * 30 + "</article></body></html>"
+        requests = []
+        
+        def handler(request):
+            requests.append(request.headers.get("if-none-match"))
+            if request.headers.get("if-none-match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, text=page, headers={"ETag": '"v1"'})
+        
+        cache = PageCache(str(tmp_path / "pages.db"), freshness={"stable.example": 3600})
+        monkeypatch.setattr(research, "_PAGE_CACHE", cache)
+        monkeypatch.setattr(research, "_PAGE_DEFAULT_MAX_AGE", None)
+        monkeypatch.setattr(research, "REAL_TIME_WEB", False)
+        
+        async def run():
+            loop = asyncio.get_running_loop()
+            research._WEB_CLIENTS[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            research._SCHEDULERS[loop] = research._FetchScheduler(domain_delay=0)
+            out = [await research._http_text("https://news.example/a?utm_source=x") for _ in range(2)]
+            out += [await research._http_text("https://stable.example/p") for _ in range(2)]
+            monkeypatch.setattr(research, "REAL_TIME_WEB", True)
+            out.append(await research._http_text("https://stable.example/p"))
+            await research.close_web_clients()
+            return out
+        
+        first, revalidated, stored, fresh, realtime = asyncio.run(run())
+        assert first[0] == "Cached" and "Stored paragraph" in first[1]
+        assert revalidated == first and fresh == stored == realtime
+        # news.example: full GET then conditional GET; stable.example: one GET, then served fresh,
+        # and in real-time mode revalidated despite its freshness policy
+        assert requests == [None, '"v1"', None, '"v1"']
+        stats = cache.stats()
+        assert (stats["misses"], stats["revalidated"], stats["hits"], stats["pages"]) == (2, 2, 1, 2)
+        cache.close()
+    
+    def test_page_cache_io_off_event_loop(self, tmp_path, monkeypatch):
+        """Test a locked page cache database does not stall other coroutines"""
+        import asyncio
+        import threading
+        import time
+        from core import research
+        from core.page_cache import PageCache
+        
+        cache = PageCache(str(tmp_path / "pages.db"), freshness={"stable.example": 3600})
+        cache.put("https://stable.example/p", b"<html></html>", "Stored", "Stored text", None)
+        monkeypatch.setattr(research, "_PAGE_CACHE", cache)
+        monkeypatch.setattr(research, "REAL_TIME_WEB", False)  # served fresh, no fetch
+        
+        def hold_lock():
+            with cache._lock:
+                time.sleep(0.3)
+        
+        async def run():
+            done = {}
+            async def ticker():
+                for _ in range(5):
+                    await asyncio.sleep(0.02)
+                done["ticker"] = time.perf_counter()
+            async def lookup():
+                out = await research._http_text("https://stable.example/p")
+                done["lookup"] = time.perf_counter()
+                return out
+            holder = threading.Thread(target=hold_lock)
+            holder.start()
+            await asyncio.sleep(0.01)
+            out, _ = await asyncio.gather(lookup(), ticker())
+            holder.join()
+            return out, done
+        
+        out, done = asyncio.run(run())
+        assert out[0] == "Stored"
+        assert done["ticker"] < done["lookup"]
+        cache.close()
+    
+    def test_extraction_off_loop_with_truncation_and_timings(self, monkeypatch):
+        """Test page parsing runs in the worker pool, bodies are truncated and stages are timed"""
+        import asyncio
+        import httpx
+        from core import research
+        
+        page = "<html><head><title>Pool</title></head><body><article>" + "<p>Paragraph parsed in a worker process.</p>" * 400 + "</article></body></html>"
+        monkeypatch.setattr(research, "_PAGE_CACHE", False)
+        monkeypatch.setattr(research, "EXTRACT_MAX_DOC_BYTES", 4096)
+        
+        async def run():
+            loop = asyncio.get_running_loop()
+            research._WEB_CLIENTS[loop] = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(200, text=page)))
+            research._SCHEDULERS[loop] = research._FetchScheduler(domain_delay=0)
+            _, body = await research._fetch_page("https://big.example/")
+            timer = research._StageTimer()
+            title, text, _ = await research._http_text("https://big.example/", timer)
+            await research.close_web_clients()
+            return body, title, text, timer.to_dict(), research._EXTRACT_POOL is not None
+        
+        try:
+            body, title, text, timings, pooled = asyncio.run(run())
+        finally:
+            research.shutdown_extract_pool()
+        assert len(body) == 4096 < len(page)
+        assert title == "Pool" and "worker process" in text and len(text) < 4096
+        assert {"fetch", "parse"} <= set(timings)
+        assert pooled == (research.EXTRACT_WORKERS > 0)
+    
+    def test_extraction_pool_started_without_fork(self, monkeypatch):
+        """Test the startup hook creates the extraction pool and its workers are not forked"""
+        from core import research
+        
+        monkeypatch.setattr(research, "EXTRACT_WORKERS", 1)
+        research.shutdown_extract_pool()
+        research.start_extract_pool()
+        try:
+            pool = research._EXTRACT_POOL
+            assert pool is not None and pool._mp_context.get_start_method() in ("forkserver", "spawn")
+            assert pool.submit(research._extract_warmup).result(timeout=60) is True
+        finally:
+            research.shutdown_extract_pool()
+    
+    def test_extraction_timeout_spares_queued_jobs(self, monkeypatch):
+        """Test a stuck extraction times out alone: queued jobs still succeed and only its pool is recycled"""
+        import asyncio
+        import time
+        from core import research
+        
+        research.shutdown_extract_pool()
+        monkeypatch.setattr(research, "EXTRACT_WORKERS", 2)
+        monkeypatch.setattr(research, "EXTRACT_TIMEOUT", 1.0)
+        
+        async def run():
+            stuck = asyncio.ensure_future(research._run_extract(time.sleep, 5))
+            await asyncio.sleep(0.2)
+            first_pool = research._EXTRACT_POOL
+            procs = list(first_pool._processes.values())
+            results = await asyncio.gather(stuck, *[research._run_extract(time.sleep, 0.05) for _ in range(30)],
+                                           return_exceptions=True)
+            return first_pool, procs, results
+        
+        try:
+            first_pool, procs, results = asyncio.run(run())
+            time.sleep(0.5)
+            assert isinstance(results[0], asyncio.TimeoutError)
+            assert results[1:] == [None] * 30
+            assert research._EXTRACT_POOL is not first_pool
+            assert procs and not any(proc.is_alive() for proc in procs)
+        finally:
+            research.shutdown_extract_pool()
+    
+    def test_pipeline_keeps_search_rank_order(self, monkeypatch):
+        """Test a slow top result is not displaced by faster lower-ranked pages; failures are backfilled"""
+        import asyncio
+        from core import research
+        
+        urls = [f"https://site{i}.example/" for i in range(8)]
+        started = []
+        
+        async def search_all(query, mode):
+            return [(f"t{i}", u) for i, u in enumerate(urls)]
+        
+        async def ingest(query, title, url, topk_chunks=2, timer=None):
+            started.append(url)
+            await asyncio.sleep(0.1 if url == urls[0] else 0.01)
+            if url == urls[1]:
+                return None
+            return research.Material(title, url, research._domain(url), 0.6, None, "snippet", []), "picked"
+        
+        async def facts(query, pages):
+            return [[] for _ in pages]
+        
+        monkeypatch.setattr(research, "_search_all", search_all)
+        monkeypatch.setattr(research, "_ingest_url", ingest)
+        monkeypatch.setattr(research, "_extract_facts_batched", facts)
+        materials, _ = asyncio.run(research._pipeline("q", "fast"))
+        max_fetch = min(3, research.AUTO_FETCH)
+        assert [m.url for m in materials] == [u for u in urls if u != urls[1]][:max_fetch]
+        assert started == urls[:max_fetch + 1]  # only the failed page was replaced
+    
+    def test_fact_extraction_batched_and_cached(self, monkeypatch):
+        """Test facts for several pages come from one LLM call and repeated pages hit the cache"""
+        import asyncio
+        import json
+        import uuid
+        import httpx
+        from core import llm, research
+        from core.middleware import SimpleCache
+        
+        monkeypatch.setattr(research, "_FACT_CACHE", SimpleCache(max_size=100, ttl=60))
+        prompts = []
+        
+        def handler(request):
+            prompt = json.loads(request.content)["messages"][-1]["content"]
+            prompts.append(prompt)
+            urls = [line.split("[", 1)[1].split("]", 1)[0] for line in prompt.splitlines() if line.startswith("- ")]
+            if "partial" in prompt:
+                urls = urls[:1]  # the model skips the other pages
+            facts = [{"fact": f"Page {u} states a verifiable fact about the query.", "source": u} for u in urls]
+            return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(facts)}}]})
+        
+        query = f"batched facts {uuid.uuid4().hex}"
+        pages = [(f"https://site{i}.example/a", f"Site {i}", f"Text of page {i}. " * 20) for i in range(4)]
+        
+        async def run():
+            loop = asyncio.get_running_loop()
+            llm._ASYNC_CLIENTS[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            first = await research._extract_facts_batched(query, pages[:3])
+            second = await research._extract_facts_batched(query, pages)
+            partial = [await research._extract_facts_batched(f"partial {query}", pages[:3]) for _ in range(2)]
+            await llm._ASYNC_CLIENTS.pop(loop).aclose()
+            return first, second, partial
+        
+        first, second, partial = asyncio.run(run())
+        assert len(prompts) == 4
+        assert all(f"site{i}.example" in prompts[0] for i in range(3))
+        assert "site3.example" in prompts[1] and "site0.example" not in prompts[1]
+        assert second[:3] == first
+        assert [len(facts) for facts in second] == [1, 1, 1, 1]
+        assert second[3][0][1] == "https://site3.example/a"
+        # Pages left out of the answer use sentence fallback now and are asked again next time
+        assert partial[0][0][0][0].startswith("Page https://site0.example/a")
+        assert not any(fact.startswith("Page ") for facts in partial[0][1:] for fact, _ in facts)
+        assert "site0.example" not in prompts[3] and "site1.example" in prompts[3] and "site2.example" in prompts[3]
 
 
 class TestTools: